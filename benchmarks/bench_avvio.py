@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tempo di avvio a freddo: import dei moduli e creazione del backend
+
+Ogni misura gira in un processo Python nuovo, così nessun modulo è già
+in memoria; si riporta la mediana su più esecuzioni. L'import di
+database.diario_alimentare non deve costruire client né leggere
+credenziali: il costo del backend si paga alla prima operazione.
+
+Uso:
+    python benchmarks/bench_avvio.py [--ripetizioni N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SRC = str(Path(__file__).resolve().parents[1] / "src")
+
+# Nome -> codice misurato (il tempo è stampato dal processo figlio)
+MISURE = {
+    "import database.diario_alimentare": "import database.diario_alimentare",
+    "primo uso, backend sqlite": (
+        "from database.diario_alimentare import DiarioAlimentareDB\n"
+        "DiarioAlimentareDB.get_statistics()"
+    ),
+    "primo uso, backend supabase (solo client)": (
+        "from database.diario_alimentare import DiarioAlimentareDB\n"
+        "DiarioAlimentareDB.get_backend()"
+    ),
+    "import pandas": "import pandas",
+    "import streamlit": "import streamlit",
+    "import plotly.express": "import plotly.express",
+    "import openpyxl": "import openpyxl",
+}
+
+MODELLO = """
+import sys, time
+sys.path.insert(0, {src!r})
+t0 = time.perf_counter()
+{codice}
+print(time.perf_counter() - t0)
+"""
+
+
+def misura(codice, ambiente, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        uscita = subprocess.run(
+            [sys.executable, "-c", MODELLO.format(src=SRC, codice=codice)],
+            env=ambiente, capture_output=True, text=True, check=True
+        )
+        tempi.append(float(uscita.stdout.strip().splitlines()[-1]))
+    return statistics.median(tempi) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cartella:
+        base = {**os.environ, "DIARIO_ENV_FILE": os.devnull}
+        ambienti = {
+            "primo uso, backend sqlite": {
+                **base, "DIARIO_BACKEND": "sqlite", "DIARIO_SQLITE_PATH": os.path.join(cartella, "diario.sqlite")
+            },
+            "primo uso, backend supabase (solo client)": {
+                **base, "DIARIO_BACKEND": "supabase",
+                "SUPABASE_URL": "http://localhost:54321", "SUPABASE_API_KEY": "fake.fake.fake"
+            },
+        }
+        print(f"{'misura':>44} {'ms':>9}")
+        for nome, codice in MISURE.items():
+            try:
+                tempo = misura(codice, ambienti.get(nome, base), args.ripetizioni)
+            except subprocess.CalledProcessError as e:
+                print(f"{nome:>44} {'errore':>9}  {e.stderr.strip().splitlines()[-1]}")
+                continue
+            print(f"{nome:>44} {tempo:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
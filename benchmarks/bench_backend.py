@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Confronto dei backend di archiviazione sullo stesso carico di lavoro
+
+Carica lo stesso diario sintetico nel backend Supabase (client finto con
+latenza iniettata, per simulare i round trip di rete) e nel backend SQLite
+locale, poi misura le operazioni di DiarioAlimentareDB con la cache delle
+letture disattivata. Per ogni operazione riporta la mediana in millisecondi.
+
+Uso:
+    python benchmarks/bench_backend.py [--righe N] [--latenza S] [--ripetizioni N]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "fake.fake.fake")
+
+from bench_conversione import genera_voci  # noqa: E402
+from fake_supabase import FakeSupabaseClient  # noqa: E402
+from database.backend_sqlite import SQLiteBackend  # noqa: E402
+from database.backend_supabase import SupabaseBackend  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+
+
+def scenari(righe, rnd):
+    """Operazioni da misurare: nome -> funzione senza argomenti"""
+    db = DiarioAlimentareDB
+    return {
+        "get_entry_by_id": lambda: db.get_entry_by_id(rnd.randint(1, righe)),
+        "get_entries_by_date_range": lambda: db.get_entries_by_date_range(
+            datetime(2020, 3, 1, tzinfo=timezone.utc), datetime(2020, 3, 31, tzinfo=timezone.utc)),
+        "get_entries_by_meal_type": lambda: db.get_entries_by_meal_type("Pranzo"),
+        "search_entries": lambda: db.search_entries("pizz"),
+        "get_all_entries": lambda: db.get_all_entries(),
+        "get_statistics": lambda: db.get_statistics(),
+        "update_entry": lambda: db.update_entry(rnd.randint(1, righe), note="benchmark"),
+        "create_entry + delete_entry": lambda: db.delete_entry(
+            db.create_entry(data=datetime.now(timezone.utc), alimento="mela")["data"]["id"]),
+    }
+
+
+def misura(nome_backend, righe, ripetizioni):
+    rnd = random.Random(1)
+    risultati = {}
+    for nome, operazione in scenari(righe, rnd).items():
+        tempi = []
+        for _ in range(ripetizioni):
+            t0 = time.perf_counter()
+            risultato = operazione()
+            tempi.append(time.perf_counter() - t0)
+            assert risultato["success"], f"{nome_backend} {nome}: {risultato.get('error')}"
+        risultati[nome] = statistics.median(tempi) * 1000
+    return risultati
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, default=20_000)
+    parser.add_argument("--latenza", type=float, default=0.03, help="secondi per richiesta a Supabase")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    args = parser.parse_args()
+
+    voci = genera_voci(args.righe)
+    DiarioAlimentareDB.cache.configure(ttl=0)
+    colonne = {}
+
+    client = FakeSupabaseClient(latenza=args.latenza)
+    client.carica(DiarioAlimentareDB.TABLE_NAME, voci)
+    DiarioAlimentareDB.use_backend(SupabaseBackend(client))
+    colonne["supabase"] = misura("supabase", args.righe, args.ripetizioni)
+
+    with tempfile.TemporaryDirectory() as cartella:
+        sqlite = SQLiteBackend(os.path.join(cartella, "diario.sqlite"))
+        for inizio in range(0, len(voci), 1000):
+            sqlite.upsert(voci[inizio:inizio + 1000])
+        DiarioAlimentareDB.use_backend(sqlite)
+        colonne["sqlite"] = misura("sqlite", args.righe, args.ripetizioni)
+        sqlite.close()
+
+    print(f"{args.righe} righe, latenza Supabase {args.latenza * 1000:.0f} ms, mediana di {args.ripetizioni} esecuzioni")
+    print(f"{'operazione':>28} {'supabase (ms)':>14} {'sqlite (ms)':>12} {'speed-up':>9}")
+    for nome in colonne["supabase"]:
+        remoto, locale = colonne["supabase"][nome], colonne["sqlite"][nome]
+        print(f"{nome:>28} {remoto:>14.2f} {locale:>12.2f} {remoto / locale:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
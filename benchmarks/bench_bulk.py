@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark delle scritture bulk (create_entries_bulk) contro create_entry
+
+Usa il client Supabase finto con latenza iniettata e riporta le righe al
+secondo ottenute con inserimenti singoli e a blocchi.
+
+Uso:
+    python benchmarks/bench_bulk.py [--righe N] [--latenza S] [--blocco N]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "fake.fake.fake")
+
+from bench_conversione import genera_voci  # noqa: E402
+from fake_supabase import FakeSupabaseClient  # noqa: E402
+from database.backend_supabase import SupabaseBackend  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+
+
+def voci_da_inserire(n):
+    voci = []
+    for voce in genera_voci(n):
+        voce = {k: v for k, v in voce.items() if k in DiarioAlimentareDB.FIELDS}
+        voce["data"] = datetime.fromisoformat(voce["data"])
+        voci.append(voce)
+    return voci
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, default=20_000)
+    parser.add_argument("--singole", type=int, default=100, help="righe per la prova con create_entry")
+    parser.add_argument("--latenza", type=float, default=0.02, help="secondi per richiesta")
+    parser.add_argument("--blocco", type=int, default=500)
+    args = parser.parse_args()
+
+    client = FakeSupabaseClient(latenza=args.latenza)
+    DiarioAlimentareDB.use_backend(SupabaseBackend(client))
+
+    voci = voci_da_inserire(args.singole)
+    t0 = time.perf_counter()
+    for voce in voci:
+        DiarioAlimentareDB.create_entry(**voce)
+    singole = args.singole / (time.perf_counter() - t0)
+
+    voci = voci_da_inserire(args.righe)
+    client.richieste = 0
+    t0 = time.perf_counter()
+    risultato = DiarioAlimentareDB.create_entries_bulk(voci, chunk_size=args.blocco)
+    trascorso = time.perf_counter() - t0
+    assert risultato["success"] and risultato["count"] == args.righe
+
+    print(f"create_entry:        {singole:>10.0f} righe/s")
+    print(f"create_entries_bulk: {args.righe / trascorso:>10.0f} righe/s "
+          f"({client.richieste} richieste, blocchi da {args.blocco})")
+
+
+if __name__ == "__main__":
+    main()
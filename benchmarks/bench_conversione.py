@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark della conversione voci -> DataFrame (database.conversione)
+
+Misura il tempo di voci_a_dataframe su diari sintetici di dimensione
+crescente e riporta il costo per riga: se la scalatura è lineare il
+costo per riga resta circa costante.
+
+Uso:
+    python benchmarks/bench_conversione.py [dimensioni...]
+"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from database.conversione import voci_a_dataframe  # noqa: E402
+
+PASTI = ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"]
+ALIMENTI = ["pasta", "pane", "riso", "mela", "yogurt", "pizza", "latte", "biscotti"]
+
+
+def genera_voci(n, seed=42):
+    """Genera n voci nel formato restituito da Supabase"""
+    rnd = random.Random(seed)
+    inizio = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    voci = []
+    for i in range(1, n + 1):
+        voci.append({
+            "id": i,
+            "data": (inizio + timedelta(minutes=37 * i)).isoformat(),
+            "pasto": rnd.choice(PASTI),
+            "alimento": rnd.choice(ALIMENTI),
+            "quantita": rnd.randint(10, 300),
+            "unita_misura": "g",
+            "carboidrati": round(rnd.uniform(0, 120), 1),
+            "glicemia_iniziale": rnd.randint(60, 250),
+            "glicemia_dop_2h": rnd.randint(70, 300) if rnd.random() < 0.7 else None,
+            "unita_insulina": round(rnd.uniform(0, 12), 1) if rnd.random() < 0.8 else None,
+            "note": None,
+            "dosi_correttive": 1.0 if rnd.random() < 0.1 else None,
+            "tempo_dosi_correttive": 90 if rnd.random() < 0.1 else None,
+        })
+    return voci
+
+
+def main():
+    dimensioni = [int(x) for x in sys.argv[1:]] or [1_000, 10_000, 100_000, 1_000_000]
+    print(f"{'righe':>10} {'tempo (s)':>10} {'µs/riga':>10}")
+    for n in dimensioni:
+        voci = genera_voci(n)
+        t0 = time.perf_counter()
+        df = voci_a_dataframe(voci)
+        trascorso = time.perf_counter() - t0
+        assert len(df) == n
+        print(f"{n:>10} {trascorso:>10.3f} {trascorso / n * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
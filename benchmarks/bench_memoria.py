@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Memoria delle voci del diario: snapshot di dizionari e formati del DataFrame
+
+Genera un diario sintetico e lo fa passare per JSON, così ogni riga ha le
+proprie copie dei testi come quelle lette da Supabase. Misura:
+
+- la memoria delle voci appena lette e quella delle stesse voci nello
+  snapshot, che tiene una sola copia dei testi ripetuti (CAMPI_RIPETUTI);
+- tempo di conversione e memoria (memory_usage(deep=True)) del DataFrame
+  nei formati di conversione.FORMATI: esteso (i tipi di sempre), compatto
+  e arrow. Il rapporto è rispetto al formato esteso.
+
+Uso:
+    python benchmarks/bench_memoria.py [--righe N [N ...]]
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from generatore import genera_diario  # noqa: E402
+from database.backend import COLONNA_UTENTE, UTENTE_PREDEFINITO  # noqa: E402
+from database.conversione import FORMATI, voci_a_dataframe  # noqa: E402
+from database.sincronizzazione import SnapshotDiario  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def misura_voci(testo):
+    """Memoria (MB) delle voci lette da JSON e delle stesse voci nello snapshot"""
+    gc.collect()
+    tracemalloc.start()
+    voci = json.loads(testo)
+    lette = tracemalloc.get_traced_memory()[0]
+    snapshot = SnapshotDiario()
+    snapshot.applica(voci)
+    del voci
+    gc.collect()
+    # Senza l'indice per id, che le voci lette non hanno
+    nello_snapshot = tracemalloc.get_traced_memory()[0] - sys.getsizeof(snapshot.voci)
+    tracemalloc.stop()
+    return lette / MB, nello_snapshot / MB, snapshot.lista()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for n in args.righe:
+        voci = genera_diario(n)
+        for voce in voci:
+            voce[COLONNA_UTENTE] = UTENTE_PREDEFINITO
+        testo = json.dumps(voci)
+        del voci
+        lette, nello_snapshot, voci = misura_voci(testo)
+        del testo
+        print(f"{n} righe")
+        print(f"  voci lette (MB) {lette:>10.1f}   nello snapshot (MB) {nello_snapshot:>10.1f}   "
+              f"rapporto {lette / nello_snapshot:.2f}x")
+        print(f"  {'formato':<10} {'conversione (s)':>16} {'memoria (MB)':>13} {'byte/riga':>10} {'rapporto':>9}")
+        riferimento = None
+        for formato in FORMATI:
+            t0 = time.perf_counter()
+            df = voci_a_dataframe(voci, formato=formato)
+            trascorso = time.perf_counter() - t0
+            memoria = df.memory_usage(deep=True).sum()
+            riferimento = riferimento or memoria
+            print(f"  {formato:<10} {trascorso:>16.3f} {memoria / MB:>13.1f} {memoria / n:>10.1f} "
+                  f"{riferimento / memoria:>8.2f}x")
+            del df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark della lettura parallela per shard di date (iter_entry_pages_parallel)
+
+Confronta il tempo reale della lettura seriale con quella parallela contro
+il client Supabase finto, che aggiunge una latenza fissa a ogni richiesta
+per simulare i round trip di rete.
+
+Uso:
+    python benchmarks/bench_parallelo.py [--righe N] [--latenza S] [--pagina N]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "fake.fake.fake")
+
+from bench_conversione import genera_voci  # noqa: E402
+from fake_supabase import FakeSupabaseClient  # noqa: E402
+from database.backend_supabase import SupabaseBackend  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, default=5_000)
+    parser.add_argument("--latenza", type=float, default=0.1, help="secondi per richiesta")
+    parser.add_argument("--pagina", type=int, default=250)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    client = FakeSupabaseClient(latenza=args.latenza)
+    client.carica(DiarioAlimentareDB.TABLE_NAME, genera_voci(args.righe))
+    DiarioAlimentareDB.use_backend(SupabaseBackend(client))
+
+    t0 = time.perf_counter()
+    seriale = [v for p in DiarioAlimentareDB.iter_entry_pages(page_size=args.pagina) for v in p]
+    tempo_seriale = time.perf_counter() - t0
+    print(f"{'modalità':>12} {'richieste':>10} {'tempo (s)':>10} {'speed-up':>9}")
+    print(f"{'seriale':>12} {client.richieste:>10} {tempo_seriale:>10.2f} {1:>9.1f}")
+
+    for workers in args.workers:
+        client.richieste = 0
+        t0 = time.perf_counter()
+        parallelo = [v for p in DiarioAlimentareDB.iter_entry_pages_parallel(
+            max_workers=workers, page_size=args.pagina) for v in p]
+        trascorso = time.perf_counter() - t0
+        assert [v["id"] for v in parallelo] == [v["id"] for v in seriale], "ordine diverso dalla lettura seriale"
+        print(f"{f'{workers} thread':>12} {client.richieste:>10} {trascorso:>10.2f} {tempo_seriale / trascorso:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Ricerca testuale: indice full-text contro scansione con ilike
+
+Crea un diario SQLite sintetico con alimenti e note variati, poi confronta
+search_entries (indice full-text, vocabolario con trigrammi e ordinamento
+per pertinenza) con il vecchio filtro alimento ilike '%termine%' ordinato
+per data, che deve leggere tutta la tabella. La cache delle letture è
+disattivata. Per ogni termine riporta la mediana in millisecondi e il
+numero di voci restituite.
+
+Uso:
+    python benchmarks/bench_ricerca.py [--righe N] [--ripetizioni N] [--limite N]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from bench_conversione import ALIMENTI, genera_voci  # noqa: E402
+from database.backend_sqlite import SQLiteBackend  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+
+QUALIFICHE = ["integrale", "al pomodoro", "con verdure", "greco", "bianco", "al forno", "fresco", "light"]
+NOTE = ["dopo palestra", "fuori casa", "porzione abbondante", "ipoglicemia prima del pasto", "cena con amici"]
+RARI = ["tiramisù", "cannoli siciliani", "melanzane alla parmigiana"]
+
+# Termine -> descrizione
+TERMINI = {
+    "pasta": "parola frequente",
+    "pomodoro": "seconda parola",
+    "tiramisu": "parola rara, senza accento",
+    "parmigiana": "parola rara",
+    "pomodroo": "refuso",
+    "cannolo": "variante",
+    "pasta integrale": "due parole",
+}
+
+BLOCCO = 10_000
+
+
+def carica(backend, righe, rnd):
+    for inizio in range(0, righe, BLOCCO):
+        voci = genera_voci(min(BLOCCO, righe - inizio), seed=inizio)
+        for i, voce in enumerate(voci, start=inizio + 1):
+            voce["id"] = i
+            if rnd.random() < 0.0005:
+                voce["alimento"] = rnd.choice(RARI)
+            else:
+                voce["alimento"] = f"{rnd.choice(ALIMENTI)} {rnd.choice(QUALIFICHE)}"
+            voce["note"] = rnd.choice(NOTE) if rnd.random() < 0.3 else None
+        backend.insert(voci)
+
+
+def misura(funzione, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        risultato = funzione()
+        tempi.append(time.perf_counter() - t0)
+    return statistics.median(tempi) * 1000, risultato
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, default=200_000)
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--limite", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cartella:
+        backend = SQLiteBackend(os.path.join(cartella, "diario.sqlite"))
+        t0 = time.perf_counter()
+        carica(backend, args.righe, random.Random(1))
+        print(f"{args.righe} righe caricate in {time.perf_counter() - t0:.1f} s\n")
+        DiarioAlimentareDB.use_backend(backend)
+        DiarioAlimentareDB.cache.configure(ttl=0)
+
+        # La prima ricerca carica il vocabolario in memoria
+        t0 = time.perf_counter()
+        DiarioAlimentareDB.search_entries("pasta", limit=args.limite)
+        print(f"prima ricerca (carica il vocabolario): {(time.perf_counter() - t0) * 1000:.1f} ms\n")
+
+        print(f"{'termine':>18} {'tipo':>28} {'indice ms':>10} {'voci':>5} {'ilike ms':>10} {'voci':>5}")
+        for termine, descrizione in TERMINI.items():
+            tempo, risultato = misura(
+                lambda: DiarioAlimentareDB.search_entries(termine, limit=args.limite), args.ripetizioni
+            )
+            tempo_ilike, scansione = misura(
+                lambda: backend.select("*", [("alimento", "ilike", f"%{termine}%")],
+                                       ordine=[("data", True)], limit=args.limite),
+                args.ripetizioni
+            )
+            print(f"{termine:>18} {descrizione:>28} {tempo:>10.2f} {risultato['count']:>5} "
+                  f"{tempo_ilike:>10.2f} {len(scansione):>5}")
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
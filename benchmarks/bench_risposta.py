@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Analisi della risposta glicemica: NumPy vettoriale contro pandas apply
+
+Genera un diario sintetico realistico e confronta RispostaGlicemica
+(array NumPy aggiornati dallo snapshot, bincount e un solo ordinamento per
+i quantili) con la stessa analisi scritta in modo ingenuo con pandas:
+apply riga per riga per variazione, rapporto e fasce, groupby().apply per
+le statistiche e rolling("7D") per pasto per le tendenze. Per
+RispostaGlicemica riporta a parte il caricamento iniziale delle voci (una
+volta sola, poi gli aggiornamenti sono incrementali) e il calcolo di tutte
+le analisi, che è ciò che la pagina Analisi paga a ogni modifica. Prima di
+misurare controlla che le due versioni diano gli stessi risultati.
+
+Uso:
+    python benchmarks/bench_risposta.py [--righe N [N ...]] [--ripetizioni N]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from generatore import genera_diario  # noqa: E402
+from database.aggregati import FASCIA_TEMPO  # noqa: E402
+from database.conversione import date_locali  # noqa: E402
+from database.risposta_glicemica import (  # noqa: E402
+    CAMPI, FASCIA_RAPPORTO, QUARTILI, RAPPORTO_MASSIMO, TARGET, RispostaGlicemica
+)
+
+FINESTRE = (7, 30)
+
+
+def analisi_ingenua(voci):
+    """La stessa analisi di RispostaGlicemica.calcola(), con apply e groupby().apply"""
+    df = pd.DataFrame(voci)
+    for campo in CAMPI:
+        df[campo] = pd.to_numeric(df[campo], errors="coerce").astype(float)
+    df["pasto"] = df["pasto"].fillna("")
+    df["giorno"] = date_locali(df["data"]).dt.normalize()
+    df["variazione"] = df.apply(lambda r: r["glicemia_dop_2h"] - r["glicemia_iniziale"], axis=1)
+    df["rapporto"] = df.apply(
+        lambda r: r["carboidrati"] / r["unita_insulina"]
+        if r["carboidrati"] > 0 and r["unita_insulina"] > 0 else np.nan, axis=1)
+    df["in_target"] = df["glicemia_dop_2h"].apply(lambda g: float(TARGET[0] <= g <= TARGET[1]))
+
+    def quartili(serie):
+        return [serie.quantile(q) for q in QUARTILI]
+
+    def per_pasto(g):
+        q = quartili(g["variazione"])
+        return pd.Series({
+            "Misurazioni": len(g), "Media Variazione": g["variazione"].mean(),
+            "Primo Quartile": q[0], "Mediana Variazione": q[1], "Terzo Quartile": q[2],
+            "Deviazione Standard": g["variazione"].std(), "In Target dopo 2h (%)": g["in_target"].mean() * 100,
+        })
+
+    def rapporti(g):
+        q = quartili(g["rapporto"])
+        return pd.Series({
+            "Voci": len(g), "Primo Quartile": q[0], "Mediana Rapporto": q[1], "Terzo Quartile": q[2],
+            "Media Variazione": g["variazione"].mean(),
+        })
+
+    def correzioni(g):
+        misurate = g.dropna(subset=["variazione"])
+        con_glicemia = g.dropna(subset=["glicemia_dop_2h"])
+        return pd.Series({
+            "Correzioni": len(g), "Media Dosi Correttive": g["dosi_correttive"].mean(),
+            "Media Variazione": misurate["variazione"].mean(),
+            "Variazione per Unità": misurate.apply(lambda r: r["variazione"] / r["dosi_correttive"], axis=1).mean()
+            if len(misurate) else np.nan,
+            "In Target dopo 2h (%)": con_glicemia["in_target"].mean() * 100,
+        })
+
+    def tendenze(g):
+        serie = g.sort_values("giorno").set_index("giorno")["variazione"]
+        medie = {f"Media {f} giorni": serie.rolling(f"{f}D").mean().groupby(level=0).last() for f in FINESTRE}
+        return pd.DataFrame(medie)
+
+    misurate = df.dropna(subset=["variazione"])
+    con_rapporto = df.dropna(subset=["rapporto"])
+    entrambi = con_rapporto.dropna(subset=["variazione"])
+    corrette = df[(df["dosi_correttive"] > 0) & df["tempo_dosi_correttive"].notna()].copy()
+    corrette["fascia"] = corrette["tempo_dosi_correttive"].apply(lambda t: int(t // FASCIA_TEMPO * FASCIA_TEMPO))
+    entrambi = entrambi.assign(fascia=entrambi["rapporto"].apply(
+        lambda r: min(r, RAPPORTO_MASSIMO) // FASCIA_RAPPORTO * FASCIA_RAPPORTO))
+    return {
+        "variazione_per_pasto": misurate.groupby("pasto").apply(per_pasto, include_groups=False),
+        "rapporti_per_pasto": con_rapporto.groupby("pasto").apply(rapporti, include_groups=False),
+        "variazione_per_rapporto": entrambi.groupby("fascia").apply(lambda g: pd.Series({
+            "Misurazioni": len(g), "Media Variazione": g["variazione"].mean(),
+            "In Target dopo 2h (%)": g["in_target"].mean() * 100,
+        }), include_groups=False),
+        "efficacia_correzioni": corrette.groupby("fascia").apply(correzioni, include_groups=False),
+        "tendenze": misurate.groupby("pasto").apply(tendenze, include_groups=False),
+    }
+
+
+def controlla(vettoriale, ingenua):
+    """Verifica che le due analisi coincidano"""
+    for nome in ("variazione_per_pasto", "rapporti_per_pasto", "variazione_per_rapporto", "efficacia_correzioni"):
+        attesa = ingenua[nome].sort_index()
+        ottenuta = vettoriale[nome].sort_index()[attesa.columns]
+        np.testing.assert_array_equal(ottenuta.index.to_numpy(), attesa.index.to_numpy(), err_msg=nome)
+        np.testing.assert_allclose(ottenuta.to_numpy(float), attesa.to_numpy(float), rtol=1e-9, err_msg=nome)
+    # Le tendenze vettoriali hanno anche i giorni senza voci dentro la
+    # finestra: si confrontano i giorni con almeno una voce del pasto
+    attese = ingenua["tendenze"].reset_index().rename(columns={"pasto": "Pasto", "giorno": "Giorno"})
+    ottenute = vettoriale["tendenze"].astype({"Pasto": object, "Giorno": "datetime64[us]"})
+    unite = attese.astype({"Giorno": "datetime64[us]"}).merge(ottenute, on=["Pasto", "Giorno"], how="left",
+                                                             suffixes=("", " vettoriale"))
+    for finestra in FINESTRE:
+        colonna = f"Media {finestra} giorni"
+        np.testing.assert_allclose(unite[f"{colonna} vettoriale"], unite[colonna], rtol=1e-9, err_msg=colonna)
+
+
+def misura(funzione, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - t0)
+    return statistics.median(tempi)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'righe':>10} {'caricamento (s)':>16} {'vettoriale (s)':>15} {'pandas apply (s)':>17} {'speed-up':>9}")
+    for n in args.righe:
+        voci = genera_diario(n)
+        risposta = RispostaGlicemica()
+        t0 = time.perf_counter()
+        risposta.aggiorna(nuove=voci)
+        caricamento = time.perf_counter() - t0
+
+        def vettoriale():
+            risposta.svuota_risultati()
+            return risposta.calcola(finestre=FINESTRE)
+
+        t0 = time.perf_counter()
+        ingenua = analisi_ingenua(voci)
+        tempo_ingenua = time.perf_counter() - t0
+        controlla(vettoriale(), ingenua)
+        tempo_vettoriale = misura(vettoriale, args.ripetizioni)
+        print(f"{n:>10} {caricamento:>16.3f} {tempo_vettoriale:>15.3f} {tempo_ingenua:>17.2f} "
+              f"{tempo_ingenua / tempo_vettoriale:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,634 @@
+"""
+Sostituto locale del client Supabase per benchmark e prove offline
+
+Implementa in memoria il sottoinsieme dell'API di supabase-py usato da
+DiarioAlimentareDB (table().select()/insert()/update()/delete() con i
+filtri PostgREST più comuni) e aggiunge una latenza configurabile per
+ogni richiesta, così da simulare i round trip di rete. I guasti di rete
+(richieste che non partono, risposte perse, connessioni bloccate) si
+iniettano con client.rete. client.channel() notifica le scritture come
+Supabase Realtime (con la riga completa anche per le eliminazioni, come
+con replica identity full).
+
+Uso:
+    client = FakeSupabaseClient(latenza=0.02)
+    client.carica("DiarioAlimentare", voci)
+    DiarioAlimentareDB.use_backend(SupabaseBackend(client))
+
+    # La prima risposta a un insert va persa dopo che le righe sono state scritte
+    client.rete.append(guasto_una_volta("risposta", "insert", ConnectionResetError("connessione chiusa")))
+"""
+
+import copy
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+
+class FakeAPIError(Exception):
+    """Errore restituito dal server, con code come postgrest.exceptions.APIError"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+
+
+def guasto_una_volta(fase: str, operazione: str, errore: BaseException) -> Callable[[str, str], Optional[BaseException]]:
+    """
+    Guasto di rete per client.rete che si verifica una sola volta
+
+    Args:
+        fase: "richiesta" (la richiesta non arriva al server) o "risposta"
+            (il server la esegue ma la risposta va persa)
+        operazione: select, insert, upsert, update, delete o rpc:<funzione>
+        errore: Eccezione da sollevare
+    """
+    rimasti = [errore]
+
+    def guasto(fase_corrente: str, operazione_corrente: str) -> Optional[BaseException]:
+        if fase_corrente == fase and operazione_corrente == operazione and rimasti:
+            return rimasti.pop()
+        return None
+    return guasto
+
+
+class FakeResponse:
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _converti(valore: str) -> Any:
+    """Converte un valore testuale dei filtri or_() nel tipo Python"""
+    if valore.startswith('"') and valore.endswith('"'):
+        return valore[1:-1]
+    if valore == "null":
+        return None
+    try:
+        return int(valore)
+    except ValueError:
+        pass
+    try:
+        return float(valore)
+    except ValueError:
+        return valore
+
+
+def _confronta(valore: Any, operatore: str, atteso: Any) -> bool:
+    if operatore == "is":
+        return valore is None if atteso in (None, "null") else valore == atteso
+    if valore is None:
+        return False
+    if operatore == "eq":
+        return valore == atteso
+    if operatore == "neq":
+        return valore != atteso
+    if operatore == "gt":
+        return valore > atteso
+    if operatore == "gte":
+        return valore >= atteso
+    if operatore == "lt":
+        return valore < atteso
+    if operatore == "lte":
+        return valore <= atteso
+    if operatore == "in":
+        return valore in atteso
+    if operatore in ("like", "ilike"):
+        modello = "^" + re.escape(atteso).replace("%", ".*").replace("_", ".") + "$"
+        flags = re.IGNORECASE | re.DOTALL if operatore == "ilike" else re.DOTALL
+        return re.match(modello, str(valore), flags) is not None
+    raise ValueError(f"Operatore non supportato: {operatore}")
+
+
+def _dividi(testo: str) -> List[str]:
+    """Divide una lista di condizioni PostgREST sulle virgole di primo livello"""
+    parti, livello, inizio, tra_virgolette = [], 0, 0, False
+    for i, carattere in enumerate(testo):
+        if carattere == '"':
+            tra_virgolette = not tra_virgolette
+        elif not tra_virgolette and carattere == "(":
+            livello += 1
+        elif not tra_virgolette and carattere == ")":
+            livello -= 1
+        elif not tra_virgolette and carattere == "," and livello == 0:
+            parti.append(testo[inizio:i])
+            inizio = i + 1
+    parti.append(testo[inizio:])
+    return parti
+
+
+def _condizione_logica(testo: str) -> Callable[[Dict[str, Any]], bool]:
+    """Interpreta una condizione come 'data.lt.X' o 'and(a.eq.1,b.gt.2)'"""
+    for logica, combina in (("and(", all), ("or(", any)):
+        if testo.startswith(logica) and testo.endswith(")"):
+            figli = [_condizione_logica(parte) for parte in _dividi(testo[len(logica):-1])]
+            return lambda riga, figli=figli, combina=combina: combina(f(riga) for f in figli)
+    colonna, operatore, valore = testo.split(".", 2)
+    negato = operatore == "not"
+    if negato:
+        operatore, valore = valore.split(".", 1)
+    atteso = _converti(valore)
+    if negato:
+        return lambda riga: not _confronta(riga.get(colonna), operatore, atteso)
+    return lambda riga: _confronta(riga.get(colonna), operatore, atteso)
+
+
+class _NotProxy:
+    def __init__(self, query: "FakeQuery"):
+        self._query = query
+
+    def __getattr__(self, operatore: str):
+        def filtro(colonna: str, valore: Any):
+            operatore_pulito = operatore.rstrip("_")
+            atteso = None if valore == "null" else valore
+            self._query._filtri.append(
+                lambda riga: not _confronta(riga.get(colonna), operatore_pulito, atteso))
+            return self._query
+        return filtro
+
+
+class FakeQuery:
+    """Costruttore di query fluente compatibile con postgrest-py"""
+
+    def __init__(self, client: "FakeSupabaseClient", tabella: str):
+        self._client = client
+        self._tabella = tabella
+        self._azione = "select"
+        self._colonne: Optional[List[str]] = None
+        self._payload: Any = None
+        self._count: Optional[str] = None
+        self._head = False
+        self._filtri: List[Callable[[Dict[str, Any]], bool]] = []
+        self._ordine: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._on_conflict = "id"
+        self._ignora_duplicati = False
+
+    # Azioni
+    def select(self, *colonne: str, count: Optional[str] = None, head: Optional[bool] = None):
+        testo = ",".join(colonne) or "*"
+        self._colonne = None if testo.strip() == "*" else [c.strip() for c in testo.split(",")]
+        self._count = count
+        self._head = bool(head)
+        return self
+
+    def insert(self, righe, **kwargs):
+        self._azione, self._payload = "insert", righe
+        return self
+
+    def upsert(self, righe, on_conflict: str = "id", ignore_duplicates: bool = False, **kwargs):
+        self._azione, self._payload = "upsert", righe
+        self._on_conflict = on_conflict or "id"
+        self._ignora_duplicati = ignore_duplicates
+        return self
+
+    def update(self, valori, **kwargs):
+        self._azione, self._payload = "update", valori
+        return self
+
+    def delete(self, **kwargs):
+        self._azione = "delete"
+        return self
+
+    # Filtri
+    def _filtro(self, colonna: str, operatore: str, valore: Any):
+        self._filtri.append(lambda riga: _confronta(riga.get(colonna), operatore, valore))
+        return self
+
+    def eq(self, colonna, valore):
+        return self._filtro(colonna, "eq", valore)
+
+    def neq(self, colonna, valore):
+        return self._filtro(colonna, "neq", valore)
+
+    def gt(self, colonna, valore):
+        return self._filtro(colonna, "gt", valore)
+
+    def gte(self, colonna, valore):
+        return self._filtro(colonna, "gte", valore)
+
+    def lt(self, colonna, valore):
+        return self._filtro(colonna, "lt", valore)
+
+    def lte(self, colonna, valore):
+        return self._filtro(colonna, "lte", valore)
+
+    def in_(self, colonna, valori):
+        return self._filtro(colonna, "in", set(valori))
+
+    def like(self, colonna, modello):
+        return self._filtro(colonna, "like", modello)
+
+    def ilike(self, colonna, modello):
+        return self._filtro(colonna, "ilike", modello)
+
+    def is_(self, colonna, valore):
+        return self._filtro(colonna, "is", None if valore == "null" else valore)
+
+    @property
+    def not_(self):
+        return _NotProxy(self)
+
+    def or_(self, filtri: str, **kwargs):
+        condizioni = [_condizione_logica(parte) for parte in _dividi(filtri)]
+        self._filtri.append(lambda riga: any(c(riga) for c in condizioni))
+        return self
+
+    # Modificatori
+    def order(self, colonna: str, desc: bool = False, **kwargs):
+        self._ordine.append((colonna, desc))
+        return self
+
+    def limit(self, n: int, **kwargs):
+        self._limit = n
+        return self
+
+    def offset(self, n: int):
+        self._offset = n
+        return self
+
+    def range(self, inizio: int, fine: int):
+        self._offset, self._limit = inizio, fine - inizio + 1
+        return self
+
+    def execute(self) -> FakeResponse:
+        self._client._attendi()
+        self._client._verifica_rete("richiesta", self._azione)
+        with self._client._lock:
+            risposta = getattr(self, f"_esegui_{self._azione}")()
+        self._client._verifica_rete("risposta", self._azione)
+        return risposta
+
+    # Esecuzione
+    def _righe(self) -> List[Dict[str, Any]]:
+        return self._client._tabelle.setdefault(self._tabella, [])
+
+    def _selezionate(self) -> List[Dict[str, Any]]:
+        return [r for r in self._righe() if all(f(r) for f in self._filtri)]
+
+    def _proietta(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self._colonne is None:
+            return [dict(r) for r in righe]
+        return [{c: r.get(c) for c in self._colonne} for r in righe]
+
+    def _esegui_select(self) -> FakeResponse:
+        righe = self._selezionate()
+        totale = len(righe)
+        for colonna, desc in reversed(self._ordine):
+            # I null vanno in fondo in ordine crescente, in testa in decrescente (come Postgres)
+            righe.sort(key=lambda r: (r.get(colonna) is None, r.get(colonna) or 0), reverse=desc)
+        cap = self._client.max_rows
+        limite = self._limit if self._limit is not None else cap
+        if cap is not None and limite is not None:
+            limite = min(limite, cap)
+        righe = righe[self._offset:] if limite is None else righe[self._offset:self._offset + limite]
+        count = totale if self._count else None
+        return FakeResponse([] if self._head else self._proietta(righe), count)
+
+    def _nuova_riga(self, valori: Dict[str, Any]) -> Dict[str, Any]:
+        riga = {colonna: None for colonna in self._client.colonne}
+        riga.update(self._client.predefiniti)
+        riga.update(copy.deepcopy(valori))
+        if riga.get("id") is None:
+            riga["id"] = self._client._prossimo_id(self._tabella)
+        elif riga["id"] > self._client._ultimo_id.get(self._tabella, 0):
+            self._client._ultimo_id[self._tabella] = riga["id"]
+        riga["updated_at"] = self._client._adesso()
+        return riga
+
+    def _verifica_chiavi(self, righe: List[Dict[str, Any]]) -> None:
+        # Vincolo unique su chiave_idempotenza, come l'indice di 006_idempotenza.sql
+        usate = self._client._chiavi.setdefault(self._tabella, set())
+        chiavi = [r["chiave_idempotenza"] for r in righe if r.get("chiave_idempotenza") is not None]
+        if len(set(chiavi)) < len(chiavi) or usate.intersection(chiavi):
+            raise FakeAPIError("23505", "duplicate key value violates unique constraint on chiave_idempotenza")
+        usate.update(chiavi)
+
+    def _esegui_insert(self) -> FakeResponse:
+        righe = self._payload if isinstance(self._payload, list) else [self._payload]
+        self._client._verifica_guasto("insert", righe)
+        self._verifica_chiavi(righe)
+        nuove = [self._nuova_riga(valori) for valori in righe]
+        self._righe().extend(nuove)
+        self._client._notifica("INSERT", nuove, self._tabella)
+        return FakeResponse([dict(r) for r in nuove])
+
+    def _esegui_upsert(self) -> FakeResponse:
+        righe = self._payload if isinstance(self._payload, list) else [self._payload]
+        self._client._verifica_guasto("upsert", righe)
+        chiave = self._on_conflict
+        esistenti = {r.get(chiave): r for r in self._righe() if r.get(chiave) is not None}
+        risultato, inserite, aggiornate = [], [], []
+        self._verifica_chiavi([valori for valori in righe if valori.get(chiave) not in esistenti])
+        for valori in righe:
+            riga = esistenti.get(valori.get(chiave))
+            if riga is None:
+                riga = self._nuova_riga(valori)
+                self._righe().append(riga)
+                esistenti[riga.get(chiave)] = riga
+                inserite.append(riga)
+            elif self._ignora_duplicati:
+                continue
+            else:
+                riga.update(copy.deepcopy(valori))
+                riga["updated_at"] = self._client._adesso()
+                aggiornate.append(riga)
+            risultato.append(dict(riga))
+        self._client._notifica("INSERT", inserite, self._tabella)
+        self._client._notifica("UPDATE", aggiornate, self._tabella)
+        return FakeResponse(risultato)
+
+    def _esegui_update(self) -> FakeResponse:
+        self._client._verifica_guasto("update", [self._payload])
+        aggiornate = self._selezionate()
+        for riga in aggiornate:
+            riga.update(copy.deepcopy(self._payload))
+            riga["updated_at"] = self._client._adesso()
+        self._client._notifica("UPDATE", aggiornate, self._tabella)
+        return FakeResponse([dict(r) for r in aggiornate])
+
+    def _esegui_delete(self) -> FakeResponse:
+        self._client._verifica_guasto("delete", [])
+        eliminate = self._selezionate()
+        ids = {id(r) for r in eliminate}
+        self._client._tabelle[self._tabella] = [r for r in self._righe() if id(r) not in ids]
+        self._client._chiavi.get(self._tabella, set()).difference_update(
+            r.get("chiave_idempotenza") for r in eliminate
+        )
+        self._client._notifica("DELETE", eliminate, self._tabella)
+        return FakeResponse([dict(r) for r in eliminate])
+
+
+def _riassunto(valori: List[Any], cifre: int) -> Dict[str, Any]:
+    presenti = [v for v in valori if v is not None]
+    if not presenti:
+        return {"avg": None, "min": None, "max": None}
+    return {"avg": round(sum(presenti) / len(presenti), cifre), "min": min(presenti), "max": max(presenti)}
+
+
+def _del_utente(client: "FakeSupabaseClient", filtro_utente: Optional[str]) -> List[Dict[str, Any]]:
+    # Come le funzioni di sql/008_rls.sql: senza utente nessuna voce, ma un errore
+    if filtro_utente is None:
+        raise FakeAPIError("22004", "filtro_utente è obbligatorio")
+    return [r for r in client.righe("DiarioAlimentare") if r["user_id"] == filtro_utente]
+
+
+def diario_statistiche(client: "FakeSupabaseClient", filtro_utente: Optional[str] = None) -> Dict[str, Any]:
+    """Equivalente Python della funzione SQL diario_statistiche"""
+    righe = _del_utente(client, filtro_utente)
+    gruppi: Dict[str, List[Dict[str, Any]]] = {}
+    for riga in righe:
+        gruppi.setdefault(riga.get("pasto") or "", []).append(riga)
+    carbs_non_zero = [r["carboidrati"] for r in righe if r.get("carboidrati")]
+    return {
+        "total_entries": len(righe),
+        "entries_with_carbs": sum(1 for r in righe if r.get("carboidrati") is not None),
+        "average_carbs": round(sum(carbs_non_zero) / len(carbs_non_zero), 2) if carbs_non_zero else 0,
+        "carboidrati": _riassunto([r.get("carboidrati") for r in righe], 2),
+        "unita_insulina": _riassunto([r.get("unita_insulina") for r in righe], 2),
+        "glicemia_iniziale": _riassunto([r.get("glicemia_iniziale") for r in righe], 1),
+        "glicemia_dop_2h": _riassunto([r.get("glicemia_dop_2h") for r in righe], 1),
+        "per_pasto": {
+            pasto: {
+                "count": len(gruppo),
+                "average_carbs": _riassunto([r.get("carboidrati") for r in gruppo], 2)["avg"],
+                "average_insulin": _riassunto([r.get("unita_insulina") for r in gruppo], 2)["avg"],
+                "average_glucose": _riassunto([r.get("glicemia_iniziale") for r in gruppo], 1)["avg"],
+                "average_glucose_2h": _riassunto([r.get("glicemia_dop_2h") for r in gruppo], 1)["avg"],
+            }
+            for pasto, gruppo in gruppi.items()
+        },
+    }
+
+
+def diario_riepilogo(client: "FakeSupabaseClient", data_da: Optional[str] = None, data_a: Optional[str] = None,
+                     filtro_pasto: Optional[str] = None, filtro_alimento: Optional[str] = None,
+                     filtro_utente: Optional[str] = None) -> Dict[str, Any]:
+    """Equivalente Python della funzione SQL diario_riepilogo"""
+    righe = [r for r in _del_utente(client, filtro_utente)
+             if (data_da is None or _confronta(r["data"], "gte", data_da))
+             and (data_a is None or _confronta(r["data"], "lte", data_a))
+             and (filtro_pasto is None or r.get("pasto") == filtro_pasto)
+             and (filtro_alimento is None or _confronta(r.get("alimento"), "ilike", f"%{filtro_alimento}%"))]
+    glicemie = [r["glicemia_iniziale"] for r in righe if r.get("glicemia_iniziale") is not None]
+    return {
+        "count": len(righe),
+        "average_glucose": round(sum(glicemie) / len(glicemie), 1) if glicemie else None,
+        "total_carbs": round(sum(r.get("carboidrati") or 0 for r in righe), 1),
+        "total_corrective_doses": round(sum(r.get("dosi_correttive") or 0 for r in righe), 1),
+    }
+
+
+def diario_checksum(client: "FakeSupabaseClient", id_min: Optional[int] = None,
+                    id_max: Optional[int] = None, filtro_utente: Optional[str] = None) -> Dict[str, Any]:
+    """Equivalente Python della funzione SQL diario_checksum"""
+    righe = [r for r in _del_utente(client, filtro_utente)
+             if (id_min is None or r["id"] >= id_min) and (id_max is None or r["id"] <= id_max)]
+    return {
+        "count": len(righe),
+        "sum_id": sum(r["id"] for r in righe),
+        "sum_quantita": sum(r.get("quantita") or 0 for r in righe),
+        "sum_glicemia_iniziale": sum(r.get("glicemia_iniziale") or 0 for r in righe),
+        "sum_glicemia_dop_2h": sum(r.get("glicemia_dop_2h") or 0 for r in righe),
+        "count_carboidrati": sum(1 for r in righe if r.get("carboidrati") is not None),
+    }
+
+
+def diario_ora(client: "FakeSupabaseClient") -> str:
+    """Equivalente della funzione SQL diario_ora, sull'orologio simulato del client"""
+    return client._ora().isoformat()
+
+
+def diario_cerca(client: "FakeSupabaseClient", termine: str, campi: Optional[List[str]] = None,
+                 limite: int = 50, filtro_utente: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Equivalente approssimato della funzione SQL diario_cerca
+
+    Scorre tutte le righe (nessun indice): misura il round trip, non la
+    velocità della ricerca su Postgres.
+    """
+    from database.ricerca import SOGLIA_SIMILARITA, parole, punteggio_testo
+
+    campi = campi or ["alimento"]
+    cercate = parole(termine)
+    if not cercate:
+        return []
+    trovate = []
+    for riga in _del_utente(client, filtro_utente):
+        valore = punteggio_testo(cercate, (riga.get(c) for c in campi)) / len(cercate)
+        if valore >= SOGLIA_SIMILARITA:
+            trovate.append((-valore, -riga["id"], riga))
+    trovate.sort(key=lambda t: t[:2])
+    return [dict(riga) for _, _, riga in trovate[:limite]]
+
+
+class FakeRpc:
+    def __init__(self, client: "FakeSupabaseClient", funzione: Callable, parametri: Dict[str, Any]):
+        self._client = client
+        self._funzione = funzione
+        self._parametri = parametri
+
+    def execute(self) -> FakeResponse:
+        operazione = f"rpc:{self._funzione.__name__}"
+        self._client._attendi()
+        self._client._verifica_rete("richiesta", operazione)
+        with self._client._lock:
+            risposta = FakeResponse(self._funzione(self._client, **self._parametri))
+        self._client._verifica_rete("risposta", operazione)
+        return risposta
+
+
+class FakeChannel:
+    """
+    Canale Realtime finto: notifica le scritture sul client, nello stesso
+    thread e subito dopo ciascuna, con il payload di on_postgres_changes
+    """
+
+    def __init__(self, client: "FakeSupabaseClient", topic: str):
+        self._client = client
+        self.topic = topic
+        self._ascolti: List[Dict[str, Any]] = []
+        self._stato: Optional[Callable[[str, Optional[Exception]], None]] = None
+
+    def on_postgres_changes(self, event: str, callback: Callable[[Dict[str, Any]], None],
+                            table: Optional[str] = None, schema: Optional[str] = None,
+                            filter: Optional[str] = None, **kwargs) -> "FakeChannel":
+        self._ascolti.append({"evento": str(event), "callback": callback, "tabella": table})
+        return self
+
+    def subscribe(self, callback: Optional[Callable[[str, Optional[Exception]], None]] = None) -> "FakeChannel":
+        self._stato = callback
+        self._client.canali.append(self)
+        if callback is not None:
+            callback("SUBSCRIBED", None)
+        return self
+
+    def unsubscribe(self) -> None:
+        if self in self._client.canali:
+            self._client.canali.remove(self)
+            if self._stato is not None:
+                self._stato("CLOSED", None)
+
+    def _notifica(self, tabella: Optional[str], evento: str, righe: List[Dict[str, Any]]) -> None:
+        for ascolto in self._ascolti:
+            if ascolto["evento"] not in ("*", evento) or ascolto["tabella"] not in (None, "*", tabella):
+                continue
+            for riga in righe:
+                ascolto["callback"]({
+                    "data": {
+                        "schema": "public", "table": tabella, "type": evento,
+                        "commit_timestamp": riga.get("updated_at"), "errors": None, "columns": [],
+                        "record": dict(riga) if evento != "DELETE" else {},
+                        "old_record": dict(riga) if evento != "INSERT" else {},
+                    },
+                    "ids": [],
+                })
+
+
+class FakeSupabaseClient:
+    """
+    Client Supabase finto, in memoria, con latenza iniettata
+
+    Args:
+        latenza: Secondi di attesa simulati per ogni richiesta
+        max_rows: Limite di righe per risposta, come max-rows di PostgREST
+    """
+
+    colonne = [
+        "id", "data", "pasto", "alimento", "quantita", "unita_misura", "carboidrati",
+        "glicemia_iniziale", "glicemia_dop_2h", "unita_insulina", "note",
+        "dosi_correttive", "tempo_dosi_correttive", "updated_at", "chiave_idempotenza", "user_id",
+    ]
+    # Valori di default delle colonne, come nella tabella su Supabase
+    predefiniti = {"user_id": "predefinito"}
+
+    def __init__(self, latenza: float = 0.0, max_rows: Optional[int] = None):
+        self.latenza = latenza
+        self.max_rows = max_rows
+        self.richieste = 0
+        self.funzioni: Dict[str, Callable] = {
+            "diario_statistiche": diario_statistiche,
+            "diario_checksum": diario_checksum,
+            "diario_riepilogo": diario_riepilogo,
+            "diario_cerca": diario_cerca,
+            "diario_ora": diario_ora,
+        }
+        # Guasti del server: (operazione, righe) -> eccezione, prima di una scrittura
+        self.guasti: List[Callable[[str, List[Dict[str, Any]]], Optional[Exception]]] = []
+        # Guasti di rete: (fase, operazione) -> eccezione, prima della richiesta
+        # ("richiesta") o dopo averla eseguita ("risposta"); possono anche attendere
+        self.rete: List[Callable[[str, str], Optional[BaseException]]] = []
+        self.ascoltatori: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.canali: List[FakeChannel] = []
+        self._tabelle: Dict[str, List[Dict[str, Any]]] = {}
+        self._ultimo_id: Dict[str, int] = {}
+        self._chiavi: Dict[str, set] = {}
+        self._lock = threading.RLock()
+        self._orologio = 0
+
+    def carica(self, tabella: str, righe: List[Dict[str, Any]]) -> None:
+        """Sostituisce il contenuto di una tabella (senza latenza)"""
+        with self._lock:
+            self._tabelle[tabella] = [{**self.predefiniti, **r} for r in righe]
+            self._chiavi[tabella] = {r["chiave_idempotenza"] for r in righe if r.get("chiave_idempotenza")}
+            self._ultimo_id[tabella] = max((r["id"] for r in righe), default=0)
+
+    def righe(self, tabella: str) -> List[Dict[str, Any]]:
+        return self._tabelle.get(tabella, [])
+
+    def table(self, nome: str) -> FakeQuery:
+        return FakeQuery(self, nome)
+
+    def from_(self, nome: str) -> FakeQuery:
+        return self.table(nome)
+
+    def channel(self, topic: str, params: Optional[Dict[str, Any]] = None) -> "FakeChannel":
+        return FakeChannel(self, topic)
+
+    def rpc(self, nome: str, parametri: Optional[Dict[str, Any]] = None) -> FakeRpc:
+        if nome not in self.funzioni:
+            # Come PostgREST quando la funzione non è nello schema
+            raise FakeAPIError("PGRST202", f"Could not find the function public.{nome}")
+        return FakeRpc(self, self.funzioni[nome], parametri or {})
+
+    def _attendi(self) -> None:
+        with self._lock:
+            self.richieste += 1
+        if self.latenza:
+            time.sleep(self.latenza)
+
+    def _verifica_rete(self, fase: str, operazione: str) -> None:
+        for guasto in self.rete:
+            errore = guasto(fase, operazione)
+            if errore is not None:
+                raise errore
+
+    def _verifica_guasto(self, operazione: str, righe: List[Dict[str, Any]]) -> None:
+        for guasto in self.guasti:
+            errore = guasto(operazione, righe)
+            if errore is not None:
+                raise errore
+
+    def _notifica(self, evento: str, righe: List[Dict[str, Any]], tabella: Optional[str] = None) -> None:
+        for ascoltatore in self.ascoltatori:
+            for riga in righe:
+                ascoltatore(evento, dict(riga))
+        for canale in list(self.canali):
+            canale._notifica(tabella, evento, righe)
+
+    def _prossimo_id(self, tabella: str) -> int:
+        self._ultimo_id[tabella] = self._ultimo_id.get(tabella, 0) + 1
+        return self._ultimo_id[tabella]
+
+    def _adesso(self) -> str:
+        # Orologio simulato: ogni scrittura avanza di un minuto, così updated_at
+        # è distinto e crescente anche con il margine della sincronizzazione
+        self._orologio += 1
+        return self._ora().isoformat()
+
+    def _ora(self) -> datetime:
+        return datetime(2030, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=self._orologio)
@@ -0,0 +1,134 @@
+"""
+Generatore di diari sintetici realistici per benchmark e prove
+
+Le voci seguono una giornata tipo: i pasti cadono in fasce orarie
+plausibili, gli alimenti hanno carboidrati per 100 g coerenti, l'insulina
+segue un rapporto insulina/carboidrati, la glicemia dopo 2 ore dipende
+da carboidrati e insulina e, quando è alta, viene registrata una dose
+correttiva. A parità di seme il diario generato è sempre lo stesso.
+
+Uso:
+    from generatore import genera_diario, SCALE
+    voci = genera_diario(SCALE["media"], seme=42)
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+# Dimensioni di riferimento
+SCALE = {"piccola": 1_000, "media": 100_000, "grande": 1_000_000}
+
+# Pasto -> (ora tipica, deviazione in minuti, probabilità di registrarlo)
+PASTI = {
+    "Colazione": (7.5, 40, 0.95),
+    "Spuntino Mattina": (10.5, 30, 0.35),
+    "Pranzo": (13.0, 45, 0.95),
+    "Merenda": (16.5, 40, 0.45),
+    "Cena": (20.0, 50, 0.95),
+    "Spuntino Sera": (22.5, 30, 0.2),
+}
+
+# Alimento -> (carboidrati per unità, unità, quantità tipica, pasti in cui compare)
+ALIMENTI = {
+    "Pasta al pomodoro": (0.75, "g", 80, ("Pranzo", "Cena")),
+    "Pasta integrale": (0.66, "g", 80, ("Pranzo", "Cena")),
+    "Risotto ai funghi": (0.78, "g", 80, ("Pranzo", "Cena")),
+    "Pizza margherita": (0.30, "g", 300, ("Cena",)),
+    "Pane": (0.50, "g", 50, ("Colazione", "Pranzo", "Cena")),
+    "Fette biscottate": (0.75, "g", 30, ("Colazione",)),
+    "Biscotti": (0.70, "g", 40, ("Colazione", "Merenda")),
+    "Cereali": (0.80, "g", 40, ("Colazione",)),
+    "Latte": (0.05, "ml", 200, ("Colazione",)),
+    "Yogurt greco": (0.04, "g", 150, ("Colazione", "Merenda", "Spuntino Mattina")),
+    "Mela": (0.12, "g", 150, ("Spuntino Mattina", "Merenda", "Spuntino Sera")),
+    "Banana": (0.20, "g", 120, ("Spuntino Mattina", "Merenda")),
+    "Crackers": (15.0, "porzione", 1, ("Spuntino Mattina", "Merenda")),
+    "Insalata di riso": (0.45, "g", 200, ("Pranzo",)),
+    "Petto di pollo con patate": (0.17, "g", 250, ("Pranzo", "Cena")),
+    "Minestrone": (0.07, "g", 300, ("Cena",)),
+    "Gelato": (0.25, "g", 100, ("Merenda", "Spuntino Sera")),
+    "Cioccolato fondente": (0.45, "g", 20, ("Spuntino Sera", "Merenda")),
+}
+
+NOTE = [
+    "dopo palestra", "fuori casa", "porzione abbondante", "ipoglicemia prima del pasto",
+    "cena con amici", "stress", "giornata di malattia", "sensore da calibrare",
+]
+
+# Parametri metabolici medi
+RAPPORTO_INSULINA = 12.0      # grammi di carboidrati per unità
+SENSIBILITA = 45.0            # mg/dl di glicemia abbassati da un'unità
+SOGLIA_CORREZIONE = 180       # glicemia a 2 ore oltre cui si corregge
+OBIETTIVO = 120
+
+
+def _giornata(rnd: random.Random, giorno: datetime) -> Iterator[Dict[str, Any]]:
+    """Voci di una giornata, in ordine di orario"""
+    for pasto, (ora, deviazione, probabilita) in PASTI.items():
+        if rnd.random() > probabilita:
+            continue
+        orario = giorno + timedelta(hours=ora, minutes=rnd.gauss(0, deviazione))
+        candidati = [nome for nome, dati in ALIMENTI.items() if pasto in dati[3]]
+        # Un pasto principale può avere più alimenti, registrati allo stesso orario
+        numero = rnd.choice((1, 1, 2)) if pasto in ("Pranzo", "Cena", "Colazione") else 1
+        glicemia_iniziale = int(min(max(rnd.gauss(135, 35), 55), 320))
+        for alimento in rnd.sample(candidati, min(numero, len(candidati))):
+            per_unita, unita, tipica, _ = ALIMENTI[alimento]
+            quantita = max(1, round(rnd.gauss(tipica, tipica * 0.25))) if unita != "porzione" else rnd.choice((1, 1, 2))
+            carboidrati = round(per_unita * quantita * rnd.uniform(0.9, 1.1), 1)
+            insulina = round(carboidrati / RAPPORTO_INSULINA * 2) / 2 if rnd.random() < 0.9 else None
+            dopo_2h = None
+            if rnd.random() < 0.75:
+                effetto = carboidrati * 3.0 - (insulina or 0) * SENSIBILITA
+                dopo_2h = int(min(max(glicemia_iniziale + effetto + rnd.gauss(0, 30), 50), 400))
+            correttiva = tempo = None
+            if dopo_2h is not None and dopo_2h > SOGLIA_CORREZIONE:
+                correttiva = max(0.5, round((dopo_2h - OBIETTIVO) / SENSIBILITA * 2) / 2)
+                tempo = int(rnd.choice((90, 120, 120, 150, 180)))
+            yield {
+                "data": orario.isoformat(),
+                "pasto": pasto,
+                "alimento": alimento,
+                "quantita": quantita,
+                "unita_misura": unita,
+                "carboidrati": carboidrati,
+                "glicemia_iniziale": glicemia_iniziale,
+                "glicemia_dop_2h": dopo_2h,
+                "unita_insulina": insulina,
+                "note": rnd.choice(NOTE) if rnd.random() < 0.08 else None,
+                "dosi_correttive": correttiva,
+                "tempo_dosi_correttive": tempo,
+            }
+
+
+def genera_diario(
+    n: int,
+    seme: int = 42,
+    inizio: Optional[datetime] = None,
+    con_id: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Genera n voci giorno per giorno, a partire da inizio
+
+    Args:
+        n: Numero di voci
+        seme: Seme del generatore casuale
+        inizio: Primo giorno (default 1 gennaio 2020, UTC)
+        con_id: Se True assegna gli id da 1 a n e updated_at, come le righe lette da Supabase
+
+    Returns:
+        Voci nel formato della tabella, in ordine cronologico
+    """
+    rnd = random.Random(seme)
+    giorno = inizio or datetime(2020, 1, 1, tzinfo=timezone.utc)
+    voci: List[Dict[str, Any]] = []
+    while len(voci) < n:
+        voci.extend(_giornata(rnd, giorno))
+        giorno += timedelta(days=1)
+    del voci[n:]
+    if con_id:
+        for entry_id, voce in enumerate(voci, start=1):
+            voce["id"] = entry_id
+            voce["updated_at"] = voce["data"]
+    return voci
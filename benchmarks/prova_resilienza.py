@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Prova dello strato di resilienza contro il client Supabase finto con guasti iniettati
+
+Ogni scenario prepara un diario vuoto, inietta un guasto di rete (richiesta
+persa, risposta persa dopo la scrittura, connessione bloccata, database
+irraggiungibile) e verifica l'esito visto da DiarioAlimentareDB e il
+contenuto della tabella: nessun pasto duplicato, letture ripetute, timeout
+rispettati e circuito aperto durante un'interruzione. Termina con codice 1
+se uno scenario fallisce.
+
+Uso:
+    python benchmarks/prova_resilienza.py [--solo REGEX]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+# Tempi ridotti per non attendere i valori di produzione
+os.environ.setdefault("DIARIO_TIMEOUT", "0.5")
+os.environ.setdefault("DIARIO_TENTATIVI", "3")
+os.environ.setdefault("DIARIO_CIRCUITO_SOGLIA", "3")
+os.environ.setdefault("DIARIO_CIRCUITO_PAUSA", "1")
+os.environ.setdefault("DIARIO_CACHE_TTL", "0")
+# Coda delle scritture in memoria, inviata solo dagli scenari
+os.environ.setdefault("DIARIO_CODA_PATH", ":memory:")
+os.environ["DIARIO_CODA_INTERVALLO"] = "0"
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from fake_supabase import FakeSupabaseClient, guasto_una_volta  # noqa: E402
+from generatore import genera_diario  # noqa: E402
+from database.backend import TABLE_NAME  # noqa: E402
+from database.backend_supabase import SupabaseBackend  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+
+SCENARI = []
+
+
+def scenario(funzione):
+    SCENARI.append(funzione)
+    return funzione
+
+
+def prepara(voci=0):
+    client = FakeSupabaseClient()
+    client.carica(TABLE_NAME, genera_diario(voci) if voci else [])
+    DiarioAlimentareDB.use_backend(SupabaseBackend(client))
+    for operazione in DiarioAlimentareDB.coda.operazioni():
+        DiarioAlimentareDB.coda.scarta(operazione["seq"])
+    return client
+
+
+def crea(**campi):
+    return DiarioAlimentareDB.create_entry(data=datetime(2024, 5, 1, 13), pasto="Pranzo",
+                                           alimento="Pasta", quantita=80, **campi)
+
+
+def verifica(condizione, messaggio):
+    if not condizione:
+        raise AssertionError(messaggio)
+
+
+@scenario
+def insert_risposta_persa():
+    """La risposta a un insert va persa dopo la scrittura: la voce esiste una sola volta"""
+    client = prepara()
+    client.rete.append(guasto_una_volta("risposta", "insert", ConnectionResetError("connessione chiusa")))
+    risultato = crea()
+    verifica(risultato["success"], risultato.get("error"))
+    verifica(len(client.righe(TABLE_NAME)) == 1, f"{len(client.righe(TABLE_NAME))} righe invece di 1")
+
+
+@scenario
+def insert_richiesta_persa():
+    """La connessione viene rifiutata: l'insert viene ripetuto"""
+    client = prepara()
+    client.rete.append(guasto_una_volta("richiesta", "insert", ConnectionRefusedError("rifiutata")))
+    verifica(crea()["success"], "inserimento non riuscito")
+    verifica(len(client.righe(TABLE_NAME)) == 1, "righe duplicate o mancanti")
+
+
+@scenario
+def bulk_risposta_persa():
+    """Un blocco di 200 voci perde la risposta: nessuna voce duplicata"""
+    client = prepara()
+    client.rete.append(guasto_una_volta("risposta", "insert", TimeoutError("timeout di lettura")))
+    risultato = DiarioAlimentareDB.create_entries_bulk(genera_diario(200, con_id=False), chunk_size=100)
+    verifica(risultato["success"] and risultato["count"] == 200, risultato.get("error"))
+    verifica(len(client.righe(TABLE_NAME)) == 200, f"{len(client.righe(TABLE_NAME))} righe invece di 200")
+
+
+@scenario
+def invio_doppio():
+    """Lo stesso modulo inviato due volte con la stessa chiave crea una sola voce"""
+    client = prepara()
+    chiave = str(uuid.uuid4())
+    primo, secondo = crea(idempotency_key=chiave), crea(idempotency_key=chiave)
+    verifica(primo["success"] and secondo["success"], secondo.get("error"))
+    verifica(primo["data"]["id"] == secondo["data"]["id"], "id diversi")
+    verifica(len(client.righe(TABLE_NAME)) == 1, "voce duplicata")
+
+
+@scenario
+def lettura_ripetuta():
+    """Una lettura fallita per un errore 503 viene ripetuta"""
+    client = prepara(50)
+
+    class Errore503(Exception):
+        code = "503"
+
+    client.rete.append(guasto_una_volta("richiesta", "select", Errore503("Service Unavailable")))
+    risultato = DiarioAlimentareDB.get_all_entries(limit=10)
+    verifica(risultato["success"] and len(risultato["data"]) == 10, risultato.get("error"))
+
+
+@scenario
+def connessione_bloccata():
+    """Una richiesta bloccata viene abbandonata al timeout e ripetuta"""
+    client = prepara(50)
+    bloccate = [1]
+
+    def blocca(fase, operazione):
+        if fase == "richiesta" and operazione == "rpc:diario_statistiche" and bloccate:
+            bloccate.pop()
+            time.sleep(5)
+        return None
+
+    client.rete.append(blocca)
+    inizio = time.perf_counter()
+    risultato = DiarioAlimentareDB.get_statistics()
+    durata = time.perf_counter() - inizio
+    verifica(risultato["success"], risultato.get("error"))
+    verifica(durata < 2, f"attesa di {durata:.1f} s")
+
+
+@scenario
+def errore_definitivo():
+    """Un errore del server non transitorio non viene ripetuto"""
+    client = prepara()
+    client.guasti.append(lambda operazione, righe: ValueError("valore non valido"))
+    risultato = crea()
+    verifica(not risultato["success"], "errore non riportato")
+    verifica(client.richieste == 1, f"{client.richieste} richieste invece di 1")
+
+
+@scenario
+def eliminazione_risposta_persa():
+    """Un delete con esito incerto non viene ripetuto e l'errore arriva al chiamante"""
+    client = prepara(10)
+    client.rete.append(guasto_una_volta("risposta", "delete", ConnectionResetError("connessione chiusa")))
+    risultato = DiarioAlimentareDB.delete_entry(1)
+    verifica(not risultato["success"], "eliminazione segnalata come riuscita")
+    verifica(len(client.righe(TABLE_NAME)) == 9, "la voce doveva essere eliminata dal server")
+
+
+@scenario
+def interruzione():
+    """Durante un'interruzione il circuito si apre, rifiuta subito e si richiude dopo la pausa"""
+    client = prepara(10)
+    guasto = [True]
+    client.rete.append(lambda fase, operazione: ConnectionRefusedError("irraggiungibile")
+                       if guasto[0] and fase == "richiesta" else None)
+    verifica(not DiarioAlimentareDB.get_all_entries(limit=5)["success"], "lettura riuscita durante il guasto")
+    verifica(DiarioAlimentareDB.get_circuit_state()["stato"] == "aperto", "circuito non aperto")
+
+    richieste = client.richieste
+    inizio = time.perf_counter()
+    risultato = DiarioAlimentareDB.get_all_entries(limit=5)
+    verifica(not risultato["success"] and time.perf_counter() - inizio < 0.05, "il circuito non rifiuta subito")
+    verifica(client.richieste == richieste, "richiesta inviata con il circuito aperto")
+
+    guasto[0] = False
+    time.sleep(float(os.environ["DIARIO_CIRCUITO_PAUSA"]))
+    verifica(DiarioAlimentareDB.get_all_entries(limit=5)["success"], "lettura fallita dopo la pausa")
+    verifica(DiarioAlimentareDB.get_circuit_state()["stato"] == "chiuso", "circuito non richiuso")
+
+
+@scenario
+def coda_offline():
+    """Senza rete le scritture restano in coda e al ritorno partono nell'ordine, senza duplicati"""
+    client = prepara(10)
+    guasto = [True]
+    client.rete.append(lambda fase, operazione: ConnectionRefusedError("irraggiungibile")
+                       if guasto[0] and fase == "richiesta" else None)
+    chiave = str(uuid.uuid4())
+    for _ in range(2):
+        DiarioAlimentareDB.queue_create_entry(datetime(2024, 5, 1, 13), pasto="Pranzo", alimento="Pasta",
+                                              quantita=80, idempotency_key=chiave)
+    DiarioAlimentareDB.queue_create_entry(datetime(2024, 5, 1, 20), pasto="Cena", alimento="Pizza", quantita=300)
+    DiarioAlimentareDB.queue_update_entry(3, note="aggiornata")
+    DiarioAlimentareDB.queue_delete_entry(3)
+    DiarioAlimentareDB.queue_delete_entry(5)
+
+    esito = DiarioAlimentareDB.flush_queue()
+    verifica(not esito["success"] and esito["pending"] == 5, f"invio riuscito senza rete: {esito}")
+    verifica(len(client.righe(TABLE_NAME)) == 10, "tabella modificata senza rete")
+
+    guasto[0] = False
+    time.sleep(float(os.environ["DIARIO_CIRCUITO_PAUSA"]))
+    esito = DiarioAlimentareDB.flush_queue()
+    verifica(esito["success"] and esito["sent"] == 5 and esito["pending"] == 0, f"invio non completo: {esito}")
+    righe = {riga["id"]: riga for riga in client.righe(TABLE_NAME)}
+    verifica(len(righe) == 10 and 3 not in righe and 5 not in righe, f"{len(righe)} righe, id {sorted(righe)}")
+    verifica(sorted(r["alimento"] for r in righe.values() if r["id"] > 10) == ["Pasta", "Pizza"], "voci nuove errate")
+
+
+@scenario
+def coda_reinvio():
+    """Una creazione già scritta da un invio interrotto non viene duplicata al nuovo invio"""
+    client = prepara()
+    operazione = DiarioAlimentareDB.queue_create_entry(datetime(2024, 5, 1, 13), pasto="Pranzo",
+                                                       alimento="Pasta", quantita=80)["data"]
+    # L'invio precedente è arrivato al database ma il processo si è fermato prima di togliere l'operazione
+    crea(idempotency_key=operazione["chiave"])
+    esito = DiarioAlimentareDB.flush_queue()
+    verifica(esito["success"] and esito["pending"] == 0, esito.get("error"))
+    verifica(len(client.righe(TABLE_NAME)) == 1, f"{len(client.righe(TABLE_NAME))} righe invece di 1")
+
+
+@scenario
+def coda_conflitto():
+    """Una modifica di una voce cambiata altrove va in conflitto e blocca le operazioni successive sulla voce"""
+    client = prepara(10)
+    letta = DiarioAlimentareDB.get_entry_by_id(4)["data"]
+    time.sleep(0.01)
+    DiarioAlimentareDB.update_entry(4, note="da un altro dispositivo")
+    DiarioAlimentareDB.queue_update_entry(4, base_updated_at=letta["updated_at"], note="dal telefono")
+    DiarioAlimentareDB.queue_update_entry(4, quantita=1)
+    DiarioAlimentareDB.queue_delete_entry(6)
+
+    esito = DiarioAlimentareDB.flush_queue()
+    stato = DiarioAlimentareDB.get_queue_status()
+    verifica(esito["sent"] == 1 and stato["conflicts"] == 1 and stato["pending"] == 1, f"{esito} {stato}")
+    voce = next(r for r in client.righe(TABLE_NAME) if r["id"] == 4)
+    verifica(voce["note"] == "da un altro dispositivo" and voce["quantita"] != 1, "modifica inviata fuori ordine")
+
+    conflitto = next(op for op in stato["data"] if op["stato"] == "conflitto")
+    DiarioAlimentareDB.retry_queued(conflitto["seq"], overwrite=True)
+    esito = DiarioAlimentareDB.flush_queue()
+    voce = next(r for r in client.righe(TABLE_NAME) if r["id"] == 4)
+    verifica(esito["sent"] == 2 and voce["note"] == "dal telefono" and voce["quantita"] == 1, f"{esito} {voce}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--solo", help="Esegue solo gli scenari il cui nome corrisponde all'espressione")
+    args = parser.parse_args()
+
+    falliti = 0
+    for funzione in SCENARI:
+        if args.solo and not re.search(args.solo, funzione.__name__):
+            continue
+        try:
+            funzione()
+            esito = "ok"
+        except AssertionError as e:
+            falliti += 1
+            esito = f"FALLITO: {e}"
+        print(f"{funzione.__name__:>30}  {esito}  ({funzione.__doc__})")
+    sys.exit(1 if falliti else 0)
+
+
+if __name__ == "__main__":
+    main()
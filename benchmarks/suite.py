@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Suite di benchmark di DiarioAlimentareDB, della conversione, dell'esportazione e delle analisi
+
+Carica un diario sintetico (generatore.py) nel client Supabase finto con
+latenza configurabile oppure nel backend SQLite, poi misura uno scenario
+per ogni metodo di DiarioAlimentareDB, il caricamento del DataFrame usato
+dall'app (ottieni_dati_come_df), le esportazioni e i calcoli della pagina
+Analisi, con la cache delle letture disattivata.
+
+Il risultato è un JSON con commit, parametri e, per ogni scenario,
+mediana, minimo e massimo in millisecondi; con --confronta si confronta
+con un risultato precedente e si esce con codice 1 se qualche mediana è
+peggiorata oltre la soglia.
+
+Il client finto scorre tutte le righe a ogni richiesta: per la scala
+grande (1M righe) conviene il backend sqlite.
+
+Uso:
+    python benchmarks/suite.py --scala piccola --output base.json
+    python benchmarks/suite.py --scala piccola --confronta base.json
+    python benchmarks/suite.py --backend sqlite --righe 200000 --solo "analisi|esporta"
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "fake.fake.fake")
+# La sincronizzazione incrementale va misurata leggendo le novità dal server
+os.environ.setdefault("DIARIO_TEMPO_REALE", "0")
+
+from fake_supabase import FakeSupabaseClient  # noqa: E402
+from generatore import SCALE, genera_diario  # noqa: E402
+from database.aggregati import RollupDiario  # noqa: E402
+from database.backend_sqlite import SQLiteBackend  # noqa: E402
+from database.backend_supabase import SupabaseBackend  # noqa: E402
+from database.catalogo import CatalogoAlimenti  # noqa: E402
+from database.conversione import voci_a_dataframe  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+from database.esportazione import esporta  # noqa: E402
+from database.grafici import raggruppa, riduci  # noqa: E402
+from database.risposta_glicemica import RispostaGlicemica  # noqa: E402
+
+FORMATO_RISULTATI = 1
+
+# Righe scritte dagli scenari bulk
+BLOCCO_BULK = 500
+
+
+class Scenario:
+    """
+    Operazione da misurare
+
+    Args:
+        gruppo: Area misurata (lettura, scrittura, sincronizzazione, ...)
+        nome: Nome univoco, usato come chiave nel JSON
+        operazione: Funzione senza argomenti; se restituisce un dict con
+            "success" False lo scenario fallisce
+        ripetizioni: Limite alle ripetizioni per le operazioni lente
+    """
+
+    def __init__(self, gruppo: str, nome: str, operazione: Callable[[], Any], ripetizioni: Optional[int] = None):
+        self.gruppo = gruppo
+        self.nome = nome
+        self.operazione = operazione
+        self.ripetizioni = ripetizioni
+
+
+def scenari(voci: List[Dict[str, Any]], rnd: random.Random) -> List[Scenario]:
+    db = DiarioAlimentareDB
+    righe = len(voci)
+    inizio = datetime.fromisoformat(voci[0]["data"])
+    fine = datetime.fromisoformat(voci[-1]["data"])
+    mese = (inizio + (fine - inizio) / 2, inizio + (fine - inizio) / 2 + timedelta(days=30))
+    # Id creati dagli scenari di scrittura, eliminati da quelli successivi
+    creati: List[int] = []
+    bulk: List[List[int]] = []
+    contesto: Dict[str, Any] = {}
+
+    def crea_voce():
+        risultato = db.create_entry(data=datetime.now(timezone.utc), pasto="Pranzo", alimento="Mela",
+                                    quantita=150, unita_misura="g", carboidrati=18.0)
+        if risultato["success"]:
+            creati.append(risultato["data"]["id"])
+        return risultato
+
+    def crea_bulk():
+        risultato = db.create_entries_bulk(genera_diario(BLOCCO_BULK, seme=rnd.random(), con_id=False))
+        bulk.append([r["data"]["id"] for r in risultato["results"] if r["success"]])
+        return risultato
+
+    def ottieni_dati_come_df():
+        # Come ottieni_dati_come_df in main.py alla prima esecuzione della sessione:
+        # sincronizzazione (incrementale) e conversione dell'intero snapshot
+        risultato = db.sync_entries()
+        contesto["df"] = voci_a_dataframe(risultato["data"])
+        return risultato
+
+    def df():
+        if "df" not in contesto:
+            ottieni_dati_come_df()
+        return contesto["df"]
+
+    def rollup():
+        return db.get_rollup()["data"]
+
+    def risposta():
+        # Senza i risultati in memoria: si misura il calcolo, non la lettura
+        risposta = db.get_glucose_response()["data"]
+        risposta.svuota_risultati()
+        return risposta
+
+    return [
+        # Letture
+        Scenario("lettura", "get_entry_by_id", lambda: db.get_entry_by_id(rnd.randint(1, righe))),
+        Scenario("lettura", "get_all_entries(limit=50)", lambda: db.get_all_entries(limit=50)),
+        Scenario("lettura", "get_all_entries", lambda: db.get_all_entries(), 3),
+        Scenario("lettura", "get_entries_by_date_range (30 giorni)", lambda: db.get_entries_by_date_range(*mese)),
+        Scenario("lettura", "get_entries_by_date_range (30 giorni, limit=50)",
+                 lambda: db.get_entries_by_date_range(*mese, limit=50)),
+        Scenario("lettura", "get_entries_by_meal_type", lambda: db.get_entries_by_meal_type("Merenda"), 3),
+        Scenario("lettura", "get_entries_page (pagina 1)", lambda: db.get_entries_page(page=1)),
+        Scenario("lettura", "get_entries_page (ultima pagina)", lambda: db.get_entries_page(page=max(1, righe // 50))),
+        Scenario("lettura", "get_entries_page (filtri)", lambda: db.get_entries_page(
+            pasto="Cena", alimento="pasta", start_date=mese[0], end_date=mese[1])),
+        Scenario("lettura", "get_summary", lambda: db.get_summary(pasto="Pranzo")),
+        Scenario("lettura", "search_entries", lambda: db.search_entries("pasta pomodoro")),
+        Scenario("lettura", "search_entries (refuso)", lambda: db.search_entries("yougurt")),
+        Scenario("lettura", "get_statistics", lambda: db.get_statistics()),
+        Scenario("lettura", "get_checksum", lambda: db.get_checksum()),
+        Scenario("lettura", "iter_entry_pages", lambda: sum(len(p) for p in db.iter_entry_pages()), 3),
+        Scenario("lettura", "iter_entry_pages_parallel", lambda: sum(
+            len(p) for p in db.iter_entry_pages_parallel(max_workers=4)), 3),
+        # Sincronizzazione e dati dell'app
+        Scenario("sincronizzazione", "sync_entries(full=True)", lambda: db.sync_entries(full=True), 3),
+        Scenario("sincronizzazione", "sync_entries (incrementale)", lambda: db.sync_entries()),
+        Scenario("sincronizzazione", "ottieni_dati_come_df", ottieni_dati_come_df, 3),
+        Scenario("sincronizzazione", "get_rollup", lambda: db.get_rollup()),
+        Scenario("sincronizzazione", "get_catalogo", lambda: db.get_catalogo()),
+        # Scritture (ogni scenario di creazione è seguito da quello che elimina le stesse voci)
+        Scenario("scrittura", "create_entry", crea_voce),
+        Scenario("scrittura", "update_entry", lambda: db.update_entry(rnd.randint(1, righe), note="benchmark")),
+        Scenario("scrittura", "delete_entry", lambda: db.delete_entry(creati.pop())),
+        Scenario("scrittura", f"create_entries_bulk ({BLOCCO_BULK})", crea_bulk),
+        Scenario("scrittura", f"update_entries_bulk ({BLOCCO_BULK})", lambda: db.update_entries_bulk(
+            [{"id": rnd.randint(1, righe), "note": "benchmark"} for _ in range(BLOCCO_BULK)])),
+        Scenario("scrittura", f"upsert_entries_bulk ({BLOCCO_BULK})", lambda: db.upsert_entries_bulk(
+            [{"id": entry_id, "note": "benchmark"} for entry_id in rnd.sample(range(1, righe + 1),
+                                                                             min(BLOCCO_BULK, righe))])),
+        Scenario("scrittura", f"delete_entries_bulk ({BLOCCO_BULK})", lambda: db.delete_entries_bulk(bulk.pop())),
+        # Esportazione del DataFrame completo
+        Scenario("esportazione", "esporta xlsx", lambda: esporta(df(), "xlsx"), 1),
+        Scenario("esportazione", "esporta csv", lambda: esporta(df(), "csv"), 3),
+        Scenario("esportazione", "esporta parquet", lambda: esporta(df(), "parquet"), 3),
+        # Calcoli della pagina Analisi
+        Scenario("analisi", "analisi: ricostruzione aggregati", lambda: RollupDiario().aggiorna(nuove=voci), 3),
+        Scenario("analisi", "analisi: serie giornaliera", lambda: rollup().serie("giorno")),
+        Scenario("analisi", "analisi: serie settimanale per pasto", lambda: rollup().serie("settimana", per_pasto=True)),
+        Scenario("analisi", "analisi: serie mensile", lambda: rollup().serie("mese")),
+        Scenario("analisi", "analisi: per pasto", lambda: rollup().per_pasto()),
+        Scenario("analisi", "analisi: totali", lambda: rollup().totali()),
+        Scenario("analisi", "analisi: alimenti frequenti", lambda: rollup().alimenti_frequenti(10)),
+        Scenario("analisi", "analisi: correlazioni", lambda: rollup().correlazioni()),
+        Scenario("analisi", "analisi: tempi correzione", lambda: rollup().tempi_correzione()),
+        Scenario("analisi", "analisi: correzioni per glicemia", lambda: rollup().correzioni_per_glicemia()),
+        Scenario("analisi", "grafici: riduzione serie giornaliera (lttb)", lambda: riduci(
+            rollup().serie("giorno"), "Periodo", ["Media Glicemia Iniziale", "Media Glicemia dopo 2h"])),
+        Scenario("analisi", "grafici: riduzione serie giornaliera (minmax)", lambda: riduci(
+            rollup().serie("giorno"), "Periodo", ["Media Glicemia Iniziale", "Media Glicemia dopo 2h"], metodo="minmax")),
+        Scenario("analisi", "grafici: barre giornaliere per pasto raggruppate", lambda: raggruppa(
+            rollup().serie("giorno", per_pasto=True), "Periodo", ["Totale Carboidrati (g)"], gruppo="Pasto")),
+        Scenario("analisi", "risposta glicemica: ricostruzione", lambda: RispostaGlicemica().aggiorna(nuove=voci), 3),
+        Scenario("analisi", "risposta glicemica: variazione per pasto", lambda: risposta().variazione_per_pasto()),
+        Scenario("analisi", "risposta glicemica: rapporti per pasto", lambda: risposta().rapporti_per_pasto()),
+        Scenario("analisi", "risposta glicemica: efficacia correzioni", lambda: risposta().efficacia_correzioni()),
+        Scenario("analisi", "risposta glicemica: tendenze 7/30 giorni", lambda: risposta().tendenze()),
+        Scenario("analisi", "risposta glicemica: tutte le analisi", lambda: risposta().calcola()),
+        Scenario("analisi", "catalogo: ricostruzione", lambda: CatalogoAlimenti().aggiorna(nuove=voci), 3),
+        Scenario("analisi", "catalogo: suggerimenti", lambda: db.stati.corrente().catalogo.suggerisci("pa")),
+    ]
+
+
+def misura(scenario: Scenario, ripetizioni: int) -> Dict[str, Any]:
+    tempi = []
+    for _ in range(min(ripetizioni, scenario.ripetizioni or ripetizioni)):
+        t0 = time.perf_counter()
+        risultato = scenario.operazione()
+        tempi.append((time.perf_counter() - t0) * 1000)
+        if isinstance(risultato, dict) and risultato.get("success") is False:
+            raise RuntimeError(f"{scenario.nome}: {risultato.get('error')}")
+    return {
+        "gruppo": scenario.gruppo,
+        "mediana_ms": round(statistics.median(tempi), 3),
+        "min_ms": round(min(tempi), 3),
+        "max_ms": round(max(tempi), 3),
+        "ripetizioni": len(tempi),
+    }
+
+
+def commit_corrente() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepara_backend(nome: str, voci: List[Dict[str, Any]], latenza: float, cartella: str):
+    if nome == "supabase":
+        client = FakeSupabaseClient(latenza=latenza, max_rows=DiarioAlimentareDB.PAGE_SIZE)
+        client.carica(DiarioAlimentareDB.TABLE_NAME, voci)
+        return SupabaseBackend(client)
+    backend = SQLiteBackend(os.path.join(cartella, "diario.sqlite"))
+    for inizio in range(0, len(voci), 10_000):
+        backend.upsert(voci[inizio:inizio + 10_000])
+    return backend
+
+
+def confronta(attuale: Dict[str, Any], precedente: Dict[str, Any], soglia: float, minimo_ms: float) -> List[str]:
+    """Stampa il confronto e restituisce gli scenari peggiorati oltre la soglia"""
+    peggiorati = []
+    print(f"\nconfronto con {precedente.get('commit') or '?'} (soglia x{soglia}, ignorate differenze < {minimo_ms} ms)",
+          file=sys.stderr)
+    print(f"{'scenario':>52} {'prima ms':>10} {'ora ms':>10} {'rapporto':>9}", file=sys.stderr)
+    for nome, risultato in attuale["scenari"].items():
+        prima = precedente.get("scenari", {}).get(nome)
+        if prima is None:
+            print(f"{nome:>52} {'-':>10} {risultato['mediana_ms']:>10.2f} {'nuovo':>9}", file=sys.stderr)
+            continue
+        rapporto = risultato["mediana_ms"] / prima["mediana_ms"] if prima["mediana_ms"] else float("inf")
+        segno = ""
+        if rapporto > soglia and risultato["mediana_ms"] - prima["mediana_ms"] > minimo_ms:
+            peggiorati.append(nome)
+            segno = "  <-- peggiorato"
+        print(f"{nome:>52} {prima['mediana_ms']:>10.2f} {risultato['mediana_ms']:>10.2f} {rapporto:>9.2f}{segno}",
+              file=sys.stderr)
+    return peggiorati
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("supabase", "sqlite"), default="supabase")
+    parser.add_argument("--scala", choices=list(SCALE), default="piccola")
+    parser.add_argument("--righe", type=int, help="numero di voci (sostituisce --scala)")
+    parser.add_argument("--latenza", type=float, default=0.0, help="secondi per richiesta al client Supabase finto")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--seme", type=int, default=42)
+    parser.add_argument("--solo", help="espressione regolare: misura solo gli scenari il cui nome corrisponde")
+    parser.add_argument("--output", help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--confronta", help="file JSON di un'esecuzione precedente")
+    parser.add_argument("--soglia", type=float, default=1.25, help="rapporto oltre cui uno scenario è peggiorato")
+    parser.add_argument("--minimo-ms", type=float, default=1.0, help="differenza minima considerata")
+    args = parser.parse_args()
+
+    righe = args.righe or SCALE[args.scala]
+    t0 = time.perf_counter()
+    voci = genera_diario(righe, seme=args.seme)
+    print(f"{righe} voci generate in {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+
+    risultati: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as cartella:
+        t0 = time.perf_counter()
+        DiarioAlimentareDB.use_backend(prepara_backend(args.backend, voci, args.latenza, cartella))
+        DiarioAlimentareDB.cache.configure(ttl=0)
+        print(f"backend {args.backend} pronto in {time.perf_counter() - t0:.1f} s\n", file=sys.stderr)
+
+        rnd = random.Random(args.seme)
+        for scenario in scenari(voci, rnd):
+            if args.solo and not re.search(args.solo, scenario.nome):
+                continue
+            risultati[scenario.nome] = misura(scenario, args.ripetizioni)
+            print(f"{scenario.nome:>52} {risultati[scenario.nome]['mediana_ms']:>10.2f} ms", file=sys.stderr)
+
+    documento = {
+        "formato": FORMATO_RISULTATI,
+        "commit": commit_corrente(),
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "parametri": {
+            "backend": args.backend, "righe": righe, "latenza": args.latenza,
+            "ripetizioni": args.ripetizioni, "seme": args.seme,
+        },
+        "scenari": risultati,
+    }
+    testo = json.dumps(documento, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(testo + "\n", encoding="utf-8")
+    else:
+        print(testo)
+
+    if args.confronta:
+        precedente = json.loads(Path(args.confronta).read_text(encoding="utf-8"))
+        if precedente.get("parametri") != documento["parametri"]:
+            print("\nattenzione: parametri diversi dall'esecuzione precedente", file=sys.stderr)
+        if confronta(documento, precedente, args.soglia, args.minimo_ms):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,143 +1,273 @@
 #!/usr/bin/env python3
 """
 Script per migrare i dati dal database SQLite locale a Supabase
+
+La migrazione legge SQLite a blocchi con un cursore (memoria costante anche
+con milioni di righe), li invia con DiarioAlimentareDB.upsert_entries_bulk e
+salva un checkpoint dopo ogni blocco. Gli id originali vengono conservati,
+quindi rieseguire lo script dopo un'interruzione riprende dall'ultimo blocco
+confermato senza creare duplicati. La verifica confronta conteggio e somme di
+controllo calcolati sul server (funzione SQL diario_checksum) con quelli
+calcolati su SQLite, senza riscaricare i dati. Con --utente le voci vengono
+assegnate al diario di quell'utente (paziente) e la verifica considera solo
+le sue voci.
+
+Uso:
+    python migrate_to_supabase.py [--sqlite FILE] [--blocco N] [--utente ID] [--solo-verifica]
 """
 
-import sqlite3
+import argparse
+import json
 import os
+import sqlite3
+import sys
+import time
 from datetime import datetime
-from src.database.diario_alimentare import DiarioAlimentare, get_session
-
-def migrate_data():
-    """Migra tutti i dati da SQLite a Supabase"""
-    
-    # Percorso del database SQLite locale
-    sqlite_db_path = "diarioalimentare.sqlite"
-    
+
+from src.database.diario_alimentare import DiarioAlimentareDB
+
+# Nomi delle colonne SQLite che differiscono da quelli della tabella Supabase
+MAPPA_COLONNE = {
+    "quantità": "quantita",
+    "glicemia_dopo_2h": "glicemia_dop_2h",
+    "tempo_dose_correttiva": "tempo_dosi_correttive",
+}
+
+# Errori conservati nel checkpoint (gli altri vengono solo contati)
+MAX_ERRORI_SALVATI = 1000
+
+# Colonne intere usate per il checksum (devono coincidere con diario_checksum)
+COLONNE_CHECKSUM = ("quantita", "glicemia_iniziale", "glicemia_dop_2h")
+
+
+def colonne_sorgente(conn, tabella):
+    """Restituisce la mappa colonna SQLite -> campo Supabase per le colonne migrabili"""
+    cursor = conn.execute(f'PRAGMA table_info("{tabella}")')
+    mappa = {}
+    for colonna in (riga[1] for riga in cursor.fetchall()):
+        campo = MAPPA_COLONNE.get(colonna, colonna)
+        if campo == "id" or campo in DiarioAlimentareDB.FIELDS:
+            mappa[colonna] = campo
+    if "id" not in mappa.values():
+        raise ValueError(f"La tabella {tabella} non ha una colonna id")
+    return mappa
+
+
+def leggi_blocchi(conn, tabella, mappa, dopo_id, blocco):
+    """Legge le righe con id > dopo_id in ordine di id, a blocchi di dimensione fissa"""
+    colonne = ", ".join(f'"{c}"' for c in mappa)
+    colonna_id = next(c for c, campo in mappa.items() if campo == "id")
+    cursor = conn.execute(
+        f'SELECT {colonne} FROM "{tabella}" WHERE "{colonna_id}" > ? ORDER BY "{colonna_id}"',
+        (dopo_id,)
+    )
+    campi = list(mappa.values())
+    while True:
+        righe = cursor.fetchmany(blocco)
+        if not righe:
+            return
+        voci = []
+        for riga in righe:
+            voce = {campo: valore for campo, valore in zip(campi, riga) if valore is not None}
+            if "data" in voce and not isinstance(voce["data"], str):
+                voce["data"] = datetime.fromtimestamp(voce["data"]).isoformat()
+            voci.append(voce)
+        yield voci
+
+
+def carica_checkpoint(percorso, sqlite_db_path):
+    if not os.path.exists(percorso):
+        return {"sqlite": os.path.abspath(sqlite_db_path), "ultimo_id": 0, "migrati": 0, "errori": []}
+    with open(percorso) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("sqlite") != os.path.abspath(sqlite_db_path):
+        raise ValueError(f"Il checkpoint {percorso} si riferisce a un altro file: {checkpoint.get('sqlite')}")
+    return checkpoint
+
+
+def salva_checkpoint(percorso, checkpoint):
+    """Scrive il checkpoint in modo atomico"""
+    temporaneo = percorso + ".tmp"
+    with open(temporaneo, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temporaneo, percorso)
+
+
+def migrate_data(sqlite_db_path, tabella, blocco, percorso_checkpoint):
+    """Migra i dati da SQLite a Supabase, riprendendo dal checkpoint se presente"""
+
     if not os.path.exists(sqlite_db_path):
-        print("❌ Database SQLite non trovato. Assicurati che il file 'diarioalimentare.sqlite' esista.")
-        return
-    
+        print(f"❌ Database SQLite non trovato. Assicurati che il file '{sqlite_db_path}' esista.")
+        return False
+
     try:
-        # Connessione al database SQLite
         conn = sqlite3.connect(sqlite_db_path)
-        cursor = conn.cursor()
-        
-        # Leggi tutti i record dal database SQLite
-        cursor.execute("SELECT * FROM diario_alimentare ORDER BY data")
-        records = cursor.fetchall()
-        
-        # Ottieni i nomi delle colonne
-        cursor.execute("PRAGMA table_info(diario_alimentare)")
-        columns_info = cursor.fetchall()
-        column_names = [col[1] for col in columns_info]
-        
-        print(f"📊 Trovati {len(records)} record da migrare...")
-        
-        # Migra ogni record
-        migrated_count = 0
-        errors = []
-        
-        for record in records:
-            try:
-                # Crea un dizionario con i dati del record
-                record_dict = dict(zip(column_names, record))
-                
-                # Rimuovi l'ID per permettere a Supabase di generarne uno nuovo
-                record_dict.pop('id', None)
-                
-                # Converti la data se necessario
-                if 'data' in record_dict and record_dict['data']:
-                    if isinstance(record_dict['data'], str):
-                        record_dict['data'] = datetime.fromisoformat(record_dict['data'])
-                
-                # Aggiungi il record a Supabase
-                DiarioAlimentare.aggiungi_record(**record_dict)
-                migrated_count += 1
-                
-                if migrated_count % 10 == 0:
-                    print(f"✅ Migrati {migrated_count}/{len(records)} record...")
-                    
-            except Exception as e:
-                error_msg = f"Errore nel record {record}: {str(e)}"
-                errors.append(error_msg)
-                print(f"⚠️  {error_msg}")
-        
+        mappa = colonne_sorgente(conn, tabella)
+        totale = conn.execute(f'SELECT COUNT(*) FROM "{tabella}"').fetchone()[0]
+        checkpoint = carica_checkpoint(percorso_checkpoint, sqlite_db_path)
+
+        if checkpoint["ultimo_id"]:
+            print(f"↩️  Ripresa dal checkpoint: {checkpoint['migrati']} record già migrati (id > {checkpoint['ultimo_id']})")
+        print(f"📊 Trovati {totale} record da migrare...")
+
+        inizio = time.perf_counter()
+        migrati_ora = 0
+        for voci in leggi_blocchi(conn, tabella, mappa, checkpoint["ultimo_id"], blocco):
+            risultato = DiarioAlimentareDB.upsert_entries_bulk(voci, chunk_size=blocco)
+            if "results" not in risultato:
+                # Errore dell'intera richiesta (rete, credenziali): il checkpoint resta
+                # all'ultimo blocco confermato e la prossima esecuzione riprende da lì
+                print(f"❌ Errore durante la migrazione: {risultato['error']}")
+                return False
+
+            for errore in risultato["errors"]:
+                voce = voci[errore["index"]]
+                checkpoint["numero_errori"] = checkpoint.get("numero_errori", 0) + 1
+                if len(checkpoint["errori"]) < MAX_ERRORI_SALVATI:
+                    checkpoint["errori"].append({"id": voce.get("id"), "error": errore["error"]})
+                print(f"⚠️  Errore nel record {voce.get('id')}: {errore['error']}")
+
+            checkpoint["ultimo_id"] = voci[-1]["id"]
+            checkpoint["migrati"] += risultato["count"]
+            migrati_ora += risultato["count"]
+            salva_checkpoint(percorso_checkpoint, checkpoint)
+
+            velocita = migrati_ora / max(time.perf_counter() - inizio, 1e-9)
+            print(f"✅ Migrati {checkpoint['migrati']}/{totale} record ({velocita:.0f} record/s)")
+
         conn.close()
-        
+
         print(f"\n🎉 Migrazione completata!")
-        print(f"✅ Record migrati con successo: {migrated_count}")
-        
+        print(f"✅ Record migrati con successo: {checkpoint['migrati']}")
+
+        errors = checkpoint["errori"]
         if errors:
-            print(f"❌ Errori riscontrati: {len(errors)}")
+            numero_errori = checkpoint.get("numero_errori", len(errors))
+            print(f"❌ Errori riscontrati: {numero_errori}")
             print("\nDettagli errori:")
             for error in errors[:5]:  # Mostra solo i primi 5 errori
-                print(f"  - {error}")
-            if len(errors) > 5:
-                print(f"  ... e altri {len(errors) - 5} errori")
-        
+                print(f"  - id {error['id']}: {error['error']}")
+            if numero_errori > 5:
+                print(f"  ... e altri {numero_errori - 5} errori (vedi {percorso_checkpoint})")
+
+        print("\n💡 Gli id originali sono stati conservati: riallinea la sequenza con il comando")
+        print("   indicato in src/database/sql/003_checksum.sql prima di inserire nuovi record.")
+        return True
+
     except Exception as e:
         print(f"❌ Errore durante la migrazione: {str(e)}")
         print("Assicurati che:")
         print("1. Le variabili d'ambiente di Supabase siano configurate correttamente")
         print("2. Il database Supabase sia accessibile")
         print("3. Il file SQLite esista e sia leggibile")
+        return False
+
+
+def checksum_sqlite(conn, tabella):
+    """Calcola su SQLite le stesse somme di controllo di diario_checksum"""
+    mappa = colonne_sorgente(conn, tabella)
+    per_campo = {campo: colonna for colonna, campo in mappa.items()}
 
-def verify_migration():
-    """Verifica che la migrazione sia avvenuta correttamente"""
+    def somma(campo):
+        return f'COALESCE(SUM("{per_campo[campo]}"), 0)' if campo in per_campo else "0"
+
+    carboidrati = f'COUNT("{per_campo["carboidrati"]}")' if "carboidrati" in per_campo else "0"
+    riga = conn.execute(
+        f'SELECT COUNT(*), {somma("id")}, {", ".join(somma(c) for c in COLONNE_CHECKSUM)}, {carboidrati} '
+        f'FROM "{tabella}"'
+    ).fetchone()
+    chiavi = ["count", "sum_id"] + [f"sum_{c}" for c in COLONNE_CHECKSUM] + ["count_carboidrati"]
+    return dict(zip(chiavi, riga)), conn.execute(
+        f'SELECT MIN("{per_campo["id"]}"), MAX("{per_campo["id"]}") FROM "{tabella}"'
+    ).fetchone()
+
+
+def verify_migration(sqlite_db_path, tabella):
+    """Verifica la migrazione confrontando conteggio e somme di controllo"""
     try:
-        # Conta i record in Supabase
-        records = DiarioAlimentare.ottieni_tutti_record()
-        print(f"📊 Record presenti in Supabase: {len(records)}")
-        
-        # Conta i record in SQLite
-        sqlite_db_path = "diarioalimentare.sqlite"
-        if os.path.exists(sqlite_db_path):
-            conn = sqlite3.connect(sqlite_db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM diario_alimentare")
-            sqlite_count = cursor.fetchone()[0]
-            conn.close()
-            
-            print(f"📊 Record presenti in SQLite: {sqlite_count}")
-            
-            if len(records) == sqlite_count:
-                print("✅ Migrazione verificata: tutti i record sono stati trasferiti!")
-            else:
-                print("⚠️  Attenzione: il numero di record non corrisponde")
-        
+        if not os.path.exists(sqlite_db_path):
+            print(f"❌ Database SQLite non trovato: {sqlite_db_path}")
+            return False
+
+        conn = sqlite3.connect(sqlite_db_path)
+        locale, (id_min, id_max) = checksum_sqlite(conn, tabella)
+        conn.close()
+
+        # Solo l'intervallo di id migrato: eventuali record nuovi non contano
+        risultato = DiarioAlimentareDB.get_checksum(id_min, id_max)
+        if not risultato["success"]:
+            print(f"❌ Errore durante la verifica: {risultato['error']}")
+            return False
+        remoto = risultato["data"]
+
+        print(f"📊 Record presenti in SQLite: {locale['count']}")
+        print(f"📊 Record presenti in Supabase (id {id_min}-{id_max}): {remoto['count']}")
+
+        differenze = [chiave for chiave in locale if locale[chiave] != remoto.get(chiave)]
+        if not differenze:
+            print("✅ Migrazione verificata: conteggio e checksum coincidono!")
+            return True
+        print("⚠️  Attenzione: i dati non corrispondono")
+        for chiave in differenze:
+            print(f"  - {chiave}: SQLite {locale[chiave]} / Supabase {remoto.get(chiave)}")
+        return False
+
     except Exception as e:
         print(f"❌ Errore durante la verifica: {str(e)}")
+        return False
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra il diario alimentare da SQLite a Supabase")
+    parser.add_argument("--sqlite", default="diarioalimentare.sqlite", help="file SQLite di origine")
+    parser.add_argument("--tabella", default="diario_alimentare", help="tabella SQLite di origine")
+    parser.add_argument("--blocco", type=int, default=DiarioAlimentareDB.BULK_CHUNK_SIZE,
+                        help="righe lette e inviate per blocco")
+    parser.add_argument("--checkpoint", default=None,
+                        help="file di checkpoint (default: <sqlite>.checkpoint.json)")
+    parser.add_argument("--utente", default=None,
+                        help="utente (paziente) a cui assegnare le voci (default DIARIO_UTENTE)")
+    parser.add_argument("--solo-verifica", action="store_true", help="esegue solo la verifica")
+    parser.add_argument("--si", action="store_true", help="non chiedere conferma")
+    args = parser.parse_args()
+    percorso_checkpoint = args.checkpoint or f"{args.sqlite}.checkpoint.json"
+    DiarioAlimentareDB.set_user(args.utente)
+
     print("🚀 Avvio migrazione da SQLite a Supabase...")
+    print(f"👤 Utente: {DiarioAlimentareDB.get_user()}")
     print("=" * 50)
-    
+
     # Verifica che le variabili d'ambiente siano configurate
-    required_vars = ["SUPABASE_URL", "SUPABASE_API_KEY", "SUPABASE_DB_URL"]
+    required_vars = ["SUPABASE_URL", "SUPABASE_API_KEY"]
     missing_vars = [var for var in required_vars if not os.getenv(var)]
-    
+
     if missing_vars:
         print("❌ Variabili d'ambiente mancanti:")
         for var in missing_vars:
             print(f"  - {var}")
         print("\nConfigura le variabili d'ambiente prima di procedere.")
         print("Consulta il file SUPABASE_SETUP.md per le istruzioni.")
-        exit(1)
-    
-    # Chiedi conferma
-    response = input("\n⚠️  Questa operazione migrerà tutti i dati da SQLite a Supabase. Continuare? (s/N): ")
-    if response.lower() not in ['s', 'si', 'sì', 'y', 'yes']:
-        print("❌ Migrazione annullata.")
-        exit(0)
-    
-    # Esegui la migrazione
-    migrate_data()
-    
+        sys.exit(1)
+
+    if not args.solo_verifica:
+        # Chiedi conferma
+        if not args.si:
+            response = input("\n⚠️  Questa operazione migrerà tutti i dati da SQLite a Supabase "
+                             "conservando gli id originali. Continuare? (s/N): ")
+            if response.lower() not in ['s', 'si', 'sì', 'y', 'yes']:
+                print("❌ Migrazione annullata.")
+                sys.exit(0)
+
+        # Esegui la migrazione
+        if not migrate_data(args.sqlite, args.tabella, args.blocco, percorso_checkpoint):
+            print("\n💡 Rilancia lo script per riprendere dall'ultimo blocco completato.")
+            sys.exit(1)
+
     # Verifica la migrazione
     print("\n" + "=" * 50)
     print("🔍 Verifica migrazione...")
-    verify_migration()
-    
+    verificata = verify_migration(args.sqlite, args.tabella)
+
     print("\n✨ Processo completato!")
-    print("💡 Ora puoi utilizzare l'applicazione con Supabase.") 
\ No newline at end of file
+    print("💡 Ora puoi utilizzare l'applicazione con Supabase.")
+    sys.exit(0 if verificata else 1)
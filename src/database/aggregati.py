@@ -0,0 +1,250 @@
+import threading
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from .conversione import COLONNE, date_locali
+
+GRANULARITA = ("giorno", "settimana", "mese")
+
+# Campi di cui si tiene somma e numero di valori presenti, per ricavare le medie
+MISURE = ("carboidrati", "unita_insulina", "glicemia_iniziale", "glicemia_dop_2h")
+
+# Campi della matrice di correlazione
+NUMERICHE = (
+    "quantita", "carboidrati", "glicemia_iniziale", "glicemia_dop_2h",
+    "unita_insulina", "dosi_correttive", "tempo_dosi_correttive"
+)
+
+# Ampiezza delle fasce per i tempi di correzione (minuti) e per la glicemia (mg/dl)
+FASCIA_TEMPO = 15
+FASCIA_GLICEMIA = 20
+
+# Somme mantenute per ogni (periodo, pasto): tutte additive, quindi una voce
+# si aggiunge o si toglie senza rileggere le altre
+SOMME = (
+    ["record"]
+    + [f"{misura}_{suffisso}" for misura in MISURE for suffisso in ("n", "somma")]
+    + ["correzioni", "dosi_correttive_somma", "tempo_correzione_n", "tempo_correzione_somma"]
+)
+
+
+def _numeri(serie: pd.Series) -> pd.Series:
+    return pd.to_numeric(serie, errors="coerce").astype(float)
+
+
+class RollupDiario:
+    """
+    Aggregati del diario per giorno, settimana e mese, suddivisi per pasto
+
+    Per ogni periodo e pasto si conservano solo somme e conteggi (record,
+    carboidrati, unità di insulina, glicemie, correzioni e relativi tempi),
+    più i totali usati dalla pagina Analisi: frequenza degli alimenti,
+    istogrammi delle correzioni e i momenti per la matrice di correlazione.
+    Essendo tutti additivi, un inserimento somma il contributo della voce,
+    un'eliminazione lo sottrae e una modifica fa entrambe le cose: il costo
+    di un aggiornamento dipende dalle voci cambiate, non dalla dimensione
+    del diario, e le letture non toccano mai le righe.
+
+    Lo snapshot chiama aggiorna() a ogni cambiamento e azzera() quando
+    viene svuotato o ricaricato.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.azzera()
+
+    def azzera(self) -> None:
+        """Svuota tutti gli aggregati"""
+        with self._lock:
+            indice = pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), pd.Index([], dtype=object)],
+                                               names=["periodo", "pasto"])
+            self._periodi = {g: pd.DataFrame(columns=list(SOMME), index=indice, dtype=float) for g in GRANULARITA}
+            self._alimenti = pd.Series(dtype=float)
+            self._tempi = pd.Series(dtype=float)
+            self._fasce = pd.DataFrame(columns=["correzioni", "dosi_correttive_somma"], dtype=float)
+            dimensione = (len(NUMERICHE), len(NUMERICHE))
+            self._momenti = {nome: np.zeros(dimensione) for nome in ("n", "sx", "sxx", "sxy")}
+            self.versione = getattr(self, "versione", 0) + 1
+
+    @staticmethod
+    def _contributi(voci: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Calcola in modo vettoriale gli aggregati di un gruppo di voci"""
+        df = pd.DataFrame.from_records(voci, columns=["data", "pasto", "alimento", *NUMERICHE])
+        # Il giorno dell'ora scritta nella voce, come nella tabella (non quello UTC)
+        giorno = date_locali(df["data"]).dt.normalize()
+        periodi = {
+            "giorno": giorno,
+            "settimana": giorno - pd.to_timedelta(giorno.dt.weekday, unit="D"),
+            "mese": giorno.dt.to_period("M").dt.to_timestamp(),
+        }
+        pasto = df["pasto"].fillna("").astype(object)
+
+        valori = pd.DataFrame({"record": np.ones(len(df))})
+        for misura in MISURE:
+            numeri = _numeri(df[misura])
+            valori[f"{misura}_n"] = numeri.notna().astype(float)
+            valori[f"{misura}_somma"] = numeri.fillna(0)
+        dosi = _numeri(df["dosi_correttive"])
+        correzione = dosi > 0
+        tempo = _numeri(df["tempo_dosi_correttive"]).where(correzione)
+        valori["correzioni"] = correzione.astype(float)
+        valori["dosi_correttive_somma"] = dosi.where(correzione, 0)
+        valori["tempo_correzione_n"] = tempo.notna().astype(float)
+        valori["tempo_correzione_somma"] = tempo.fillna(0)
+
+        glicemia = _numeri(df["glicemia_iniziale"]).where(correzione)
+        fasce = pd.DataFrame({"correzioni": 1.0, "dosi_correttive_somma": dosi})[glicemia.notna()]
+        fasce = fasce.groupby((glicemia.dropna() // FASCIA_GLICEMIA * FASCIA_GLICEMIA).to_numpy()).sum()
+
+        # Momenti a coppie sulle righe in cui entrambi i valori sono presenti,
+        # come fa DataFrame.corr
+        x = np.column_stack([_numeri(df[campo]).to_numpy() for campo in NUMERICHE])
+        presenti = (~np.isnan(x)).astype(float)
+        x = np.nan_to_num(x)
+        momenti = {
+            "n": presenti.T @ presenti,
+            "sx": x.T @ presenti,
+            "sxx": (x * x).T @ presenti,
+            "sxy": x.T @ x,
+        }
+
+        return {
+            "periodi": {
+                g: valori.groupby([periodo.to_numpy(), pasto.to_numpy()]).sum().rename_axis(["periodo", "pasto"])
+                for g, periodo in periodi.items()
+            },
+            "alimenti": df["alimento"].dropna().value_counts().astype(float),
+            "tempi": (tempo.dropna() // FASCIA_TEMPO * FASCIA_TEMPO).value_counts().astype(float),
+            "fasce": fasce,
+            "momenti": momenti,
+        }
+
+    def aggiorna(
+        self,
+        vecchie: Iterable[Dict[str, Any]] = (),
+        nuove: Iterable[Dict[str, Any]] = ()
+    ) -> None:
+        """
+        Toglie il contributo delle versioni precedenti e aggiunge quello delle nuove
+
+        Args:
+            vecchie: Voci eliminate o versioni prima della modifica
+            nuove: Voci inserite o versioni dopo la modifica
+        """
+        parti = [(voci, segno) for voci, segno in ((list(vecchie), -1.0), (list(nuove), 1.0)) if voci]
+        if not parti:
+            return
+        contributi = [(self._contributi(voci), segno) for voci, segno in parti]
+        with self._lock:
+            for contributo, segno in contributi:
+                for g in GRANULARITA:
+                    somme = self._periodi[g].add(contributo["periodi"][g] * segno, fill_value=0)
+                    self._periodi[g] = somme[somme["record"] > 0]
+                self._alimenti = self._somma(self._alimenti, contributo["alimenti"] * segno)
+                self._tempi = self._somma(self._tempi, contributo["tempi"] * segno)
+                fasce = self._fasce.add(contributo["fasce"] * segno, fill_value=0)
+                self._fasce = fasce[fasce["correzioni"] > 0]
+                for nome, matrice in contributo["momenti"].items():
+                    self._momenti[nome] += segno * matrice
+            self.versione += 1
+
+    @staticmethod
+    def _somma(conteggi: pd.Series, delta: pd.Series) -> pd.Series:
+        conteggi = conteggi.add(delta, fill_value=0)
+        return conteggi[conteggi > 0]
+
+    @staticmethod
+    def _medie(somme: pd.DataFrame) -> pd.DataFrame:
+        """Ricava record, medie e correzioni da una tabella di somme"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            risultato = pd.DataFrame({"Record": somme["record"].astype(int)}, index=somme.index)
+            for misura in MISURE:
+                risultato[f"Media {COLONNE[misura]}"] = (
+                    somme[f"{misura}_somma"] / somme[f"{misura}_n"].where(somme[f"{misura}_n"] > 0)
+                )
+            risultato["Totale Carboidrati (g)"] = somme["carboidrati_somma"]
+            risultato["Totale Unità Insulina"] = somme["unita_insulina_somma"]
+            risultato["Correzioni"] = somme["correzioni"].astype(int)
+            risultato["Media Dosi Correttive"] = (
+                somme["dosi_correttive_somma"] / somme["correzioni"].where(somme["correzioni"] > 0)
+            )
+            risultato["Media Tempo Correzione (min)"] = (
+                somme["tempo_correzione_somma"] / somme["tempo_correzione_n"].where(somme["tempo_correzione_n"] > 0)
+            )
+        return risultato
+
+    def totali(self) -> pd.Series:
+        """Record, medie e correzioni dell'intero diario"""
+        with self._lock:
+            somme = self._periodi["mese"]
+        return self._medie(somme.sum().to_frame().T).iloc[0]
+
+    def serie(self, granularita: str = "giorno", per_pasto: bool = False) -> pd.DataFrame:
+        """
+        Aggregati per periodo, ordinati per data
+
+        Args:
+            granularita: "giorno", "settimana" o "mese"
+            per_pasto: Se True una riga per periodo e pasto, altrimenti una per periodo
+
+        Returns:
+            DataFrame con le colonne Periodo (inizio del periodo), Pasto se
+            richiesto, Record, medie, totali e statistiche delle correzioni
+        """
+        if granularita not in GRANULARITA:
+            raise ValueError(f"Granularità non valida: {granularita}")
+        with self._lock:
+            somme = self._periodi[granularita]
+        if not per_pasto:
+            somme = somme.groupby(level="periodo").sum()
+        risultato = self._medie(somme).sort_index().reset_index()
+        return risultato.rename(columns={"periodo": "Periodo", "pasto": "Pasto"})
+
+    def per_pasto(self) -> pd.DataFrame:
+        """Aggregati dell'intero diario per pasto, indicizzati per nome del pasto"""
+        with self._lock:
+            somme = self._periodi["mese"]
+        somme = somme.groupby(level="pasto").sum()
+        somme.index.name = "Pasto"
+        return self._medie(somme)
+
+    def alimenti_frequenti(self, n: int = 10) -> pd.Series:
+        """Gli n alimenti registrati più spesso, con il numero di voci"""
+        with self._lock:
+            alimenti = self._alimenti
+        return alimenti.sort_values(ascending=False, kind="stable").head(n).astype(int)
+
+    def tempi_correzione(self) -> pd.Series:
+        """Numero di correzioni per fascia di FASCIA_TEMPO minuti (indice: inizio fascia)"""
+        with self._lock:
+            tempi = self._tempi.sort_index().astype(int)
+        tempi.index = tempi.index.astype(int)
+        return tempi
+
+    def correzioni_per_glicemia(self) -> pd.DataFrame:
+        """Numero di correzioni e dose media per fascia di glicemia iniziale"""
+        with self._lock:
+            fasce = self._fasce.sort_index()
+        return pd.DataFrame({
+            "Correzioni": fasce["correzioni"].astype(int),
+            "Media Dosi Correttive": fasce["dosi_correttive_somma"] / fasce["correzioni"],
+        }, index=pd.Index(fasce.index.astype(int), name="Glicemia Iniziale"))
+
+    def correlazioni(self) -> pd.DataFrame:
+        """
+        Matrice di correlazione di Pearson tra i campi numerici
+
+        Ogni coppia usa le sole voci in cui entrambi i valori sono presenti;
+        i campi senza valori sono esclusi.
+        """
+        with self._lock:
+            n, sx, sxx, sxy = (self._momenti[nome].copy() for nome in ("n", "sx", "sxx", "sxy"))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covarianza = n * sxy - sx * sx.T
+            varianze = (n * sxx - sx ** 2) * (n * sxx - sx ** 2).T
+            matrice = np.where((n > 1) & (varianze > 0), covarianza / np.sqrt(varianze), np.nan)
+        presenti = np.diag(n) > 0
+        nomi = [COLONNE[campo] for campo, presente in zip(NUMERICHE, presenti) if presente]
+        return pd.DataFrame(matrice[np.ix_(presenti, presenti)], index=nomi, columns=nomi)
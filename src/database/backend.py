@@ -0,0 +1,219 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+TABLE_NAME = "DiarioAlimentare"
+
+# Campi scrivibili della tabella
+CAMPI = (
+    "data", "pasto", "alimento", "quantita", "unita_misura", "carboidrati",
+    "glicemia_iniziale", "glicemia_dop_2h", "unita_insulina", "note",
+    "dosi_correttive", "tempo_dosi_correttive"
+)
+
+# Chiave di idempotenza (uuid, unica) assegnata a ogni nuova voce: un
+# inserimento ripetuto con la stessa chiave non crea una seconda riga
+CHIAVE_IDEMPOTENZA = "chiave_idempotenza"
+
+# Utente (paziente) a cui appartiene ogni voce: tutte le richieste di
+# DiarioAlimentareDB sono limitate alle voci di un solo utente (vedi utenti.py)
+COLONNA_UTENTE = "user_id"
+# Utente delle voci scritte senza indicarne uno, assegnato anche alle righe
+# esistenti dalla migrazione 007_utenti.sql
+UTENTE_PREDEFINITO = "predefinito"
+
+# Filtro (colonna, operatore, valore). Operatori: eq, neq, gt, gte, lt, lte,
+# in (valore iterabile), ilike (modello con % e _), is (valore None).
+# Una colonna "a,b" con operatore lt o gt e valore (va, vb) confronta la coppia
+# in ordine lessicografico, come serve alla paginazione keyset.
+Filtro = Tuple[str, str, Any]
+# Ordinamento (colonna, decrescente)
+Ordine = Tuple[str, bool]
+
+# Eventi delle modifiche notificate da subscribe, come in Supabase Realtime
+INSERT, UPDATE, DELETE = "INSERT", "UPDATE", "DELETE"
+# Funzione chiamata con (evento, riga) per ogni riga modificata; per DELETE
+# la riga contiene almeno l'id
+Ascoltatore = Callable[[str, Dict[str, Any]], None]
+
+
+class DiarioBackend(ABC):
+    """
+    Motore di archiviazione usato da DiarioAlimentareDB
+
+    Le implementazioni espongono le poche primitive di cui ha bisogno il
+    diario (lettura filtrata e ordinata, conteggio, scritture con RETURNING,
+    statistiche e checksum) e sollevano un'eccezione in caso di errore:
+    la conversione in {"success": False, "error": ...} resta a DiarioAlimentareDB.
+    Le primitive aggregate ricevono l'utente di cui considerare le voci
+    (None per tutte); select e le scritture lo ricevono come filtro o colonna.
+    """
+
+    nome = ""
+    # True se il backend limita da sé la durata delle richieste: BackendResiliente
+    # non ha bisogno di eseguirle in un thread di servizio per applicare il timeout
+    timeout_proprio = False
+
+    @abstractmethod
+    def select(
+        self,
+        colonne: str = "*",
+        filtri: Sequence[Filtro] = (),
+        ordine: Sequence[Ordine] = (),
+        limit: Optional[int] = None,
+        offset: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Legge le righe che soddisfano tutti i filtri"""
+
+    @abstractmethod
+    def count(self, filtri: Sequence[Filtro] = ()) -> int:
+        """Conta le righe che soddisfano tutti i filtri"""
+
+    @abstractmethod
+    def insert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Inserisce le righe in un'unica transazione e le restituisce complete"""
+
+    @abstractmethod
+    def upsert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Inserisce o sostituisce le righe in base all'id, in un'unica transazione"""
+
+    @abstractmethod
+    def update(self, valori: Dict[str, Any], filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        """Aggiorna le righe filtrate e le restituisce"""
+
+    @abstractmethod
+    def delete(self, filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        """Elimina le righe filtrate e le restituisce"""
+
+    @abstractmethod
+    def search(
+        self,
+        termine: str,
+        campi: Sequence[str] = ("alimento",),
+        limit: int = 50,
+        utente: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Cerca il testo nei campi indicati (tra CAMPI_RICERCA) usando un indice
+
+        Il termine deve corrispondere, anche come prefisso, sottostringa o con
+        un refuso, al testo di uno dei campi: SQLite cerca ogni parola del
+        termine separatamente, Supabase confronta il termine per intero. Le
+        voci sono ordinate per pertinenza e poi dalla più recente.
+        """
+
+    @abstractmethod
+    def statistics(self, utente: Optional[str] = None) -> Dict[str, Any]:
+        """Statistiche aggregate, nel formato della funzione SQL diario_statistiche"""
+
+    @abstractmethod
+    def summary(
+        self,
+        data_da: Optional[str] = None,
+        data_a: Optional[str] = None,
+        pasto: Optional[str] = None,
+        alimento: Optional[str] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Riepilogo delle voci filtrate, nel formato della funzione SQL diario_riepilogo
+
+        I filtri sono data >= data_da, data <= data_a, pasto uguale e alimento
+        che contiene il testo indicato (senza distinzione tra maiuscole e minuscole).
+        """
+
+    @abstractmethod
+    def checksum(
+        self,
+        id_min: Optional[int] = None,
+        id_max: Optional[int] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Conteggio e somme di controllo, nel formato della funzione SQL diario_checksum"""
+
+    def subscribe(
+        self,
+        ascoltatore: Ascoltatore,
+        stato: Optional[Callable[[bool], None]] = None
+    ) -> Callable[[], None]:
+        """
+        Notifica inserimenti, modifiche ed eliminazioni di tutti gli utenti
+
+        L'ascoltatore può essere chiamato da un altro thread e non deve
+        bloccarsi né chiamare il backend. stato riceve True quando la
+        sottoscrizione è attiva e False quando si interrompe (le modifiche
+        fatte nel frattempo non vengono notificate).
+
+        Returns:
+            Funzione che annulla la sottoscrizione
+
+        Raises:
+            NotImplementedError: Se il backend non notifica le modifiche
+        """
+        raise NotImplementedError(f"Il backend {self.nome} non notifica le modifiche")
+
+    def now(self) -> datetime:
+        """
+        Ora corrente del database (con fuso orario), lo stesso orologio di updated_at
+
+        Serve alla sincronizzazione incrementale per sapere fin dove ha già
+        letto: a differenza dell'orologio del client non risente di scarti.
+
+        Raises:
+            NotImplementedError: Se il backend non la fornisce
+        """
+        raise NotImplementedError(f"Il backend {self.nome} non fornisce l'ora del database")
+
+    def sign_in(self, email: str, password: str) -> List[str]:
+        """
+        Autentica un account per l'accesso corrente (utenti.imposta_accesso):
+        da quel momento le richieste fatte con lo stesso accesso per conto dei
+        suoi utenti (set_user) usano la sua sessione, e il database mostra
+        solo le voci a cui l'account ha accesso
+
+        Returns:
+            Utenti di cui l'account può usare il diario, per primo il proprio id
+
+        Raises:
+            NotImplementedError: Se il backend non gestisce l'autenticazione
+        """
+        raise NotImplementedError(f"Il backend {self.nome} non gestisce l'autenticazione")
+
+    def sign_out(self) -> None:
+        """
+        Chiude la sessione aperta da sign_in per l'accesso corrente
+
+        Raises:
+            NotImplementedError: Se il backend non gestisce l'autenticazione
+        """
+        raise NotImplementedError(f"Il backend {self.nome} non gestisce l'autenticazione")
+
+
+def dividi_colonne(colonne: str) -> List[str]:
+    """Restituisce l'elenco delle colonne di una stringa "a,b,c" (vuoto per "*")"""
+    if colonne.strip() == "*":
+        return []
+    return [c.strip() for c in colonne.split(",") if c.strip()]
+
+
+def crea_backend(nome: Optional[str] = None, **opzioni) -> DiarioBackend:
+    """
+    Crea il backend indicato, o quello configurato in DIARIO_BACKEND
+
+    Args:
+        nome: "supabase" (default) oppure "sqlite"
+        **opzioni: Per sqlite, percorso (default DIARIO_SQLITE_PATH o
+            diario_alimentare.sqlite); per supabase, url e key (default
+            SUPABASE_URL e SUPABASE_API_KEY)
+    """
+    nome = (nome or os.getenv("DIARIO_BACKEND") or "supabase").lower()
+    if nome == "sqlite":
+        from .backend_sqlite import SQLiteBackend
+        percorso = opzioni.get("percorso") or os.getenv("DIARIO_SQLITE_PATH", "diario_alimentare.sqlite")
+        return SQLiteBackend(percorso)
+    if nome == "supabase":
+        from .backend_supabase import SupabaseBackend
+        return SupabaseBackend.from_env(opzioni.get("url"), opzioni.get("key"))
+    raise ValueError(f"Backend sconosciuto: {nome} (valori ammessi: supabase, sqlite)")
+
@@ -0,0 +1,503 @@
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .backend import (
+    CAMPI, CHIAVE_IDEMPOTENZA, COLONNA_UTENTE, DELETE, INSERT, TABLE_NAME, UPDATE, UTENTE_PREDEFINITO,
+    Ascoltatore, DiarioBackend, Filtro, Ordine, dividi_colonne
+)
+from .ricerca import CAMPI_RICERCA, IndiceParole, conta_parole, parole, punteggio_testo
+
+COLONNE = ("id",) + CAMPI + ("updated_at", CHIAVE_IDEMPOTENZA, COLONNA_UTENTE)
+
+# Colonne timestamp: salvate come testo ISO in UTC a larghezza fissa, così
+# l'ordine lessicografico coincide con quello cronologico
+COLONNE_DATA = ("data", "updated_at")
+
+OPERATORI = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+SCHEMA = f"""
+create table if not exists "{TABLE_NAME}" (
+  id integer primary key autoincrement,
+  data text not null,
+  pasto text,
+  alimento text,
+  quantita integer,
+  unita_misura text,
+  carboidrati real,
+  glicemia_iniziale integer,
+  glicemia_dop_2h integer,
+  unita_insulina real,
+  note text,
+  dosi_correttive real,
+  tempo_dosi_correttive integer,
+  updated_at text not null,
+  chiave_idempotenza text,
+  user_id text not null default '{UTENTE_PREDEFINITO}'
+);
+"""
+
+# Indici con l'utente come prima colonna: ogni richiesta legge solo le voci di
+# un utente, quindi il costo non dipende da quanti utenti ha il database. Sono
+# separati dallo schema perché i database creati prima della colonna user_id
+# la ricevono con alter table (e perdono gli indici senza l'utente)
+SCHEMA_UTENTI = f"""
+drop index if exists "{TABLE_NAME}_data_idx";
+drop index if exists "{TABLE_NAME}_pasto_idx";
+drop index if exists "{TABLE_NAME}_alimento_idx";
+drop index if exists "{TABLE_NAME}_updated_at_idx";
+create index if not exists "{TABLE_NAME}_utente_data_idx" on "{TABLE_NAME}" (user_id, data, id);
+create index if not exists "{TABLE_NAME}_utente_pasto_idx" on "{TABLE_NAME}" (user_id, pasto, data);
+create index if not exists "{TABLE_NAME}_utente_alimento_idx" on "{TABLE_NAME}" (user_id, alimento);
+create index if not exists "{TABLE_NAME}_utente_updated_at_idx" on "{TABLE_NAME}" (user_id, updated_at);
+create index if not exists "{TABLE_NAME}_utente_id_idx" on "{TABLE_NAME}" (user_id, id);
+"""
+
+# Vincolo sulla chiave di idempotenza, separato dallo schema perché i database
+# creati prima della colonna la ricevono con alter table
+SCHEMA_IDEMPOTENZA = f"""
+create unique index if not exists "{TABLE_NAME}_chiave_idempotenza_idx" on "{TABLE_NAME}" (chiave_idempotenza);
+"""
+
+# Indice full-text su alimento e note, allineato alla tabella dai trigger, e
+# vocabolario delle parole indicizzate (mantenuto dal backend a ogni scrittura)
+# per trovare prefissi, sottostringhe e refusi senza leggere le righe
+SCHEMA_RICERCA = f"""
+create virtual table if not exists diario_testo using fts5(
+  {", ".join(CAMPI_RICERCA)}, content="{TABLE_NAME}", content_rowid="id",
+  tokenize="unicode61 remove_diacritics 2"
+);
+create trigger if not exists diario_testo_ai after insert on "{TABLE_NAME}" begin
+  insert into diario_testo (rowid, alimento, note) values (new.id, new.alimento, new.note);
+end;
+create trigger if not exists diario_testo_ad after delete on "{TABLE_NAME}" begin
+  insert into diario_testo (diario_testo, rowid, alimento, note) values ('delete', old.id, old.alimento, old.note);
+end;
+create trigger if not exists diario_testo_au after update of alimento, note on "{TABLE_NAME}" begin
+  insert into diario_testo (diario_testo, rowid, alimento, note) values ('delete', old.id, old.alimento, old.note);
+  insert into diario_testo (rowid, alimento, note) values (new.id, new.alimento, new.note);
+end;
+create table if not exists diario_parole (
+  campo text not null,
+  parola text not null,
+  voci integer not null,
+  primary key (campo, parola)
+) without rowid;
+"""
+
+
+def _normalizza_data(valore: Any) -> Any:
+    """
+    Converte datetime e stringhe ISO in testo ISO UTC (gli orari senza fuso sono UTC, come su Postgres)
+
+    Raises:
+        ValueError: Se la stringa non è una data ISO, come timestamptz su Postgres
+    """
+    if isinstance(valore, str):
+        try:
+            valore = datetime.fromisoformat(valore.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError(f"Data non valida: {valore!r}") from None
+    if isinstance(valore, datetime):
+        if valore.tzinfo is None:
+            valore = valore.replace(tzinfo=timezone.utc)
+        return valore.astimezone(timezone.utc).isoformat(timespec="microseconds")
+    return valore
+
+
+def _adesso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _riga_come_dict(cursor: sqlite3.Cursor, riga: tuple) -> Dict[str, Any]:
+    return {descrizione[0]: valore for descrizione, valore in zip(cursor.description, riga)}
+
+
+class SQLiteBackend(DiarioBackend):
+    """
+    Backend locale su un file SQLite, senza rete
+
+    Adatto a installazioni con un solo utente, all'uso offline e alle prove.
+    Lo schema (con gli indici su data, pasto e alimento e l'indice full-text
+    per la ricerca) viene creato all'apertura; statistiche e checksum sono
+    calcolati in SQL con la stessa forma delle funzioni Supabase. Una sola connessione è condivisa tra i
+    thread e protetta da un lock.
+
+    subscribe notifica le scritture fatte attraverso questa istanza, dopo il
+    commit: tutte le sessioni del processo la condividono, mentre le modifiche
+    fatte al file da altri processi non vengono notificate.
+    """
+
+    nome = "sqlite"
+    # Le attese sui lock del file sono già limitate dal timeout di sqlite3.connect
+    timeout_proprio = True
+
+    def __init__(self, percorso: str = ":memory:"):
+        """
+        Args:
+            percorso: File del database (":memory:" per un database temporaneo)
+        """
+        self.percorso = percorso
+        self.lock = threading.RLock()
+        self.ascoltatori: List[Ascoltatore] = []
+        self.conn = sqlite3.connect(percorso, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = _riga_come_dict
+        if percorso != ":memory:":
+            self.conn.execute("pragma journal_mode = wal")
+            self.conn.execute("pragma synchronous = normal")
+        self.conn.executescript(SCHEMA)
+        colonne = {r["name"] for r in self.conn.execute(f'pragma table_info("{TABLE_NAME}")')}
+        if CHIAVE_IDEMPOTENZA not in colonne:
+            self.conn.execute(f'alter table "{TABLE_NAME}" add column {CHIAVE_IDEMPOTENZA} text')
+        if COLONNA_UTENTE not in colonne:
+            self.conn.execute(f'alter table "{TABLE_NAME}" add column {COLONNA_UTENTE} text not null '
+                              f"default '{UTENTE_PREDEFINITO}'")
+        self.conn.executescript(SCHEMA_IDEMPOTENZA)
+        self.conn.executescript(SCHEMA_UTENTI)
+        # Vocabolario in memoria, caricato alla prima ricerca
+        self._indice: Optional[IndiceParole] = None
+        nuovo_indice = not self.conn.execute(
+            "select 1 from sqlite_master where name = 'diario_testo'"
+        ).fetchone()
+        self.conn.executescript(SCHEMA_RICERCA)
+        if nuovo_indice:
+            self._ricostruisci_ricerca()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def subscribe(
+        self,
+        ascoltatore: Ascoltatore,
+        stato: Optional[Callable[[bool], None]] = None
+    ) -> Callable[[], None]:
+        self.ascoltatori.append(ascoltatore)
+        if stato is not None:
+            stato(True)
+
+        def annulla() -> None:
+            if ascoltatore in self.ascoltatori:
+                self.ascoltatori.remove(ascoltatore)
+            if stato is not None:
+                stato(False)
+        return annulla
+
+    def now(self) -> datetime:
+        # updated_at viene scritto con l'orologio di questo processo
+        return datetime.fromisoformat(_adesso())
+
+    def _notifica(self, evento: str, righe: List[Dict[str, Any]]) -> None:
+        for ascoltatore in list(self.ascoltatori):
+            for riga in righe:
+                ascoltatore(evento, dict(riga))
+
+    @contextmanager
+    def _transazione(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self._parole_in_sospeso: Counter = Counter()
+            self.conn.execute("begin")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("rollback")
+                raise
+            self.conn.execute("commit")
+            # Il vocabolario in memoria riceve le variazioni solo dopo il commit,
+            # quindi non vede mai scritture annullate
+            if self._indice is not None and self._parole_in_sospeso:
+                self._indice.aggiorna(self._parole_in_sospeso)
+
+    def _ricostruisci_ricerca(self) -> None:
+        """Indicizza le righe già presenti (database creati prima dell'indice di ricerca)"""
+        with self._transazione() as conn:
+            conn.execute("insert into diario_testo (diario_testo) values ('rebuild')")
+            conn.execute("delete from diario_parole")
+            righe = conn.execute(f'select {", ".join(CAMPI_RICERCA)} from "{TABLE_NAME}"').fetchall()
+            self._scrivi_parole(conn, conta_parole(righe))
+
+    @staticmethod
+    def _scrivi_parole(conn: sqlite3.Connection, delta: Dict[Tuple[str, str], int]) -> None:
+        variazioni = [(campo, parola, n) for (campo, parola), n in delta.items() if n]
+        conn.executemany(
+            "insert into diario_parole (campo, parola, voci) values (?, ?, ?) "
+            "on conflict (campo, parola) do update set voci = voci + excluded.voci",
+            variazioni
+        )
+        conn.executemany(
+            "delete from diario_parole where campo = ? and parola = ? and voci <= 0",
+            [(campo, parola) for campo, parola, n in variazioni if n < 0]
+        )
+
+    def _registra_parole(
+        self,
+        conn: sqlite3.Connection,
+        vecchie: Iterable[Dict[str, Any]],
+        nuove: Iterable[Dict[str, Any]]
+    ) -> None:
+        """Aggiorna il vocabolario all'interno della transazione in corso"""
+        delta = conta_parole(vecchie, -1)
+        delta.update(conta_parole(nuove))
+        self._scrivi_parole(conn, delta)
+        self._parole_in_sospeso.update(delta)
+
+    def _righe_ricerca(self, conn: sqlite3.Connection, where: str, parametri: List[Any]) -> List[Dict[str, Any]]:
+        return conn.execute(f'select {", ".join(CAMPI_RICERCA)} from "{TABLE_NAME}"{where}', parametri).fetchall()
+
+    @staticmethod
+    def _colonna(nome: str) -> str:
+        if nome not in COLONNE:
+            raise ValueError(f"Colonna sconosciuta: {nome}")
+        return nome
+
+    @staticmethod
+    def _valore(colonna: str, valore: Any) -> Any:
+        # Gli scalari numpy (ad esempio un ID letto da un DataFrame) verrebbero
+        # passati a SQLite come blob: si convertono nel tipo Python equivalente
+        if hasattr(valore, "item") and not isinstance(valore, (str, bytes)):
+            valore = valore.item()
+        return _normalizza_data(valore) if colonna in COLONNE_DATA else valore
+
+    def _where(self, filtri: Sequence[Filtro]) -> Tuple[str, List[Any]]:
+        condizioni: List[str] = []
+        parametri: List[Any] = []
+        for colonna, operatore, valore in filtri:
+            if "," in colonna:
+                colonne = [self._colonna(c.strip()) for c in colonna.split(",")]
+                if operatore not in ("lt", "gt"):
+                    raise ValueError(f"Operatore non valido per una coppia di colonne: {operatore}")
+                segnaposti = ", ".join("?" for _ in colonne)
+                condizioni.append(f"({', '.join(colonne)}) {OPERATORI[operatore]} ({segnaposti})")
+                parametri.extend(self._valore(c, v) for c, v in zip(colonne, valore))
+                continue
+            colonna = self._colonna(colonna)
+            if operatore in OPERATORI:
+                condizioni.append(f"{colonna} {OPERATORI[operatore]} ?")
+                parametri.append(self._valore(colonna, valore))
+            elif operatore == "in":
+                valori = [self._valore(colonna, v) for v in valore]
+                if not valori:
+                    condizioni.append("0")
+                    continue
+                condizioni.append(f"{colonna} in ({', '.join('?' for _ in valori)})")
+                parametri.extend(valori)
+            elif operatore == "ilike":
+                # like di SQLite ignora già maiuscole e minuscole (caratteri ASCII)
+                condizioni.append(f"{colonna} like ?")
+                parametri.append(valore)
+            elif operatore == "is":
+                condizioni.append(f"{colonna} is null")
+            else:
+                raise ValueError(f"Operatore sconosciuto: {operatore}")
+        if not condizioni:
+            return "", parametri
+        return " where " + " and ".join(condizioni), parametri
+
+    def _prepara(self, riga: Dict[str, Any]) -> Dict[str, Any]:
+        return {self._colonna(c): self._valore(c, v) for c, v in riga.items()}
+
+    def select(
+        self,
+        colonne: str = "*",
+        filtri: Sequence[Filtro] = (),
+        ordine: Sequence[Ordine] = (),
+        limit: Optional[int] = None,
+        offset: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        elenco = [self._colonna(c) for c in dividi_colonne(colonne)]
+        sql = f'select {", ".join(elenco) or "*"} from "{TABLE_NAME}"'
+        where, parametri = self._where(filtri)
+        sql += where
+        if ordine:
+            # Come Postgres: i null vengono dopo in ordine crescente e prima in decrescente
+            sql += " order by " + ", ".join(
+                f"{self._colonna(c)} desc nulls first" if desc else f"{self._colonna(c)} asc nulls last"
+                for c, desc in ordine
+            )
+        if limit or offset:
+            sql += " limit ? offset ?"
+            parametri += [limit or -1, offset or 0]
+        with self.lock:
+            return self.conn.execute(sql, parametri).fetchall()
+
+    def count(self, filtri: Sequence[Filtro] = ()) -> int:
+        where, parametri = self._where(filtri)
+        with self.lock:
+            return self.conn.execute(f'select count(*) as n from "{TABLE_NAME}"{where}', parametri).fetchone()["n"]
+
+    def insert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        adesso = _adesso()
+        inserite = []
+        with self._transazione() as conn:
+            for riga in righe:
+                valori = {**self._prepara(riga), "updated_at": adesso}
+                inserite.append(conn.execute(
+                    f'insert into "{TABLE_NAME}" ({", ".join(valori)}) '
+                    f'values ({", ".join("?" for _ in valori)}) returning *',
+                    list(valori.values())
+                ).fetchone())
+            self._registra_parole(conn, [], inserite)
+        self._notifica(INSERT, inserite)
+        return inserite
+
+    def upsert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        adesso = _adesso()
+        scritte = []
+        with self._transazione() as conn:
+            ids = [riga["id"] for riga in righe if riga.get("id") is not None]
+            vecchie = self._righe_ricerca(conn, *self._where([("id", "in", ids)])) if ids else []
+            for riga in righe:
+                valori = {**self._prepara(riga), "updated_at": adesso}
+                aggiornamenti = ", ".join(f"{c} = excluded.{c}" for c in valori if c != "id")
+                scritte.append(conn.execute(
+                    f'insert into "{TABLE_NAME}" ({", ".join(valori)}) '
+                    f'values ({", ".join("?" for _ in valori)}) '
+                    f'on conflict (id) do update set {aggiornamenti} returning *',
+                    list(valori.values())
+                ).fetchone())
+            self._registra_parole(conn, vecchie, scritte)
+        self._notifica(UPDATE, scritte)
+        return scritte
+
+    def update(self, valori: Dict[str, Any], filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        valori = {**self._prepara(valori), "updated_at": _adesso()}
+        where, parametri = self._where(filtri)
+        testo = any(c in CAMPI_RICERCA for c in valori)
+        with self._transazione() as conn:
+            vecchie = self._righe_ricerca(conn, where, parametri) if testo else []
+            aggiornate = conn.execute(
+                f'update "{TABLE_NAME}" set {", ".join(f"{c} = ?" for c in valori)}{where} returning *',
+                list(valori.values()) + parametri
+            ).fetchall()
+            self._registra_parole(conn, vecchie, aggiornate if testo else [])
+        self._notifica(UPDATE, aggiornate)
+        return aggiornate
+
+    def delete(self, filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        where, parametri = self._where(filtri)
+        with self._transazione() as conn:
+            eliminate = conn.execute(f'delete from "{TABLE_NAME}"{where} returning *', parametri).fetchall()
+            self._registra_parole(conn, eliminate, [])
+        self._notifica(DELETE, eliminate)
+        return eliminate
+
+    def search(
+        self,
+        termine: str,
+        campi: Sequence[str] = ("alimento",),
+        limit: int = 50,
+        utente: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        cercate = parole(termine)
+        if not cercate or limit <= 0:
+            return []
+        with self.lock:
+            if self._indice is None:
+                self._indice = IndiceParole()
+                self._indice.aggiorna({
+                    (r["campo"], r["parola"]): r["voci"]
+                    for r in self.conn.execute("select campo, parola, voci from diario_parole")
+                })
+            # Parole del vocabolario che corrispondono a ciascuna parola cercata
+            gruppi = [[p for p, _ in self._indice.candidati(cercata, campi)] for cercata in cercate]
+            if not all(gruppi):
+                return []
+
+            # Si scorrono i candidati della parola più lunga dal migliore, chiedendo
+            # all'indice full-text le voci più recenti che contengono anche una
+            # variante di ciascuna delle altre parole
+            perno = max(range(len(cercate)), key=lambda i: len(cercate[i]))
+            altre = "".join(
+                " AND (" + " OR ".join(f'"{p}"' for p in gruppo) + ")"
+                for i, gruppo in enumerate(gruppi) if i != perno
+            )
+            colonne = "{" + " ".join(campi) + "}"
+            # Il vocabolario e l'indice sono comuni a tutti gli utenti: le voci
+            # trovate vengono filtrate per utente prima di applicare il limite
+            sql = "select rowid as id from diario_testo where diario_testo match ? order by rowid desc limit ?"
+            filtri: List[Filtro] = []
+            if utente is not None:
+                sql = (f'select t.rowid as id from diario_testo t join "{TABLE_NAME}" d on d.id = t.rowid '
+                       f"where diario_testo match ? and d.{COLONNA_UTENTE} = ? order by t.rowid desc limit ?")
+                filtri.append((COLONNA_UTENTE, "eq", utente))
+            ids: Dict[int, None] = {}
+            for parola in gruppi[perno]:
+                parametri = [f'{colonne} : ("{parola}"{altre})'] + ([utente] if utente is not None else [])
+                for riga in self.conn.execute(sql, parametri + [limit + len(ids)]):
+                    ids.setdefault(riga["id"])
+                if len(ids) >= limit:
+                    break
+            ids = list(ids)[:limit]
+            righe = {r["id"]: r for r in self.select("*", [("id", "in", ids), *filtri])}
+
+        trovate = [righe[i] for i in ids if i in righe]
+        trovate.sort(key=lambda r: -punteggio_testo(cercate, (r.get(c) for c in campi)))
+        return trovate
+
+    def statistics(self, utente: Optional[str] = None) -> Dict[str, Any]:
+        where, parametri = self._where([(COLONNA_UTENTE, "eq", utente)] if utente is not None else [])
+        riassunti = {"carboidrati": 2, "unita_insulina": 2, "glicemia_iniziale": 1, "glicemia_dop_2h": 1}
+        colonne = ", ".join(
+            f"round(avg({c}), {cifre}) as {c}_avg, min({c}) as {c}_min, max({c}) as {c}_max"
+            for c, cifre in riassunti.items()
+        )
+        with self.lock:
+            totali = self.conn.execute(
+                f"select count(*) as total_entries, count(carboidrati) as entries_with_carbs, "
+                f"coalesce(round(avg(case when carboidrati <> 0 then carboidrati end), 2), 0) as average_carbs, "
+                f'{colonne} from "{TABLE_NAME}"{where}',
+                parametri
+            ).fetchone()
+            per_pasto = self.conn.execute(
+                "select coalesce(pasto, '') as pasto, count(*) as count, "
+                "round(avg(carboidrati), 2) as average_carbs, round(avg(unita_insulina), 2) as average_insulin, "
+                "round(avg(glicemia_iniziale), 1) as average_glucose, "
+                f'round(avg(glicemia_dop_2h), 1) as average_glucose_2h from "{TABLE_NAME}"{where} group by 1',
+                parametri
+            ).fetchall()
+        stats = {chiave: totali[chiave] for chiave in ("total_entries", "entries_with_carbs", "average_carbs")}
+        for c in riassunti:
+            stats[c] = {"avg": totali[f"{c}_avg"], "min": totali[f"{c}_min"], "max": totali[f"{c}_max"]}
+        stats["per_pasto"] = {gruppo.pop("pasto"): gruppo for gruppo in per_pasto}
+        return stats
+
+    def summary(
+        self,
+        data_da: Optional[str] = None,
+        data_a: Optional[str] = None,
+        pasto: Optional[str] = None,
+        alimento: Optional[str] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        filtri = [(COLONNA_UTENTE, "eq", utente), ("data", "gte", data_da), ("data", "lte", data_a),
+                  ("pasto", "eq", pasto), ("alimento", "ilike", f"%{alimento}%" if alimento else None)]
+        where, parametri = self._where([f for f in filtri if f[2] is not None])
+        with self.lock:
+            return self.conn.execute(
+                "select count(*) as count, round(avg(glicemia_iniziale), 1) as average_glucose, "
+                "coalesce(round(sum(carboidrati), 1), 0) as total_carbs, "
+                "coalesce(round(sum(dosi_correttive), 1), 0) as total_corrective_doses "
+                f'from "{TABLE_NAME}"{where}',
+                parametri
+            ).fetchone()
+
+    def checksum(
+        self,
+        id_min: Optional[int] = None,
+        id_max: Optional[int] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        filtri = [(COLONNA_UTENTE, "eq", utente), ("id", "gte", id_min), ("id", "lte", id_max)]
+        where, parametri = self._where([f for f in filtri if f[2] is not None])
+        with self.lock:
+            return self.conn.execute(
+                "select count(*) as count, coalesce(sum(id), 0) as sum_id, "
+                "coalesce(sum(quantita), 0) as sum_quantita, "
+                "coalesce(sum(glicemia_iniziale), 0) as sum_glicemia_iniziale, "
+                "coalesce(sum(glicemia_dop_2h), 0) as sum_glicemia_dop_2h, "
+                f'count(carboidrati) as count_carboidrati from "{TABLE_NAME}"{where}',
+                parametri
+            ).fetchone()
@@ -0,0 +1,332 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from .backend import DELETE, TABLE_NAME, Ascoltatore, DiarioBackend, Filtro, Ordine
+from .utenti import accesso_corrente, utente_corrente
+
+
+def _valore_postgrest(valore: Any) -> str:
+    """Formatta un valore per un filtro or_ di PostgREST (le stringhe tra virgolette)"""
+    if isinstance(valore, str):
+        return f'"{valore}"'
+    return str(valore)
+
+
+class _CanaleAsincrono:
+    """
+    Sottoscrizione Realtime con il client asincrono di realtime-py
+
+    Il client sincrono di supabase-py non supporta Realtime: il canale gira
+    in un thread con il suo event loop, che il client usa anche per
+    riconnettersi da solo quando la connessione cade.
+    """
+
+    def __init__(self, url: str, key: str, tabella: str, ricevi: Callable, cambio_stato: Callable):
+        self.url = url
+        self.key = key
+        self.tabella = tabella
+        self.ricevi = ricevi
+        self.cambio_stato = cambio_stato
+        self._loop = asyncio.new_event_loop()
+        self._client = None
+
+    def avvia(self) -> Callable[[], None]:
+        threading.Thread(target=self._loop.run_forever, name="diario-realtime", daemon=True).start()
+        connessione = asyncio.run_coroutine_threadsafe(self._connetti(), self._loop)
+        connessione.add_done_callback(self._esito)
+        return self.chiudi
+
+    def _esito(self, connessione) -> None:
+        # Connessione non riuscita dopo i tentativi del client: si resta senza notifiche
+        if connessione.exception() is not None:
+            self.cambio_stato("CHANNEL_ERROR", connessione.exception())
+
+    async def _connetti(self) -> None:
+        from realtime import AsyncRealtimeClient
+
+        self._client = AsyncRealtimeClient(self.url, token=self.key, auto_reconnect=True)
+        await self._client.connect()
+        canale = self._client.channel(f"diario-{self.tabella}")
+        await canale.on_postgres_changes("*", self.ricevi, table=self.tabella, schema="public").subscribe(
+            self.cambio_stato
+        )
+
+    def chiudi(self) -> None:
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.cambio_stato("CLOSED", None)
+
+
+class SupabaseBackend(DiarioBackend):
+    """Backend che legge e scrive la tabella su Supabase tramite PostgREST"""
+
+    nome = "supabase"
+
+    def __init__(self, client, table_name: str = TABLE_NAME, nuovo_client: Optional[Callable[[], Any]] = None):
+        """
+        Args:
+            client: Client creato con supabase.create_client (o un sostituto compatibile)
+            table_name: Nome della tabella
+            nuovo_client: Crea un altro client come client, per le sessioni di sign_in
+        """
+        self.client = client
+        self.table_name = table_name
+        self.nuovo_client = nuovo_client
+        # Con l'autenticazione (DIARIO_MULTIUTENTE=1) ogni accesso usa il client
+        # della sessione che ha aperto, e con RLS (sql/008_rls.sql) il client
+        # con la sola chiave anon non legge nulla. Per ogni accesso: client
+        # della sessione e utenti a cui dà accesso; restano le max_sessioni
+        # usate più di recente
+        self.autenticazione = False
+        self.sessioni: "OrderedDict[str, Tuple[Any, FrozenSet[str]]]" = OrderedDict()
+        self.max_sessioni = 100
+        self._lock_sessioni = threading.Lock()
+        # False dopo che diario_ora è risultata mancante (sql/001_updated_at.sql senza diario_ora)
+        self._con_ora = True
+
+    @classmethod
+    def from_env(cls, url: Optional[str] = None, key: Optional[str] = None) -> "SupabaseBackend":
+        """
+        Crea il client da SUPABASE_URL e SUPABASE_API_KEY
+
+        Le richieste HTTP scadono dopo DIARIO_TIMEOUT secondi (default 15),
+        così una connessione bloccata viene chiusa invece di restare appesa.
+        """
+        import supabase
+
+        url = url or os.getenv("SUPABASE_URL")
+        key = key or os.getenv("SUPABASE_API_KEY")
+        if not url or not key:
+            raise ValueError("SUPABASE_URL e SUPABASE_API_KEY devono essere impostati nelle variabili d'ambiente")
+        timeout = float(os.getenv("DIARIO_TIMEOUT", "15")) or None
+
+        def nuovo_client():
+            return supabase.create_client(url, key, options=supabase.ClientOptions(postgrest_client_timeout=timeout))
+
+        backend = cls(nuovo_client(), nuovo_client=nuovo_client)
+        backend.timeout_proprio = timeout is not None
+        backend.autenticazione = os.getenv("DIARIO_MULTIUTENTE") == "1"
+        return backend
+
+    def _client(self):
+        """Client della sessione dell'accesso corrente se dà accesso all'utente corrente, altrimenti quello della chiave"""
+        accesso = accesso_corrente()
+        if accesso is not None:
+            with self._lock_sessioni:
+                sessione = self.sessioni.get(accesso)
+                if sessione is not None:
+                    self.sessioni.move_to_end(accesso)
+            if sessione is not None and utente_corrente() in sessione[1]:
+                return sessione[0]
+        return self.client
+
+    def clienti(self) -> List[Any]:
+        """Il client della chiave e quelli delle sessioni aperte"""
+        with self._lock_sessioni:
+            return [self.client, *(client for client, _ in self.sessioni.values())]
+
+    def _table(self):
+        return self._client().table(self.table_name)
+
+    @staticmethod
+    def _filtra(query, filtri: Sequence[Filtro]):
+        for colonna, operatore, valore in filtri:
+            if "," in colonna:
+                prima, seconda = colonna.split(",")
+                v1, v2 = valore
+                query = query.or_(
+                    f"{prima}.{operatore}.{_valore_postgrest(v1)},"
+                    f"and({prima}.eq.{_valore_postgrest(v1)},{seconda}.{operatore}.{_valore_postgrest(v2)})"
+                )
+            elif operatore == "in":
+                query = query.in_(colonna, list(valore))
+            elif operatore == "is":
+                query = query.is_(colonna, "null")
+            else:
+                query = getattr(query, operatore)(colonna, valore)
+        return query
+
+    def select(
+        self,
+        colonne: str = "*",
+        filtri: Sequence[Filtro] = (),
+        ordine: Sequence[Ordine] = (),
+        limit: Optional[int] = None,
+        offset: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        query = self._filtra(self._table().select(colonne), filtri)
+        for colonna, desc in ordine:
+            query = query.order(colonna, desc=desc)
+        if limit:
+            query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+        return query.execute().data
+
+    def count(self, filtri: Sequence[Filtro] = ()) -> int:
+        return self._filtra(self._table().select("id", count="exact", head=True), filtri).execute().count
+
+    def insert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self._table().insert(righe).execute().data
+
+    def upsert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self._table().upsert(righe, on_conflict="id").execute().data
+
+    def update(self, valori: Dict[str, Any], filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        return self._filtra(self._table().update(valori), filtri).execute().data
+
+    def delete(self, filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        return self._filtra(self._table().delete(), filtri).execute().data
+
+    def search(
+        self,
+        termine: str,
+        campi: Sequence[str] = ("alimento",),
+        limit: int = 50,
+        utente: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        trovate = self._client().rpc("diario_cerca", {
+            "termine": termine, "campi": list(campi), "limite": limit, "filtro_utente": utente
+        }).execute().data
+        if not isinstance(trovate, list):
+            raise ValueError("Risposta non valida da diario_cerca")
+        return trovate
+
+    def statistics(self, utente: Optional[str] = None) -> Dict[str, Any]:
+        stats = self._client().rpc("diario_statistiche", {"filtro_utente": utente}).execute().data
+        if not isinstance(stats, dict):
+            raise ValueError("Risposta non valida da diario_statistiche")
+        return stats
+
+    def summary(
+        self,
+        data_da: Optional[str] = None,
+        data_a: Optional[str] = None,
+        pasto: Optional[str] = None,
+        alimento: Optional[str] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        riepilogo = self._client().rpc("diario_riepilogo", {
+            "data_da": data_da, "data_a": data_a, "filtro_pasto": pasto, "filtro_alimento": alimento,
+            "filtro_utente": utente
+        }).execute().data
+        if not isinstance(riepilogo, dict):
+            raise ValueError("Risposta non valida da diario_riepilogo")
+        return riepilogo
+
+    def checksum(
+        self,
+        id_min: Optional[int] = None,
+        id_max: Optional[int] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        somme = self._client().rpc("diario_checksum", {
+            "id_min": id_min, "id_max": id_max, "filtro_utente": utente
+        }).execute().data
+        if not isinstance(somme, dict):
+            raise ValueError("Risposta non valida da diario_checksum")
+        return somme
+
+    def now(self) -> datetime:
+        if not self._con_ora:
+            raise NotImplementedError("Funzione diario_ora mancante: aggiornare con sql/001_updated_at.sql")
+        try:
+            ora = self._client().rpc("diario_ora", {}).execute().data
+        except Exception as e:
+            # PGRST202: funzione non trovata nello schema
+            if str(getattr(e, "code", "")) == "PGRST202":
+                self._con_ora = False
+                raise NotImplementedError("Funzione diario_ora mancante: aggiornare con sql/001_updated_at.sql") from e
+            raise
+        if not isinstance(ora, str):
+            raise ValueError("Risposta non valida da diario_ora")
+        return datetime.fromisoformat(ora.replace("Z", "+00:00"))
+
+    def sign_in(self, email: str, password: str) -> List[str]:
+        """
+        Accede con email e password di Supabase Auth, in un client dedicato
+
+        Il client della sessione (che rinnova da sé il token) viene usato per
+        le richieste fatte con lo stesso accesso per conto dell'account e dei
+        pazienti del claim app_metadata.pazienti; l'invio della coda in
+        background usa l'accesso registrato con ogni operazione. Un altro
+        accesso non usa mai questa sessione, anche se imposta lo stesso
+        utente. L'accesso alle voci lo decidono le policy di sql/008_rls.sql.
+        """
+        if self.nuovo_client is None:
+            raise NotImplementedError("Autenticazione non disponibile: il backend non sa creare altri client")
+        accesso = accesso_corrente()
+        if accesso is None:
+            raise ValueError("Nessun accesso nel contesto corrente: impostarlo prima di sign_in")
+        client = self.nuovo_client()
+        risposta = client.auth.sign_in_with_password({"email": email, "password": password})
+        if risposta.user is None:
+            raise PermissionError("Accesso non riuscito")
+        pazienti = (risposta.user.app_metadata or {}).get("pazienti") or []
+        utenti = list(dict.fromkeys([str(risposta.user.id), *map(str, pazienti)]))
+        self.autenticazione = True
+        with self._lock_sessioni:
+            precedente = self.sessioni.pop(accesso, None)
+            self.sessioni[accesso] = (client, frozenset(utenti))
+            scadute = []
+            while len(self.sessioni) > max(1, self.max_sessioni):
+                scadute.append(self.sessioni.popitem(last=False)[1])
+        for vecchio, _ in filter(None, [precedente, *scadute]):
+            self._chiudi_sessione(vecchio)
+        return utenti
+
+    def sign_out(self) -> None:
+        """Chiude la sessione dell'accesso corrente: le sue richieste tornano al client della chiave"""
+        with self._lock_sessioni:
+            sessione = self.sessioni.pop(accesso_corrente(), None)
+        if sessione is not None:
+            self._chiudi_sessione(sessione[0])
+
+    @staticmethod
+    def _chiudi_sessione(client) -> None:
+        # Il token viene revocato sul server; se non riesce (ad esempio offline)
+        # la sessione è comunque dimenticata e scade da sola
+        try:
+            client.auth.sign_out()
+        except Exception:
+            pass
+
+    def subscribe(
+        self,
+        ascoltatore: Ascoltatore,
+        stato: Optional[Callable[[bool], None]] = None
+    ) -> Callable[[], None]:
+        """
+        Notifica le modifiche con Supabase Realtime
+
+        La tabella deve essere nella pubblicazione supabase_realtime e, perché
+        le eliminazioni riportino l'utente, avere replica identity full
+        (sql/009_tempo_reale.sql); altrimenti per DELETE arriva solo l'id.
+        Con l'autenticazione le notifiche non sono disponibili: il canale,
+        uno per processo, riceverebbe solo le voci visibili al suo token, e
+        lo snapshot crederebbe di non aver perso modifiche.
+        """
+        if self.autenticazione:
+            raise NotImplementedError("Notifiche non disponibili con l'autenticazione per sessione")
+        def ricevi(payload: Dict[str, Any]) -> None:
+            dati = payload["data"]
+            evento = str(getattr(dati["type"], "value", dati["type"]))
+            ascoltatore(evento, dict((dati.get("old_record") if evento == DELETE else dati.get("record")) or {}))
+
+        def cambio_stato(stato_canale: Any, errore: Optional[Exception] = None) -> None:
+            if stato is not None:
+                stato(str(getattr(stato_canale, "value", stato_canale)) == "SUBSCRIBED")
+
+        try:
+            canale = self.client.channel(f"diario-{self.table_name}")
+        except NotImplementedError:
+            return _CanaleAsincrono(
+                str(self.client.realtime_url), self.client.supabase_key, self.table_name, ricevi, cambio_stato
+            ).avvia()
+        canale.on_postgres_changes("*", ricevi, table=self.table_name, schema="public").subscribe(cambio_stato)
+        return canale.unsubscribe
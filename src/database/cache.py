@@ -0,0 +1,195 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class QueryCache:
+    """
+    Cache LRU con scadenza (TTL) per i risultati delle letture dal database
+
+    La cache è condivisa dal processo (quindi da tutte le sessioni Streamlit
+    servite dallo stesso server) ed è thread-safe. Le scritture devono
+    invalidarla o aggiornarla per evitare dati obsoleti.
+
+    Con una funzione partizione (ad esempio l'utente corrente) le voci sono
+    divise in partizioni indipendenti, ciascuna con il suo limite di
+    max_entries: get, set e invalidate agiscono solo sulla partizione
+    corrente, quindi le letture di un utente non scartano quelle degli altri.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        max_entries: int = 128,
+        partizione: Optional[Callable[[], Hashable]] = None,
+        max_partizioni: int = 50
+    ):
+        """
+        Args:
+            ttl: Durata di validità di una voce in secondi (0 disattiva la cache)
+            max_entries: Numero massimo di voci conservate (per partizione)
+            partizione: Funzione che restituisce la partizione corrente (None: una sola)
+            max_partizioni: Partizioni conservate, scartando quelle usate meno di recente
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.partizione = partizione
+        self.max_partizioni = max_partizioni
+        self.hits = 0
+        self.misses = 0
+        # Nome funzione -> [successi, mancati] delle funzioni decorate con cached
+        self._per_funzione: Dict[str, List[int]] = {}
+        self._partizioni: "OrderedDict[Hashable, OrderedDict[Hashable, Tuple[float, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, partizione: Optional[Callable[[], Hashable]] = None) -> "QueryCache":
+        """Crea la cache leggendo DIARIO_CACHE_TTL, DIARIO_CACHE_MAX_VOCI e DIARIO_MAX_UTENTI"""
+        return cls(
+            ttl=float(os.getenv("DIARIO_CACHE_TTL", "300")),
+            max_entries=int(os.getenv("DIARIO_CACHE_MAX_VOCI", "128")),
+            partizione=partizione,
+            max_partizioni=int(os.getenv("DIARIO_MAX_UTENTI", "50")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def configure(self, ttl: Optional[float] = None, max_entries: Optional[int] = None) -> None:
+        """Modifica TTL e dimensione massima, svuotando la cache"""
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self._partizioni.clear()
+
+    def _voci(self, crea: bool = True) -> "OrderedDict[Hashable, Tuple[float, Any]]":
+        """Voci della partizione corrente, creata se manca e crea è True (da chiamare con il lock)"""
+        chiave = self.partizione() if self.partizione else None
+        voci = self._partizioni.get(chiave)
+        if voci is None:
+            if not crea:
+                return OrderedDict()
+            voci = self._partizioni[chiave] = OrderedDict()
+            while len(self._partizioni) > max(1, self.max_partizioni):
+                self._partizioni.popitem(last=False)
+        else:
+            self._partizioni.move_to_end(chiave)
+        return voci
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Restituisce (trovato, valore) per la chiave indicata"""
+        with self._lock:
+            voci = self._voci(crea=False)
+            voce = voci.get(key)
+            if voce is None or voce[0] < time.monotonic():
+                if voce is not None:
+                    del voci[key]
+                self.misses += 1
+                return False, None
+            voci.move_to_end(key)
+            self.hits += 1
+            return True, voce[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Memorizza un valore, scartando le voci usate meno di recente"""
+        if not self.enabled:
+            return
+        with self._lock:
+            voci = self._voci()
+            voci[key] = (time.monotonic() + self.ttl, value)
+            voci.move_to_end(key)
+            while len(voci) > self.max_entries:
+                voci.popitem(last=False)
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """
+        Rimuove le voci della partizione corrente
+
+        Args:
+            predicate: Se indicato, rimuove solo le chiavi per cui restituisce True
+        """
+        with self._lock:
+            voci = self._voci(crea=False)
+            if predicate is None:
+                voci.clear()
+                return
+            for key in [k for k in voci if predicate(k)]:
+                del voci[key]
+
+    def svuota(self) -> None:
+        """Rimuove le voci di tutte le partizioni"""
+        with self._lock:
+            self._partizioni.clear()
+
+    def __len__(self) -> int:
+        return sum(len(voci) for voci in self._partizioni.values())
+
+    def statistiche(self) -> Dict[str, Any]:
+        """
+        Successi e mancati della cache
+
+        Returns:
+            Dict con hits, misses, voci, partizioni, ttl e funzioni (nome -> {hits, misses})
+        """
+        with self._lock:
+            funzioni = {nome: {"hits": h, "misses": m} for nome, (h, m) in sorted(self._per_funzione.items())}
+            return {"hits": self.hits, "misses": self.misses, "voci": len(self),
+                    "partizioni": len(self._partizioni), "ttl": self.ttl, "funzioni": funzioni}
+
+    def azzera_statistiche(self) -> None:
+        with self._lock:
+            self.hits = self.misses = 0
+            self._per_funzione.clear()
+
+    def cached(self, func: Callable) -> Callable:
+        """
+        Decoratore che memorizza i risultati con success=True
+
+        La chiave è (nome funzione, argomenti normalizzati), per cui chiamate
+        posizionali e con keyword condividono la stessa voce; liste e insiemi
+        negli argomenti diventano tuple e frozenset. La funzione
+        decorata espone cache_key(*args, **kwargs) per aggiornare la cache
+        dall'esterno.
+        """
+        firma = inspect.signature(func)
+
+        def cache_key(*args, **kwargs) -> Hashable:
+            argomenti = firma.bind(*args, **kwargs)
+            argomenti.apply_defaults()
+            return (func.__name__, tuple((nome, _hashable(valore)) for nome, valore in argomenti.arguments.items()))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            key = cache_key(*args, **kwargs)
+            trovato, valore = self.get(key)
+            with self._lock:
+                self._per_funzione.setdefault(func.__name__, [0, 0])[0 if trovato else 1] += 1
+            if trovato:
+                return valore
+            risultato = func(*args, **kwargs)
+            if risultato.get("success"):
+                self.set(key, risultato)
+            return risultato
+
+        wrapper.cache_key = cache_key
+        return wrapper
+
+
+def _hashable(valore: Any) -> Hashable:
+    """Rende usabile come chiave un argomento lista, insieme o dizionario"""
+    if isinstance(valore, (list, tuple)):
+        return tuple(_hashable(v) for v in valore)
+    if isinstance(valore, (set, frozenset)):
+        return frozenset(_hashable(v) for v in valore)
+    if isinstance(valore, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in valore.items()))
+    return valore
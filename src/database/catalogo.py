@@ -0,0 +1,188 @@
+import heapq
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from .ricerca import parole
+
+
+@lru_cache(maxsize=4096)
+def chiave_alimento(nome: Optional[str]) -> str:
+    """Forma normalizzata del nome (minuscole, senza accenti né punteggiatura)"""
+    return " ".join(parole(nome))
+
+
+def _conta(conteggi: Counter, valore: Any, segno: int) -> None:
+    # I valori che scendono a zero vengono rimossi, così most_common resta corretto
+    conteggi[valore] += segno
+    if conteggi[valore] <= 0:
+        del conteggi[valore]
+
+
+class TriePrefissi:
+    """
+    Albero dei prefissi dalle parole alle chiavi che le contengono
+
+    Ogni nodo conserva l'insieme delle chiavi del suo sottoalbero, quindi
+    le chiavi con una parola che inizia per un prefisso si trovano
+    scendendo lungo il prefisso, senza visitare il resto dell'albero.
+    """
+
+    def __init__(self):
+        self._radice: Dict[str, Any] = {}
+
+    def aggiungi(self, parola: str, chiave: str) -> None:
+        nodo = self._radice
+        for carattere in parola:
+            nodo = nodo.setdefault(carattere, {"": set()})
+            nodo[""].add(chiave)
+
+    def rimuovi(self, parola: str, chiave: str) -> None:
+        """
+        Toglie la chiave lungo il percorso della parola
+
+        I prefissi comuni a più parole della stessa chiave la perdono
+        insieme, quindi va chiamato per tutte le parole della chiave.
+        """
+        percorso = [self._radice]
+        for carattere in parola:
+            nodo = percorso[-1].get(carattere)
+            if nodo is None:
+                return
+            nodo[""].discard(chiave)
+            percorso.append(nodo)
+        # Elimina i nodi rimasti senza chiavi, dal fondo
+        for i in range(len(parola), 0, -1):
+            if percorso[i][""]:
+                break
+            del percorso[i - 1][parola[i - 1]]
+
+    def cerca(self, prefisso: str) -> Set[str]:
+        """Chiavi con almeno una parola che inizia per il prefisso"""
+        nodo = self._radice
+        for carattere in prefisso:
+            nodo = nodo.get(carattere)
+            if nodo is None:
+                return set()
+        return nodo[""] if nodo is not self._radice else set()
+
+
+class CatalogoAlimenti:
+    """
+    Catalogo degli alimenti registrati nel diario, per suggerimenti e precompilazione
+
+    Per ogni alimento (a meno di maiuscole e accenti) tiene il numero di
+    voci, la grafia più usata e, per ogni unità di misura, le quantità
+    registrate e il totale di carboidrati e quantità, da cui si ricavano
+    l'unità e la quantità tipiche e i carboidrati per unità. I nomi sono
+    indicizzati parola per parola in un TriePrefissi, così i suggerimenti
+    mentre si scrive non scorrono il catalogo.
+
+    Come gli aggregati della pagina Analisi, viene aggiornato dallo snapshot
+    a ogni inserimento, modifica o eliminazione.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.azzera()
+
+    def azzera(self) -> None:
+        with self._lock:
+            self._alimenti: Dict[str, Dict[str, Any]] = {}
+            self._trie = TriePrefissi()
+
+    def __len__(self) -> int:
+        return len(self._alimenti)
+
+    def aggiorna(
+        self,
+        vecchie: Iterable[Dict[str, Any]] = (),
+        nuove: Iterable[Dict[str, Any]] = ()
+    ) -> None:
+        """Toglie le versioni precedenti delle voci e aggiunge le nuove"""
+        with self._lock:
+            for voce in vecchie:
+                self._registra(voce, -1)
+            for voce in nuove:
+                self._registra(voce, 1)
+
+    def _registra(self, voce: Dict[str, Any], segno: int) -> None:
+        chiave = chiave_alimento(voce.get("alimento"))
+        if not chiave:
+            return
+        alimento = self._alimenti.get(chiave)
+        if alimento is None:
+            if segno < 0:
+                return
+            alimento = self._alimenti[chiave] = {"voci": 0, "nomi": Counter(), "unita": {}}
+            for parola in set(chiave.split()):
+                self._trie.aggiungi(parola, chiave)
+
+        alimento["voci"] += segno
+        _conta(alimento["nomi"], voce["alimento"].strip(), segno)
+        nome_unita = voce.get("unita_misura") or ""
+        unita = alimento["unita"].setdefault(nome_unita, {
+            "voci": 0, "quantita": Counter(), "carboidrati": 0.0, "quantita_carboidrati": 0.0
+        })
+        unita["voci"] += segno
+        quantita, carboidrati = voce.get("quantita"), voce.get("carboidrati")
+        if quantita:
+            _conta(unita["quantita"], quantita, segno)
+            if carboidrati is not None:
+                unita["carboidrati"] += segno * carboidrati
+                unita["quantita_carboidrati"] += segno * quantita
+
+        if unita["voci"] <= 0:
+            del alimento["unita"][nome_unita]
+        if alimento["voci"] <= 0:
+            del self._alimenti[chiave]
+            for parola in set(chiave.split()):
+                self._trie.rimuovi(parola, chiave)
+
+    @staticmethod
+    def _descrivi(alimento: Dict[str, Any]) -> Dict[str, Any]:
+        unita_misura, unita = max(alimento["unita"].items(), key=lambda u: (u[1]["voci"], u[0]))
+        quantita = unita["quantita"].most_common(1)[0][0] if unita["quantita"] else None
+        per_unita = (
+            unita["carboidrati"] / unita["quantita_carboidrati"] if unita["quantita_carboidrati"] > 0 else None
+        )
+        return {
+            "alimento": alimento["nomi"].most_common(1)[0][0],
+            "voci": alimento["voci"],
+            "unita_misura": unita_misura or None,
+            "quantita": quantita,
+            "carboidrati_per_unita": per_unita,
+            "carboidrati": round(per_unita * quantita, 1) if per_unita is not None and quantita else None,
+        }
+
+    def trova(self, nome: str) -> Optional[Dict[str, Any]]:
+        """
+        Dati tipici di un alimento
+
+        Returns:
+            Dict con alimento (grafia più usata), voci, unita_misura e quantita
+            più frequenti, carboidrati_per_unita (media pesata sulle quantità)
+            e carboidrati stimati per la quantità tipica; None se sconosciuto
+        """
+        with self._lock:
+            alimento = self._alimenti.get(chiave_alimento(nome))
+            return self._descrivi(alimento) if alimento else None
+
+    def suggerisci(self, testo: str, massimo: int = 8) -> List[Dict[str, Any]]:
+        """
+        Alimenti i cui nomi contengono parole che iniziano con quelle del testo
+
+        Ad esempio "pa pom" suggerisce "Pasta al pomodoro". Prima i nomi che
+        iniziano con il testo, poi i più registrati.
+        """
+        cercate = parole(testo)
+        if not cercate:
+            return []
+        with self._lock:
+            chiavi = set.intersection(*(self._trie.cerca(parola) for parola in cercate))
+            inizio = " ".join(cercate)
+            ordinate = heapq.nsmallest(
+                massimo, chiavi, key=lambda c: (not c.startswith(inizio), -self._alimenti[c]["voci"], c)
+            )
+            return [self._descrivi(self._alimenti[chiave]) for chiave in ordinate]
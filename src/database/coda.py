@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Operazioni ammesse nella coda
+CREA, AGGIORNA, ELIMINA = "crea", "aggiorna", "elimina"
+
+# Stati di un'operazione: da inviare, bloccata da un conflitto con il server
+# (voce modificata o eliminata altrove) o rifiutata dal database
+IN_ATTESA, CONFLITTO, ERRORE = "in_attesa", "conflitto", "errore"
+
+SCHEMA = """
+create table if not exists coda_scritture (
+  seq integer primary key autoincrement,
+  operazione text not null check (operazione in ('crea', 'aggiorna', 'elimina')),
+  entry_id integer,
+  valori text,
+  chiave text unique,
+  base text,
+  stato text not null default 'in_attesa',
+  tentativi integer not null default 0,
+  errore text,
+  creata_il text not null,
+  user_id text,
+  chiave_voce text,
+  accesso text
+);
+create index if not exists coda_scritture_stato_idx on coda_scritture (stato, seq);
+"""
+
+
+def _operazione(riga: sqlite3.Row) -> Dict[str, Any]:
+    operazione = dict(riga)
+    operazione["valori"] = json.loads(operazione["valori"]) if operazione["valori"] else {}
+    return operazione
+
+
+def _json(valore: Any) -> Any:
+    # Scalari numpy (ad esempio i valori letti da un DataFrame) e altri tipi non JSON
+    return valore.item() if hasattr(valore, "item") else str(valore)
+
+
+def stesso_istante(a: Optional[str], b: Optional[str]) -> bool:
+    """Confronta due timestamp ISO-8601 scritti in formati diversi (Z, +00:00, microsecondi)"""
+    if not a or not b:
+        return a == b
+    istanti = [datetime.fromisoformat(str(x).replace("Z", "+00:00")) for x in (a, b)]
+    return istanti[0] == istanti[1]
+
+
+class CodaScritture:
+    """
+    Coda durevole delle scritture (write-ahead) su un file SQLite locale
+
+    Creazioni, modifiche ed eliminazioni vengono registrate subito e inviate
+    al database in seguito, nell'ordine in cui sono state accodate. Le
+    operazioni inviate con successo vengono tolte dalla coda; quelle in
+    conflitto o rifiutate restano finché non vengono ripetute o scartate, e
+    bloccano le operazioni successive sulla stessa voce. Il file viene
+    aperto al primo utilizzo, quindi creare la coda non tocca il disco.
+    """
+
+    def __init__(self, percorso: str = "diario_coda.sqlite"):
+        """
+        Args:
+            percorso: File della coda (":memory:" per una coda non durevole)
+        """
+        self.percorso = percorso
+        self.lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @classmethod
+    def from_env(cls) -> "CodaScritture":
+        """Crea la coda leggendo DIARIO_CODA_PATH"""
+        return cls(os.getenv("DIARIO_CODA_PATH", "diario_coda.sqlite"))
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        with self.lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.percorso, check_same_thread=False, isolation_level=None)
+                conn.row_factory = sqlite3.Row
+                if self.percorso != ":memory:":
+                    # Ogni operazione accodata deve sopravvivere a un arresto improvviso
+                    conn.execute("pragma journal_mode = wal")
+                    conn.execute("pragma synchronous = full")
+                conn.executescript(SCHEMA)
+                # Code create prima della divisione per utente, dei riferimenti per chiave e degli accessi
+                colonne = {r["name"] for r in conn.execute("pragma table_info(coda_scritture)")}
+                if "user_id" not in colonne:
+                    conn.execute("alter table coda_scritture add column user_id text")
+                if "chiave_voce" not in colonne:
+                    conn.execute("alter table coda_scritture add column chiave_voce text")
+                    conn.execute("update coda_scritture set chiave_voce = chiave where chiave is not null")
+                if "accesso" not in colonne:
+                    conn.execute("alter table coda_scritture add column accesso text")
+                self._conn = conn
+            return self._conn
+
+    def accoda(
+        self,
+        operazione: str,
+        valori: Optional[Dict[str, Any]] = None,
+        entry_id: Optional[int] = None,
+        chiave: Optional[str] = None,
+        base: Optional[str] = None,
+        utente: Optional[str] = None,
+        accesso: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Registra un'operazione in fondo alla coda
+
+        Args:
+            operazione: CREA, AGGIORNA o ELIMINA
+            valori: Campi della voce da creare o da aggiornare
+            entry_id: Voce da aggiornare o eliminare
+            chiave: Chiave di idempotenza della voce da creare: accodando di
+                nuovo la stessa chiave si ottiene l'operazione già in coda.
+                Per una modifica o un'eliminazione senza entry_id indica la
+                voce, ad esempio una creata in coda e non ancora inviata
+            base: updated_at della voce letta prima di modificarla; se sul
+                server è cambiato nel frattempo la modifica va in conflitto
+            utente: Utente per conto del quale inviare l'operazione
+            accesso: Accesso (login) con la cui sessione inviare l'operazione
+
+        Returns:
+            L'operazione accodata, con seq, stato e creata_il
+        """
+        if operazione not in (CREA, AGGIORNA, ELIMINA):
+            raise ValueError(f"Operazione non valida: {operazione}")
+        if operazione == CREA and not chiave:
+            raise ValueError("Una creazione richiede la chiave di idempotenza")
+        if operazione != CREA and entry_id is None and not chiave:
+            raise ValueError(f"L'operazione {operazione} richiede l'id o la chiave della voce")
+        adesso = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            cursore = self.conn.execute(
+                "insert into coda_scritture (operazione, entry_id, valori, chiave, base, creata_il, user_id, chiave_voce, accesso) "
+                "values (?, ?, ?, ?, ?, ?, ?, ?, ?) on conflict (chiave) do nothing",
+                (operazione, int(entry_id) if entry_id is not None else None, json.dumps(valori, default=_json) if valori else None,
+                 chiave if operazione == CREA else None, base, adesso, utente, chiave, accesso)
+            )
+            if cursore.rowcount:
+                seq = cursore.lastrowid
+                riga = self.conn.execute("select * from coda_scritture where seq = ?", (seq,)).fetchone()
+            else:
+                riga = self.conn.execute("select * from coda_scritture where chiave = ?", (chiave,)).fetchone()
+        return _operazione(riga)
+
+    def da_inviare(self, limite: int, utente: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Le prime operazioni in attesa (di un solo utente, se indicato), in ordine di arrivo
+
+        Sono escluse quelle su voci con un'operazione precedente dello stesso
+        utente in conflitto o rifiutata, che andrebbero applicate fuori
+        ordine. La voce è riconosciuta dall'id o dalla chiave: una creazione
+        rifiutata (senza id) blocca le modifiche accodate sulla sua chiave.
+        """
+        with self.lock:
+            righe = self.conn.execute(
+                "select * from coda_scritture c where stato = ? and (? is null or user_id is ?) and not exists ("
+                "  select 1 from coda_scritture b where b.stato != ? and b.seq < c.seq and b.user_id is c.user_id"
+                "  and (b.entry_id = c.entry_id or b.chiave_voce = c.chiave_voce)"
+                ") order by seq limit ?",
+                (IN_ATTESA, utente, utente, IN_ATTESA, limite)
+            ).fetchall()
+        return [_operazione(riga) for riga in righe]
+
+    def completa(self, seqs: List[int]) -> None:
+        """Toglie dalla coda le operazioni inviate"""
+        with self.lock:
+            self.conn.executemany("delete from coda_scritture where seq = ?", [(seq,) for seq in seqs])
+
+    def segna(self, seq: int, stato: str, errore: Optional[str] = None) -> None:
+        """Registra un tentativo fallito, cambiando lo stato dell'operazione"""
+        with self.lock:
+            self.conn.execute(
+                "update coda_scritture set stato = ?, errore = ?, tentativi = tentativi + 1 where seq = ?",
+                (stato, errore, seq)
+            )
+
+    def riprova(
+        self,
+        seq: int,
+        sovrascrivi: bool = False,
+        utente: Optional[str] = None,
+        accesso: Optional[str] = None
+    ) -> bool:
+        """
+        Rimette in attesa un'operazione in conflitto o rifiutata
+
+        Args:
+            sovrascrivi: Invia la modifica anche se la voce è cambiata sul server
+            utente: Se indicato, solo se l'operazione è di quell'utente
+            accesso: Se indicato, l'operazione verrà inviata con la sessione di
+                questo accesso (ad esempio quella aperta dopo un riavvio)
+        """
+        with self.lock:
+            cursore = self.conn.execute(
+                "update coda_scritture set stato = ?, errore = null, accesso = coalesce(?, accesso)"
+                + (", base = null" if sovrascrivi else "") + " where seq = ? and (? is null or user_id is ?)",
+                (IN_ATTESA, accesso, seq, utente, utente)
+            )
+        return cursore.rowcount > 0
+
+    def scarta(self, seq: int, utente: Optional[str] = None) -> bool:
+        """Elimina un'operazione senza inviarla (se indicato, solo se è di quell'utente)"""
+        with self.lock:
+            cursore = self.conn.execute(
+                "delete from coda_scritture where seq = ? and (? is null or user_id is ?)", (seq, utente, utente)
+            )
+        return cursore.rowcount > 0
+
+    def operazioni(self, utente: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Le operazioni ancora in coda (di un solo utente, se indicato), in ordine di arrivo"""
+        with self.lock:
+            if utente is None:
+                righe = self.conn.execute("select * from coda_scritture order by seq").fetchall()
+            else:
+                righe = self.conn.execute(
+                    "select * from coda_scritture where user_id is ? order by seq", (utente,)
+                ).fetchall()
+        return [_operazione(riga) for riga in righe]
+
+    def conteggi(self, utente: Optional[str] = None) -> Dict[str, int]:
+        """Numero di operazioni per stato (di un solo utente, se indicato)"""
+        with self.lock:
+            if utente is None:
+                righe = self.conn.execute("select stato, count(*) from coda_scritture group by stato").fetchall()
+            else:
+                righe = self.conn.execute(
+                    "select stato, count(*) from coda_scritture where user_id is ? group by stato", (utente,)
+                ).fetchall()
+        return {IN_ATTESA: 0, CONFLITTO: 0, ERRORE: 0, **{stato: n for stato, n in righe}}
+
+
+class InvioCoda:
+    """
+    Thread in background che svuota la coda delle scritture
+
+    Il thread parte alla prima richiesta di invio e invia la coda subito dopo
+    ogni sveglia() e, finché restano operazioni in attesa, ogni intervallo
+    secondi. Un solo invio è in corso alla volta.
+    """
+
+    def __init__(self, invia: Callable[[], Dict[str, Any]], intervallo: float = 5.0):
+        """
+        Args:
+            invia: Funzione che invia la coda e restituisce {"success": ..., "pending": ...}
+            intervallo: Secondi tra un tentativo e il successivo mentre la coda non è
+                vuota (0 disattiva il thread: la coda si invia solo chiamando invia)
+        """
+        self.invia = invia
+        self.intervallo = intervallo
+        self._sveglia = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Esito dell'ultimo invio, per l'interfaccia
+        self.ultimo_invio: Optional[float] = None
+        self.ultimo_esito: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_env(cls, invia: Callable[[], Dict[str, Any]]) -> "InvioCoda":
+        """Crea il thread leggendo DIARIO_CODA_INTERVALLO"""
+        return cls(invia, intervallo=float(os.getenv("DIARIO_CODA_INTERVALLO", "5")))
+
+    def sveglia(self) -> None:
+        """Chiede un invio immediato, avviando il thread se necessario"""
+        if self.intervallo <= 0:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._ciclo, name="diario-coda", daemon=True)
+                self._thread.start()
+        self._sveglia.set()
+
+    def _ciclo(self) -> None:
+        in_attesa = True
+        while True:
+            # Senza operazioni in attesa il thread dorme fino alla prossima sveglia()
+            self._sveglia.wait(self.intervallo if in_attesa else None)
+            self._sveglia.clear()
+            try:
+                esito = self.invia()
+            except Exception as e:
+                logger.exception("Invio della coda delle scritture interrotto")
+                esito = {"success": False, "error": str(e), "pending": True}
+            else:
+                if not esito.get("success"):
+                    logger.warning("Invio della coda delle scritture non riuscito: %s (%s operazioni in attesa)",
+                                   esito.get("error"), esito.get("pending"))
+            self.ultimo_invio = time.time()
+            self.ultimo_esito = esito
+            in_attesa = bool(esito.get("pending"))
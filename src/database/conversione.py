@@ -0,0 +1,162 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+# Mappatura campo Supabase -> colonna del DataFrame mostrata nell'app
+COLONNE = {
+    "id": "ID",
+    "data": "Data",
+    "pasto": "Pasto",
+    "alimento": "Alimento",
+    "quantita": "Quantità",
+    "unita_misura": "Unità di Misura",
+    "carboidrati": "Carboidrati (g)",
+    "glicemia_iniziale": "Glicemia Iniziale",
+    "glicemia_dop_2h": "Glicemia dopo 2h",
+    "unita_insulina": "Unità Insulina",
+    "dosi_correttive": "Dosi Correttive",
+    "tempo_dosi_correttive": "Tempo Dose Correttiva (min)",
+    "note": "Note",
+}
+
+# Tipi nullable per ogni colonna (la data viene gestita a parte)
+TIPI = {
+    "ID": "Int64",
+    "Pasto": "string",
+    "Alimento": "string",
+    "Quantità": "Int64",
+    "Unità di Misura": "string",
+    "Carboidrati (g)": "Float64",
+    "Glicemia Iniziale": "Int64",
+    "Glicemia dopo 2h": "Int64",
+    "Unità Insulina": "Float64",
+    "Dosi Correttive": "Float64",
+    "Tempo Dose Correttiva (min)": "Int64",
+    "Note": "string",
+}
+
+# Tipi ridotti del formato compatto: categorie per i testi che si ripetono,
+# interi piccoli per glicemie e quantità, float32 per carboidrati e insulina.
+# Un intero che non entra nel tipo ridotto resta Int64 (vedi _restringi)
+TIPI_COMPATTI = {
+    "ID": "Int32",
+    "Pasto": "category",
+    "Alimento": "category",
+    "Quantità": "Int16",
+    "Unità di Misura": "category",
+    "Carboidrati (g)": "Float32",
+    "Glicemia Iniziale": "Int16",
+    "Glicemia dopo 2h": "Int16",
+    "Unità Insulina": "Float32",
+    "Dosi Correttive": "Float32",
+    "Tempo Dose Correttiva (min)": "Int16",
+    "Note": "string",
+}
+
+# Formati del DataFrame:
+# - esteso: i tipi di TIPI, valori esatti (per i moduli di modifica)
+# - compatto: i tipi di TIPI_COMPATTI, circa un terzo della memoria; le
+#   categorie e i float32 cambiano confronti, concatenazioni e somme, quindi
+#   va scelto esplicitamente dove il chiamante li gestisce
+# - arrow: come compatto ma con colonne pyarrow (pd.ArrowDtype), le
+#   categorie diventano dizionari Arrow e i valori mancanti bitmap
+FORMATI = ("esteso", "compatto", "arrow")
+
+# Formato usato quando non è indicato, ad esempio per il diario tenuto in sessione
+FORMATO_PREDEFINITO = os.getenv("DIARIO_DATAFRAME", "esteso")
+
+# Fuso orario in fondo a una data ISO-8601 (Z, +02:00, +0200)
+_FUSO = r"(?:Z|[+-]\d{2}:?\d{2})$"
+
+
+def _restringi(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte le colonne ai tipi di TIPI_COMPATTI, tenendo Int64 per gli interi fuori intervallo"""
+    tipi = {}
+    for colonna, tipo in TIPI_COMPATTI.items():
+        serie = df[colonna]
+        if tipo.startswith("Int") and serie.notna().any():
+            # astype tra interi non controlla l'intervallo: un valore
+            # troppo grande cambierebbe senza errori
+            limiti = np.iinfo(tipo.lower())
+            if serie.min() < limiti.min or serie.max() > limiti.max:
+                continue
+        tipi[colonna] = tipo
+    return df.astype(tipi)
+
+
+def _in_arrow(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte un DataFrame compatto in colonne pyarrow, senza copie di testi e categorie"""
+    import pyarrow as pa
+
+    tabella = pa.Table.from_pandas(df, preserve_index=False)
+    # Le note arrivano come large_string: gli offset a 32 bit invece che a
+    # 64 dimezzano il loro costo per riga (bastano fino a 2 GB di testo)
+    schema = pa.schema([campo.with_type(pa.string()) if pa.types.is_large_string(campo.type) else campo
+                        for campo in tabella.schema], metadata=tabella.schema.metadata)
+    return tabella.cast(schema).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def date_locali(serie: pd.Series) -> pd.Series:
+    """
+    Date ISO-8601 come datetime senza fuso, con l'ora scritta nella stringa
+
+    Il fuso viene tolto senza convertire (come tz_localize(None)): una voce
+    delle 12:00+02:00 resta alle 12:00, l'ora del pasto per chi l'ha scritta.
+    Tabella, aggregati e risposta glicemica la usano tutti, così una voce
+    cade nello stesso giorno in ogni vista.
+    """
+    try:
+        date = pd.to_datetime(serie, format="ISO8601")
+    except (ValueError, TypeError):
+        # Fusi diversi tra le voci (o voci con e senza fuso): si tolgono dal testo
+        date = pd.to_datetime(serie.astype("string").str.replace(_FUSO, "", regex=True), format="ISO8601")
+    return date.dt.tz_localize(None) if date.dt.tz is not None else date
+
+
+def dataframe_vuoto(formato: Optional[str] = None) -> pd.DataFrame:
+    """Restituisce un DataFrame senza righe ma con colonne e tipi corretti"""
+    formato = formato or FORMATO_PREDEFINITO
+    tipi = TIPI if formato == "esteso" else TIPI_COMPATTI
+    df = pd.DataFrame({colonna: pd.Series(dtype=tipi.get(colonna, "datetime64[ns]"))
+                       for colonna in COLONNE.values()})
+    return _in_arrow(df) if formato == "arrow" else df
+
+
+def voci_a_dataframe(
+    voci: List[Dict[str, Any]],
+    ordina: bool = True,
+    formato: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Converte le voci restituite da DiarioAlimentareDB in un DataFrame tipizzato
+
+    La conversione avviene in un solo passaggio colonnare: rinomina dei campi,
+    parsing vettoriale delle date ISO-8601 (rese naive mantenendo l'ora
+    scritta, senza convertire il fuso) e cast ai tipi nullable di pandas.
+
+    Args:
+        voci: Lista di dizionari come in risultato["data"]
+        ordina: Se False mantiene l'ordine delle voci (ad esempio quello del server)
+        formato: Uno di FORMATI (default FORMATO_PREDEFINITO, da DIARIO_DATAFRAME).
+            Nei formati compatto e arrow carboidrati, insulina e dosi sono
+            float32: per i valori da modificare o riscrivere usare "esteso"
+
+    Returns:
+        DataFrame ordinato per ID con le colonne di COLONNE
+    """
+    formato = formato or FORMATO_PREDEFINITO
+    if formato not in FORMATI:
+        raise ValueError(f"Formato non valido: {formato}")
+    if not voci:
+        return dataframe_vuoto(formato)
+
+    df = pd.DataFrame.from_records(voci, columns=list(COLONNE)).rename(columns=COLONNE)
+    df["Data"] = date_locali(df["Data"])
+    df = df.astype(TIPI)
+    if ordina:
+        df = df.sort_values(by="ID", ignore_index=True)
+    if formato == "esteso":
+        return df
+    df = _restringi(df)
+    return _in_arrow(df) if formato == "arrow" else df
@@ -1,25 +1,292 @@
-import supabase
 import os
-from typing import Dict, Optional, Any
-from datetime import datetime
-from dotenv import load_dotenv
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union, Any
+from datetime import datetime, timedelta
 
-load_dotenv("/Users/carlo/Desktop/SideQuests/DiarioAlimentare/.env")
+from .backend import CAMPI, CHIAVE_IDEMPOTENZA, COLONNA_UTENTE, DELETE, TABLE_NAME, DiarioBackend, crea_backend
+from .cache import QueryCache
+from .coda import AGGIORNA, CONFLITTO, CREA, ELIMINA, ERRORE, IN_ATTESA, CodaScritture, InvioCoda, stesso_istante
+from .parallelo import unisci_in_ordine
+from .resilienza import BackendResiliente, CircuitoAperto, classifica_errore
+from .ricerca import CAMPI_RICERCA
+from .sincronizzazione import SnapshotDiario
+from .strumentazione import BackendMisurato, Metriche, strumentato
+from .tempo_reale import FlussoModifiche, piu_recente
+from .utenti import (
+    BackendUtente, PerUtente, StatoUtente, accesso_corrente, come_utente, con_accesso, imposta_accesso,
+    imposta_utente, utente_corrente
+)
 
-supabase_url = os.getenv('SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_API_KEY')
+# Protegge la creazione del backend, condiviso da tutte le sessioni del processo
+_backend_lock = threading.Lock()
 
-if not supabase_url or not supabase_key:
-    raise ValueError("SUPABASE_URL e SUPABASE_API_KEY devono essere impostati nelle variabili d'ambiente")
+# Cache delle letture, condivisa da tutte le sessioni del processo e divisa per utente
+query_cache = QueryCache.from_env(partizione=utente_corrente)
 
-supabase_client = supabase.create_client(supabase_url, supabase_key)
+# Misure delle chiamate e delle primitive del backend, condivise dal processo
+metriche = Metriche.from_env()
+
+# Per ogni utente: copia locale delle sue voci per la sincronizzazione
+# incrementale, aggregati della pagina Analisi e catalogo degli alimenti
+stati = PerUtente(StatoUtente, max_utenti=int(os.getenv("DIARIO_MAX_UTENTI", "50")))
+
+# Coda durevole delle scritture fatte dall'interfaccia e thread che la invia
+coda = CodaScritture.from_env()
+invio_coda = InvioCoda.from_env(lambda: DiarioAlimentareDB.flush_queue())
+# Un solo invio della coda alla volta (thread in background o invio manuale)
+_invio_lock = threading.Lock()
+
+# Modifiche notificate dal backend (anche da altri dispositivi), applicate
+# agli snapshot e alla cache degli utenti interessati
+flusso = FlussoModifiche.from_env(lambda evento, riga: DiarioAlimentareDB._applica_modifica(evento, riga))
 
 class DiarioAlimentareDB:
     """Classe per gestire le operazioni CRUD sulla tabella DiarioAlimentare"""
     
-    TABLE_NAME = "DiarioAlimentare"
+    TABLE_NAME = TABLE_NAME
+    # Backend creato al primo utilizzo da get_backend (o impostato con use_backend)
+    backend: Optional[DiarioBackend] = None
+    # Impostazioni esplicite per la creazione del backend (vedi configure)
+    settings: Dict[str, Any] = {}
+    # Righe per pagina: non deve superare max-rows di PostgREST (1000 su Supabase)
+    PAGE_SIZE = int(os.getenv("DIARIO_PAGE_SIZE", "1000"))
+    # Richieste contemporanee per le letture complete (1 = lettura seriale)
+    MAX_WORKERS = int(os.getenv("DIARIO_CONCORRENZA", "1"))
+    cache = query_cache
+    stati = stati
+    metriche = metriche
+    coda = coda
+    flusso = flusso
+
+    # Campi scrivibili della tabella
+    FIELDS = CAMPI
+    # Righe per richiesta nelle operazioni bulk
+    BULK_CHUNK_SIZE = int(os.getenv("DIARIO_BULK_CHUNK", "500"))
+    # Voci restituite al massimo da search_entries
+    SEARCH_LIMIT = int(os.getenv("DIARIO_RICERCA_LIMITE", "100"))
+
+    @staticmethod
+    def configure(backend: Optional[str] = None, env_file: Optional[str] = None, **opzioni) -> None:
+        """
+        Imposta esplicitamente il backend, che verrà creato al primo utilizzo
+        
+        Args:
+            backend: "supabase" o "sqlite" (default DIARIO_BACKEND, altrimenti supabase)
+            env_file: File .env da caricare prima di leggere le variabili d'ambiente
+                (default DIARIO_ENV_FILE, altrimenti il primo .env risalendo dalla
+                cartella corrente)
+            **opzioni: Opzioni di crea_backend: url e key per supabase, percorso per sqlite
+        """
+        with _backend_lock:
+            DiarioAlimentareDB.settings = {"nome": backend, "env_file": env_file, **opzioni}
+            DiarioAlimentareDB.backend = None
+        flusso.ferma()
+        query_cache.svuota()
+        stati.azzera()
+
+    @staticmethod
+    def get_backend() -> DiarioBackend:
+        """
+        Restituisce il backend, creandolo alla prima chiamata
+        
+        Il client (e il suo pool di connessioni HTTP) viene creato una sola
+        volta per processo e riusato da tutte le sessioni Streamlit, quindi
+        importare il modulo non richiede credenziali né costruisce client.
+        
+        Raises:
+            ValueError: Se la configurazione è incompleta (ad esempio mancano
+                SUPABASE_URL e SUPABASE_API_KEY)
+        """
+        backend = DiarioAlimentareDB.backend
+        if backend is not None:
+            return backend
+        with _backend_lock:
+            if DiarioAlimentareDB.backend is None:
+                from dotenv import find_dotenv, load_dotenv
+                
+                impostazioni = dict(DiarioAlimentareDB.settings)
+                env_file = (impostazioni.pop("env_file", None) or os.getenv("DIARIO_ENV_FILE")
+                            or find_dotenv(usecwd=True))
+                if env_file:
+                    load_dotenv(env_file)
+                DiarioAlimentareDB.backend = DiarioAlimentareDB._avvolgi(
+                    crea_backend(impostazioni.pop("nome", None), **impostazioni)
+                )
+            return DiarioAlimentareDB.backend
+
+    @staticmethod
+    def use_backend(nuovo: DiarioBackend) -> None:
+        """
+        Sostituisce il motore di archiviazione (ad esempio SQLiteBackend nelle prove)
+
+        Cache e snapshot vengono svuotati perché si riferiscono al backend precedente.
+        """
+        with _backend_lock:
+            DiarioAlimentareDB.backend = DiarioAlimentareDB._avvolgi(nuovo)
+        flusso.ferma()
+        query_cache.svuota()
+        stati.azzera()
+
+    @staticmethod
+    def _avvolgi(backend: DiarioBackend) -> DiarioBackend:
+        """
+        Limita il backend alle voci dell'utente corrente (BackendUtente) e
+        aggiunge timeout, tentativi e circuit breaker (BackendResiliente) e,
+        se le metriche sono attive, la misura di ogni richiesta (BackendMisurato)
+        """
+        if isinstance(backend, BackendResiliente):
+            return backend
+        if not isinstance(backend, BackendUtente):
+            backend = BackendUtente(backend)
+        if metriche.attive:
+            backend = BackendMisurato(backend, metriche)
+        return BackendResiliente.from_env(backend, metriche)
+
+    @staticmethod
+    def set_user(user_id: Optional[str]) -> None:
+        """
+        Imposta l'utente (paziente) a cui si riferiscono le chiamate successive
+
+        L'utente vale per il contesto corrente: il thread o l'esecuzione dello
+        script Streamlit, quindi sessioni diverse possono usare utenti diversi.
+
+        Args:
+            user_id: Identificativo dell'utente (None: DIARIO_UTENTE, altrimenti "predefinito")
+        """
+        imposta_utente(user_id)
+
+    @staticmethod
+    def get_user() -> str:
+        """Utente a cui si riferiscono le chiamate nel contesto corrente"""
+        return utente_corrente()
+
+    @staticmethod
+    @contextmanager
+    def as_user(user_id: Optional[str]) -> Iterator[str]:
+        """Esegue un blocco di chiamate per conto di un utente, ripristinando poi quello precedente"""
+        with come_utente(user_id) as utente:
+            yield utente
+
+    @staticmethod
+    def set_login(login_id: Optional[str]) -> None:
+        """
+        Imposta l'accesso (login) del contesto corrente, ad esempio un id della sessione Streamlit
+
+        Le chiamate usano la sessione aperta da sign_in con lo stesso accesso:
+        un'esecuzione con un altro accesso non la usa anche se imposta lo
+        stesso utente. Come l'utente, vale per il thread o l'esecuzione dello
+        script Streamlit e va impostato a ogni esecuzione.
+        """
+        imposta_accesso(login_id)
+
+    @staticmethod
+    def sign_in(email: str, password: str) -> Dict[str, Any]:
+        """
+        Accede con un account del database e ne imposta l'utente
+
+        La sessione appartiene all'accesso corrente (set_login; se non è
+        impostato ne viene creato uno per il contesto corrente). Con le policy
+        di sql/008_rls.sql il database mostra a ogni account solo le sue voci
+        e quelle dei pazienti che gli sono assegnati: l'utente di set_user va
+        scelto tra quelli restituiti in data.
+
+        Returns:
+            Dict con success e data (utenti accessibili, per primo quello
+            dell'account) o error
+        """
+        try:
+            if accesso_corrente() is None:
+                imposta_accesso(str(uuid.uuid4()))
+            utenti = DiarioAlimentareDB.get_backend().sign_in(email, password)
+            imposta_utente(utenti[0])
+            return {"success": True, "data": utenti}
+
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    @staticmethod
+    def sign_out() -> Dict[str, Any]:
+        """
+        Chiude la sessione dell'accesso corrente e torna all'utente predefinito
+
+        Le operazioni in coda accodate con questo accesso non potranno più
+        usarne la sessione: vanno ripetute (retry_queued) dopo un nuovo accesso.
+        """
+        try:
+            DiarioAlimentareDB.get_backend().sign_out()
+            imposta_utente(None)
+            return {"success": True}
+
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    @staticmethod
+    def get_circuit_state() -> Dict[str, Any]:
+        """
+        Stato del circuit breaker del backend
+
+        Returns:
+            Dict con stato ("chiuso", "aperto" o "prova"), errori consecutivi
+            e riprova_tra_s (secondi prima della prossima chiamata di prova)
+        """
+        return DiarioAlimentareDB.get_backend().interruttore.stato()
+
+    @staticmethod
+    def get_metrics(formato: str = "json") -> str:
+        """
+        Misure delle chiamate al database e della cache delle letture
+
+        Args:
+            formato: "json" oppure "prometheus" (formato di esposizione testuale)
+        """
+        if formato == "prometheus":
+            return metriche.prometheus(query_cache)
+        if formato == "json":
+            return metriche.json(query_cache)
+        raise ValueError(f"Formato delle metriche non valido: {formato} (valori ammessi: json, prometheus)")
+
+    @staticmethod
+    def reset_metrics() -> None:
+        """Azzera le misure e i contatori della cache"""
+        metriche.azzera()
+        query_cache.azzera_statistiche()
+
+    @staticmethod
+    def _aggiorna_cache(entry_id: int, voce: Optional[Dict[str, Any]]) -> None:
+        """
+        Invalida le letture in cache dopo una scrittura
+
+        Le liste e le statistiche vengono scartate, mentre la voce modificata
+        viene aggiornata (o rimossa se voce è None) nella cache per ID.
+        """
+        if voce is None:
+            DiarioAlimentareDB._aggiorna_cache_bulk(eliminate=[entry_id])
+        else:
+            DiarioAlimentareDB._aggiorna_cache_bulk(scritte=[voce])
+
+    @staticmethod
+    def _aggiorna_cache_bulk(
+        scritte: Iterable[Dict[str, Any]] = (),
+        eliminate: Iterable[int] = ()
+    ) -> None:
+        """Come _aggiorna_cache, per più voci scritte o eliminate in una volta"""
+        get_entry = DiarioAlimentareDB.get_entry_by_id
+        query_cache.invalidate(lambda chiave: chiave[0] != get_entry.__name__)
+        scritte, eliminate = list(scritte), list(eliminate)
+        for voce in scritte:
+            query_cache.set(get_entry.cache_key(voce["id"]), {"success": True, "data": voce})
+        if eliminate:
+            chiavi = {get_entry.cache_key(entry_id) for entry_id in eliminate}
+            query_cache.invalidate(lambda k: k in chiavi)
+            stati.corrente().snapshot.rimuovi(eliminate)
+        if scritte:
+            stati.corrente().snapshot.applica(scritte, avanza=False)
     
     @staticmethod
+    @strumentato(metriche)
     def create_entry(
         data: datetime,
         pasto: Optional[str] = None,
@@ -32,7 +299,8 @@ class DiarioAlimentareDB:
         unita_insulina: Optional[float] = None,
         note: Optional[str] = None,
         dosi_correttive: Optional[float] = None,
-        tempo_dosi_correttive: Optional[int] = None
+        tempo_dosi_correttive: Optional[int] = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Crea una nuova voce nel diario alimentare
@@ -50,6 +318,9 @@ class DiarioAlimentareDB:
             note: Note aggiuntive
             dosi_correttive: Dosi correttive di insulina
             tempo_dosi_correttive: Tempo delle dosi correttive in minuti
+            idempotency_key: Chiave (uuid) della voce: richiamando create_entry
+                con la stessa chiave si ottiene la voce già creata, senza
+                duplicarla (default una chiave nuova)
             
         Returns:
             Dict con i dati della voce creata o errore
@@ -72,11 +343,13 @@ class DiarioAlimentareDB:
             
             # Rimuovi i campi None per non inserire valori null non necessari
             entry_data = {k: v for k, v in entry_data.items() if v is not None}
+            entry_data[CHIAVE_IDEMPOTENZA] = idempotency_key or str(uuid.uuid4())
             
-            response = supabase_client.table(DiarioAlimentareDB.TABLE_NAME).insert(entry_data).execute()
+            create = DiarioAlimentareDB.get_backend().insert([entry_data])
             
-            if response.data:
-                return {"success": True, "data": response.data[0]}
+            if create:
+                DiarioAlimentareDB._aggiorna_cache(create[0]["id"], create[0])
+                return {"success": True, "data": create[0]}
             else:
                 return {"success": False, "error": "Errore durante l'inserimento"}
                 
@@ -84,6 +357,155 @@ class DiarioAlimentareDB:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    def iter_entry_pages(
+        page_size: Optional[int] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        columns: str = "*"
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Scorre le voci a pagine, dalla più recente, con paginazione keyset su (data, id)
+
+        Ogni pagina riparte dall'ultima chiave letta invece di usare offset,
+        quindi il costo di una pagina non cresce con la profondità e non si
+        incorre nel limite di righe per risposta di PostgREST. page_size non
+        deve superare max-rows: una pagina incompleta viene considerata l'ultima.
+        
+        Args:
+            page_size: Righe per pagina (default PAGE_SIZE)
+            start_date: Se indicata, solo voci con data >= start_date
+            end_date: Se indicata, solo voci con data <= end_date
+            columns: Colonne da leggere; data e id vengono sempre incluse
+            
+        Yields:
+            Liste di voci ordinate per data e id decrescenti
+        """
+        page_size = page_size or DiarioAlimentareDB.PAGE_SIZE
+        if columns.strip() != "*":
+            richieste = [c.strip() for c in columns.split(",")]
+            columns = ",".join(dict.fromkeys(richieste + ["data", "id"]))
+        
+        filtri = []
+        if start_date:
+            filtri.append(("data", "gte", start_date.isoformat()))
+        if end_date:
+            filtri.append(("data", "lte", end_date.isoformat()))
+        
+        ultima = None
+        while True:
+            chiave = [("data,id", "lt", (ultima["data"], ultima["id"]))] if ultima is not None else []
+            pagina = DiarioAlimentareDB.get_backend().select(
+                columns, filtri + chiave, ordine=[("data", True), ("id", True)], limit=page_size
+            )
+            if pagina:
+                yield pagina
+            # Una pagina incompleta è l'ultima, purché page_size non superi max-rows
+            if len(pagina) < page_size:
+                return
+            ultima = pagina[-1]
+    
+    @staticmethod
+    def _date_range_limits() -> Optional[tuple]:
+        """Restituisce (data minima, data massima) della tabella, o None se è vuota"""
+        estremi = []
+        for desc in (False, True):
+            righe = DiarioAlimentareDB.get_backend().select("data", ordine=[("data", desc)], limit=1)
+            if not righe:
+                return None
+            estremi.append(datetime.fromisoformat(righe[0]["data"].replace("Z", "+00:00")))
+        return tuple(estremi)
+    
+    @staticmethod
+    def iter_entry_pages_parallel(
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        max_workers: Optional[int] = None,
+        shards: Optional[int] = None,
+        page_size: Optional[int] = None,
+        prefetch: int = 2,
+        columns: str = "*"
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Come iter_entry_pages, ma divide l'intervallo di date in shard letti in parallelo
+        
+        Gli shard sono intervalli di tempo disgiunti, ciascuno paginato con keyset
+        in un thread del pool; le pagine vengono restituite nello stesso ordine
+        della lettura seriale (data e id decrescenti). Ogni shard può accumulare
+        al massimo prefetch pagine non ancora consumate.
+        
+        Args:
+            start_date: Inizio dell'intervallo (default: la data più vecchia)
+            end_date: Fine dell'intervallo (default: la data più recente)
+            max_workers: Richieste contemporanee (default MAX_WORKERS)
+            shards: Numero di intervalli (default 2 * max_workers)
+            page_size: Righe per pagina (default PAGE_SIZE)
+            prefetch: Pagine accumulabili in anticipo per shard
+            columns: Colonne da leggere; data e id vengono sempre incluse
+            
+        Yields:
+            Liste di voci ordinate per data e id decrescenti
+        """
+        max_workers = max_workers or max(DiarioAlimentareDB.MAX_WORKERS, 1)
+        shards = shards or 2 * max_workers
+        
+        if start_date is None or end_date is None:
+            estremi = DiarioAlimentareDB._date_range_limits()
+            if estremi is None:
+                return
+            start_date = start_date or estremi[0]
+            end_date = end_date or estremi[1]
+        
+        # Confini disgiunti: ogni shard termina un microsecondo prima del successivo
+        ampiezza = (end_date - start_date) / shards
+        confini = [start_date + ampiezza * i for i in range(shards)] + [end_date]
+        intervalli = []
+        for i in reversed(range(shards)):
+            fine = confini[i + 1] if i == shards - 1 else confini[i + 1] - timedelta(microseconds=1)
+            if fine >= confini[i]:
+                intervalli.append((confini[i], fine))
+        
+        produttori = [
+            lambda inizio=inizio, fine=fine: DiarioAlimentareDB.iter_entry_pages(
+                page_size=page_size, start_date=inizio, end_date=fine, columns=columns
+            )
+            for inizio, fine in intervalli
+        ]
+        yield from unisci_in_ordine(produttori, max_workers=max_workers, prefetch=prefetch)
+    
+    @staticmethod
+    def _iter_all_pages(
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Sceglie la lettura seriale o parallela in base a MAX_WORKERS"""
+        if DiarioAlimentareDB.MAX_WORKERS > 1:
+            return DiarioAlimentareDB.iter_entry_pages_parallel(start_date=start_date, end_date=end_date)
+        return DiarioAlimentareDB.iter_entry_pages(start_date=start_date, end_date=end_date)
+    
+    @staticmethod
+    def _iter_pages_by_id(
+        columns: str = "*",
+        filtri: Iterable[tuple] = (),
+        page_size: Optional[int] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Scorre le voci a pagine in ordine di id (keyset su id), con filtri opzionali"""
+        page_size = page_size or DiarioAlimentareDB.PAGE_SIZE
+        filtri = list(filtri)
+        ultimo_id = None
+        while True:
+            chiave = [("id", "gt", ultimo_id)] if ultimo_id is not None else []
+            pagina = DiarioAlimentareDB.get_backend().select(
+                columns, filtri + chiave, ordine=[("id", False)], limit=page_size
+            )
+            if pagina:
+                yield pagina
+            if len(pagina) < page_size:
+                return
+            ultimo_id = pagina[-1]["id"]
+    
+    @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
     def get_entry_by_id(entry_id: int) -> Dict[str, Any]:
         """
         Recupera una voce specifica per ID
@@ -95,10 +517,10 @@ class DiarioAlimentareDB:
             Dict con i dati della voce o errore
         """
         try:
-            response = supabase_client.table(DiarioAlimentareDB.TABLE_NAME).select("*").eq("id", entry_id).execute()
+            righe = DiarioAlimentareDB.get_backend().select("*", [("id", "eq", entry_id)])
             
-            if response.data:
-                return {"success": True, "data": response.data[0]}
+            if righe:
+                return {"success": True, "data": righe[0]}
             else:
                 return {"success": False, "error": "Voce non trovata"}
                 
@@ -106,10 +528,16 @@ class DiarioAlimentareDB:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
     def get_all_entries(limit: Optional[int] = None, offset: Optional[int] = None) -> Dict[str, Any]:
         """
         Recupera tutte le voci del diario alimentare
         
+        Senza limit e offset le voci vengono lette a pagine con iter_entry_pages
+        (o iter_entry_pages_parallel se MAX_WORKERS > 1), così il risultato non
+        viene troncato dal limite di righe di PostgREST.
+        
         Args:
             limit: Numero massimo di voci da recuperare
             offset: Numero di voci da saltare (per paginazione)
@@ -118,24 +546,24 @@ class DiarioAlimentareDB:
             Dict con lista delle voci o errore
         """
         try:
-            query = supabase_client.table(DiarioAlimentareDB.TABLE_NAME).select("*").order("data", desc=True)
+            if not limit and not offset:
+                data = [voce for pagina in DiarioAlimentareDB._iter_all_pages() for voce in pagina]
+                return {"success": True, "data": data, "count": len(data)}
             
-            if limit:
-                query = query.limit(limit)
-            if offset:
-                query = query.offset(offset)
-                
-            response = query.execute()
+            data = DiarioAlimentareDB.get_backend().select("*", ordine=[("data", True)], limit=limit, offset=offset)
             
-            return {"success": True, "data": response.data, "count": len(response.data)}
+            return {"success": True, "data": data, "count": len(data)}
                 
         except Exception as e:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
     def get_entries_by_date_range(
         start_date: datetime, 
-        end_date: datetime
+        end_date: datetime,
+        limit: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         Recupera le voci in un intervallo di date
@@ -143,24 +571,33 @@ class DiarioAlimentareDB:
         Args:
             start_date: Data di inizio
             end_date: Data di fine
+            limit: Se indicato, solo le limit voci più recenti dell'intervallo
             
         Returns:
             Dict con lista delle voci o errore
         """
         try:
-            response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                       .select("*")
-                       .gte("data", start_date.isoformat())
-                       .lte("data", end_date.isoformat())
-                       .order("data", desc=True)
-                       .execute())
-            
-            return {"success": True, "data": response.data, "count": len(response.data)}
+            if limit:
+                pagine = DiarioAlimentareDB.iter_entry_pages(
+                    page_size=min(limit, DiarioAlimentareDB.PAGE_SIZE), start_date=start_date, end_date=end_date
+                )
+            else:
+                pagine = DiarioAlimentareDB._iter_all_pages(start_date=start_date, end_date=end_date)
+            data = []
+            for pagina in pagine:
+                data.extend(pagina)
+                if limit and len(data) >= limit:
+                    del data[limit:]
+                    break
+            
+            return {"success": True, "data": data, "count": len(data)}
                 
         except Exception as e:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
     def get_entries_by_meal_type(pasto: str) -> Dict[str, Any]:
         """
         Recupera le voci per tipo di pasto
@@ -172,18 +609,341 @@ class DiarioAlimentareDB:
             Dict con lista delle voci o errore
         """
         try:
-            response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                       .select("*")
-                       .eq("pasto", pasto)
-                       .order("data", desc=True)
-                       .execute())
+            data = DiarioAlimentareDB.get_backend().select("*", [("pasto", "eq", pasto)], ordine=[("data", True)])
+            
+            return {"success": True, "data": data, "count": len(data)}
+                
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def _filtri_tabella(
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        pasto: Optional[str],
+        alimento: Optional[str]
+    ) -> List[tuple]:
+        """Filtri comuni di get_entries_page (alimento: contiene, senza distinzione di maiuscole)"""
+        filtri = []
+        if start_date:
+            filtri.append(("data", "gte", start_date.isoformat()))
+        if end_date:
+            filtri.append(("data", "lte", end_date.isoformat()))
+        if pasto:
+            filtri.append(("pasto", "eq", pasto))
+        if alimento:
+            filtri.append(("alimento", "ilike", f"%{alimento}%"))
+        return filtri
+    
+    @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
+    def get_entries_page(
+        page: int = 1,
+        page_size: int = 50,
+        sort_by: str = "data",
+        descending: bool = True,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        pasto: Optional[str] = None,
+        alimento: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Recupera una sola pagina di voci, filtrate e ordinate sul server
+        
+        Servono due richieste (la pagina e il conteggio delle voci filtrate),
+        qualunque sia la dimensione della tabella. L'id è usato come secondo
+        criterio di ordinamento, così le pagine sono stabili anche a parità di valore.
+        
+        Args:
+            page: Numero di pagina, da 1
+            page_size: Voci per pagina
+            sort_by: Campo di ordinamento (id o uno di FIELDS)
+            descending: Ordine decrescente
+            start_date: Se indicata, solo voci con data >= start_date
+            end_date: Se indicata, solo voci con data <= end_date
+            pasto: Se indicato, solo voci di quel pasto
+            alimento: Se indicato, solo voci il cui alimento contiene il testo
+            
+        Returns:
+            Dict con le voci della pagina in "data", "count" (voci nella
+            pagina), "total" (voci filtrate), "page" e "pages", o errore
+        """
+        try:
+            if sort_by != "id" and sort_by not in DiarioAlimentareDB.FIELDS:
+                return {"success": False, "error": f"Campo di ordinamento non valido: {sort_by}"}
+            page, page_size = max(page, 1), max(page_size, 1)
+            
+            filtri = DiarioAlimentareDB._filtri_tabella(start_date, end_date, pasto, alimento)
+            backend = DiarioAlimentareDB.get_backend()
+            totale = backend.count(filtri)
+            ordine = [(sort_by, descending)] + ([("id", descending)] if sort_by != "id" else [])
+            data = backend.select("*", filtri, ordine=ordine, limit=page_size, offset=(page - 1) * page_size)
+            
+            return {
+                "success": True,
+                "data": data,
+                "count": len(data),
+                "total": totale,
+                "page": page,
+                "pages": max((totale + page_size - 1) // page_size, 1)
+            }
+                
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
+    def get_summary(
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        pasto: Optional[str] = None,
+        alimento: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Calcola sul server il riepilogo delle voci filtrate
+        
+        Su Supabase usa la funzione SQL diario_riepilogo (vedi sql/004_riepilogo.sql),
+        con gli stessi filtri di get_entries_page.
+        
+        Returns:
+            Dict con count, average_glucose (glicemia iniziale media),
+            total_carbs e total_corrective_doses, o errore
+        """
+        try:
+            riepilogo = DiarioAlimentareDB.get_backend().summary(
+                start_date.isoformat() if start_date else None,
+                end_date.isoformat() if end_date else None,
+                pasto or None,
+                alimento or None
+            )
+            return {"success": True, "data": riepilogo}
+                
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    def sync_entries(full: bool = False) -> Dict[str, Any]:
+        """
+        Sincronizza la copia locale della tabella e restituisce tutte le voci
+
+        Al primo utilizzo (o con full=True) scarica l'intera tabella; in seguito
+        legge solo le righe inserite o modificate dopo il punto di ripresa.
+        Le eliminazioni vengono rilevate confrontando il conteggio sul server
+        con quello locale: solo se differiscono si scarica l'elenco degli id.
+        
+        Args:
+            full: Forza un caricamento completo
             
-            return {"success": True, "data": response.data, "count": len(response.data)}
+        Returns:
+            Dict con lista delle voci (non ordinate), numero di righe scaricate
+            in "fetched" e versione dello snapshot, o errore
+        """
+        try:
+            snapshot = stati.corrente().snapshot
+            with snapshot.lock:
+                fetched = DiarioAlimentareDB._sincronizza(full)
+                data = snapshot.lista()
+                return {
+                    "success": True,
+                    "data": data,
+                    "count": len(data),
+                    "fetched": fetched,
+                    "version": snapshot.versione
+                }
+                
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def _sincronizza(full: bool = False) -> int:
+        """
+        Allinea lo snapshot dell'utente corrente al server, restituendo il numero di righe scaricate
+
+        Con la sottoscrizione alle modifiche attiva da prima dell'ultima
+        sincronizzazione le novità arrivano già dal flusso e non si rilegge
+        il server, se non ogni DIARIO_TEMPO_REALE_VERIFICA secondi.
+        """
+        flusso.avvia(DiarioAlimentareDB.get_backend())
+        snapshot = stati.corrente().snapshot
+        with snapshot.lock:
+            fetched = 0
+            inizio = time.monotonic()
+            if full or not snapshot.caricato:
+                ora = DiarioAlimentareDB._ora_database(snapshot)
+                data = [voce for pagina in DiarioAlimentareDB._iter_pages_by_id() for voce in pagina]
+                snapshot.sostituisci(data)
+                snapshot.inizio_sync = inizio
+                snapshot.ora_sync = ora
+                fetched = len(data)
+            elif snapshot.da_sincronizzare() and not flusso.copre(snapshot.inizio_sync):
+                ora = DiarioAlimentareDB._ora_database(snapshot)
+                for pagina in DiarioAlimentareDB._iter_pages_by_id(filtri=[snapshot.filtro_delta()]):
+                    snapshot.applica(pagina)
+                    fetched += len(pagina)
                 
+                # Riconcilia le eliminazioni solo se i conteggi non tornano
+                if DiarioAlimentareDB.get_backend().count() != len(snapshot):
+                    mancanti = snapshot.riconcilia(
+                        voce["id"] for pagina in DiarioAlimentareDB._iter_pages_by_id("id") for voce in pagina
+                    )
+                    for da in range(0, len(mancanti), DiarioAlimentareDB.PAGE_SIZE):
+                        blocco = mancanti[da:da + DiarioAlimentareDB.PAGE_SIZE]
+                        righe = DiarioAlimentareDB.get_backend().select("*", [("id", "in", blocco)])
+                        snapshot.applica(righe, avanza=False)
+                        fetched += len(righe)
+                snapshot.ultimo_sync = time.monotonic()
+                snapshot.inizio_sync = inizio
+                snapshot.ora_sync = ora
+            return fetched
+
+    @staticmethod
+    def _ora_database(snapshot: SnapshotDiario) -> Optional[datetime]:
+        """Ora del database prima di leggere, None se non serve o il backend non la fornisce"""
+        if not snapshot.colonna_modifica:
+            return None
+        try:
+            return DiarioAlimentareDB.get_backend().now()
+        except NotImplementedError:
+            return None
+
+    @staticmethod
+    def _applica_modifica(evento: str, riga: Dict[str, Any]) -> None:
+        """
+        Applica allo snapshot e alla cache del suo utente una modifica notificata dal backend
+
+        Gli snapshot non ancora caricati vengono lasciati alla prima
+        sincronizzazione. Una modifica già presente nello snapshot (ad esempio
+        scritta da questo stesso processo) non invalida la cache. Un'eliminazione
+        senza utente (tabella senza replica identity full) si applica a tutti.
+        """
+        if riga.get("id") is None:
+            return
+        utente = riga.get(COLONNA_UTENTE)
+        if utente is None:
+            if evento == DELETE:
+                for _, stato in stati.elementi():
+                    stato.snapshot.rimuovi([riga["id"]])
+                query_cache.svuota()
+            return
+        stato = stati.presente(utente)
+        if stato is not None and not stato.snapshot.caricato:
+            stato.notifiche += 1
+        elif stato is not None:
+            snapshot = stato.snapshot
+            with snapshot.lock:
+                if evento == DELETE:
+                    cambiate = snapshot.rimuovi([riga["id"]])
+                elif piu_recente(riga, snapshot.voci.get(riga["id"]), snapshot.colonna_modifica):
+                    cambiate = snapshot.applica([riga], avanza=False)
+                else:
+                    cambiate = 0
+            if not cambiate:
+                return
+        get_entry = DiarioAlimentareDB.get_entry_by_id
+        voce = get_entry.cache_key(riga["id"])
+        with come_utente(utente):
+            query_cache.invalidate(lambda chiave: chiave[0] != get_entry.__name__ or chiave == voce)
+
+    @staticmethod
+    def get_data_version() -> int:
+        """
+        Versione dei dati dell'utente corrente, senza sincronizzarli
+
+        Cambia a ogni modifica applicata allo snapshot o notificata per
+        l'utente, anche da un'altra sessione o da un altro dispositivo: l'app
+        la confronta con quella dei dati mostrati per sapere quando ridisegnarli.
+        """
+        try:
+            flusso.avvia(DiarioAlimentareDB.get_backend())
+        except Exception:
+            # Backend non configurato o non raggiungibile: l'errore arriva
+            # già dalle letture, la versione resta quella in memoria
+            pass
+        stato = stati.corrente()
+        return stato.snapshot.versione + stato.notifiche
+
+    @staticmethod
+    def get_realtime_status() -> Dict[str, Any]:
+        """
+        Stato della sottoscrizione alle modifiche
+
+        Returns:
+            Dict con stato ("connesso", "in connessione", "non disponibile",
+            "disattivato" o "non avviato"), eventi applicati, errori, in_coda,
+            ultimo_evento (epoch) e ultimo_errore
+        """
+        return flusso.stato()
+    
+    @staticmethod
+    @strumentato(metriche)
+    def get_rollup(full: bool = False) -> Dict[str, Any]:
+        """
+        Sincronizza lo snapshot e restituisce gli aggregati per la pagina Analisi
+        
+        A differenza di sync_entries non copia le voci: dopo il primo
+        caricamento il costo dipende solo dalle righe cambiate.
+        
+        Args:
+            full: Forza un caricamento completo
+            
+        Returns:
+            Dict con il RollupDiario in "data" e la sua versione, o errore
+        """
+        try:
+            DiarioAlimentareDB._sincronizza(full)
+            rollup = stati.corrente().rollup
+            return {"success": True, "data": rollup, "version": rollup.versione}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    def get_glucose_response(full: bool = False) -> Dict[str, Any]:
+        """
+        Sincronizza lo snapshot e restituisce l'analisi della risposta glicemica ai pasti
+
+        Come per gli aggregati, le voci sono già in colonna dopo il primo
+        caricamento: variazione della glicemia, rapporti carboidrati/insulina,
+        efficacia delle correzioni e tendenze si calcolano sull'intero diario
+        solo quando cambia qualcosa.
+
+        Args:
+            full: Forza un caricamento completo
+
+        Returns:
+            Dict con la RispostaGlicemica in "data" e la sua versione, o errore
+        """
+        try:
+            DiarioAlimentareDB._sincronizza(full)
+            risposta = stati.corrente().risposta
+            return {"success": True, "data": risposta, "version": risposta.versione}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    @staticmethod
+    @strumentato(metriche)
+    def get_catalogo(full: bool = False) -> Dict[str, Any]:
+        """
+        Sincronizza lo snapshot e restituisce il catalogo degli alimenti
+        
+        Args:
+            full: Forza un caricamento completo
+            
+        Returns:
+            Dict con il CatalogoAlimenti in "data" e il numero di alimenti, o errore
+        """
+        try:
+            DiarioAlimentareDB._sincronizza(full)
+            catalogo = stati.corrente().catalogo
+            return {"success": True, "data": catalogo, "count": len(catalogo)}
         except Exception as e:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    @strumentato(metriche)
     def update_entry(entry_id: int, **kwargs) -> Dict[str, Any]:
         """
         Aggiorna una voce esistente
@@ -206,13 +966,11 @@ class DiarioAlimentareDB:
             if "data" in update_data and isinstance(update_data["data"], datetime):
                 update_data["data"] = update_data["data"].isoformat()
             
-            response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                       .update(update_data)
-                       .eq("id", entry_id)
-                       .execute())
+            aggiornate = DiarioAlimentareDB.get_backend().update(update_data, [("id", "eq", entry_id)])
             
-            if response.data:
-                return {"success": True, "data": response.data[0]}
+            if aggiornate:
+                DiarioAlimentareDB._aggiorna_cache(entry_id, aggiornate[0])
+                return {"success": True, "data": aggiornate[0]}
             else:
                 return {"success": False, "error": "Voce non trovata o non aggiornata"}
                 
@@ -220,6 +978,7 @@ class DiarioAlimentareDB:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    @strumentato(metriche)
     def delete_entry(entry_id: int) -> Dict[str, Any]:
         """
         Elimina una voce dal diario alimentare
@@ -231,12 +990,8 @@ class DiarioAlimentareDB:
             Dict con risultato dell'operazione
         """
         try:
-            response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                       .delete()
-                       .eq("id", entry_id)
-                       .execute())
-            
-            if response.data:
+            if DiarioAlimentareDB.get_backend().delete([("id", "eq", entry_id)]):
+                DiarioAlimentareDB._aggiorna_cache(entry_id, None)
                 return {"success": True, "message": "Voce eliminata con successo"}
             else:
                 return {"success": False, "error": "Voce non trovata"}
@@ -245,66 +1000,578 @@ class DiarioAlimentareDB:
             return {"success": False, "error": str(e)}
     
     @staticmethod
-    def search_entries(search_term: str, field: str = "alimento") -> Dict[str, Any]:
+    def _prepara_riga(valori: Dict[str, Any], consenti_id: bool = False) -> Dict[str, Any]:
+        """Valida i campi di una voce e converte le date in stringhe ISO"""
+        ammessi = DiarioAlimentareDB.FIELDS + (CHIAVE_IDEMPOTENZA,) + (("id",) if consenti_id else ())
+        sconosciuti = [k for k in valori if k not in ammessi]
+        if sconosciuti:
+            raise ValueError(f"Campi sconosciuti: {', '.join(sconosciuti)}")
+        riga = dict(valori)
+        if isinstance(riga.get("data"), datetime):
+            riga["data"] = riga["data"].isoformat()
+        return riga
+    
+    @staticmethod
+    def _riga_nuova(riga: Dict[str, Any]) -> Dict[str, Any]:
+        """Tutti i campi di una voce da inserire, con la sua chiave di idempotenza"""
+        completa = {campo: riga.get(campo) for campo in DiarioAlimentareDB.FIELDS}
+        completa[CHIAVE_IDEMPOTENZA] = riga.get(CHIAVE_IDEMPOTENZA) or str(uuid.uuid4())
+        return completa
+    
+    @staticmethod
+    def _scrivi_a_blocchi(
+        righe: List[Any],
+        chunk_size: Optional[int],
+        scrivi_blocco: Callable[[List[Any]], List[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
         """
-        Cerca voci per termine di ricerca
+        Esegue una scrittura a blocchi restituendo un risultato per ogni riga
+        
+        Ogni blocco è una singola richiesta (e una singola transazione sul server).
+        Se un blocco fallisce viene ripetuto riga per riga, così l'errore resta
+        confinato alle righe che lo causano. scrivi_blocco riceve le righe e
+        restituisce un risultato {"success": ..., ...} per ciascuna.
+        """
+        chunk_size = chunk_size or DiarioAlimentareDB.BULK_CHUNK_SIZE
+        risultati: List[Dict[str, Any]] = []
+        for inizio in range(0, len(righe), chunk_size):
+            blocco = righe[inizio:inizio + chunk_size]
+            try:
+                risultati.extend(scrivi_blocco(blocco))
+            except Exception as e:
+                if len(blocco) == 1:
+                    risultati.append({"success": False, "error": str(e)})
+                    continue
+                for riga in blocco:
+                    try:
+                        risultati.extend(scrivi_blocco([riga]))
+                    except Exception as e:
+                        risultati.append({"success": False, "error": str(e)})
+        return risultati
+    
+    @staticmethod
+    def _risultato_bulk(risultati: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Riassume i risultati per riga nel formato {"success": ..., "error": ...}"""
+        errori = [{"index": i, "error": r["error"]} for i, r in enumerate(risultati) if not r["success"]]
+        riepilogo = {
+            "success": not errori,
+            "data": [r["data"] for r in risultati if r["success"] and "data" in r],
+            "count": len(risultati) - len(errori),
+            "results": risultati,
+            "errors": errori
+        }
+        if errori:
+            riepilogo["error"] = f"{len(errori)} voci su {len(risultati)} non riuscite"
+        return riepilogo
+    
+    @staticmethod
+    @strumentato(metriche)
+    def create_entries_bulk(entries: List[Dict[str, Any]], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Crea più voci, inviandole a blocchi di chunk_size righe per richiesta
+        
+        Args:
+            entries: Voci con gli stessi campi di create_entry (data obbligatoria)
+                ed eventualmente chiave_idempotenza (altrimenti ne viene assegnata una)
+            chunk_size: Righe per richiesta (default BULK_CHUNK_SIZE)
+            
+        Returns:
+            Dict con success (True se tutte le voci sono state create), data con
+            le voci create, count, results con un {"success": ..., "data"/"error": ...}
+            per ogni voce in ingresso ed errors con indice e messaggio dei fallimenti
+        """
+        preparate: List[Any] = []
+        for voce in entries:
+            try:
+                riga = DiarioAlimentareDB._prepara_riga(voce)
+                if not riga.get("data"):
+                    raise ValueError("Il campo data è obbligatorio")
+                # Stesse colonne per tutte le righe, come richiesto da PostgREST
+                preparate.append(DiarioAlimentareDB._riga_nuova(riga))
+            except ValueError as e:
+                preparate.append(e)
+        
+        def scrivi_blocco(blocco: List[Any]) -> List[Dict[str, Any]]:
+            valide = [riga for riga in blocco if not isinstance(riga, Exception)]
+            create = iter([])
+            if valide:
+                inserite = DiarioAlimentareDB.get_backend().insert(valide)
+                DiarioAlimentareDB._aggiorna_cache_bulk(scritte=inserite)
+                create = iter(inserite)
+            return [{"success": False, "error": str(riga)} if isinstance(riga, Exception)
+                    else {"success": True, "data": next(create)} for riga in blocco]
+        
+        try:
+            risultati = DiarioAlimentareDB._scrivi_a_blocchi(preparate, chunk_size, scrivi_blocco)
+            return DiarioAlimentareDB._risultato_bulk(risultati)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    def upsert_entries_bulk(entries: List[Dict[str, Any]], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Inserisce o aggiorna più voci in base all'id, a blocchi
+        
+        Le voci con id esistente vengono aggiornate nei soli campi indicati
+        (gli altri vengono riletti e riscritti invariati), quelle senza id o
+        con id nuovo vengono inserite.
+        
+        Args:
+            entries: Voci con i campi di create_entry ed eventualmente id
+            chunk_size: Righe per richiesta (default BULK_CHUNK_SIZE)
+            
+        Returns:
+            Dict nello stesso formato di create_entries_bulk
+        """
+        return DiarioAlimentareDB._upsert_bulk(entries, chunk_size, solo_esistenti=False)
+    
+    @staticmethod
+    @strumentato(metriche)
+    def update_entries_bulk(updates: List[Dict[str, Any]], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Aggiorna più voci esistenti, a blocchi
+        
+        Args:
+            updates: Dizionari con id e i campi da aggiornare (i None vengono ignorati)
+            chunk_size: Righe per richiesta (default BULK_CHUNK_SIZE)
+            
+        Returns:
+            Dict nello stesso formato di create_entries_bulk; le voci inesistenti
+            risultano fallite con "Voce non trovata"
+        """
+        pulite = [{k: v for k, v in voce.items() if v is not None} for voce in updates]
+        return DiarioAlimentareDB._upsert_bulk(pulite, chunk_size, solo_esistenti=True)
+    
+    @staticmethod
+    def _upsert_bulk(entries: List[Dict[str, Any]], chunk_size: Optional[int], solo_esistenti: bool) -> Dict[str, Any]:
+        """Implementazione comune di upsert_entries_bulk e update_entries_bulk"""
+        preparate: List[Any] = []
+        for voce in entries:
+            try:
+                riga = DiarioAlimentareDB._prepara_riga(voce, consenti_id=True)
+                if solo_esistenti and "id" not in riga:
+                    raise ValueError("Il campo id è obbligatorio")
+                if solo_esistenti and len(riga) == 1:
+                    raise ValueError("Nessun campo da aggiornare")
+                preparate.append(riga)
+            except ValueError as e:
+                preparate.append(e)
+        
+        def scrivi_blocco(blocco: List[Any]) -> List[Dict[str, Any]]:
+            risultati: List[Optional[Dict[str, Any]]] = [
+                {"success": False, "error": str(riga)} if isinstance(riga, Exception) else None for riga in blocco
+            ]
+            indici = [i for i, r in enumerate(risultati) if r is None]
+            
+            # Le voci esistenti vengono completate con i valori attuali: un upsert
+            # parziale violerebbe il vincolo not null su data, e così tutte le
+            # righe hanno le stesse colonne come richiesto da PostgREST
+            ids = list({blocco[i]["id"] for i in indici if "id" in blocco[i]})
+            esistenti: Dict[int, Dict[str, Any]] = {}
+            if ids:
+                righe = DiarioAlimentareDB.get_backend().select(
+                    ",".join(("id",) + DiarioAlimentareDB.FIELDS), [("id", "in", ids)]
+                )
+                esistenti = {voce["id"]: voce for voce in righe}
+            
+            con_id, senza_id = [], []
+            for i in indici:
+                riga = blocco[i]
+                if riga.get("id") in esistenti:
+                    con_id.append((i, {**esistenti[riga["id"]], **riga}))
+                elif solo_esistenti:
+                    risultati[i] = {"success": False, "error": "Voce non trovata"}
+                elif not riga.get("data"):
+                    risultati[i] = {"success": False, "error": "Il campo data è obbligatorio"}
+                else:
+                    completa = DiarioAlimentareDB._riga_nuova(riga)
+                    if "id" in riga:
+                        completa["id"] = riga["id"]
+                        con_id.append((i, completa))
+                    else:
+                        senza_id.append((i, completa))
+            
+            if con_id:
+                scritte = DiarioAlimentareDB.get_backend().upsert([riga for _, riga in con_id])
+                DiarioAlimentareDB._aggiorna_cache_bulk(scritte=scritte)
+                per_id = {voce["id"]: voce for voce in scritte}
+                for i, riga in con_id:
+                    risultati[i] = {"success": True, "data": per_id[riga["id"]]}
+            if senza_id:
+                inserite = DiarioAlimentareDB.get_backend().insert([riga for _, riga in senza_id])
+                DiarioAlimentareDB._aggiorna_cache_bulk(scritte=inserite)
+                for (i, _), voce in zip(senza_id, inserite):
+                    risultati[i] = {"success": True, "data": voce}
+            return risultati
+        
+        try:
+            risultati = DiarioAlimentareDB._scrivi_a_blocchi(preparate, chunk_size, scrivi_blocco)
+            return DiarioAlimentareDB._risultato_bulk(risultati)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    def delete_entries_bulk(entry_ids: List[int], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Elimina più voci, a blocchi di chunk_size id per richiesta
+        
+        Args:
+            entry_ids: ID delle voci da eliminare
+            chunk_size: ID per richiesta (default BULK_CHUNK_SIZE)
+            
+        Returns:
+            Dict nello stesso formato di create_entries_bulk; gli id inesistenti
+            risultano falliti con "Voce non trovata"
+        """
+        def scrivi_blocco(blocco: List[int]) -> List[Dict[str, Any]]:
+            eliminate = {voce["id"] for voce in DiarioAlimentareDB.get_backend().delete([("id", "in", blocco)])}
+            DiarioAlimentareDB._aggiorna_cache_bulk(eliminate=eliminate)
+            return [{"success": True, "message": "Voce eliminata con successo"} if entry_id in eliminate
+                    else {"success": False, "error": "Voce non trovata"} for entry_id in blocco]
+        
+        try:
+            risultati = DiarioAlimentareDB._scrivi_a_blocchi(list(entry_ids), chunk_size, scrivi_blocco)
+            return DiarioAlimentareDB._risultato_bulk(risultati)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def queue_create_entry(data: datetime, idempotency_key: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Accoda la creazione di una voce, da inviare al database in background
+        
+        Ritorna subito, anche senza connessione: la voce viene scritta nella
+        coda locale e inviata dal thread di invio. Riaccodare la stessa
+        idempotency_key (ad esempio un modulo inviato due volte) non crea
+        una seconda voce.
+        
+        Args:
+            data: Data e ora del pasto (obbligatorio)
+            idempotency_key: Chiave (uuid) della voce (default una chiave nuova)
+            **kwargs: Gli altri campi di create_entry
+            
+        Returns:
+            Dict con l'operazione accodata (seq, stato, chiave, ...) o errore
+        """
+        try:
+            valori = DiarioAlimentareDB._prepara_riga(
+                {k: v for k, v in {"data": data, **kwargs}.items() if v is not None}
+            )
+            operazione = coda.accoda(CREA, valori, chiave=idempotency_key or str(uuid.uuid4()),
+                                     utente=utente_corrente(), accesso=accesso_corrente())
+            invio_coda.sveglia()
+            return {"success": True, "data": operazione}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def queue_update_entry(
+        entry_id: Optional[int] = None,
+        base_updated_at: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Accoda la modifica di una voce, da inviare al database in background
+        
+        Args:
+            entry_id: ID della voce da aggiornare
+            base_updated_at: updated_at della voce quando è stata letta: se al
+                momento dell'invio è cambiato (voce modificata da un altro
+                dispositivo) la modifica resta in coda in conflitto
+            idempotency_key: Al posto di entry_id, la chiave della voce (ad
+                esempio di una creazione ancora in coda, che non ha un id)
+            **kwargs: Campi da aggiornare
+            
+        Returns:
+            Dict con l'operazione accodata o errore
+        """
+        try:
+            valori = DiarioAlimentareDB._prepara_riga({k: v for k, v in kwargs.items() if v is not None})
+            if not valori:
+                return {"success": False, "error": "Nessun campo da aggiornare"}
+            operazione = coda.accoda(AGGIORNA, valori, entry_id=entry_id, chiave=idempotency_key,
+                                     base=base_updated_at, utente=utente_corrente(), accesso=accesso_corrente())
+            invio_coda.sveglia()
+            return {"success": True, "data": operazione}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def queue_delete_entry(entry_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Accoda l'eliminazione di una voce, da inviare al database in background
+        
+        Args:
+            entry_id: ID della voce da eliminare
+            idempotency_key: Al posto di entry_id, la chiave della voce
+            
+        Returns:
+            Dict con l'operazione accodata o errore
+        """
+        try:
+            operazione = coda.accoda(ELIMINA, entry_id=entry_id, chiave=idempotency_key, utente=utente_corrente(),
+                                     accesso=accesso_corrente())
+            invio_coda.sveglia()
+            return {"success": True, "data": operazione}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    def flush_queue() -> Dict[str, Any]:
+        """
+        Invia al database le operazioni in coda, nell'ordine in cui sono state accodate
+        
+        Le creazioni e le eliminazioni consecutive partono in un'unica
+        richiesta per blocco di BULK_CHUNK_SIZE righe; le creazioni usano la
+        chiave di idempotenza, quindi un invio ripetuto dopo un'interruzione
+        non le duplica. Al primo errore transitorio (rete assente, timeout,
+        circuito aperto) l'invio si ferma e le operazioni restano in coda.
+        Una modifica di una voce eliminata o cambiata sul server dopo la
+        lettura va in conflitto; un'operazione rifiutata dal database va in
+        errore. In entrambi i casi le operazioni successive sulla stessa
+        voce attendono che venga ripetuta o scartata. Ogni operazione viene
+        inviata per conto dell'utente che l'ha accodata e con la sessione del
+        suo accesso, qualunque sia il contesto che chiama flush_queue.
+        
+        Returns:
+            Dict con il numero di operazioni inviate in "sent", quelle ancora
+            in attesa in "pending" e, se l'invio si è interrotto, l'errore
+        """
+        with _invio_lock:
+            inviate = 0
+            try:
+                while True:
+                    operazioni = coda.da_inviare(DiarioAlimentareDB.BULK_CHUNK_SIZE)
+                    if not operazioni:
+                        break
+                    inizio = 0
+                    while inizio < len(operazioni):
+                        # Creazioni ed eliminazioni consecutive dello stesso utente e accesso vengono raggruppate
+                        tipo, utente, accesso = (operazioni[inizio][c] for c in ("operazione", "user_id", "accesso"))
+                        fine = inizio + 1
+                        while (tipo != AGGIORNA and fine < len(operazioni) and operazioni[fine]["operazione"] == tipo
+                               and operazioni[fine]["user_id"] == utente and operazioni[fine]["accesso"] == accesso):
+                            fine += 1
+                        with come_utente(utente), con_accesso(accesso):
+                            riuscite = DiarioAlimentareDB._invia_gruppo(operazioni[inizio:fine])
+                        inviate += riuscite
+                        if riuscite < fine - inizio:
+                            # Un'operazione fallita blocca le successive sulla stessa voce:
+                            # si rilegge la coda per non inviarle fuori ordine
+                            break
+                        inizio = fine
+                return {"success": True, "sent": inviate, "pending": coda.conteggi()[IN_ATTESA]}
+                
+            except Exception as e:
+                return {"success": False, "error": str(e), "sent": inviate, "pending": coda.conteggi()[IN_ATTESA]}
+    
+    @staticmethod
+    def _invia_gruppo(operazioni: List[Dict[str, Any]]) -> int:
+        """
+        Invia operazioni consecutive dello stesso tipo, restituendo quante sono riuscite
+        
+        Gli errori transitori vengono rilanciati lasciando le operazioni in
+        attesa; se il database rifiuta un blocco, le operazioni vengono
+        ripetute una alla volta per isolare quella che causa l'errore.
+        """
+        backend = DiarioAlimentareDB.get_backend()
+        tipo = operazioni[0]["operazione"]
+        try:
+            if tipo == CREA:
+                righe = [DiarioAlimentareDB._riga_nuova({**op["valori"], CHIAVE_IDEMPOTENZA: op["chiave"]})
+                         for op in operazioni]
+                create = backend.insert(righe)
+                DiarioAlimentareDB._aggiorna_cache_bulk(scritte=create)
+            elif tipo == ELIMINA:
+                ids = [op["entry_id"] for op in operazioni if op["entry_id"] is not None]
+                chiavi = [op["chiave_voce"] for op in operazioni if op["entry_id"] is None]
+                eliminate = [voce["id"] for voce in backend.delete([("id", "in", ids)])] if ids else []
+                if chiavi:
+                    eliminate += [voce["id"] for voce in backend.delete([(CHIAVE_IDEMPOTENZA, "in", chiavi)])]
+                # Una voce già assente è comunque eliminata (ad esempio da un invio precedente)
+                DiarioAlimentareDB._aggiorna_cache_bulk(eliminate=eliminate)
+            else:
+                op = operazioni[0]
+                voce = ([("id", "eq", op["entry_id"])] if op["entry_id"] is not None
+                        else [(CHIAVE_IDEMPOTENZA, "eq", op["chiave_voce"])])
+                attuale = backend.select("*", voce)
+                if not attuale:
+                    coda.segna(op["seq"], CONFLITTO, "La voce è stata eliminata dal database")
+                    return 0
+                if op["base"] and not stesso_istante(attuale[0].get("updated_at"), op["base"]):
+                    coda.segna(op["seq"], CONFLITTO, "La voce è stata modificata da un altro dispositivo")
+                    return 0
+                aggiornate = backend.update(op["valori"], voce)
+                if aggiornate:
+                    DiarioAlimentareDB._aggiorna_cache(aggiornate[0]["id"], aggiornate[0])
+        except Exception as e:
+            if isinstance(e, CircuitoAperto) or classifica_errore(e) is not None:
+                coda.segna(operazioni[0]["seq"], IN_ATTESA, str(e))
+                raise
+            if len(operazioni) == 1:
+                coda.segna(operazioni[0]["seq"], ERRORE, str(e))
+                return 0
+            return sum(DiarioAlimentareDB._invia_gruppo([op]) for op in operazioni)
+        coda.completa([op["seq"] for op in operazioni])
+        return len(operazioni)
+    
+    @staticmethod
+    def get_queue_status() -> Dict[str, Any]:
+        """
+        Stato della coda delle scritture dell'utente corrente, per l'interfaccia
+        
+        Se ci sono operazioni in attesa (ad esempio rimaste da un'esecuzione
+        precedente) avvia il thread di invio.
+        
+        Returns:
+            Dict con le operazioni in coda in "data", i conteggi per stato in
+            "pending", "conflicts" ed "errors", l'istante dell'ultimo invio
+            (epoch) in "last_flush" e il suo esito in "last_result"
+        """
+        try:
+            utente = utente_corrente()
+            conteggi = coda.conteggi(utente)
+            if conteggi[IN_ATTESA]:
+                invio_coda.sveglia()
+            return {
+                "success": True,
+                "data": coda.operazioni(utente) if sum(conteggi.values()) else [],
+                "pending": conteggi[IN_ATTESA],
+                "conflicts": conteggi[CONFLITTO],
+                "errors": conteggi[ERRORE],
+                "last_flush": invio_coda.ultimo_invio,
+                "last_result": invio_coda.ultimo_esito
+            }
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def retry_queued(seq: int, overwrite: bool = False) -> Dict[str, Any]:
+        """
+        Rimette in attesa un'operazione in conflitto o rifiutata dell'utente corrente
+        
+        L'operazione verrà inviata con la sessione dell'accesso corrente, ad
+        esempio quella aperta dopo un riavvio dell'app.
+        
+        Args:
+            seq: Numero dell'operazione in coda
+            overwrite: Per una modifica in conflitto, la invia comunque
+                sovrascrivendo la versione del server
+        """
+        try:
+            if not coda.riprova(seq, sovrascrivi=overwrite, utente=utente_corrente(), accesso=accesso_corrente()):
+                return {"success": False, "error": "Operazione non trovata"}
+            invio_coda.sveglia()
+            return {"success": True}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    def discard_queued(seq: int) -> Dict[str, Any]:
+        """Toglie un'operazione dell'utente corrente dalla coda senza inviarla"""
+        try:
+            if not coda.scarta(seq, utente=utente_corrente()):
+                return {"success": False, "error": "Operazione non trovata"}
+            invio_coda.sveglia()
+            return {"success": True}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
+    def search_entries(
+        search_term: str,
+        field: Union[str, Sequence[str]] = "alimento",
+        limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Cerca voci per termine di ricerca, usando l'indice full-text del backend
+        
+        Con SQLite ogni parola del termine deve comparire nel campo, anche come
+        prefisso, parte di parola o con un refuso (ad esempio "pasat" trova
+        "pasta"); con Supabase (diario_cerca) il termine è confrontato per
+        intero, quindi più parole devono comparire vicine come in una frase.
+        Le voci sono ordinate per pertinenza e poi dalla più recente.
         
         Args:
             search_term: Termine da cercare
-            field: Campo in cui cercare (default: alimento)
+            field: Campo o campi in cui cercare, tra CAMPI_RICERCA (default: alimento)
+            limit: Numero massimo di voci (default SEARCH_LIMIT)
             
         Returns:
-            Dict con lista delle voci trovate o errore
+            Dict con lista delle voci trovate o errore; limit è il limite
+            applicato e truncated è True se altre voci corrispondono al termine
         """
         try:
-            response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                       .select("*")
-                       .ilike(field, f"%{search_term}%")
-                       .order("data", desc=True)
-                       .execute())
+            campi = (field,) if isinstance(field, str) else tuple(field)
+            non_validi = [campo for campo in campi if campo not in CAMPI_RICERCA]
+            if not campi or non_validi:
+                raise ValueError(
+                    f"Campo di ricerca non valido: {', '.join(non_validi) or '(nessuno)'} "
+                    f"(valori ammessi: {', '.join(CAMPI_RICERCA)})"
+                )
+            limite = limit or DiarioAlimentareDB.SEARCH_LIMIT
+            # Una voce in più dice se il limite ha escluso dei risultati
+            data = DiarioAlimentareDB.get_backend().search(search_term, campi, limite + 1)
+            troncata = len(data) > limite
+            data = data[:limite]
             
-            return {"success": True, "data": response.data, "count": len(response.data)}
+            return {"success": True, "data": data, "count": len(data), "limit": limite, "truncated": troncata}
                 
         except Exception as e:
             return {"success": False, "error": str(e)}
     
     @staticmethod
+    @strumentato(metriche)
+    @query_cache.cached
     def get_statistics() -> Dict[str, Any]:
         """
         Recupera statistiche generali del diario alimentare
         
+        Le statistiche sono calcolate dal backend: su Supabase dalla funzione
+        SQL diario_statistiche (vedi sql/002_statistiche.sql) con una sola
+        chiamata, quindi il trasferimento non dipende dalla dimensione della tabella.
+        
         Returns:
-            Dict con statistiche o errore
+            Dict con statistiche o errore. Oltre a total_entries, average_carbs
+            ed entries_with_carbs contiene media/min/max di carboidrati,
+            unita_insulina, glicemia_iniziale e glicemia_dop_2h e, in
+            per_pasto, conteggi e medie per tipo di pasto
         """
         try:
-            # Conta totale voci
-            total_response = supabase_client.table(DiarioAlimentareDB.TABLE_NAME).select("id", count="exact").execute()
-            total_entries = total_response.count
-            
-            # Conta voci per tipo di pasto
-            meals_response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                             .select("pasto", count="exact")
-                             .execute())
-            
-            # Calcola media carboidrati
-            carbs_response = (supabase_client.table(DiarioAlimentareDB.TABLE_NAME)
-                             .select("carboidrati")
-                             .not_.is_("carboidrati", "null")
-                             .execute())
-            
-            avg_carbs = 0
-            if carbs_response.data:
-                carbs_values = [entry["carboidrati"] for entry in carbs_response.data if entry["carboidrati"]]
-                avg_carbs = sum(carbs_values) / len(carbs_values) if carbs_values else 0
+            stats = DiarioAlimentareDB.get_backend().statistics()
+            stats["average_carbs"] = stats.get("average_carbs") or 0
+            stats.setdefault("per_pasto", {})
+            return {"success": True, "data": stats}
+                
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+
+    @staticmethod
+    @strumentato(metriche)
+    def get_checksum(id_min: Optional[int] = None, id_max: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Calcola sul server conteggio e somme di controllo delle voci
+        
+        Su Supabase usa la funzione SQL diario_checksum (vedi sql/003_checksum.sql):
+        serve a verificare una migrazione senza riscaricare i dati.
+        
+        Args:
+            id_min: Se indicato, solo voci con id >= id_min
+            id_max: Se indicato, solo voci con id <= id_max
             
-            return {
-                "success": True,
-                "data": {
-                    "total_entries": total_entries,
-                    "average_carbs": round(avg_carbs, 2),
-                    "entries_with_carbs": len(carbs_response.data) if carbs_response.data else 0
-                }
-            }
+        Returns:
+            Dict con count, sum_id, sum_quantita, sum_glicemia_iniziale,
+            sum_glicemia_dop_2h e count_carboidrati, o errore
+        """
+        try:
+            return {"success": True, "data": DiarioAlimentareDB.get_backend().checksum(id_min, id_max)}
                 
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -331,8 +1598,14 @@ def elimina_voce(entry_id: int):
     """Funzione di convenienza per eliminare una voce"""
     return DiarioAlimentareDB.delete_entry(entry_id)
 
-def cerca_voci(search_term: str, field="alimento"):
+def cerca_voci(search_term: str, field="alimento", limit=None):
     """Funzione di convenienza per cercare voci"""
-    return DiarioAlimentareDB.search_entries(search_term, field)
+    return DiarioAlimentareDB.search_entries(search_term, field, limit)
 
+def crea_voci_diario(voci, chunk_size=None):
+    """Funzione di convenienza per creare più voci"""
+    return DiarioAlimentareDB.create_entries_bulk(voci, chunk_size)
 
+def elimina_voci(entry_ids, chunk_size=None):
+    """Funzione di convenienza per eliminare più voci"""
+    return DiarioAlimentareDB.delete_entries_bulk(entry_ids, chunk_size)
@@ -0,0 +1,157 @@
+import io
+import threading
+from typing import Any, Dict, Hashable, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Formato -> (etichetta, estensione, tipo MIME)
+FORMATI = {
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "csv", "text/csv"),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet"),
+}
+
+NOME_FOGLIO = "Diario_Alimentare"
+
+# Righe lette dal DataFrame alla volta durante la scrittura in xlsx
+BLOCCO_EXCEL = 10_000
+
+
+def _cella(valore: Any) -> Any:
+    """Valore Python per xlsxwriter: None (cella vuota) per NA e NaT, datetime per i Timestamp"""
+    if valore is None or valore is pd.NA or valore is pd.NaT:
+        return None
+    if isinstance(valore, pd.Timestamp):
+        return valore.to_pydatetime()
+    if isinstance(valore, np.generic):
+        valore = valore.item()
+    if isinstance(valore, float) and valore != valore:
+        return None
+    return valore
+
+
+def _da_esportare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Riporta le colonne di un DataFrame compatto o arrow ai tipi che si esportano fedelmente
+
+    Un float32 convertito direttamente diventa ad esempio 12.300000190734863:
+    passando dalla sua rappresentazione testuale più breve si esporta 12.3,
+    il valore scritto nel diario. Dei formati arrow, le date tornano
+    datetime64 di numpy (che to_csv formatta con date_format) e i dizionari
+    categorie.
+    """
+    convertite = {}
+    for nome in df.columns:
+        serie = df[nome]
+        if getattr(serie.dtype, "numpy_dtype", None) == np.float32:
+            valori = serie.to_numpy(dtype=np.float32, na_value=np.nan)
+            convertite[nome] = pd.array(valori.astype(str).astype(np.float64), dtype="Float64")
+        elif isinstance(serie.dtype, pd.ArrowDtype):
+            import pyarrow as pa
+
+            tipo = serie.dtype.pyarrow_dtype
+            if pa.types.is_dictionary(tipo):
+                # pandas non rilegge da Parquet i dizionari pyarrow: si esportano come categorie
+                convertite[nome] = pa.array(serie).to_pandas().set_axis(serie.index)
+            elif pa.types.is_timestamp(tipo):
+                convertite[nome] = serie.astype(serie.dtype.numpy_dtype)
+    return df.assign(**convertite) if convertite else df
+
+
+def _excel(df: pd.DataFrame) -> bytes:
+    """
+    Scrive il DataFrame in xlsx con xlsxwriter in modalità constant_memory
+
+    Le righe vengono scritte in sequenza e scaricate su un file temporaneo,
+    quindi la memoria usata non cresce con il numero di righe.
+    """
+    import xlsxwriter
+
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm",
+        # Testo scritto così com'è: niente ricerca di URL o formule in ogni cella
+        "strings_to_urls": False,
+        "strings_to_formulas": False,
+    })
+    worksheet = workbook.add_worksheet(NOME_FOGLIO)
+    worksheet.write_row(0, 0, list(df.columns), workbook.add_format({"bold": True}))
+    for colonna, nome in enumerate(df.columns):
+        larghezza = 18 if pd.api.types.is_datetime64_any_dtype(df[nome]) else max(len(str(nome)) + 2, 10)
+        worksheet.set_column(colonna, colonna, larghezza)
+
+    # Righe lette a blocchi con itertuples, convertite cella per cella: non
+    # si costruiscono liste Python di intere colonne
+    for inizio in range(0, len(df), BLOCCO_EXCEL):
+        blocco = df.iloc[inizio:inizio + BLOCCO_EXCEL]
+        for riga, valori in enumerate(blocco.itertuples(index=False, name=None), start=inizio + 1):
+            worksheet.write_row(riga, 0, [_cella(valore) for valore in valori])
+
+    workbook.close()
+    return output.getvalue()
+
+
+def _csv(df: pd.DataFrame) -> bytes:
+    # utf-8-sig: Excel riconosce la codifica e mostra correttamente gli accenti
+    return df.to_csv(index=False, date_format="%Y-%m-%d %H:%M:%S").encode("utf-8-sig")
+
+
+def _parquet(df: pd.DataFrame) -> bytes:
+    output = io.BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()
+
+
+def esporta(df: pd.DataFrame, formato: str) -> bytes:
+    """
+    Converte il DataFrame nel formato indicato, senza modificarlo
+
+    Args:
+        df: DataFrame come restituito da voci_a_dataframe
+        formato: Una delle chiavi di FORMATI
+
+    Returns:
+        Il contenuto del file
+    """
+    scrittori = {"xlsx": _excel, "csv": _csv, "parquet": _parquet}
+    if formato not in scrittori:
+        raise ValueError(f"Formato non supportato: {formato}")
+    return scrittori[formato](_da_esportare(df))
+
+
+class CacheEsportazioni:
+    """
+    File esportati, indicizzati per versione dei dati e formato
+
+    Si conservano solo i file dell'ultima versione: quando i dati cambiano
+    i file precedenti non servono più e vengono scartati.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versione: Any = None
+        self._file: Dict[str, bytes] = {}
+
+    def get(self, versione: Hashable, formato: str) -> Tuple[bool, bytes]:
+        with self._lock:
+            if versione != self._versione or formato not in self._file:
+                return False, b""
+            return True, self._file[formato]
+
+    def esporta(self, versione: Hashable, df: pd.DataFrame, formato: str) -> bytes:
+        """Restituisce il file dalla cache, generandolo solo se manca"""
+        trovato, contenuto = self.get(versione, formato)
+        if trovato:
+            return contenuto
+        contenuto = esporta(df, formato)
+        with self._lock:
+            if versione != self._versione:
+                self._versione, self._file = versione, {}
+            self._file[formato] = contenuto
+        return contenuto
+
+
+# Cache condivisa da tutte le sessioni del processo
+cache_esportazioni = CacheEsportazioni()
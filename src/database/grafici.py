@@ -0,0 +1,207 @@
+import os
+from typing import Any, Callable, Hashable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .cache import QueryCache
+from .utenti import utente_corrente
+
+# Punti per serie di un grafico: più o meno la larghezza in pixel del
+# grafico, oltre la quale altri punti non si distinguono
+PUNTI_GRAFICO = int(os.getenv("DIARIO_GRAFICI_PUNTI", "800"))
+
+# Sotto questo numero di punti le linee mostrano anche i marcatori
+PUNTI_MARCATORI = 200
+
+
+def _numeri(valori: pd.Series) -> np.ndarray:
+    """Valori dell'asse x come float (le date in nanosecondi)"""
+    if pd.api.types.is_datetime64_any_dtype(valori):
+        return valori.astype("datetime64[ns]").to_numpy().astype(np.int64).astype(float)
+    return valori.to_numpy(dtype=float)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, punti: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: i punti che conservano la forma della serie
+
+    Primo e ultimo punto restano; gli altri vengono divisi in punti - 2
+    gruppi consecutivi e di ogni gruppo si tiene il punto che forma il
+    triangolo più grande con quello scelto nel gruppo precedente e con la
+    media del gruppo successivo. I picchi isolati sopravvivono, a
+    differenza di una media per gruppo.
+
+    Args:
+        x: Ascisse crescenti
+        y: Ordinate, senza NaN
+        punti: Numero di punti da tenere
+
+    Returns:
+        Indici dei punti scelti, crescenti
+    """
+    n = len(x)
+    if punti >= n or punti < 3:
+        return np.arange(n)
+    bordi = np.linspace(1, n - 1, punti - 1).astype(np.int64)
+    somme_x = np.concatenate(([0.0], np.cumsum(x)))
+    somme_y = np.concatenate(([0.0], np.cumsum(y)))
+    scelti = np.empty(punti, dtype=np.int64)
+    scelti[0], scelti[-1] = 0, n - 1
+    a = 0
+    for i in range(punti - 2):
+        inizio, fine = bordi[i], bordi[i + 1]
+        if i + 2 < len(bordi):
+            dopo, limite = bordi[i + 1], bordi[i + 2]
+            cx = (somme_x[limite] - somme_x[dopo]) / (limite - dopo)
+            cy = (somme_y[limite] - somme_y[dopo]) / (limite - dopo)
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+        xs, ys = x[inizio:fine], y[inizio:fine]
+        aree = np.abs((x[a] - cx) * (ys - y[a]) - (x[a] - xs) * (cy - y[a]))
+        a = inizio + int(np.argmax(aree))
+        scelti[i + 1] = a
+    return scelti
+
+
+def minmax(x: np.ndarray, y: np.ndarray, punti: int) -> np.ndarray:
+    """
+    Minimo e massimo di ogni intervallo: (punti - 2) // 2 intervalli di pari ampiezza su x
+
+    Più veloce di lttb e senza cicli, conserva esattamente l'inviluppo
+    della serie (utile per escursioni glicemiche e picchi). Con il primo e
+    l'ultimo punto gli indici restano al più punti.
+
+    Returns:
+        Indici dei punti scelti, crescenti (primo e ultimo compresi)
+    """
+    n = len(x)
+    if punti >= n or punti < 4:
+        return np.arange(n)
+    gruppi = (punti - 2) // 2
+    ampiezza = (x[-1] - x[0]) or 1.0
+    gruppo = np.minimum(((x - x[0]) / ampiezza * gruppi).astype(np.int64), gruppi - 1)
+    ordine = np.lexsort((y, gruppo))
+    ordinati = gruppo[ordine]
+    inizi = np.flatnonzero(np.r_[True, ordinati[1:] != ordinati[:-1]])
+    fini = np.r_[inizi[1:], n] - 1
+    return np.unique(np.concatenate(([0, n - 1], ordine[inizi], ordine[fini])))
+
+
+def riduci(
+    df: pd.DataFrame,
+    x: str,
+    colonne: Sequence[str],
+    punti: int = PUNTI_GRAFICO,
+    inizio: Optional[Any] = None,
+    fine: Optional[Any] = None,
+    gruppo: Optional[str] = None,
+    metodo: str = "lttb"
+) -> pd.DataFrame:
+    """
+    Righe di una serie temporale da disegnare, al più punti per serie
+
+    Le righe fuori da [inizio, fine] vengono scartate prima di ridurre,
+    così restringendo l'intervallo si vedono più dettagli. Ogni colonna (e
+    ogni valore di gruppo, ad esempio il pasto) è ridotta separatamente,
+    ignorando i valori mancanti; si tengono le righe scelte per almeno una.
+
+    Args:
+        df: Serie con la colonna x e le colonne da disegnare
+        x: Colonna dell'asse x (date o numeri)
+        colonne: Colonne dell'asse y
+        punti: Punti da tenere per colonna e gruppo
+        inizio, fine: Intervallo di x da mostrare (None: nessun limite)
+        gruppo: Colonna che divide le righe in serie distinte (un colore per serie)
+        metodo: "lttb" o "minmax"
+
+    Returns:
+        Le righe scelte di df, ordinate per x
+    """
+    scegli = {"lttb": lttb, "minmax": minmax}.get(metodo)
+    if scegli is None:
+        raise ValueError(f"Metodo non valido: {metodo}")
+    if inizio is not None:
+        df = df[df[x] >= inizio]
+    if fine is not None:
+        df = df[df[x] <= fine]
+    df = df.sort_values(x, kind="stable")
+    valori_x = _numeri(df[x])
+    serie = [np.arange(len(df))] if gruppo is None else [
+        posizioni for posizioni in pd.Series(np.arange(len(df))).groupby(df[gruppo].to_numpy(), observed=True)
+        .indices.values()
+    ]
+    scelte = []
+    for posizioni in serie:
+        for colonna in colonne:
+            valori_y = df[colonna].to_numpy(dtype=float, na_value=np.nan)[posizioni]
+            presenti = posizioni[~np.isnan(valori_y)]
+            scelte.append(presenti[scegli(valori_x[presenti], valori_y[~np.isnan(valori_y)], punti)])
+    if not scelte:
+        return df
+    return df.iloc[np.unique(np.concatenate(scelte))]
+
+
+def raggruppa(
+    df: pd.DataFrame,
+    x: str,
+    colonne: Sequence[str],
+    punti: int = PUNTI_GRAFICO,
+    inizio: Optional[Any] = None,
+    fine: Optional[Any] = None,
+    gruppo: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Somma le righe in al più punti intervalli consecutivi di x, per i grafici a barre
+
+    A differenza di riduci non scarta righe: i totali di ogni intervallo
+    restano corretti. Se le righe sono già poche vengono restituite così
+    come sono (dopo il filtro sull'intervallo).
+
+    Returns:
+        DataFrame con x (inizio dell'intervallo), gruppo se indicato e le colonne sommate
+    """
+    if inizio is not None:
+        df = df[df[x] >= inizio]
+    if fine is not None:
+        df = df[df[x] <= fine]
+    valori_x = np.unique(df[x].to_numpy())
+    if len(valori_x) <= punti:
+        return df
+    # Intervalli con lo stesso numero di valori distinti di x, che iniziano
+    # su un valore presente (ad esempio il primo giorno di una settimana)
+    passo = -(-len(valori_x) // punti)
+    inizi = valori_x[::passo]
+    intervallo = inizi[np.searchsorted(inizi, df[x].to_numpy(), side="right") - 1]
+    chiavi = [pd.Series(intervallo, index=df.index, name=x)]
+    if gruppo is not None:
+        chiavi.append(df[gruppo])
+    return df.groupby(chiavi, observed=True, sort=True)[list(colonne)].sum(min_count=1).reset_index()
+
+
+# Figure già costruite, per utente: la chiave comprende la versione dei dati,
+# quindi una figura viene ricostruita solo quando i dati (o i parametri) cambiano
+cache_figure = QueryCache(
+    ttl=float(os.getenv("DIARIO_GRAFICI_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("DIARIO_GRAFICI_CACHE", "32")),
+    partizione=utente_corrente,
+    max_partizioni=int(os.getenv("DIARIO_MAX_UTENTI", "50")),
+)
+
+
+def figura_in_cache(chiave: Hashable, versione: Hashable, crea: Callable[[], Any]) -> Any:
+    """
+    Restituisce la figura dalla cache, costruendola con crea() solo se manca
+
+    Args:
+        chiave: Grafico e parametri che lo determinano (granularità, intervallo, ...)
+        versione: Versione dei dati da cui è costruito
+        crea: Funzione che costruisce la figura
+
+    La figura restituita è condivisa: non va modificata dopo averla ottenuta.
+    """
+    trovata, figura = cache_figure.get((chiave, versione))
+    if not trovata:
+        figura = crea()
+        cache_figure.set((chiave, versione), figura)
+    return figura
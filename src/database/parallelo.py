@@ -0,0 +1,80 @@
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_FINE = object()
+
+
+class _Errore:
+    def __init__(self, eccezione: BaseException):
+        self.eccezione = eccezione
+
+
+def unisci_in_ordine(
+    produttori: List[Callable[[], Iterable[T]]],
+    max_workers: int = 4,
+    prefetch: int = 2
+) -> Iterator[T]:
+    """
+    Esegue più produttori in parallelo e ne restituisce gli elementi in ordine
+
+    Ogni produttore (ad esempio le pagine di uno shard di date) gira in un
+    thread del pool e deposita i risultati in una coda limitata a prefetch
+    elementi: quando la coda è piena il thread si ferma finché il consumatore
+    non la svuota (backpressure). Il consumatore legge i produttori nell'ordine
+    della lista, quindi l'ordine complessivo è quello dei produttori concatenati.
+
+    Args:
+        produttori: Funzioni senza argomenti che restituiscono un iterabile
+        max_workers: Numero massimo di produttori eseguiti contemporaneamente
+        prefetch: Elementi che ogni produttore può accumulare in anticipo
+
+    Yields:
+        Gli elementi di tutti i produttori, nell'ordine della lista
+
+    Raises:
+        La prima eccezione sollevata da un produttore
+    """
+    stop = threading.Event()
+    code = [queue.Queue(maxsize=max(1, prefetch)) for _ in produttori]
+
+    def metti(coda: queue.Queue, elemento) -> bool:
+        while not stop.is_set():
+            try:
+                coda.put(elemento, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def esegui(produttore: Callable[[], Iterable[T]], coda: queue.Queue) -> None:
+        try:
+            for elemento in produttore():
+                if not metti(coda, elemento):
+                    return
+            metti(coda, _FINE)
+        except BaseException as e:
+            metti(coda, _Errore(e))
+
+    # I produttori partono in ordine (FIFO): quello che il consumatore sta
+    # leggendo è sempre già in esecuzione, quindi non ci sono stalli
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        for produttore, coda in zip(produttori, code):
+            # Ogni produttore vede le variabili di contesto del chiamante (ad esempio l'utente)
+            executor.submit(contextvars.copy_context().run, esegui, produttore, coda)
+        for coda in code:
+            while True:
+                elemento = coda.get()
+                if elemento is _FINE:
+                    break
+                if isinstance(elemento, _Errore):
+                    raise elemento.eccezione
+                yield elemento
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
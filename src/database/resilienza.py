@@ -0,0 +1,355 @@
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .backend import CHIAVE_IDEMPOTENZA, DiarioBackend, Filtro
+
+# Esito di un errore: la richiesta non è partita (ripetibile sempre), potrebbe
+# essere stata eseguita (ripetibile solo se idempotente) oppure è definitivo
+NON_INVIATA = "non_inviata"
+INCERTA = "incerta"
+
+# Codici di errore transitori: stato HTTP, errori di PostgREST sulla
+# connessione al database e classi SQLSTATE di connessione, risorse e conflitti
+CODICI_TRANSITORI = {
+    "408", "429", "500", "502", "503", "504",
+    "PGRST000", "PGRST001", "PGRST002", "PGRST003",
+    "40001", "40P01", "53300", "57P01", "57P02", "57P03",
+}
+
+# Chiavi controllate per richiesta durante la riconciliazione degli inserimenti
+BLOCCO_RICONCILIAZIONE = 100
+
+
+class CircuitoAperto(Exception):
+    """Il database ha fallito troppe volte di seguito: le chiamate vengono rifiutate subito"""
+
+
+class TempoScaduto(TimeoutError):
+    """La chiamata al backend non ha risposto entro il timeout"""
+
+
+def classifica_errore(errore: BaseException) -> Optional[str]:
+    """
+    Decide se un errore del backend è transitorio
+
+    Returns:
+        NON_INVIATA se la richiesta non ha raggiunto il database, INCERTA se
+        potrebbe essere stata eseguita (timeout di lettura, connessione caduta,
+        errore 5xx), None se l'errore è definitivo (richiesta non valida,
+        vincolo violato, ...)
+    """
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+    if httpx is not None:
+        if isinstance(errore, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return NON_INVIATA
+        if isinstance(errore, httpx.TransportError):
+            return INCERTA
+    if isinstance(errore, ConnectionRefusedError):
+        return NON_INVIATA
+    if isinstance(errore, (TimeoutError, ConnectionError)):
+        return INCERTA
+    if isinstance(errore, sqlite3.OperationalError):
+        # Con il database bloccato da un altro processo la transazione non è partita
+        messaggio = str(errore)
+        return NON_INVIATA if "locked" in messaggio or "busy" in messaggio else None
+    codice = str(getattr(errore, "code", "") or "")
+    if codice in CODICI_TRANSITORI or codice.startswith("08"):
+        return INCERTA
+    return None
+
+
+def _duplicato(errore: BaseException) -> bool:
+    """Violazione del vincolo di unicità sulla chiave di idempotenza"""
+    if str(getattr(errore, "code", "") or "") == "23505":
+        return True
+    return isinstance(errore, sqlite3.IntegrityError) and CHIAVE_IDEMPOTENZA in str(errore)
+
+
+class Interruttore:
+    """
+    Circuit breaker condiviso dalle chiamate al backend
+
+    Dopo soglia errori transitori consecutivi il circuito si apre e per
+    pausa secondi ogni chiamata fallisce subito con CircuitoAperto, invece
+    di attendere timeout e tentativi. Trascorsa la pausa passa una sola
+    chiamata di prova: se riesce il circuito si chiude, altrimenti si riapre.
+    """
+
+    def __init__(self, soglia: int = 5, pausa: float = 30.0):
+        self.soglia = soglia
+        self.pausa = pausa
+        self._lock = threading.Lock()
+        self._errori = 0
+        self._aperto_fino: Optional[float] = None
+        self._prova_in_corso = False
+
+    def consenti(self) -> None:
+        """Solleva CircuitoAperto se la chiamata non può partire"""
+        if self.soglia <= 0:
+            return
+        with self._lock:
+            if self._aperto_fino is None:
+                return
+            attesa = self._aperto_fino - time.monotonic()
+            if attesa > 0 or self._prova_in_corso:
+                raise CircuitoAperto(
+                    f"Database non raggiungibile, nuovo tentativo tra {max(attesa, 0):.0f} s"
+                )
+            self._prova_in_corso = True
+
+    def successo(self) -> None:
+        with self._lock:
+            self._errori = 0
+            self._aperto_fino = None
+            self._prova_in_corso = False
+
+    def fallimento(self) -> bool:
+        """Registra un errore transitorio; True se il circuito si è appena aperto"""
+        with self._lock:
+            self._errori += 1
+            riapri = self._prova_in_corso or (self._aperto_fino is None and self._errori >= self.soglia)
+            self._prova_in_corso = False
+            if riapri and self.soglia > 0:
+                self._aperto_fino = time.monotonic() + self.pausa
+            return riapri
+
+    def stato(self) -> Dict[str, Any]:
+        """Dict con stato ("chiuso", "aperto" o "prova"), errori consecutivi e secondi alla riapertura"""
+        with self._lock:
+            if self._aperto_fino is None:
+                stato = "chiuso"
+            elif self._prova_in_corso or self._aperto_fino <= time.monotonic():
+                stato = "prova"
+            else:
+                stato = "aperto"
+            attesa = max(self._aperto_fino - time.monotonic(), 0) if self._aperto_fino else 0
+            return {"stato": stato, "errori": self._errori, "riprova_tra_s": attesa}
+
+
+class BackendResiliente(DiarioBackend):
+    """
+    Backend che aggiunge timeout, tentativi ripetuti e circuit breaker a un altro backend
+
+    Ogni primitiva viene eseguita in un thread di servizio e abbandonata
+    dopo timeout secondi, così una connessione bloccata non ferma lo script
+    (i backend con timeout_proprio, come il client Supabase creato da
+    from_env, applicano il timeout da sé e vengono chiamati direttamente).
+    Gli errori transitori vengono ripetuti fino a tentativi volte, con attesa
+    esponenziale e jitter casuale:
+
+    - letture, update (riscrive gli stessi valori) e upsert per id sono
+      idempotenti e si ripetono sempre;
+    - gli insert con CHIAVE_IDEMPOTENZA, se l'esito è incerto, vengono
+      riconciliati: si leggono le righe con quelle chiavi già scritte e si
+      inseriscono solo le mancanti, quindi un pasto non viene mai duplicato;
+    - delete e insert senza chiave si ripetono solo se la richiesta non è
+      partita.
+    """
+
+    def __init__(
+        self,
+        backend: DiarioBackend,
+        timeout: float = 15.0,
+        tentativi: int = 3,
+        attesa_base: float = 0.2,
+        attesa_massima: float = 2.0,
+        interruttore: Optional[Interruttore] = None,
+        metriche=None
+    ):
+        """
+        Args:
+            backend: Backend da proteggere
+            timeout: Secondi di attesa massima per una chiamata (0 senza limite)
+            tentativi: Tentativi complessivi per chiamata (1 = nessuna ripetizione)
+            attesa_base: Attesa prima del secondo tentativo, raddoppiata ai successivi
+            attesa_massima: Limite dell'attesa tra due tentativi
+            interruttore: Circuit breaker (default Interruttore())
+            metriche: Registro Metriche in cui contare ripetizioni, timeout e rifiuti
+        """
+        self.protetto = backend
+        self.nome = backend.nome
+        self.timeout_proprio = True
+        self.timeout = timeout
+        self.tentativi = max(tentativi, 1)
+        self.attesa_base = attesa_base
+        self.attesa_massima = attesa_massima
+        self.interruttore = interruttore or Interruttore()
+        self.metriche = metriche
+        self._esecutore: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, backend: DiarioBackend, metriche=None) -> "BackendResiliente":
+        """
+        Legge DIARIO_TIMEOUT, DIARIO_TENTATIVI, DIARIO_CIRCUITO_SOGLIA e DIARIO_CIRCUITO_PAUSA
+        """
+        return cls(
+            backend,
+            timeout=float(os.getenv("DIARIO_TIMEOUT", "15")),
+            tentativi=int(os.getenv("DIARIO_TENTATIVI", "3")),
+            interruttore=Interruttore(
+                soglia=int(os.getenv("DIARIO_CIRCUITO_SOGLIA", "5")),
+                pausa=float(os.getenv("DIARIO_CIRCUITO_PAUSA", "30")),
+            ),
+            metriche=metriche,
+        )
+
+    def _conta(self, evento: str) -> None:
+        if self.metriche is not None:
+            self.metriche.conta(f"resilienza.{evento}")
+
+    def _con_timeout(self, funzione: Callable[[], Any]) -> Any:
+        if not self.timeout or self.protetto.timeout_proprio:
+            return funzione()
+        with self._lock:
+            if self._esecutore is None:
+                self._esecutore = ThreadPoolExecutor(max_workers=16, thread_name_prefix="diario-backend")
+        # Il contesto viene copiato, così le misure aperte dal chiamante vedono i byte ricevuti
+        futuro = self._esecutore.submit(contextvars.copy_context().run, funzione)
+        try:
+            return futuro.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            futuro.cancel()
+            self._conta("timeout")
+            raise TempoScaduto(f"Il database non ha risposto entro {self.timeout:g} s") from None
+
+    def _attesa(self, tentativo: int) -> float:
+        # Full jitter: attesa casuale tra 0 e il limite esponenziale
+        return random.uniform(0, min(self.attesa_massima, self.attesa_base * 2 ** tentativo))
+
+    def _esegui(
+        self,
+        funzione: Callable[[], Any],
+        idempotente: bool = True,
+        riconcilia: Optional[Callable[[], Any]] = None
+    ) -> Any:
+        """
+        Esegue la chiamata con circuit breaker, timeout e tentativi
+
+        Args:
+            funzione: Chiamata al backend
+            idempotente: Se False, dopo un esito incerto non viene ripetuta
+            riconcilia: Chiamata da usare al posto di funzione dopo un esito incerto
+        """
+        chiamata = funzione
+        for tentativo in range(self.tentativi):
+            try:
+                self.interruttore.consenti()
+            except CircuitoAperto:
+                self._conta("rifiutate")
+                raise
+            try:
+                risultato = self._con_timeout(chiamata)
+            except Exception as errore:
+                esito = classifica_errore(errore)
+                if esito is None:
+                    # Il database ha risposto: l'errore non riguarda la sua disponibilità
+                    self.interruttore.successo()
+                    raise
+                if self.interruttore.fallimento():
+                    self._conta("circuito_aperto")
+                ultimo = tentativo == self.tentativi - 1
+                if ultimo or (esito == INCERTA and not idempotente and riconcilia is None):
+                    raise
+                if esito == INCERTA and riconcilia is not None:
+                    chiamata = riconcilia
+                self._conta("ripetute")
+                time.sleep(self._attesa(tentativo))
+                continue
+            self.interruttore.successo()
+            return risultato
+
+    def _inserisci_mancanti(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Inserisce solo le righe la cui chiave di idempotenza non è già presente
+
+        Restituisce le righe nell'ordine di quelle richieste, prese dal
+        database se già scritte da un tentativo precedente.
+        """
+        self._conta("riconciliazioni")
+        chiavi = [riga[CHIAVE_IDEMPOTENZA] for riga in righe]
+        for _ in range(self.tentativi):
+            scritte: Dict[str, Dict[str, Any]] = {}
+            for inizio in range(0, len(chiavi), BLOCCO_RICONCILIAZIONE):
+                blocco = chiavi[inizio:inizio + BLOCCO_RICONCILIAZIONE]
+                for riga in self.protetto.select("*", [(CHIAVE_IDEMPOTENZA, "in", blocco)]):
+                    scritte[str(riga[CHIAVE_IDEMPOTENZA])] = riga
+            mancanti = [riga for riga in righe if str(riga[CHIAVE_IDEMPOTENZA]) not in scritte]
+            try:
+                for riga in self.protetto.insert(mancanti) if mancanti else []:
+                    scritte[str(riga[CHIAVE_IDEMPOTENZA])] = riga
+            except Exception as errore:
+                # Il tentativo precedente ha scritto nel frattempo: si rilegge
+                if _duplicato(errore):
+                    continue
+                raise
+            return [scritte[str(chiave)] for chiave in chiavi]
+        raise TempoScaduto("Impossibile riconciliare l'inserimento con le righe già scritte")
+
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.protetto, nome)
+
+    def select(self, *args, **kwargs):
+        return self._esegui(lambda: self.protetto.select(*args, **kwargs))
+
+    def count(self, *args, **kwargs):
+        return self._esegui(lambda: self.protetto.count(*args, **kwargs))
+
+    def insert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        con_chiave = bool(righe) and all(riga.get(CHIAVE_IDEMPOTENZA) for riga in righe)
+        riconcilia = (lambda: self._inserisci_mancanti(righe)) if con_chiave else None
+        try:
+            return self._esegui(lambda: self.protetto.insert(righe), idempotente=False, riconcilia=riconcilia)
+        except Exception as errore:
+            # Chiavi già usate (ad esempio un modulo inviato due volte): si
+            # restituiscono le righe esistenti invece di un errore
+            if riconcilia is not None and _duplicato(errore):
+                return self._esegui(riconcilia)
+            raise
+
+    def upsert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        idempotente = all(riga.get("id") is not None for riga in righe)
+        return self._esegui(lambda: self.protetto.upsert(righe), idempotente=idempotente)
+
+    def update(self, valori: Dict[str, Any], filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        return self._esegui(lambda: self.protetto.update(valori, filtri))
+
+    def delete(self, filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        # Ripetuta dopo un esito incerto restituirebbe solo le righe rimaste
+        return self._esegui(lambda: self.protetto.delete(filtri), idempotente=False)
+
+    def search(self, *args, **kwargs):
+        return self._esegui(lambda: self.protetto.search(*args, **kwargs))
+
+    def statistics(self, *args, **kwargs):
+        return self._esegui(lambda: self.protetto.statistics(*args, **kwargs))
+
+    def summary(self, *args, **kwargs):
+        return self._esegui(lambda: self.protetto.summary(*args, **kwargs))
+
+    def checksum(self, *args, **kwargs):
+        return self._esegui(lambda: self.protetto.checksum(*args, **kwargs))
+
+    def subscribe(self, *args, **kwargs):
+        # La sottoscrizione gestisce da sé le riconnessioni e ne informa con stato
+        return self.protetto.subscribe(*args, **kwargs)
+
+    def now(self):
+        return self._esegui(lambda: self.protetto.now())
+
+    def sign_in(self, *args, **kwargs):
+        # Credenziali errate non sono un guasto del database: niente tentativi né circuito
+        return self.protetto.sign_in(*args, **kwargs)
+
+    def sign_out(self):
+        return self.protetto.sign_out()
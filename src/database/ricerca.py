@@ -0,0 +1,131 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+# Campi in cui si può cercare testo (gli unici indicizzati)
+CAMPI_RICERCA = ("alimento", "note")
+
+# Somiglianza minima tra trigrammi perché una parola sia considerata un refuso
+SOGLIA_SIMILARITA = 0.3
+
+# Parole candidate considerate per ogni parola cercata
+MASSIMO_CANDIDATI = 20
+
+_PAROLA = re.compile(r"[^\W_]+")
+
+
+def parole(testo: Optional[str]) -> List[str]:
+    """
+    Divide il testo in parole minuscole e senza accenti
+
+    Segue le regole del tokenizer unicode61 di SQLite con remove_diacritics,
+    così le parole coincidono con quelle dell'indice full-text.
+    """
+    if not testo:
+        return []
+    testo = unicodedata.normalize("NFKD", testo.lower())
+    testo = "".join(c for c in testo if not unicodedata.combining(c))
+    return _PAROLA.findall(testo)
+
+
+def trigrammi(parola: str) -> Set[str]:
+    """Trigrammi della parola con gli spazi di bordo usati da pg_trgm"""
+    parola = f"  {parola} "
+    return {parola[i:i + 3] for i in range(len(parola) - 2)}
+
+
+def punteggio(cercata: str, parola: str, comuni: Optional[int] = None) -> float:
+    """
+    Quanto la parola corrisponde a quella cercata, da 0 a 1
+
+    Uguale vale 1, un prefisso 0.9, una sottostringa 0.8; altrimenti la
+    somiglianza tra trigrammi (come similarity di pg_trgm), che tollera i
+    refusi.
+
+    Args:
+        comuni: Numero di trigrammi in comune, se già noto
+    """
+    if parola == cercata:
+        return 1.0
+    if parola.startswith(cercata):
+        return 0.9
+    if cercata in parola:
+        return 0.8
+    a, b = trigrammi(cercata), trigrammi(parola)
+    if comuni is None:
+        comuni = len(a & b)
+    return comuni / (len(a) + len(b) - comuni)
+
+
+def punteggio_testo(cercate: Sequence[str], testi: Iterable[Optional[str]]) -> float:
+    """Somma, per ogni parola cercata, del miglior punteggio tra le parole dei testi"""
+    presenti = {p for testo in testi for p in parole(testo)}
+    if not presenti:
+        return 0.0
+    return sum(max(punteggio(cercata, parola) for parola in presenti) for cercata in cercate)
+
+
+class IndiceParole:
+    """
+    Vocabolario dei campi di ricerca con un indice per trigrammi
+
+    Per ogni campo tiene quante voci contengono ciascuna parola; i trigrammi
+    puntano alle parole che li contengono, così per trovare i candidati di
+    una parola cercata (anche con refusi) si guardano solo le parole che
+    hanno almeno un trigramma in comune, non tutto il vocabolario.
+    """
+
+    def __init__(self):
+        self.voci: Dict[str, Counter] = {campo: Counter() for campo in CAMPI_RICERCA}
+        self._trigrammi: Dict[str, Set[str]] = {}
+
+    def aggiorna(self, delta: Dict[Tuple[str, str], int]) -> None:
+        """Applica le variazioni {(campo, parola): voci} prodotte da conta_parole"""
+        for (campo, parola), n in delta.items():
+            conteggi = self.voci[campo]
+            conteggi[parola] += n
+            if conteggi[parola] <= 0:
+                del conteggi[parola]
+                if not any(parola in self.voci[c] for c in CAMPI_RICERCA):
+                    for trigramma in trigrammi(parola):
+                        self._trigrammi.get(trigramma, set()).discard(parola)
+            elif n > 0:
+                for trigramma in trigrammi(parola):
+                    self._trigrammi.setdefault(trigramma, set()).add(parola)
+
+    def candidati(
+        self,
+        cercata: str,
+        campi: Sequence[str] = CAMPI_RICERCA,
+        massimo: int = MASSIMO_CANDIDATI
+    ) -> List[Tuple[str, float]]:
+        """
+        Parole dei campi indicati che corrispondono a quella cercata
+
+        Returns:
+            Fino a massimo coppie (parola, punteggio), dal punteggio più alto
+        """
+        comuni: Counter = Counter()
+        for trigramma in trigrammi(cercata):
+            comuni.update(self._trigrammi.get(trigramma, ()))
+        trovate = []
+        for parola, n in comuni.items():
+            if not any(parola in self.voci[campo] for campo in campi):
+                continue
+            valore = punteggio(cercata, parola, n)
+            if valore >= SOGLIA_SIMILARITA:
+                trovate.append((parola, valore))
+        # A parità di punteggio prima le parole più frequenti
+        trovate.sort(key=lambda t: (-t[1], -sum(self.voci[c][t[0]] for c in campi), t[0]))
+        return trovate[:massimo]
+
+
+def conta_parole(righe: Iterable[Dict], segno: int = 1) -> Counter:
+    """Variazione del vocabolario {(campo, parola): voci} per le righe indicate"""
+    delta: Counter = Counter()
+    for riga in righe:
+        for campo in CAMPI_RICERCA:
+            for parola in set(parole(riga.get(campo))):
+                delta[(campo, parola)] += segno
+    return delta
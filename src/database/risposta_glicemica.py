@@ -0,0 +1,431 @@
+import threading
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .aggregati import FASCIA_TEMPO
+from .conversione import date_locali
+
+# Campi numerici tenuti in colonna, uno per array
+CAMPI = (
+    "carboidrati", "glicemia_iniziale", "glicemia_dop_2h",
+    "unita_insulina", "dosi_correttive", "tempo_dosi_correttive"
+)
+
+# Intervallo della glicemia dopo 2 ore considerato in target (mg/dl)
+TARGET = (70, 180)
+
+# Ampiezza delle fasce del rapporto carboidrati/insulina (g per unità) e
+# fascia oltre la quale i rapporti vengono raggruppati
+FASCIA_RAPPORTO = 2.0
+RAPPORTO_MASSIMO = 30.0
+
+# Misure disponibili per le tendenze
+MISURE_TENDENZA = {
+    "variazione": "Variazione Glicemia",
+    "glicemia_dop_2h": "Glicemia dopo 2h",
+    "rapporto": "Rapporto Carboidrati/Insulina",
+}
+
+QUARTILI = (0.25, 0.5, 0.75)
+
+
+def _quantili(valori: np.ndarray, gruppi: np.ndarray, n_gruppi: int, q: Sequence[float]) -> np.ndarray:
+    """
+    Quantili dei valori di ogni gruppo (interpolazione lineare, come np.quantile)
+
+    I valori vengono ordinati una volta sola e poi, in modo stabile, per
+    gruppo: i quantili di ogni gruppo si leggono agli indici ricavati
+    dall'inizio e dalla dimensione del gruppo.
+
+    Returns:
+        Matrice n_gruppi x len(q), NaN per i gruppi vuoti
+    """
+    ordine = np.argsort(valori)
+    ordinati = valori[ordine][np.argsort(gruppi[ordine], kind="stable")]
+    conteggi = np.bincount(gruppi, minlength=n_gruppi)
+    inizi = np.concatenate(([0], np.cumsum(conteggi)[:-1]))
+    risultato = np.full((n_gruppi, len(q)), np.nan)
+    pieni = conteggi > 0
+    for j, quota in enumerate(q):
+        posizione = quota * (conteggi[pieni] - 1)
+        sotto = np.floor(posizione).astype(np.int64)
+        sopra = np.minimum(sotto + 1, conteggi[pieni] - 1)
+        peso = posizione - sotto
+        a = ordinati[inizi[pieni] + sotto]
+        b = ordinati[inizi[pieni] + sopra]
+        risultato[pieni, j] = a + (b - a) * peso
+    return risultato
+
+
+def _medie(somme: np.ndarray, conteggi: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(conteggi > 0, somme / conteggi, np.nan)
+
+
+class RispostaGlicemica:
+    """
+    Analisi della risposta glicemica ai pasti, vettoriale su tutto il diario
+
+    Le voci sono tenute in array NumPy, una colonna per campo, aggiornati a
+    ogni cambiamento dello snapshot: un inserimento occupa una posizione
+    libera, una modifica riscrive la sua e un'eliminazione la libera. Le
+    analisi (variazione della glicemia dopo il pasto, rapporti carboidrati/
+    insulina, efficacia delle correzioni e tendenze su finestre mobili)
+    lavorano sugli array interi con bincount e un solo ordinamento per i
+    quantili, senza cicli sulle righe. I risultati restano in memoria fino
+    al cambiamento successivo.
+
+    Lo snapshot chiama aggiorna() a ogni cambiamento e azzera() quando
+    viene svuotato o ricaricato.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.azzera()
+
+    def azzera(self) -> None:
+        """Scarta tutte le voci"""
+        with self._lock:
+            self._posizioni: Dict[int, int] = {}
+            self._libere: List[int] = []
+            self._n = 0
+            self._valide = np.zeros(0, dtype=bool)
+            self._giorni = np.zeros(0, dtype=np.int64)
+            self._pasti = np.zeros(0, dtype=np.int16)
+            self._campi = {campo: np.zeros(0) for campo in CAMPI}
+            # Nomi dei pasti, nell'ordine dei codici usati in _pasti
+            self._nomi_pasti: List[str] = []
+            self._codici_pasti: Dict[str, int] = {}
+            self._risultati: Dict[Tuple, Any] = {}
+            self.versione = getattr(self, "versione", 0) + 1
+
+    def __len__(self) -> int:
+        return len(self._posizioni)
+
+    def _capacita(self, richiesta: int) -> None:
+        capacita = len(self._valide)
+        if richiesta <= capacita:
+            return
+        nuova = max(richiesta, capacita * 2, 1024)
+
+        def estendi(array: np.ndarray, riempimento: Any) -> np.ndarray:
+            esteso = np.full(nuova, riempimento, dtype=array.dtype)
+            esteso[:capacita] = array
+            return esteso
+
+        self._valide = estendi(self._valide, False)
+        self._giorni = estendi(self._giorni, 0)
+        self._pasti = estendi(self._pasti, 0)
+        self._campi = {campo: estendi(array, np.nan) for campo, array in self._campi.items()}
+
+    def _codici(self, pasti: pd.Series) -> np.ndarray:
+        codici, nomi = pd.factorize(pasti.fillna("").astype(object))
+        mappa = np.array([self._codici_pasti.setdefault(nome, len(self._codici_pasti)) for nome in nomi],
+                         dtype=np.int16)
+        self._nomi_pasti = list(self._codici_pasti)
+        return mappa[codici]
+
+    def aggiorna(
+        self,
+        vecchie: Iterable[Dict[str, Any]] = (),
+        nuove: Iterable[Dict[str, Any]] = ()
+    ) -> None:
+        """
+        Libera le posizioni delle voci eliminate e scrive le versioni nuove
+
+        Args:
+            vecchie: Voci eliminate o versioni prima della modifica
+            nuove: Voci inserite o versioni dopo la modifica
+        """
+        vecchie, nuove = list(vecchie), list(nuove)
+        if not vecchie and not nuove:
+            return
+        if nuove:
+            df = pd.DataFrame.from_records(nuove, columns=["id", "data", "pasto", *CAMPI])
+            giorni = date_locali(df["data"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+            valori = {campo: pd.to_numeric(df[campo], errors="coerce").to_numpy(dtype=float) for campo in CAMPI}
+        with self._lock:
+            ids_nuove = {voce["id"] for voce in nuove} if vecchie else set()
+            for voce in vecchie:
+                if voce["id"] in ids_nuove:
+                    continue
+                posizione = self._posizioni.pop(voce["id"], None)
+                if posizione is not None:
+                    self._valide[posizione] = False
+                    self._libere.append(posizione)
+            if nuove:
+                if not self._posizioni and not self._libere:
+                    # Primo caricamento: le voci occupano le posizioni in ordine
+                    posizioni = np.arange(self._n, self._n + len(nuove))
+                    self._posizioni.update(zip(df["id"].tolist(), posizioni.tolist()))
+                    self._n += len(nuove)
+                else:
+                    posizioni = np.empty(len(nuove), dtype=np.int64)
+                    for i, voce in enumerate(nuove):
+                        posizione = self._posizioni.get(voce["id"])
+                        if posizione is None:
+                            if self._libere:
+                                posizione = self._libere.pop()
+                            else:
+                                posizione = self._n
+                                self._n += 1
+                            self._posizioni[voce["id"]] = posizione
+                        posizioni[i] = posizione
+                self._capacita(self._n)
+                self._valide[posizioni] = True
+                self._giorni[posizioni] = giorni
+                self._pasti[posizioni] = self._codici(df["pasto"])
+                for campo in CAMPI:
+                    self._campi[campo][posizioni] = valori[campo]
+            self._risultati = {}
+            self.versione += 1
+
+    def _righe(self) -> Tuple[Dict[str, np.ndarray], List[str]]:
+        """
+        Colonne delle sole voci presenti, con variazione della glicemia e
+        rapporto carboidrati/insulina di ogni voce, e nomi dei pasti
+
+        Le colonne sono calcolate una volta per versione e condivise dalle
+        analisi, che non devono modificarle.
+        """
+        with self._lock:
+            memorizzate = self._risultati.get(("righe",))
+            if memorizzate is not None:
+                return memorizzate
+            valide = self._valide[:self._n]
+            righe = {campo: array[:self._n][valide] for campo, array in self._campi.items()}
+            righe["giorno"] = self._giorni[:self._n][valide]
+            righe["pasto"] = self._pasti[:self._n][valide]
+            nomi = list(self._nomi_pasti)
+            carboidrati, insulina = righe["carboidrati"], righe["unita_insulina"]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                righe["rapporto"] = np.where((carboidrati > 0) & (insulina > 0), carboidrati / insulina, np.nan)
+            righe["variazione"] = righe["glicemia_dop_2h"] - righe["glicemia_iniziale"]
+            self._risultati[("righe",)] = righe, nomi
+            return righe, nomi
+
+    def _memorizzato(self, chiave: Tuple, calcola) -> Any:
+        with self._lock:
+            versione = self.versione
+            risultato = self._risultati.get(chiave)
+        if risultato is None:
+            risultato = calcola()
+            with self._lock:
+                if self.versione == versione:
+                    self._risultati[chiave] = risultato
+        return risultato.copy()
+
+    @staticmethod
+    def _in_target(glicemia: np.ndarray) -> np.ndarray:
+        return ((glicemia >= TARGET[0]) & (glicemia <= TARGET[1])).astype(float)
+
+    def variazione_per_pasto(self) -> pd.DataFrame:
+        """
+        Variazione della glicemia dopo 2 ore per pasto
+
+        Returns:
+            DataFrame indicizzato per Pasto con Misurazioni, media, quartili e
+            deviazione standard della variazione e quota in target dopo 2 ore,
+            calcolati sulle voci con entrambe le glicemie
+        """
+        return self._memorizzato(("variazione_per_pasto",), self._variazione_per_pasto)
+
+    def _variazione_per_pasto(self) -> pd.DataFrame:
+        righe, nomi = self._righe()
+        variazione = righe["variazione"]
+        presenti = ~np.isnan(variazione)
+        pasto, variazione = righe["pasto"][presenti], variazione[presenti]
+        n_pasti = len(nomi)
+        n = np.bincount(pasto, minlength=n_pasti).astype(float)
+        somma = np.bincount(pasto, weights=variazione, minlength=n_pasti)
+        quadrati = np.bincount(pasto, weights=variazione ** 2, minlength=n_pasti)
+        target = np.bincount(pasto, weights=self._in_target(righe["glicemia_dop_2h"][presenti]), minlength=n_pasti)
+        media = _medie(somma, n)
+        with np.errstate(invalid="ignore"):
+            varianza = np.where(n > 1, (quadrati - n * media ** 2) / np.maximum(n - 1, 1), np.nan)
+        quartili = _quantili(variazione, pasto, n_pasti, QUARTILI)
+        risultato = pd.DataFrame({
+            "Misurazioni": n.astype(int),
+            "Media Variazione": media,
+            "Primo Quartile": quartili[:, 0],
+            "Mediana Variazione": quartili[:, 1],
+            "Terzo Quartile": quartili[:, 2],
+            "Deviazione Standard": np.sqrt(np.maximum(varianza, 0)),
+            "In Target dopo 2h (%)": _medie(target, n) * 100,
+        }, index=pd.Index(nomi, name="Pasto"))
+        return risultato[risultato["Misurazioni"] > 0]
+
+    def rapporti_per_pasto(self) -> pd.DataFrame:
+        """
+        Rapporto carboidrati/insulina effettivamente usato, per pasto
+
+        Returns:
+            DataFrame indicizzato per Pasto con Voci (con carboidrati e
+            insulina), quartili del rapporto (g per unità) e variazione media
+            della glicemia
+        """
+        return self._memorizzato(("rapporti_per_pasto",), self._rapporti_per_pasto)
+
+    def _rapporti_per_pasto(self) -> pd.DataFrame:
+        righe, nomi = self._righe()
+        presenti = ~np.isnan(righe["rapporto"])
+        pasto, rapporto = righe["pasto"][presenti], righe["rapporto"][presenti]
+        variazione = righe["variazione"][presenti]
+        misurata = ~np.isnan(variazione)
+        n_pasti = len(nomi)
+        n = np.bincount(pasto, minlength=n_pasti)
+        quartili = _quantili(rapporto, pasto, n_pasti, QUARTILI)
+        risultato = pd.DataFrame({
+            "Voci": n,
+            "Primo Quartile": quartili[:, 0],
+            "Mediana Rapporto": quartili[:, 1],
+            "Terzo Quartile": quartili[:, 2],
+            "Media Variazione": _medie(
+                np.bincount(pasto[misurata], weights=variazione[misurata], minlength=n_pasti),
+                np.bincount(pasto[misurata], minlength=n_pasti)
+            ),
+        }, index=pd.Index(nomi, name="Pasto"))
+        return risultato[risultato["Voci"] > 0]
+
+    def variazione_per_rapporto(self) -> pd.DataFrame:
+        """
+        Variazione media della glicemia per fascia di rapporto carboidrati/insulina
+
+        Le fasce sono ampie FASCIA_RAPPORTO g per unità; i rapporti oltre
+        RAPPORTO_MASSIMO finiscono nell'ultima.
+
+        Returns:
+            DataFrame indicizzato per Rapporto (inizio della fascia) con
+            Misurazioni, Media Variazione e In Target dopo 2h (%)
+        """
+        return self._memorizzato(("variazione_per_rapporto",), self._variazione_per_rapporto)
+
+    def _variazione_per_rapporto(self) -> pd.DataFrame:
+        righe, _ = self._righe()
+        presenti = ~np.isnan(righe["rapporto"]) & ~np.isnan(righe["variazione"])
+        fasce = (np.minimum(righe["rapporto"][presenti], RAPPORTO_MASSIMO) // FASCIA_RAPPORTO).astype(np.int64)
+        n = np.bincount(fasce).astype(float)
+        somma = np.bincount(fasce, weights=righe["variazione"][presenti])
+        target = np.bincount(fasce, weights=self._in_target(righe["glicemia_dop_2h"][presenti]))
+        risultato = pd.DataFrame({
+            "Misurazioni": n.astype(int),
+            "Media Variazione": _medie(somma, n),
+            "In Target dopo 2h (%)": _medie(target, n) * 100,
+        }, index=pd.Index(np.arange(len(n)) * FASCIA_RAPPORTO, name="Rapporto"))
+        return risultato[risultato["Misurazioni"] > 0]
+
+    def efficacia_correzioni(self) -> pd.DataFrame:
+        """
+        Efficacia delle dosi correttive per fascia di tempo della correzione
+
+        Le fasce sono ampie FASCIA_TEMPO minuti, come nella distribuzione dei
+        tempi di correzione degli aggregati.
+
+        Returns:
+            DataFrame indicizzato per Minuti (inizio della fascia) con
+            Correzioni, Media Dosi Correttive, Media Variazione, Variazione per
+            Unità (sulle correzioni con entrambe le glicemie) e In Target dopo 2h (%)
+        """
+        return self._memorizzato(("efficacia_correzioni",), self._efficacia_correzioni)
+
+    def _efficacia_correzioni(self) -> pd.DataFrame:
+        righe, _ = self._righe()
+        dosi, tempo = righe["dosi_correttive"], righe["tempo_dosi_correttive"]
+        presenti = (dosi > 0) & ~np.isnan(tempo) & (tempo >= 0)
+        fasce = (tempo[presenti] // FASCIA_TEMPO).astype(np.int64)
+        dosi = dosi[presenti]
+        variazione = righe["variazione"][presenti]
+        misurata = ~np.isnan(variazione)
+        n_fasce = int(fasce.max()) + 1 if len(fasce) else 0
+        n = np.bincount(fasce, minlength=n_fasce).astype(float)
+        misurate = np.bincount(fasce[misurata], minlength=n_fasce).astype(float)
+        glicemia_dopo = righe["glicemia_dop_2h"][presenti]
+        con_glicemia = ~np.isnan(glicemia_dopo)
+        risultato = pd.DataFrame({
+            "Correzioni": n.astype(int),
+            "Media Dosi Correttive": _medie(np.bincount(fasce, weights=dosi, minlength=n_fasce), n),
+            "Media Variazione": _medie(
+                np.bincount(fasce[misurata], weights=variazione[misurata], minlength=n_fasce), misurate
+            ),
+            "Variazione per Unità": _medie(
+                np.bincount(fasce[misurata], weights=variazione[misurata] / dosi[misurata], minlength=n_fasce),
+                misurate
+            ),
+            "In Target dopo 2h (%)": _medie(
+                np.bincount(fasce[con_glicemia], weights=self._in_target(glicemia_dopo[con_glicemia]),
+                            minlength=n_fasce),
+                np.bincount(fasce[con_glicemia], minlength=n_fasce)
+            ) * 100,
+        }, index=pd.Index(np.arange(n_fasce) * FASCIA_TEMPO, name="Minuti"))
+        return risultato[risultato["Correzioni"] > 0]
+
+    def tendenze(self, misura: str = "variazione", finestre: Sequence[int] = (7, 30)) -> pd.DataFrame:
+        """
+        Media mobile di una misura per pasto, su finestre di giorni di calendario
+
+        La media di un giorno comprende le voci dei giorni precedenti che
+        cadono nella finestra, come rolling("7D") di pandas; i giorni senza
+        voci nella finestra sono omessi.
+
+        Args:
+            misura: "variazione", "glicemia_dop_2h" o "rapporto"
+            finestre: Ampiezze delle finestre in giorni
+
+        Returns:
+            DataFrame con Giorno, Pasto e una colonna "Media {n} giorni" per finestra
+        """
+        if misura not in MISURE_TENDENZA:
+            raise ValueError(f"Misura non valida: {misura}")
+        finestre = tuple(int(finestra) for finestra in finestre)
+        return self._memorizzato(("tendenze", misura, finestre), lambda: self._tendenze(misura, finestre))
+
+    def _tendenze(self, misura: str, finestre: Tuple[int, ...]) -> pd.DataFrame:
+        righe, nomi = self._righe()
+        valori = righe[misura]
+        presenti = ~np.isnan(valori)
+        colonne = ["Giorno", "Pasto"] + [f"Media {finestra} giorni" for finestra in finestre]
+        if not presenti.any():
+            return pd.DataFrame(columns=colonne)
+        giorni, pasto, valori = righe["giorno"][presenti], righe["pasto"][presenti], valori[presenti]
+        primo = giorni.min()
+        n_giorni, n_pasti = int(giorni.max() - primo) + 1, len(nomi)
+        # Somme e conteggi per (pasto, giorno) su una griglia densa: la somma
+        # di una finestra è la differenza di due somme cumulate
+        cella = pasto.astype(np.int64) * n_giorni + (giorni - primo)
+        somme = np.bincount(cella, weights=valori, minlength=n_pasti * n_giorni).reshape(n_pasti, n_giorni)
+        conteggi = np.bincount(cella, minlength=n_pasti * n_giorni).reshape(n_pasti, n_giorni)
+        cumulate_somme = np.concatenate((np.zeros((n_pasti, 1)), np.cumsum(somme, axis=1)), axis=1)
+        cumulate_conteggi = np.concatenate(
+            (np.zeros((n_pasti, 1), dtype=np.int64), np.cumsum(conteggi, axis=1)), axis=1
+        )
+        fine = np.arange(1, n_giorni + 1)
+        medie, presenze = [], np.zeros((n_pasti, n_giorni), dtype=bool)
+        for finestra in finestre:
+            inizio = np.maximum(fine - finestra, 0)
+            n = cumulate_conteggi[:, fine] - cumulate_conteggi[:, inizio]
+            medie.append(_medie(cumulate_somme[:, fine] - cumulate_somme[:, inizio], n))
+            presenze |= n > 0
+        # Righe in ordine di giorno e poi di pasto
+        giorno, codici = np.nonzero(presenze.T)
+        return pd.DataFrame({
+            "Giorno": (giorno + primo).astype("datetime64[D]").astype("datetime64[us]"),
+            "Pasto": pd.Categorical.from_codes(codici, nomi),
+            **{colonna: media[codici, giorno] for colonna, media in zip(colonne[2:], medie)},
+        })
+
+    def calcola(self, misura: str = "variazione", finestre: Sequence[int] = (7, 30)) -> Dict[str, pd.DataFrame]:
+        """Tutte le analisi, con i nomi dei metodi come chiavi"""
+        return {
+            "variazione_per_pasto": self.variazione_per_pasto(),
+            "rapporti_per_pasto": self.rapporti_per_pasto(),
+            "variazione_per_rapporto": self.variazione_per_rapporto(),
+            "efficacia_correzioni": self.efficacia_correzioni(),
+            "tendenze": self.tendenze(misura, finestre),
+        }
+
+    def svuota_risultati(self) -> None:
+        """Scarta i risultati in memoria (per misurare il calcolo)"""
+        with self._lock:
+            self._risultati = {}
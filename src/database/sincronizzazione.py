@@ -0,0 +1,183 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .backend import COLONNA_UTENTE
+
+# Campi con pochi valori distinti, ripetuti in moltissime voci: ogni riga
+# letta dal server ne ha una copia propria, lo snapshot ne tiene una sola
+CAMPI_RIPETUTI = ("pasto", "alimento", "unita_misura", COLONNA_UTENTE)
+
+
+class SnapshotDiario:
+    """
+    Copia locale della tabella DiarioAlimentare per la sincronizzazione incrementale
+
+    Le voci sono indicizzate per id. Il punto di ripresa è l'ora del database
+    all'inizio dell'ultima sincronizzazione (ora_sync), oppure, se il backend
+    non la fornisce, il massimo di colonna_modifica visto finora; se la
+    tabella non ha una colonna di ultima modifica è il massimo id e vengono
+    rilevati solo inserimenti ed eliminazioni, non le modifiche fatte da
+    altri client.
+    """
+
+    def __init__(
+        self,
+        colonna_modifica: Optional[str] = "updated_at",
+        margine: float = 5.0,
+        intervallo_minimo: float = 0.0
+    ):
+        """
+        Args:
+            colonna_modifica: Colonna timestamp aggiornata a ogni scrittura (None per usare l'id)
+            margine: Secondi di sovrapposizione sul punto di ripresa, per non perdere
+                transazioni confermate in ritardo
+            intervallo_minimo: Secondi entro cui una nuova sincronizzazione viene saltata
+        """
+        self.colonna_modifica = colonna_modifica
+        self.margine = margine
+        self.intervallo_minimo = intervallo_minimo
+        self.lock = threading.RLock()
+        # Oggetti con aggiorna(vecchie, nuove) e azzera(), avvisati a ogni
+        # cambiamento (ad esempio gli aggregati della pagina Analisi)
+        self.osservatori: List[Any] = []
+        self.reset()
+
+    @classmethod
+    def from_env(cls) -> "SnapshotDiario":
+        """Crea lo snapshot leggendo DIARIO_SYNC_COLONNA e DIARIO_SYNC_INTERVALLO"""
+        return cls(
+            colonna_modifica=os.getenv("DIARIO_SYNC_COLONNA", "updated_at") or None,
+            intervallo_minimo=float(os.getenv("DIARIO_SYNC_INTERVALLO", "0")),
+        )
+
+    def reset(self) -> None:
+        """Svuota lo snapshot: la prossima sincronizzazione sarà completa"""
+        with self.lock:
+            self.voci: Dict[int, Dict[str, Any]] = {}
+            self.ultima_modifica: Optional[datetime] = None
+            # Ora del database all'inizio dell'ultima sincronizzazione completata
+            self.ora_sync: Optional[datetime] = None
+            self.max_id = 0
+            # La versione non riparte da zero: chi ha in cache dati legati a
+            # una versione precedente deve vederli come superati
+            self.versione = getattr(self, "versione", 0) + 1
+            self.ultimo_sync = 0.0
+            # Inizio (monotonic) dell'ultima sincronizzazione completata: le
+            # modifiche successive sono già lette o notificate dal flusso
+            self.inizio_sync = 0.0
+            self.caricato = False
+            for osservatore in self.osservatori:
+                osservatore.azzera()
+
+    def __len__(self) -> int:
+        return len(self.voci)
+
+    def da_sincronizzare(self) -> bool:
+        """Indica se è trascorso l'intervallo minimo dall'ultima sincronizzazione"""
+        return time.monotonic() - self.ultimo_sync >= self.intervallo_minimo
+
+    def filtro_delta(self) -> Tuple[str, str, Any]:
+        """
+        Restituisce il filtro (colonna, operatore, valore) per leggere solo le novità
+
+        Le righe con colonna_modifica precedente all'inizio dell'ultima
+        sincronizzazione (meno il margine per le transazioni confermate in
+        ritardo) erano già confermate quando è stata letta. Senza ora_sync si
+        riparte dall'ultima modifica vista, rileggendo ogni volta le righe
+        scritte nel margine che la precede.
+        """
+        riferimenti = [istante for istante in (self.ultima_modifica, self.ora_sync) if istante is not None]
+        if self.colonna_modifica and riferimenti:
+            inizio = max(riferimenti) - timedelta(seconds=self.margine)
+            return self.colonna_modifica, "gte", inizio.isoformat()
+        return "id", "gt", self.max_id
+
+    def sostituisci(self, voci: Iterable[Dict[str, Any]]) -> None:
+        """Sostituisce tutto il contenuto con un caricamento completo"""
+        with self.lock:
+            self.voci = {}
+            self.ultima_modifica = None
+            self.ora_sync = None
+            self.max_id = 0
+            for osservatore in self.osservatori:
+                osservatore.azzera()
+            self.applica(voci)
+            self.caricato = True
+            self.versione += 1
+            self.ultimo_sync = time.monotonic()
+
+    def applica(self, voci: Iterable[Dict[str, Any]], avanza: bool = True) -> int:
+        """
+        Inserisce o aggiorna le voci indicate
+
+        Args:
+            voci: Voci lette dal server o appena scritte dall'app
+            avanza: Se False il punto di ripresa non viene spostato (scritture
+                locali, che non garantiscono di aver visto le righe precedenti)
+
+        Returns:
+            Numero di voci nuove o effettivamente cambiate
+        """
+        vecchie, nuove = [], []
+        with self.lock:
+            for voce in voci:
+                entry_id = voce["id"]
+                precedente = self.voci.get(entry_id)
+                if precedente != voce:
+                    for campo in CAMPI_RIPETUTI:
+                        valore = voce.get(campo)
+                        if type(valore) is str:
+                            voce[campo] = sys.intern(valore)
+                    self.voci[entry_id] = voce
+                    if precedente is not None:
+                        vecchie.append(precedente)
+                    nuove.append(voce)
+                if not avanza:
+                    continue
+                if entry_id > self.max_id:
+                    self.max_id = entry_id
+                modifica = voce.get(self.colonna_modifica) if self.colonna_modifica else None
+                if modifica:
+                    istante = datetime.fromisoformat(modifica.replace("Z", "+00:00"))
+                    if self.ultima_modifica is None or istante > self.ultima_modifica:
+                        self.ultima_modifica = istante
+            if nuove:
+                self.versione += 1
+                for osservatore in self.osservatori:
+                    osservatore.aggiorna(vecchie, nuove)
+        return len(nuove)
+
+    def rimuovi(self, entry_ids: Iterable[int]) -> int:
+        """Rimuove le voci indicate, restituendo quante erano presenti"""
+        rimosse = []
+        with self.lock:
+            for entry_id in entry_ids:
+                voce = self.voci.pop(entry_id, None)
+                if voce is not None:
+                    rimosse.append(voce)
+            if rimosse:
+                self.versione += 1
+                for osservatore in self.osservatori:
+                    osservatore.aggiorna(vecchie=rimosse)
+        return len(rimosse)
+
+    def riconcilia(self, ids_presenti: Iterable[int]) -> List[int]:
+        """
+        Rimuove le voci che non esistono più sul server
+
+        Returns:
+            Gli id presenti sul server ma assenti dallo snapshot, da rileggere
+        """
+        with self.lock:
+            presenti = set(ids_presenti)
+            self.rimuovi([entry_id for entry_id in self.voci if entry_id not in presenti])
+            return sorted(presenti.difference(self.voci))
+
+    def lista(self) -> List[Dict[str, Any]]:
+        """Restituisce le voci dello snapshot (in ordine di arrivo, non ordinate)"""
+        with self.lock:
+            return list(self.voci.values())
@@ -0,0 +1,35 @@
+-- Colonna updated_at per la sincronizzazione incrementale (DiarioAlimentareDB.sync_entries)
+-- e ora del database (diario_ora): all'inizio di ogni sincronizzazione l'app
+-- legge l'ora del server e la volta successiva rilegge solo le righe con
+-- updated_at da quell'istante (meno un margine), invece di tutte quelle vicine
+-- all'updated_at più recente.
+-- Da eseguire una volta nello SQL Editor di Supabase.
+
+alter table public."DiarioAlimentare"
+  add column if not exists updated_at timestamp with time zone not null default now();
+
+create index if not exists "DiarioAlimentare_updated_at_idx"
+  on public."DiarioAlimentare" (updated_at);
+
+create or replace function public.diario_imposta_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists diario_updated_at on public."DiarioAlimentare";
+create trigger diario_updated_at
+  before update on public."DiarioAlimentare"
+  for each row execute function public.diario_imposta_updated_at();
+
+create or replace function public.diario_ora()
+returns timestamp with time zone
+language sql
+stable
+as $$
+  select now();
+$$;
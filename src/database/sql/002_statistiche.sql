@@ -0,0 +1,37 @@
+-- Statistiche del diario calcolate sul server (DiarioAlimentareDB.get_statistics)
+-- Un'unica chiamata RPC restituisce un JSON compatto, indipendente dalla dimensione della tabella.
+
+create or replace function public.diario_statistiche()
+returns jsonb
+language sql
+stable
+as $$
+  with per_pasto as (
+    select
+      coalesce(pasto, '') as pasto,
+      jsonb_build_object(
+        'count', count(*),
+        'average_carbs', round(avg(carboidrati)::numeric, 2),
+        'average_insulin', round(avg(unita_insulina)::numeric, 2),
+        'average_glucose', round(avg(glicemia_iniziale)::numeric, 1),
+        'average_glucose_2h', round(avg(glicemia_dop_2h)::numeric, 1)
+      ) as valori
+    from public."DiarioAlimentare"
+    group by 1
+  )
+  select jsonb_build_object(
+    'total_entries', count(*),
+    'entries_with_carbs', count(carboidrati),
+    'average_carbs', coalesce(round((avg(carboidrati) filter (where carboidrati <> 0))::numeric, 2), 0),
+    'carboidrati', jsonb_build_object(
+      'avg', round(avg(carboidrati)::numeric, 2), 'min', min(carboidrati), 'max', max(carboidrati)),
+    'unita_insulina', jsonb_build_object(
+      'avg', round(avg(unita_insulina)::numeric, 2), 'min', min(unita_insulina), 'max', max(unita_insulina)),
+    'glicemia_iniziale', jsonb_build_object(
+      'avg', round(avg(glicemia_iniziale)::numeric, 1), 'min', min(glicemia_iniziale), 'max', max(glicemia_iniziale)),
+    'glicemia_dop_2h', jsonb_build_object(
+      'avg', round(avg(glicemia_dop_2h)::numeric, 1), 'min', min(glicemia_dop_2h), 'max', max(glicemia_dop_2h)),
+    'per_pasto', (select coalesce(jsonb_object_agg(pasto, valori), '{}'::jsonb) from per_pasto)
+  )
+  from public."DiarioAlimentare";
+$$;
@@ -0,0 +1,24 @@
+-- Checksum della tabella per verificare le migrazioni (DiarioAlimentareDB.get_checksum)
+-- Somme su colonne intere, quindi confrontabili esattamente con quelle calcolate in locale.
+
+create or replace function public.diario_checksum(id_min bigint default null, id_max bigint default null)
+returns jsonb
+language sql
+stable
+as $$
+  select jsonb_build_object(
+    'count', count(*),
+    'sum_id', coalesce(sum(id), 0),
+    'sum_quantita', coalesce(sum(quantita), 0),
+    'sum_glicemia_iniziale', coalesce(sum(glicemia_iniziale), 0),
+    'sum_glicemia_dop_2h', coalesce(sum(glicemia_dop_2h), 0),
+    'count_carboidrati', count(carboidrati)
+  )
+  from public."DiarioAlimentare"
+  where (id_min is null or id >= id_min)
+    and (id_max is null or id <= id_max);
+$$;
+
+-- Dopo una migrazione che conserva gli id, riallinea la sequenza dell'identity:
+-- select setval(pg_get_serial_sequence('public."DiarioAlimentare"', 'id'),
+--               (select max(id) from public."DiarioAlimentare"));
@@ -0,0 +1,29 @@
+-- Riepilogo delle voci filtrate (DiarioAlimentareDB.get_summary), usato dalle
+-- statistiche rapide della tabella paginata. Da eseguire una volta nello SQL Editor di Supabase.
+
+create or replace function public.diario_riepilogo(
+  data_da timestamp with time zone default null,
+  data_a timestamp with time zone default null,
+  filtro_pasto text default null,
+  filtro_alimento text default null
+)
+returns jsonb
+language sql
+stable
+as $$
+  select jsonb_build_object(
+    'count', count(*),
+    'average_glucose', round(avg(glicemia_iniziale)::numeric, 1),
+    'total_carbs', coalesce(round(sum(carboidrati)::numeric, 1), 0),
+    'total_corrective_doses', coalesce(round(sum(dosi_correttive)::numeric, 1), 0)
+  )
+  from public."DiarioAlimentare"
+  where (data_da is null or data >= data_da)
+    and (data_a is null or data <= data_a)
+    and (filtro_pasto is null or pasto = filtro_pasto)
+    and (filtro_alimento is null or alimento ilike '%' || filtro_alimento || '%');
+$$;
+
+-- Indici per i filtri e gli ordinamenti della tabella paginata
+create index if not exists "DiarioAlimentare_data_idx" on public."DiarioAlimentare" (data, id);
+create index if not exists "DiarioAlimentare_pasto_idx" on public."DiarioAlimentare" (pasto, data);
@@ -0,0 +1,53 @@
+-- Ricerca testuale su alimento e note (DiarioAlimentareDB.search_entries).
+-- Gli indici a trigrammi servono sia i filtri ilike '%...%' sia la somiglianza
+-- di parola (operatore <%), che tollera i refusi; l'ordinamento per distanza
+-- (<<->) usa lo stesso indice GiST, quindi si leggono solo le prime voci.
+-- Da eseguire una volta nello SQL Editor di Supabase.
+
+create extension if not exists pg_trgm;
+
+create index if not exists "DiarioAlimentare_alimento_trgm_idx"
+  on public."DiarioAlimentare" using gist (alimento gist_trgm_ops);
+create index if not exists "DiarioAlimentare_note_trgm_idx"
+  on public."DiarioAlimentare" using gist (note gist_trgm_ops);
+
+create or replace function public.diario_cerca(
+  termine text,
+  campi text[] default array['alimento'],
+  limite integer default 50
+)
+returns setof public."DiarioAlimentare"
+language plpgsql
+stable
+set pg_trgm.word_similarity_threshold = 0.3
+as $$
+declare
+  -- I caratteri speciali di ilike vanno cercati alla lettera
+  modello text := '%' || replace(replace(replace(termine, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+begin
+  if cardinality(campi) = 0 or not campi <@ array['alimento', 'note'] then
+    raise exception 'Campi di ricerca non validi: %', campi;
+  end if;
+
+  if campi = array['alimento'] then
+    return query
+      select * from public."DiarioAlimentare" d
+      where d.alimento ilike modello or termine <% d.alimento
+      order by termine <<-> d.alimento, d.id desc
+      limit limite;
+  elsif campi = array['note'] then
+    return query
+      select * from public."DiarioAlimentare" d
+      where d.note ilike modello or termine <% d.note
+      order by termine <<-> d.note, d.id desc
+      limit limite;
+  else
+    return query
+      select * from public."DiarioAlimentare" d
+      where d.alimento ilike modello or termine <% d.alimento
+         or d.note ilike modello or termine <% d.note
+      order by least(termine <<-> coalesce(d.alimento, ''), termine <<-> coalesce(d.note, '')), d.id desc
+      limit limite;
+  end if;
+end;
+$$;
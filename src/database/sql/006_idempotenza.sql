@@ -0,0 +1,10 @@
+-- Chiave di idempotenza delle voci: DiarioAlimentareDB assegna un uuid a ogni
+-- nuova voce e, se un inserimento va ripetuto dopo un errore di rete, prima
+-- legge le chiavi già scritte, così un pasto non viene mai registrato due volte.
+-- Da eseguire una volta nello SQL Editor di Supabase.
+
+alter table public."DiarioAlimentare"
+  add column if not exists chiave_idempotenza uuid;
+
+create unique index if not exists "DiarioAlimentare_chiave_idempotenza_idx"
+  on public."DiarioAlimentare" (chiave_idempotenza);
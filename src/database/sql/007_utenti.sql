@@ -0,0 +1,169 @@
+-- Diari di più utenti (pazienti) nella stessa tabella. DiarioAlimentareDB filtra
+-- ogni richiesta sulla colonna user_id dell'utente corrente (set_user / as_user)
+-- e le funzioni RPC ricevono l'utente in filtro_utente. Le voci già presenti
+-- restano all'utente "predefinito". Da eseguire una volta nello SQL Editor di
+-- Supabase, dopo gli script da 002 a 006.
+
+alter table public."DiarioAlimentare"
+  add column if not exists user_id text not null default 'predefinito';
+
+-- Indici con l'utente come prima colonna: ogni richiesta legge solo le voci di
+-- un utente, quindi il costo non dipende da quanti utenti ha la tabella
+create extension if not exists btree_gist;
+
+drop index if exists public."DiarioAlimentare_data_idx";
+drop index if exists public."DiarioAlimentare_pasto_idx";
+drop index if exists public."DiarioAlimentare_alimento_trgm_idx";
+drop index if exists public."DiarioAlimentare_note_trgm_idx";
+
+create index if not exists "DiarioAlimentare_utente_data_idx"
+  on public."DiarioAlimentare" (user_id, data, id);
+create index if not exists "DiarioAlimentare_utente_pasto_idx"
+  on public."DiarioAlimentare" (user_id, pasto, data);
+create index if not exists "DiarioAlimentare_utente_updated_at_idx"
+  on public."DiarioAlimentare" (user_id, updated_at);
+create index if not exists "DiarioAlimentare_utente_id_idx"
+  on public."DiarioAlimentare" (user_id, id);
+create index if not exists "DiarioAlimentare_utente_alimento_trgm_idx"
+  on public."DiarioAlimentare" using gist (user_id, alimento gist_trgm_ops);
+create index if not exists "DiarioAlimentare_utente_note_trgm_idx"
+  on public."DiarioAlimentare" using gist (user_id, note gist_trgm_ops);
+
+-- Le funzioni ricevono un parametro in più: le versioni precedenti vanno
+-- eliminate, altrimenti PostgREST non saprebbe quale chiamare
+drop function if exists public.diario_statistiche();
+drop function if exists public.diario_checksum(bigint, bigint);
+drop function if exists public.diario_riepilogo(timestamp with time zone, timestamp with time zone, text, text);
+drop function if exists public.diario_cerca(text, text[], integer);
+
+create or replace function public.diario_statistiche(filtro_utente text default null)
+returns jsonb
+language sql
+stable
+as $$
+  with voci as (
+    select * from public."DiarioAlimentare"
+    where filtro_utente is null or user_id = filtro_utente
+  ),
+  per_pasto as (
+    select
+      coalesce(pasto, '') as pasto,
+      jsonb_build_object(
+        'count', count(*),
+        'average_carbs', round(avg(carboidrati)::numeric, 2),
+        'average_insulin', round(avg(unita_insulina)::numeric, 2),
+        'average_glucose', round(avg(glicemia_iniziale)::numeric, 1),
+        'average_glucose_2h', round(avg(glicemia_dop_2h)::numeric, 1)
+      ) as valori
+    from voci
+    group by 1
+  )
+  select jsonb_build_object(
+    'total_entries', count(*),
+    'entries_with_carbs', count(carboidrati),
+    'average_carbs', coalesce(round((avg(carboidrati) filter (where carboidrati <> 0))::numeric, 2), 0),
+    'carboidrati', jsonb_build_object(
+      'avg', round(avg(carboidrati)::numeric, 2), 'min', min(carboidrati), 'max', max(carboidrati)),
+    'unita_insulina', jsonb_build_object(
+      'avg', round(avg(unita_insulina)::numeric, 2), 'min', min(unita_insulina), 'max', max(unita_insulina)),
+    'glicemia_iniziale', jsonb_build_object(
+      'avg', round(avg(glicemia_iniziale)::numeric, 1), 'min', min(glicemia_iniziale), 'max', max(glicemia_iniziale)),
+    'glicemia_dop_2h', jsonb_build_object(
+      'avg', round(avg(glicemia_dop_2h)::numeric, 1), 'min', min(glicemia_dop_2h), 'max', max(glicemia_dop_2h)),
+    'per_pasto', (select coalesce(jsonb_object_agg(pasto, valori), '{}'::jsonb) from per_pasto)
+  )
+  from voci;
+$$;
+
+create or replace function public.diario_checksum(
+  id_min bigint default null,
+  id_max bigint default null,
+  filtro_utente text default null
+)
+returns jsonb
+language sql
+stable
+as $$
+  select jsonb_build_object(
+    'count', count(*),
+    'sum_id', coalesce(sum(id), 0),
+    'sum_quantita', coalesce(sum(quantita), 0),
+    'sum_glicemia_iniziale', coalesce(sum(glicemia_iniziale), 0),
+    'sum_glicemia_dop_2h', coalesce(sum(glicemia_dop_2h), 0),
+    'count_carboidrati', count(carboidrati)
+  )
+  from public."DiarioAlimentare"
+  where (id_min is null or id >= id_min)
+    and (id_max is null or id <= id_max)
+    and (filtro_utente is null or user_id = filtro_utente);
+$$;
+
+create or replace function public.diario_riepilogo(
+  data_da timestamp with time zone default null,
+  data_a timestamp with time zone default null,
+  filtro_pasto text default null,
+  filtro_alimento text default null,
+  filtro_utente text default null
+)
+returns jsonb
+language sql
+stable
+as $$
+  select jsonb_build_object(
+    'count', count(*),
+    'average_glucose', round(avg(glicemia_iniziale)::numeric, 1),
+    'total_carbs', coalesce(round(sum(carboidrati)::numeric, 1), 0),
+    'total_corrective_doses', coalesce(round(sum(dosi_correttive)::numeric, 1), 0)
+  )
+  from public."DiarioAlimentare"
+  where (data_da is null or data >= data_da)
+    and (data_a is null or data <= data_a)
+    and (filtro_pasto is null or pasto = filtro_pasto)
+    and (filtro_alimento is null or alimento ilike '%' || filtro_alimento || '%')
+    and (filtro_utente is null or user_id = filtro_utente);
+$$;
+
+create or replace function public.diario_cerca(
+  termine text,
+  campi text[] default array['alimento'],
+  limite integer default 50,
+  filtro_utente text default null
+)
+returns setof public."DiarioAlimentare"
+language plpgsql
+stable
+set pg_trgm.word_similarity_threshold = 0.3
+as $$
+declare
+  -- I caratteri speciali di ilike vanno cercati alla lettera
+  modello text := '%' || replace(replace(replace(termine, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+begin
+  if cardinality(campi) = 0 or not campi <@ array['alimento', 'note'] then
+    raise exception 'Campi di ricerca non validi: %', campi;
+  end if;
+
+  if campi = array['alimento'] then
+    return query
+      select * from public."DiarioAlimentare" d
+      where (filtro_utente is null or d.user_id = filtro_utente)
+        and (d.alimento ilike modello or termine <% d.alimento)
+      order by termine <<-> d.alimento, d.id desc
+      limit limite;
+  elsif campi = array['note'] then
+    return query
+      select * from public."DiarioAlimentare" d
+      where (filtro_utente is null or d.user_id = filtro_utente)
+        and (d.note ilike modello or termine <% d.note)
+      order by termine <<-> d.note, d.id desc
+      limit limite;
+  else
+    return query
+      select * from public."DiarioAlimentare" d
+      where (filtro_utente is null or d.user_id = filtro_utente)
+        and (d.alimento ilike modello or termine <% d.alimento
+             or d.note ilike modello or termine <% d.note)
+      order by least(termine <<-> coalesce(d.alimento, ''), termine <<-> coalesce(d.note, '')), d.id desc
+      limit limite;
+  end if;
+end;
+$$;
@@ -0,0 +1,241 @@
+-- Accesso alle voci limitato all'utente autenticato (Row Level Security).
+-- Con 007 il filtro per utente lo applica solo l'app: chiunque abbia la chiave
+-- anon può leggere e modificare tutta la tabella. Dopo questo script:
+--
+-- - un account Supabase Auth vede e modifica solo le voci con user_id uguale
+--   al suo id (auth.uid()) o a uno dei pazienti assegnatigli nel claim
+--   app_metadata.pazienti del JWT (lo imposta solo il service role, ad esempio
+--   con auth.admin.update_user_by_id);
+-- - le funzioni RPC rifiutano filtro_utente nullo invece di calcolare su tutti
+--   gli utenti, e non restituiscono mai voci non visibili all'account;
+-- - con la chiave anon e senza accesso non si legge nulla: l'app va usata con
+--   DIARIO_MULTIUTENTE=1 (accesso con email e password) oppure, per un solo
+--   utente su un server fidato, con la chiave service_role, che ignora RLS.
+--
+-- Le voci già presenti vanno assegnate agli account, ad esempio:
+--   update public."DiarioAlimentare" set user_id = '<id dell''account>'
+--   where user_id = 'predefinito';
+--
+-- Da eseguire una volta nello SQL Editor di Supabase, dopo gli script da 002 a 007.
+
+-- Utenti di cui l'account autenticato può usare il diario
+create or replace function public.diario_utenti_autorizzati()
+returns text[]
+language sql
+stable
+as $$
+  select array_remove(
+    array[auth.uid()::text]
+      || coalesce(array(select jsonb_array_elements_text(auth.jwt() -> 'app_metadata' -> 'pazienti')), '{}'),
+    null
+  );
+$$;
+
+-- Verifica l'utente passato a una funzione RPC: obbligatorio e autorizzato
+-- (il service role, che ignora RLS, può indicarne uno qualsiasi)
+create or replace function public.diario_verifica_utente(filtro_utente text)
+returns void
+language plpgsql
+stable
+as $$
+begin
+  if filtro_utente is null then
+    raise exception 'filtro_utente è obbligatorio' using errcode = '22004';
+  end if;
+  if coalesce(auth.role(), '') <> 'service_role'
+     and not filtro_utente = any(public.diario_utenti_autorizzati()) then
+    raise exception 'Utente non autorizzato: %', filtro_utente using errcode = '42501';
+  end if;
+end;
+$$;
+
+alter table public."DiarioAlimentare" enable row level security;
+
+drop policy if exists "diario_lettura" on public."DiarioAlimentare";
+drop policy if exists "diario_inserimento" on public."DiarioAlimentare";
+drop policy if exists "diario_modifica" on public."DiarioAlimentare";
+drop policy if exists "diario_eliminazione" on public."DiarioAlimentare";
+
+-- (select ...) fa calcolare la funzione una volta per richiesta e non per riga
+create policy "diario_lettura" on public."DiarioAlimentare"
+  for select to authenticated
+  using (user_id = any((select public.diario_utenti_autorizzati())));
+
+create policy "diario_inserimento" on public."DiarioAlimentare"
+  for insert to authenticated
+  with check (user_id = any((select public.diario_utenti_autorizzati())));
+
+-- with check impedisce anche di spostare una voce a un utente non autorizzato
+create policy "diario_modifica" on public."DiarioAlimentare"
+  for update to authenticated
+  using (user_id = any((select public.diario_utenti_autorizzati())))
+  with check (user_id = any((select public.diario_utenti_autorizzati())));
+
+create policy "diario_eliminazione" on public."DiarioAlimentare"
+  for delete to authenticated
+  using (user_id = any((select public.diario_utenti_autorizzati())));
+
+-- Le funzioni restano security invoker (quindi soggette a RLS) e mantengono
+-- la firma di 007; in plpgsql il controllo dell'utente avviene prima di
+-- leggere, anche quando non ci sono voci
+
+create or replace function public.diario_statistiche(filtro_utente text default null)
+returns jsonb
+language plpgsql
+stable
+as $$
+declare
+  risultato jsonb;
+begin
+  perform public.diario_verifica_utente(filtro_utente);
+
+  with voci as (
+    select * from public."DiarioAlimentare" d
+    where d.user_id = filtro_utente
+  ),
+  per_pasto as (
+    select
+      coalesce(voci.pasto, '') as pasto,
+      jsonb_build_object(
+        'count', count(*),
+        'average_carbs', round(avg(voci.carboidrati)::numeric, 2),
+        'average_insulin', round(avg(voci.unita_insulina)::numeric, 2),
+        'average_glucose', round(avg(voci.glicemia_iniziale)::numeric, 1),
+        'average_glucose_2h', round(avg(voci.glicemia_dop_2h)::numeric, 1)
+      ) as valori
+    from voci
+    group by 1
+  )
+  select jsonb_build_object(
+    'total_entries', count(*),
+    'entries_with_carbs', count(carboidrati),
+    'average_carbs', coalesce(round((avg(carboidrati) filter (where carboidrati <> 0))::numeric, 2), 0),
+    'carboidrati', jsonb_build_object(
+      'avg', round(avg(carboidrati)::numeric, 2), 'min', min(carboidrati), 'max', max(carboidrati)),
+    'unita_insulina', jsonb_build_object(
+      'avg', round(avg(unita_insulina)::numeric, 2), 'min', min(unita_insulina), 'max', max(unita_insulina)),
+    'glicemia_iniziale', jsonb_build_object(
+      'avg', round(avg(glicemia_iniziale)::numeric, 1), 'min', min(glicemia_iniziale), 'max', max(glicemia_iniziale)),
+    'glicemia_dop_2h', jsonb_build_object(
+      'avg', round(avg(glicemia_dop_2h)::numeric, 1), 'min', min(glicemia_dop_2h), 'max', max(glicemia_dop_2h)),
+    'per_pasto', (select coalesce(jsonb_object_agg(per_pasto.pasto, per_pasto.valori), '{}'::jsonb) from per_pasto)
+  )
+  into risultato
+  from voci;
+
+  return risultato;
+end;
+$$;
+
+create or replace function public.diario_checksum(
+  id_min bigint default null,
+  id_max bigint default null,
+  filtro_utente text default null
+)
+returns jsonb
+language plpgsql
+stable
+as $$
+declare
+  risultato jsonb;
+begin
+  perform public.diario_verifica_utente(filtro_utente);
+
+  select jsonb_build_object(
+    'count', count(*),
+    'sum_id', coalesce(sum(d.id), 0),
+    'sum_quantita', coalesce(sum(d.quantita), 0),
+    'sum_glicemia_iniziale', coalesce(sum(d.glicemia_iniziale), 0),
+    'sum_glicemia_dop_2h', coalesce(sum(d.glicemia_dop_2h), 0),
+    'count_carboidrati', count(d.carboidrati)
+  )
+  into risultato
+  from public."DiarioAlimentare" d
+  where (id_min is null or d.id >= id_min)
+    and (id_max is null or d.id <= id_max)
+    and d.user_id = filtro_utente;
+
+  return risultato;
+end;
+$$;
+
+create or replace function public.diario_riepilogo(
+  data_da timestamp with time zone default null,
+  data_a timestamp with time zone default null,
+  filtro_pasto text default null,
+  filtro_alimento text default null,
+  filtro_utente text default null
+)
+returns jsonb
+language plpgsql
+stable
+as $$
+declare
+  risultato jsonb;
+begin
+  perform public.diario_verifica_utente(filtro_utente);
+
+  select jsonb_build_object(
+    'count', count(*),
+    'average_glucose', round(avg(d.glicemia_iniziale)::numeric, 1),
+    'total_carbs', coalesce(round(sum(d.carboidrati)::numeric, 1), 0),
+    'total_corrective_doses', coalesce(round(sum(d.dosi_correttive)::numeric, 1), 0)
+  )
+  into risultato
+  from public."DiarioAlimentare" d
+  where (data_da is null or d.data >= data_da)
+    and (data_a is null or d.data <= data_a)
+    and (filtro_pasto is null or d.pasto = filtro_pasto)
+    and (filtro_alimento is null or d.alimento ilike '%' || filtro_alimento || '%')
+    and d.user_id = filtro_utente;
+
+  return risultato;
+end;
+$$;
+
+create or replace function public.diario_cerca(
+  termine text,
+  campi text[] default array['alimento'],
+  limite integer default 50,
+  filtro_utente text default null
+)
+returns setof public."DiarioAlimentare"
+language plpgsql
+stable
+set pg_trgm.word_similarity_threshold = 0.3
+as $$
+declare
+  -- I caratteri speciali di ilike vanno cercati alla lettera
+  modello text := '%' || replace(replace(replace(termine, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+begin
+  perform public.diario_verifica_utente(filtro_utente);
+
+  if cardinality(campi) = 0 or not campi <@ array['alimento', 'note'] then
+    raise exception 'Campi di ricerca non validi: %', campi;
+  end if;
+
+  if campi = array['alimento'] then
+    return query
+      select * from public."DiarioAlimentare" d
+      where d.user_id = filtro_utente
+        and (d.alimento ilike modello or termine <% d.alimento)
+      order by termine <<-> d.alimento, d.id desc
+      limit limite;
+  elsif campi = array['note'] then
+    return query
+      select * from public."DiarioAlimentare" d
+      where d.user_id = filtro_utente
+        and (d.note ilike modello or termine <% d.note)
+      order by termine <<-> d.note, d.id desc
+      limit limite;
+  else
+    return query
+      select * from public."DiarioAlimentare" d
+      where d.user_id = filtro_utente
+        and (d.alimento ilike modello or termine <% d.alimento
+             or d.note ilike modello or termine <% d.note)
+      order by least(termine <<-> coalesce(d.alimento, ''), termine <<-> coalesce(d.note, '')), d.id desc
+      limit limite;
+  end if;
+end;
+$$;
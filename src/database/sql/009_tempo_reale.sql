@@ -0,0 +1,11 @@
+-- Notifiche in tempo reale delle modifiche al diario (Supabase Realtime).
+-- DiarioAlimentareDB si iscrive agli inserimenti, alle modifiche e alle
+-- eliminazioni della tabella e aggiorna subito le copie locali e le pagine
+-- aperte. Da eseguire una volta nello SQL Editor di Supabase, dopo gli script
+-- da 002 a 007.
+
+-- Con replica identity full le eliminazioni notificano la riga intera (e
+-- quindi anche user_id), non solo la chiave primaria
+alter table public."DiarioAlimentare" replica identity full;
+
+alter publication supabase_realtime add table public."DiarioAlimentare";
@@ -0,0 +1,408 @@
+import bisect
+import contextvars
+import functools
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from .backend import DiarioBackend
+
+# Limiti superiori (in secondi) dei bucket degli istogrammi di latenza
+BUCKET = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Misure aperte nel contesto corrente. Una variabile di contesto, e non del
+# thread, così le chiamate eseguite in un altro thread con copy_context()
+# (ad esempio per i timeout) attribuiscono i byte anche alle misure esterne
+_aperte: contextvars.ContextVar[tuple] = contextvars.ContextVar("misure_aperte", default=())
+
+
+class Istogramma:
+    """Distribuzione delle durate di un'operazione, con bucket cumulativi come in Prometheus"""
+
+    def __init__(self, limiti: Sequence[float] = BUCKET):
+        self.limiti = tuple(limiti)
+        # Un contatore per bucket più quello oltre l'ultimo limite (+Inf)
+        self.conteggi = [0] * (len(self.limiti) + 1)
+        self.totale = 0
+        self.somma = 0.0
+        self.massimo = 0.0
+
+    def osserva(self, durata: float) -> None:
+        self.conteggi[bisect.bisect_left(self.limiti, durata)] += 1
+        self.totale += 1
+        self.somma += durata
+        self.massimo = max(self.massimo, durata)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Stima del quantile per interpolazione lineare nel bucket, come histogram_quantile"""
+        if not self.totale:
+            return None
+        obiettivo = q * self.totale
+        cumulato = 0
+        for i, conteggio in enumerate(self.conteggi):
+            if cumulato + conteggio >= obiettivo and conteggio:
+                inizio = self.limiti[i - 1] if i > 0 else 0.0
+                fine = self.limiti[i] if i < len(self.limiti) else self.massimo
+                return min(inizio + (fine - inizio) * (obiettivo - cumulato) / conteggio, self.massimo)
+            cumulato += conteggio
+        return self.massimo
+
+    def cumulativi(self) -> List[int]:
+        """Conteggi cumulativi per ogni limite, l'ultimo è +Inf"""
+        risultato, cumulato = [], 0
+        for conteggio in self.conteggi:
+            cumulato += conteggio
+            risultato.append(cumulato)
+        return risultato
+
+
+class Metriche:
+    """
+    Registro delle misure delle operazioni sul database e delle fasi dell'app
+
+    Per ogni operazione (ad esempio "db.get_entries_page", "backend.select"
+    o "app.grafici") tiene un Istogramma delle durate, il numero di errori e
+    il totale di righe e di byte restituiti. Come la cache delle letture è
+    condiviso dal processo ed è thread-safe.
+
+    I byte sono quelli dei corpi delle risposte HTTP, attribuiti a tutte le
+    misure aperte nel contesto in cui arriva la risposta (con SQLite non ci
+    sono byte da contare). Accanto alle misure ci sono semplici contatori di
+    eventi, ad esempio i tentativi ripetuti.
+    """
+
+    def __init__(self, attive: bool = True):
+        self.attive = attive
+        self._lock = threading.Lock()
+        self.azzera()
+
+    @classmethod
+    def from_env(cls) -> "Metriche":
+        """Crea il registro, disattivato se DIARIO_METRICHE è 0"""
+        return cls(attive=os.getenv("DIARIO_METRICHE", "1").lower() not in ("0", "false", "no"))
+
+    def azzera(self) -> None:
+        with self._lock:
+            self._operazioni: Dict[str, Dict[str, Any]] = {}
+            self._contatori: Dict[str, int] = {}
+            self.dal = time.time()
+
+    def registra(
+        self,
+        operazione: str,
+        durata: float,
+        righe: Optional[int] = None,
+        byte: Optional[int] = None,
+        errore: bool = False
+    ) -> None:
+        """Aggiunge una misura all'operazione indicata"""
+        if not self.attive:
+            return
+        with self._lock:
+            voce = self._operazioni.get(operazione)
+            if voce is None:
+                voce = self._operazioni[operazione] = {
+                    "istogramma": Istogramma(), "errori": 0, "righe": 0, "byte": 0
+                }
+            voce["istogramma"].osserva(durata)
+            voce["errori"] += errore
+            voce["righe"] += righe or 0
+            voce["byte"] += byte or 0
+
+    def conta(self, evento: str, quanti: int = 1) -> None:
+        """Incrementa il contatore di un evento"""
+        if not self.attive:
+            return
+        with self._lock:
+            self._contatori[evento] = self._contatori.get(evento, 0) + quanti
+
+    @contextmanager
+    def misura(self, operazione: str) -> Iterator[Dict[str, Any]]:
+        """
+        Misura il blocco with come un'operazione
+
+        Il dizionario restituito accetta "righe" ed "errore" dal blocco; se il
+        blocco solleva un'eccezione la misura viene registrata come errore.
+        """
+        if not self.attive:
+            yield {}
+            return
+        misura = {"righe": None, "byte": None, "errore": False}
+        token = _aperte.set(_aperte.get() + (misura,))
+        inizio = time.perf_counter()
+        try:
+            yield misura
+        except BaseException:
+            misura["errore"] = True
+            raise
+        finally:
+            durata = time.perf_counter() - inizio
+            _aperte.reset(token)
+            self.registra(operazione, durata, misura["righe"], misura["byte"], misura["errore"])
+
+    def conta_byte(self, byte: int) -> None:
+        """Attribuisce i byte ricevuti alle misure aperte nel contesto corrente"""
+        with self._lock:
+            for misura in _aperte.get():
+                misura["byte"] = (misura["byte"] or 0) + byte
+
+    def dati(self, cache=None) -> Dict[str, Any]:
+        """
+        Istantanea delle misure, serializzabile in JSON
+
+        Args:
+            cache: QueryCache di cui riportare successi e mancati per funzione
+
+        Returns:
+            Dict con dal (inizio delle misure, epoch), operazioni (una voce per
+            operazione con chiamate, errori, righe, byte, durate in ms e bucket
+            cumulativi), contatori (evento -> numero) e, se indicata, cache
+        """
+        with self._lock:
+            operazioni = []
+            for nome, voce in sorted(self._operazioni.items()):
+                istogramma = voce["istogramma"]
+                operazioni.append({
+                    "operazione": nome,
+                    "chiamate": istogramma.totale,
+                    "errori": voce["errori"],
+                    "righe": voce["righe"],
+                    "byte": voce["byte"],
+                    "totale_ms": istogramma.somma * 1000,
+                    "media_ms": istogramma.somma / istogramma.totale * 1000,
+                    "p50_ms": istogramma.quantile(0.5) * 1000,
+                    "p95_ms": istogramma.quantile(0.95) * 1000,
+                    "max_ms": istogramma.massimo * 1000,
+                    "bucket": dict(zip([str(l) for l in istogramma.limiti] + ["+Inf"], istogramma.cumulativi())),
+                })
+            dati = {"dal": self.dal, "operazioni": operazioni, "contatori": dict(sorted(self._contatori.items()))}
+        if cache is not None:
+            dati["cache"] = cache.statistiche()
+        return dati
+
+    def json(self, cache=None) -> str:
+        return json.dumps(self.dati(cache), indent=2)
+
+    def prometheus(self, cache=None) -> str:
+        """Misure nel formato di esposizione testuale di Prometheus"""
+        dati = self.dati(cache)
+        righe = [
+            "# HELP diario_operazione_secondi Durata delle operazioni",
+            "# TYPE diario_operazione_secondi histogram",
+        ]
+        for voce in dati["operazioni"]:
+            etichetta = f'operazione="{_etichetta(voce["operazione"])}"'
+            for limite, conteggio in voce["bucket"].items():
+                righe.append(f'diario_operazione_secondi_bucket{{{etichetta},le="{limite}"}} {conteggio}')
+            righe.append(f"diario_operazione_secondi_sum{{{etichetta}}} {voce['totale_ms'] / 1000:.6f}")
+            righe.append(f"diario_operazione_secondi_count{{{etichetta}}} {voce['chiamate']}")
+        for nome, descrizione in (("errori", "Operazioni fallite"), ("righe", "Righe restituite"),
+                                  ("byte", "Byte ricevuti dal database")):
+            righe.append(f"# HELP diario_operazione_{nome}_total {descrizione}")
+            righe.append(f"# TYPE diario_operazione_{nome}_total counter")
+            for voce in dati["operazioni"]:
+                righe.append(f'diario_operazione_{nome}_total{{operazione="{_etichetta(voce["operazione"])}"}} '
+                             f"{voce[nome]}")
+        if dati["contatori"]:
+            righe.append("# HELP diario_eventi_total Eventi contati")
+            righe.append("# TYPE diario_eventi_total counter")
+            for evento, numero in dati["contatori"].items():
+                righe.append(f'diario_eventi_total{{evento="{_etichetta(evento)}"}} {numero}')
+        if "cache" in dati:
+            for nome, descrizione in (("hits", "Letture servite dalla cache"),
+                                      ("misses", "Letture non trovate in cache")):
+                righe.append(f"# HELP diario_cache_{nome}_total {descrizione}")
+                righe.append(f"# TYPE diario_cache_{nome}_total counter")
+                for funzione, conteggi in dati["cache"]["funzioni"].items():
+                    righe.append(f'diario_cache_{nome}_total{{funzione="{_etichetta(funzione)}"}} {conteggi[nome]}')
+            righe.append("# TYPE diario_cache_voci gauge")
+            righe.append(f"diario_cache_voci {dati['cache']['voci']}")
+        return "\n".join(righe) + "\n"
+
+
+def _etichetta(valore: str) -> str:
+    return valore.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _righe(risultato: Any) -> Optional[int]:
+    """Righe di un risultato di DiarioAlimentareDB o di una primitiva del backend"""
+    if isinstance(risultato, list):
+        return len(risultato)
+    if isinstance(risultato, dict):
+        dati = risultato.get("data")
+        if isinstance(dati, list):
+            return len(dati)
+        if "success" in risultato and isinstance(risultato.get("count"), int):
+            return risultato["count"]
+    return None
+
+
+def strumentato(metriche: Metriche, prefisso: str = "db") -> Callable[[Callable], Callable]:
+    """
+    Decoratore che misura ogni chiamata come l'operazione "<prefisso>.<nome>"
+
+    Un risultato {"success": False, ...} viene contato come errore. Gli
+    attributi della funzione decorata (ad esempio cache_key) restano
+    accessibili.
+    """
+    def decoratore(func: Callable) -> Callable:
+        operazione = f"{prefisso}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metriche.attive:
+                return func(*args, **kwargs)
+            with metriche.misura(operazione) as misura:
+                risultato = func(*args, **kwargs)
+                misura["righe"] = _righe(risultato)
+                misura["errore"] = isinstance(risultato, dict) and risultato.get("success") is False
+                return risultato
+
+        return wrapper
+    return decoratore
+
+
+class BackendMisurato(DiarioBackend):
+    """
+    Backend che misura le primitive di un altro backend ("backend.select", ...)
+
+    Con Supabase aggiunge ai client HTTP di PostgREST (quello della chiave e
+    quelli delle sessioni aperte con sign_in) un hook sulle risposte che ne
+    conta i byte. Gli altri attributi (ad esempio close di
+    SQLiteBackend) vengono inoltrati al backend misurato.
+    """
+
+    def __init__(self, backend: DiarioBackend, metriche: Metriche):
+        self.misurato = backend
+        self.metriche = metriche
+        self.nome = backend.nome
+        self.timeout_proprio = backend.timeout_proprio
+
+    def _chiama(self, primitiva: str, *args, **kwargs) -> Any:
+        self._installa_hook()
+        with self.metriche.misura(f"backend.{primitiva}") as misura:
+            risultato = getattr(self.misurato, primitiva)(*args, **kwargs)
+            misura["righe"] = _righe(risultato)
+            return risultato
+
+    def _installa_hook(self) -> None:
+        # Il client supabase può ricreare quello di PostgREST (ad esempio al
+        # rinnovo del token) e sign_in aggiunge i client delle sessioni, quindi
+        # l'hook viene controllato a ogni chiamata su tutti i client
+        try:
+            clienti = self.misurato.clienti()
+        except AttributeError:
+            return
+        for client in clienti:
+            try:
+                hooks = client.postgrest.session.event_hooks["response"]
+            except (AttributeError, KeyError, TypeError):
+                continue
+            if self._conta_risposta not in hooks:
+                hooks.append(self._conta_risposta)
+
+    def _conta_risposta(self, risposta) -> None:
+        risposta.read()
+        self.metriche.conta_byte(len(risposta.content))
+
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.misurato, nome)
+
+    def select(self, *args, **kwargs):
+        return self._chiama("select", *args, **kwargs)
+
+    def count(self, *args, **kwargs):
+        return self._chiama("count", *args, **kwargs)
+
+    def insert(self, *args, **kwargs):
+        return self._chiama("insert", *args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._chiama("upsert", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._chiama("update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._chiama("delete", *args, **kwargs)
+
+    def search(self, *args, **kwargs):
+        return self._chiama("search", *args, **kwargs)
+
+    def statistics(self, *args, **kwargs):
+        return self._chiama("statistics", *args, **kwargs)
+
+    def summary(self, *args, **kwargs):
+        return self._chiama("summary", *args, **kwargs)
+
+    def checksum(self, *args, **kwargs):
+        return self._chiama("checksum", *args, **kwargs)
+
+    def subscribe(self, *args, **kwargs):
+        return self.misurato.subscribe(*args, **kwargs)
+
+    def now(self):
+        return self._chiama("now")
+
+    def sign_in(self, *args, **kwargs):
+        return self._chiama("sign_in", *args, **kwargs)
+
+    def sign_out(self):
+        return self._chiama("sign_out")
+
+
+class Profilo:
+    """
+    Profilazione di un'esecuzione dello script Streamlit
+
+    motore è "cProfile" (libreria standard) oppure "pyinstrument", che va
+    installato a parte e viene importato solo quando richiesto.
+    """
+
+    MOTORI = ("cProfile", "pyinstrument")
+
+    def __init__(self, motore: str = "cProfile"):
+        if motore not in self.MOTORI:
+            raise ValueError(f"Profilatore sconosciuto: {motore} (valori ammessi: {', '.join(self.MOTORI)})")
+        self.motore = motore
+        # Pagina dell'app profilata, indicata dal chiamante
+        self.pagina = None
+        if motore == "pyinstrument":
+            from pyinstrument import Profiler
+            self._profilatore = Profiler()
+        else:
+            import cProfile
+            self._profilatore = cProfile.Profile()
+        self._inizio = None
+
+    def avvia(self) -> "Profilo":
+        self._inizio = time.perf_counter()
+        if self.motore == "pyinstrument":
+            self._profilatore.start()
+        else:
+            self._profilatore.enable()
+        return self
+
+    def ferma(self, righe: int = 40) -> Dict[str, Any]:
+        """
+        Ferma la profilazione
+
+        Returns:
+            Dict con motore, durata_ms e report testuale (per cProfile le
+            righe funzioni con il tempo cumulativo più alto)
+        """
+        durata = time.perf_counter() - self._inizio
+        if self.motore == "pyinstrument":
+            self._profilatore.stop()
+            report = self._profilatore.output_text(unicode=True)
+        else:
+            import pstats
+            self._profilatore.disable()
+            testo = io.StringIO()
+            pstats.Stats(self._profilatore, stream=testo).sort_stats("cumulative").print_stats(righe)
+            report = testo.getvalue()
+        return {"motore": self.motore, "durata_ms": durata * 1000, "report": report}
@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from .backend import DiarioBackend
+
+
+def piu_recente(nuova: Dict[str, Any], attuale: Optional[Dict[str, Any]], colonna: Optional[str] = "updated_at") -> bool:
+    """
+    Indica se la riga notificata non è più vecchia di quella già in memoria
+
+    Una notifica può arrivare dopo che una sincronizzazione ha già letto una
+    versione successiva della stessa voce: in quel caso va ignorata.
+    """
+    if attuale is None or not colonna or not nuova.get(colonna) or not attuale.get(colonna):
+        return True
+    istanti = [datetime.fromisoformat(str(riga[colonna]).replace("Z", "+00:00")) for riga in (nuova, attuale)]
+    return istanti[0] >= istanti[1]
+
+
+class FlussoModifiche:
+    """
+    Sottoscrizione alle modifiche della tabella, condivisa dal processo
+
+    Le notifiche del backend (inserimenti, modifiche ed eliminazioni fatti da
+    qualunque sessione o dispositivo) vengono messe in coda e applicate da un
+    thread dedicato, così il backend non attende mai chi le elabora. Finché la
+    sottoscrizione resta attiva, le copie locali sincronizzate dopo il suo
+    avvio ricevono ogni modifica e non hanno bisogno di rileggere le novità
+    dal server (vedi copre).
+    """
+
+    def __init__(
+        self,
+        applica: Callable[[str, Dict[str, Any]], None],
+        attivo: bool = True,
+        verifica: float = 300.0
+    ):
+        """
+        Args:
+            applica: Funzione chiamata con (evento, riga) per ogni modifica notificata
+            attivo: False disattiva la sottoscrizione (si torna alla sola lettura delle novità)
+            verifica: Secondi dopo i quali una copia locale viene comunque
+                riallineata al server, anche con la sottoscrizione attiva
+        """
+        self.applica = applica
+        self.attivo = attivo
+        self.verifica = verifica
+        self.eventi = 0
+        self.errori = 0
+        self.ultimo_evento: Optional[float] = None
+        self.ultimo_errore: Optional[str] = None
+        # Istante (monotonic) da cui la sottoscrizione è ininterrotta, None se non è attiva
+        self.connesso_dal: Optional[float] = None
+        self.disponibile: Optional[bool] = None
+        self._annulla: Optional[Callable[[], None]] = None
+        self._backend: Optional[DiarioBackend] = None
+        self._coda: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, applica: Callable[[str, Dict[str, Any]], None]) -> "FlussoModifiche":
+        """Crea il flusso leggendo DIARIO_TEMPO_REALE e DIARIO_TEMPO_REALE_VERIFICA"""
+        return cls(
+            applica,
+            attivo=os.getenv("DIARIO_TEMPO_REALE", "1") != "0",
+            verifica=float(os.getenv("DIARIO_TEMPO_REALE_VERIFICA", "300")),
+        )
+
+    def avvia(self, backend: DiarioBackend) -> bool:
+        """
+        Si iscrive alle modifiche del backend, se non lo ha già fatto
+
+        Returns:
+            True se la sottoscrizione è stata richiesta (anche se non ancora
+            attiva), False se è disattivata o il backend non la supporta
+        """
+        if not self.attivo:
+            return False
+        with self._lock:
+            if self._backend is backend:
+                return bool(self.disponibile)
+            self._ferma()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._ciclo, name="diario-tempo-reale", daemon=True)
+                self._thread.start()
+            self._backend = backend
+            try:
+                self._annulla = backend.subscribe(self._ricevi, self._stato)
+                self.disponibile = True
+            except NotImplementedError:
+                self.disponibile = False
+            except Exception as e:
+                self.disponibile = False
+                self.ultimo_errore = str(e)
+            return bool(self.disponibile)
+
+    def ferma(self) -> None:
+        """Annulla la sottoscrizione (ad esempio quando cambia il backend)"""
+        with self._lock:
+            self._ferma()
+
+    def _ferma(self) -> None:
+        annulla, self._annulla, self._backend = self._annulla, None, None
+        self.connesso_dal = None
+        self.disponibile = None
+        if annulla is not None:
+            try:
+                annulla()
+            except Exception as e:
+                self.ultimo_errore = str(e)
+
+    def _stato(self, connesso: bool) -> None:
+        # Chi si è sincronizzato prima della (ri)connessione può aver perso
+        # delle modifiche: copre() vale solo per le sincronizzazioni successive
+        self.connesso_dal = time.monotonic() if connesso else None
+
+    def _ricevi(self, evento: str, riga: Dict[str, Any]) -> None:
+        self._coda.put((evento, riga))
+
+    def _ciclo(self) -> None:
+        while True:
+            evento, riga = self._coda.get()
+            try:
+                self.applica(evento, riga)
+                self.eventi += 1
+                self.ultimo_evento = time.time()
+            except Exception as e:
+                self.errori += 1
+                self.ultimo_errore = str(e)
+            finally:
+                self._coda.task_done()
+
+    def attendi(self) -> None:
+        """Attende che le modifiche già ricevute siano state applicate"""
+        self._coda.join()
+
+    def copre(self, inizio_sync: float) -> bool:
+        """
+        Indica se una copia locale sincronizzata a partire da inizio_sync
+        (monotonic) è tenuta aggiornata dalla sottoscrizione
+        """
+        connesso_dal = self.connesso_dal
+        return (connesso_dal is not None and inizio_sync >= connesso_dal
+                and time.monotonic() - inizio_sync < self.verifica)
+
+    def stato(self) -> Dict[str, Any]:
+        """Stato della sottoscrizione, per la pagina Diagnostica"""
+        if not self.attivo:
+            stato = "disattivato"
+        elif self.disponibile is False:
+            stato = "non disponibile"
+        elif self.connesso_dal is not None:
+            stato = "connesso"
+        elif self.disponibile:
+            stato = "in connessione"
+        else:
+            stato = "non avviato"
+        return {
+            "stato": stato,
+            "eventi": self.eventi,
+            "errori": self.errori,
+            "in_coda": self._coda.qsize(),
+            "ultimo_evento": self.ultimo_evento,
+            "ultimo_errore": self.ultimo_errore,
+        }
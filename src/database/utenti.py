@@ -0,0 +1,240 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from .aggregati import RollupDiario
+from .backend import COLONNA_UTENTE, UTENTE_PREDEFINITO, DiarioBackend, Filtro, Ordine
+from .catalogo import CatalogoAlimenti
+from .risposta_glicemica import RispostaGlicemica
+from .sincronizzazione import SnapshotDiario
+
+# Utente a cui si riferiscono le chiamate del contesto corrente (thread o
+# esecuzione dello script Streamlit); None indica quello predefinito
+_utente: ContextVar[Optional[str]] = ContextVar("utente", default=None)
+# Accesso (login) del contesto corrente, ad esempio la sessione Streamlit: con
+# l'autenticazione il backend usa il client della sessione aperta da questo
+# accesso con sign_in, mai quella aperta da un altro; None se non c'è
+_accesso: ContextVar[Optional[str]] = ContextVar("accesso", default=None)
+
+T = TypeVar("T")
+
+
+def utente_predefinito() -> str:
+    """Utente predefinito, da DIARIO_UTENTE (letta a ogni chiamata, dopo il caricamento del file .env)"""
+    return os.getenv("DIARIO_UTENTE") or UTENTE_PREDEFINITO
+
+
+def utente_corrente() -> str:
+    """Utente a cui sono riferite letture e scritture nel contesto corrente"""
+    return _utente.get() or utente_predefinito()
+
+
+def imposta_utente(utente: Optional[str]) -> None:
+    """Imposta l'utente per il resto del contesto corrente (None torna a quello predefinito)"""
+    _utente.set(str(utente) if utente else None)
+
+
+@contextmanager
+def come_utente(utente: Optional[str]) -> Iterator[str]:
+    """Esegue il blocco per conto dell'utente indicato, ripristinando poi quello precedente"""
+    token = _utente.set(str(utente) if utente else None)
+    try:
+        yield utente_corrente()
+    finally:
+        _utente.reset(token)
+
+
+def accesso_corrente() -> Optional[str]:
+    """Accesso (login) del contesto corrente, None se non è stato impostato"""
+    return _accesso.get()
+
+
+def imposta_accesso(accesso: Optional[str]) -> None:
+    """Imposta l'accesso per il resto del contesto corrente"""
+    _accesso.set(str(accesso) if accesso else None)
+
+
+@contextmanager
+def con_accesso(accesso: Optional[str]) -> Iterator[Optional[str]]:
+    """Esegue il blocco con l'accesso indicato, ripristinando poi quello precedente"""
+    token = _accesso.set(str(accesso) if accesso else None)
+    try:
+        yield accesso_corrente()
+    finally:
+        _accesso.reset(token)
+
+
+class PerUtente(Generic[T]):
+    """
+    Un oggetto per ogni utente, creato al primo utilizzo
+
+    Restano in memoria gli oggetti dei max_utenti usati più di recente: gli
+    altri vengono scartati e ricreati (vuoti) se l'utente torna.
+    """
+
+    def __init__(self, fabbrica: Callable[[], T], max_utenti: int = 50):
+        self.fabbrica = fabbrica
+        self.max_utenti = max_utenti
+        self._oggetti: "OrderedDict[str, T]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def di(self, utente: Optional[str] = None) -> T:
+        """Oggetto dell'utente indicato (default quello corrente)"""
+        utente = utente or utente_corrente()
+        with self._lock:
+            oggetto = self._oggetti.get(utente)
+            if oggetto is None:
+                oggetto = self._oggetti[utente] = self.fabbrica()
+                while len(self._oggetti) > max(1, self.max_utenti):
+                    self._oggetti.popitem(last=False)
+            else:
+                self._oggetti.move_to_end(utente)
+            return oggetto
+
+    def corrente(self) -> T:
+        return self.di()
+
+    def presente(self, utente: str) -> Optional[T]:
+        """Oggetto dell'utente se è già in memoria, senza crearlo"""
+        with self._lock:
+            return self._oggetti.get(utente)
+
+    def elementi(self) -> List[Tuple[str, T]]:
+        """Coppie (utente, oggetto) in memoria"""
+        with self._lock:
+            return list(self._oggetti.items())
+
+    def azzera(self) -> None:
+        """Scarta gli oggetti di tutti gli utenti"""
+        with self._lock:
+            self._oggetti.clear()
+
+    def __len__(self) -> int:
+        return len(self._oggetti)
+
+
+class StatoUtente:
+    """Copia locale del diario di un utente e aggregati che ne derivano"""
+
+    def __init__(self):
+        self.snapshot = SnapshotDiario.from_env()
+        # Aggregati e risposta glicemica per la pagina Analisi e catalogo per
+        # i suggerimenti, aggiornati dallo snapshot a ogni cambiamento
+        self.rollup = RollupDiario()
+        self.risposta = RispostaGlicemica()
+        self.catalogo = CatalogoAlimenti()
+        self.snapshot.osservatori.extend([self.rollup, self.risposta, self.catalogo])
+        # Modifiche notificate mentre lo snapshot non era caricato (ad esempio
+        # per chi consulta solo la tabella paginata, letta dalla cache)
+        self.notifiche = 0
+
+
+class BackendUtente(DiarioBackend):
+    """
+    Limita ogni richiesta al backend alle voci dell'utente corrente
+
+    Letture, conteggi, modifiche ed eliminazioni ricevono il filtro sulla
+    colonna user_id, le righe inserite la ricevono con l'utente corrente e
+    statistiche, riepilogo, ricerca e checksum sono calcolati solo sulle sue
+    voci. Un upsert non può sovrascrivere (per id) voci di un altro utente.
+    subscribe invece notifica le modifiche di tutti gli utenti: è il flusso
+    delle modifiche (tempo_reale.py) a recapitarle allo stato di ciascuno.
+    """
+
+    def __init__(self, backend: DiarioBackend):
+        self.protetto = backend
+        self.nome = backend.nome
+        self.timeout_proprio = backend.timeout_proprio
+
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.protetto, nome)
+
+    @staticmethod
+    def _filtri(filtri: Sequence[Filtro]) -> List[Filtro]:
+        return [(COLONNA_UTENTE, "eq", utente_corrente()), *filtri]
+
+    @staticmethod
+    def _righe(righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        utente = utente_corrente()
+        for riga in righe:
+            if riga.get(COLONNA_UTENTE) not in (None, utente):
+                raise PermissionError(f"Voce di un altro utente: {riga.get(COLONNA_UTENTE)}")
+        return [{**riga, COLONNA_UTENTE: utente} for riga in righe]
+
+    def select(
+        self,
+        colonne: str = "*",
+        filtri: Sequence[Filtro] = (),
+        ordine: Sequence[Ordine] = (),
+        limit: Optional[int] = None,
+        offset: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return self.protetto.select(colonne, self._filtri(filtri), ordine, limit, offset)
+
+    def count(self, filtri: Sequence[Filtro] = ()) -> int:
+        return self.protetto.count(self._filtri(filtri))
+
+    def insert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self.protetto.insert(self._righe(righe))
+
+    def upsert(self, righe: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        righe = self._righe(righe)
+        ids = [riga["id"] for riga in righe if riga.get("id") is not None]
+        if ids:
+            altrui = self.protetto.select("id", [("id", "in", ids), (COLONNA_UTENTE, "neq", utente_corrente())])
+            if altrui:
+                raise PermissionError(f"Voci di un altro utente: {', '.join(str(r['id']) for r in altrui)}")
+        return self.protetto.upsert(righe)
+
+    def update(self, valori: Dict[str, Any], filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        if valori.get(COLONNA_UTENTE, utente_corrente()) != utente_corrente():
+            raise PermissionError("Una voce non può essere spostata a un altro utente")
+        return self.protetto.update(valori, self._filtri(filtri))
+
+    def delete(self, filtri: Sequence[Filtro]) -> List[Dict[str, Any]]:
+        return self.protetto.delete(self._filtri(filtri))
+
+    def search(
+        self,
+        termine: str,
+        campi: Sequence[str] = ("alimento",),
+        limit: int = 50,
+        utente: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        return self.protetto.search(termine, campi, limit, utente=utente_corrente())
+
+    def statistics(self, utente: Optional[str] = None) -> Dict[str, Any]:
+        return self.protetto.statistics(utente=utente_corrente())
+
+    def summary(
+        self,
+        data_da: Optional[str] = None,
+        data_a: Optional[str] = None,
+        pasto: Optional[str] = None,
+        alimento: Optional[str] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return self.protetto.summary(data_da, data_a, pasto, alimento, utente=utente_corrente())
+
+    def checksum(
+        self,
+        id_min: Optional[int] = None,
+        id_max: Optional[int] = None,
+        utente: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return self.protetto.checksum(id_min, id_max, utente=utente_corrente())
+
+    def subscribe(self, *args, **kwargs):
+        return self.protetto.subscribe(*args, **kwargs)
+
+    def now(self):
+        return self.protetto.now()
+
+    def sign_in(self, email: str, password: str) -> List[str]:
+        return self.protetto.sign_in(email, password)
+
+    def sign_out(self) -> None:
+        return self.protetto.sign_out()
@@ -1,9 +1,15 @@
+import os
+import time
+import uuid
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date
-import plotly.express as px
 from database.diario_alimentare import DiarioAlimentareDB
-import io
+from database.conversione import COLONNE, voci_a_dataframe
+from database.esportazione import FORMATI, cache_esportazioni
+from database.grafici import PUNTI_MARCATORI, figura_in_cache, raggruppa, riduci
+from database.risposta_glicemica import MISURE_TENDENZA, TARGET
+from database.strumentazione import Profilo
 
 # Configurazione della pagina
 st.set_page_config(
@@ -13,61 +19,342 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Misure delle fasi dell'app, insieme a quelle delle chiamate al database
+metriche = DiarioAlimentareDB.metriche
+inizio_esecuzione = time.perf_counter()
+
+# Profilazione delle esecuzioni, attivata dalla pagina Diagnostica. Il profilo
+# si chiude a fine script o, se l'esecuzione è stata interrotta (st.rerun,
+# st.stop), all'inizio della successiva
+def chiudi_profilo():
+    profilo = st.session_state.pop("profilo_in_corso", None)
+    if profilo is None:
+        return
+    try:
+        st.session_state["ultimo_profilo"] = {"pagina": profilo.pagina, **profilo.ferma()}
+    except Exception as e:
+        st.session_state["errore_profilo"] = f"Impossibile chiudere il profilo: {e}"
+
+chiudi_profilo()
+if st.session_state.get("profilatore"):
+    try:
+        st.session_state["profilo_in_corso"] = Profilo(st.session_state["profilatore"]).avvia()
+    except ImportError:
+        st.session_state["profilatore"] = None
+        st.session_state["errore_profilo"] = "pyinstrument non è installato (pip install pyinstrument)"
+    except ValueError as e:
+        # Con Python 3.12 un solo profilatore alla volta per processo
+        st.session_state["errore_profilo"] = f"Profilazione non avviata: {e}"
+
 # Titolo principale
 st.title("🍽️ Diario Alimentare")
 st.markdown("---")
 
+# Paziente di cui si consulta il diario: con DIARIO_MULTIUTENTE=1 si accede
+# con un account del database, che (con le policy di sql/008_rls.sql) vede
+# solo le sue voci e quelle dei pazienti che gli sono assegnati; altrimenti è
+# l'utente predefinito (DIARIO_UTENTE). Tutte le letture e scritture di questa
+# esecuzione si riferiscono solo alle sue voci
+if os.getenv("DIARIO_MULTIUTENTE") == "1":
+    # La sessione aperta con l'accesso appartiene solo a questa sessione Streamlit
+    DiarioAlimentareDB.set_login(st.session_state.setdefault("accesso", str(uuid.uuid4())))
+    if "utenti_autorizzati" not in st.session_state:
+        with st.sidebar.form("accesso"):
+            st.markdown("### 🔐 Accesso")
+            email = st.text_input("Email")
+            password = st.text_input("Password", type="password")
+            entra = st.form_submit_button("Entra")
+        if entra:
+            esito = DiarioAlimentareDB.sign_in(email.strip(), password)
+            if esito["success"]:
+                st.session_state["utenti_autorizzati"] = esito["data"]
+                st.rerun()
+            st.sidebar.error(f"Accesso non riuscito: {esito['error']}")
+        st.info("Accedi dalla barra laterale per consultare il diario")
+        st.stop()
+    utenti = st.session_state["utenti_autorizzati"]
+    paziente = st.sidebar.selectbox(
+        "👤 Paziente", utenti, key="paziente",
+        help="Paziente di cui consultare e modificare il diario, tra quelli assegnati all'account"
+    ) if len(utenti) > 1 else utenti[0]
+    DiarioAlimentareDB.set_user(paziente)
+    if st.sidebar.button("🚪 Esci"):
+        DiarioAlimentareDB.sign_out()
+        for chiave in ("utenti_autorizzati", "paziente", "accesso"):
+            st.session_state.pop(chiave, None)
+        st.rerun()
+st.session_state["utente"] = DiarioAlimentareDB.get_user()
+
 # Sidebar per la navigazione
 st.sidebar.title("Navigazione")
+# La pagina Diagnostica compare solo aprendo l'app con ?diagnostica nell'indirizzo
+diagnostica = ["🩺 Diagnostica"] if "diagnostica" in st.query_params else []
 toggle=st.sidebar.toggle("Visualizza Dati",value=True,key="visualizza_dati")
 if not toggle:
     pagina = st.sidebar.selectbox(
         "Seleziona una pagina:",
         ["📝 Aggiungi Record", "📊 Visualizza Dati", "✏️ Modifica Record", "🗑️ Elimina Record", "📈 Analisi"]
+        + diagnostica
     )
 if toggle:
     pagina = st.sidebar.selectbox(
         "Seleziona una pagina:",
-        ["📊 Visualizza Dati", "📈 Analisi"]
+        ["📊 Visualizza Dati", "📈 Analisi"] + diagnostica
+    )
+if "profilo_in_corso" in st.session_state:
+    st.session_state["profilo_in_corso"].pagina = pagina
+if st.sidebar.button("🔄 Ricarica dati", help="Svuota la cache e rilegge i dati dal database"):
+    DiarioAlimentareDB.cache.invalidate()
+    DiarioAlimentareDB.stati.corrente().snapshot.reset()
+
+def descrivi_operazione(operazione):
+    valori = operazione["valori"]
+    if operazione["operazione"] == "crea":
+        return f"➕ {valori.get('alimento') or 'Nuovo record'} del {pd.Timestamp(valori['data']).strftime('%d/%m/%Y')}"
+    # Una voce creata in coda e non ancora inviata non ha un ID
+    voce = operazione["entry_id"] or "in coda"
+    if operazione["operazione"] == "aggiorna":
+        return f"✏️ Modifica del record {voce}"
+    return f"🗑️ Eliminazione del record {voce}"
+
+# Stato delle scritture in coda: le inserisce, modifica ed elimina il thread
+# di invio in background; il riquadro si aggiorna da solo ogni pochi secondi
+@st.fragment(run_every=5)
+def stato_coda():
+    # Il frammento si riesegue da solo, senza la parte dello script che sceglie il paziente
+    DiarioAlimentareDB.set_login(st.session_state.get("accesso"))
+    DiarioAlimentareDB.set_user(st.session_state.get("utente"))
+    stato = DiarioAlimentareDB.get_queue_status()
+    if not stato["success"]:
+        st.warning(f"Coda delle modifiche non disponibile: {stato['error']}")
+        return
+    # Appena la coda si svuota si riesegue l'app, così i dati mostrati includono le modifiche
+    precedenti = st.session_state.get("modifiche_in_coda", 0)
+    st.session_state["modifiche_in_coda"] = stato["pending"]
+    if precedenti and not stato["pending"]:
+        st.rerun()
+    
+    if stato["pending"]:
+        st.info(f"🕓 {stato['pending']} modifiche in attesa di invio")
+        esito = stato["last_result"]
+        if esito and not esito["success"]:
+            st.caption(f"Ultimo tentativo non riuscito: {esito['error']}")
+        if st.button("📤 Invia ora", key="invia_coda"):
+            esito = DiarioAlimentareDB.flush_queue()
+            if not esito["success"]:
+                st.error(f"Invio non riuscito: {esito['error']}")
+            else:
+                st.rerun()
+    elif not stato["conflicts"] and not stato["errors"]:
+        st.caption("✅ Tutte le modifiche sono salvate")
+    
+    bloccate = [op for op in stato["data"] if op["stato"] != "in_attesa"]
+    if bloccate:
+        st.warning(f"⚠️ {len(bloccate)} modifiche non inviate")
+    if stato["data"]:
+        with st.expander("Modifiche in coda", expanded=bool(bloccate)):
+            for operazione in stato["data"]:
+                st.write(descrivi_operazione(operazione))
+                if operazione["stato"] == "in_attesa":
+                    continue
+                st.caption(operazione["errore"])
+                col1, col2 = st.columns(2)
+                with col1:
+                    # Una modifica in conflitto con la versione letta si può imporre su quella del server
+                    sovrascrivi = operazione["stato"] == "conflitto" and operazione["base"] is not None
+                    if st.button("Sovrascrivi" if sovrascrivi else "Riprova", key=f"riprova_{operazione['seq']}"):
+                        DiarioAlimentareDB.retry_queued(operazione["seq"], overwrite=sovrascrivi)
+                        st.rerun()
+                with col2:
+                    if st.button("Scarta", key=f"scarta_{operazione['seq']}"):
+                        DiarioAlimentareDB.discard_queued(operazione["seq"])
+                        st.rerun()
+
+# Pagine che mostrano i dati del diario: vengono ridisegnate quando cambiano
+PAGINE_DATI = ["📊 Visualizza Dati", "📈 Analisi"]
+
+# Aggiornamenti in tempo reale: le modifiche fatte da altre sessioni o da altri
+# dispositivi arrivano allo snapshot dal flusso delle modifiche; se i dati sono
+# cambiati da quando la pagina è stata disegnata l'app si riesegue. Il frammento
+# è inserito a fine script, dopo aver registrato la versione mostrata
+@st.fragment(run_every=2)
+def aggiornamenti():
+    DiarioAlimentareDB.set_login(st.session_state.get("accesso"))
+    DiarioAlimentareDB.set_user(st.session_state.get("utente"))
+    mostrata = st.session_state.get("versione_mostrata")
+    if mostrata is not None and mostrata != DiarioAlimentareDB.get_data_version():
+        st.rerun()
+
+with st.sidebar:
+    stato_coda()
+
+PASTI = ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"]
+
+# Esportazione: i dati vengono caricati e il file generato solo quando
+# l'utente lo richiede; il file è riusato finché i dati non cambiano
+def mostra_esportazione():
+    col_formato, col_prepara = st.columns([2, 1])
+    with col_formato:
+        formato = st.selectbox("Formato di esportazione", list(FORMATI),
+                               format_func=lambda f: FORMATI[f][0])
+    with col_prepara:
+        st.write("")
+        if st.button("📦 Prepara file", use_container_width=True):
+            st.session_state["esportazione"] = formato
+    
+    if st.session_state.get("esportazione") == formato:
+        etichetta, estensione, mime = FORMATI[formato]
+        df = ottieni_dati_come_df()
+        if df.empty:
+            return
+        versione = st.session_state.get("df_diario", (None, None))[0]
+        try:
+            with metriche.misura(f"app.esportazione.{formato}"):
+                contenuto = cache_esportazioni.esporta(versione, df, formato)
+        except Exception as e:
+            st.error(f"Errore durante l'esportazione: {e}")
+            return
+        st.download_button(
+            label=f"📥 Scarica come {etichetta}",
+            data=contenuto,
+            file_name=f"diario_alimentare_{datetime.now().strftime('%Y%m%d')}.{estensione}",
+            mime=mime
+        )
+
+# Grafici della pagina Analisi: la costruzione delle figure plotly e il loro
+# invio al browser (serializzazione in JSON) sono misurati separatamente. Con
+# una chiave la figura viene ricostruita solo se cambiano i dati
+# (versione_grafici, letta prima degli aggregati) o i parametri nella chiave
+def figura(crea, *args, chiave=None, **kwargs):
+    def costruisci():
+        with metriche.misura("app.grafici.figure"):
+            return crea(*args, **kwargs)
+    if chiave is None:
+        return costruisci()
+    return figura_in_cache(chiave, versione_grafici, costruisci)
+
+def mostra_grafico(grafico):
+    with metriche.misura("app.grafici.invio"):
+        st.plotly_chart(grafico, use_container_width=True)
+
+UNITA_MISURA = ["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"]
+
+# Suggerimenti del catalogo nella pagina Aggiungi Record: scegliendone uno si
+# precompilano alimento, unità, quantità e carboidrati abituali
+def descrivi_suggerimento(voce):
+    if voce is None:
+        return "Scegli un alimento già registrato..."
+    dettagli = [f"{voce['quantita']} {voce['unita_misura'] or ''}".strip()] if voce["quantita"] else []
+    if voce["carboidrati"] is not None:
+        dettagli.append(f"{voce['carboidrati']:g} g carboidrati")
+    return f"{voce['alimento']} ({', '.join(dettagli)})" if dettagli else voce["alimento"]
+
+def applica_suggerimento():
+    voce = st.session_state.get("nuovo_suggerimento")
+    if voce is None:
+        return
+    st.session_state["nuovo_alimento"] = voce["alimento"]
+    if voce["unita_misura"]:
+        st.session_state["nuova_unita"] = voce["unita_misura"]
+    if voce["quantita"]:
+        st.session_state["nuova_quantita"] = int(voce["quantita"])
+    if voce["carboidrati"] is not None:
+        st.session_state["nuovi_carboidrati"] = float(voce["carboidrati"])
+    st.session_state["nuovo_suggerimento"] = None
+
+def calcola_carboidrati(per_unita):
+    quantita = st.session_state.get("nuova_quantita") or 0
+    st.session_state["nuovi_carboidrati"] = round(per_unita * quantita, 1)
+
+# Voci mostrate al massimo dal selettore dei record
+LIMITE_RICERCA = 50
+
+# Selettore dei record per Modifica ed Elimina: cerca al massimo LIMITE_RICERCA
+# voci per alimento, giorno o ID e legge solo quella scelta, quindi il costo
+# non dipende dalla dimensione del diario
+def seleziona_record(etichetta, chiave):
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        testo = st.text_input("Cerca per alimento o ID", key=f"{chiave}_cerca",
+                              placeholder="es. pasta oppure 125").strip()
+    with col2:
+        giorno = st.date_input("Giorno", value=None, key=f"{chiave}_giorno")
+    
+    # I risultati arrivano dalla cache delle letture: vanno solo letti, mai modificati
+    if testo.isdigit():
+        risultato = DiarioAlimentareDB.get_entry_by_id(int(testo))
+        if not risultato["success"] and risultato["error"] == "Voce non trovata":
+            risultato = {"success": True, "data": None}
+        trovate = [risultato["data"]] if risultato["success"] and risultato["data"] else []
+    elif giorno is not None:
+        risultato = DiarioAlimentareDB.get_entries_by_date_range(
+            datetime.combine(giorno, datetime.min.time()), datetime.combine(giorno, datetime.max.time()),
+            limit=LIMITE_RICERCA
+        )
+        trovate = [v for v in risultato.get("data", []) if testo.lower() in (v.get("alimento") or "").lower()]
+    elif testo:
+        risultato = DiarioAlimentareDB.search_entries(testo, limit=LIMITE_RICERCA)
+        trovate = risultato.get("data", [])
+    else:
+        risultato = DiarioAlimentareDB.get_all_entries(limit=LIMITE_RICERCA)
+        trovate = risultato.get("data", [])
+    
+    if not risultato["success"]:
+        st.error(f"Errore nel recuperare i dati: {risultato['error']}")
+        return None
+    if not trovate:
+        st.info("Nessun record trovato.")
+        return None
+    
+    voci = {voce["id"]: voce for voce in trovate}
+    if risultato.get("truncated"):
+        st.caption(f"Sono mostrati i {LIMITE_RICERCA} record più pertinenti: affina la ricerca per trovarne altri.")
+    elif "truncated" not in risultato and len(voci) >= LIMITE_RICERCA:
+        st.caption(f"Sono mostrati i {LIMITE_RICERCA} record più recenti: affina la ricerca per trovarne altri.")
+    entry_id = st.selectbox(
+        etichetta,
+        options=list(voci),
+        format_func=lambda x: f"ID {x} - {pd.Timestamp(voci[x]['data']).strftime('%d/%m/%Y')} - {voci[x].get('alimento')}",
+        key=f"{chiave}_record"
     )
-# Funzione per convertire DataFrame in Excel
-def converti_in_excel(df):
-    output = io.BytesIO()
-    df["Data"]=pd.to_datetime(df["Data"])
-    df.to_excel(output, index=False, sheet_name='Diario_Alimentare')
-    return output.getvalue()
+    
+    risultato = DiarioAlimentareDB.get_entry_by_id(entry_id)
+    if not risultato["success"]:
+        st.error(f"Errore nel recuperare il record: {risultato['error']}")
+        return None
+    # Versione (updated_at) del record quando è stato scelto: resta la stessa
+    # nelle esecuzioni successive, così una modifica fatta altrove nel
+    # frattempo, anche mentre si è offline, manda in conflitto il salvataggio.
+    # Con una modifica del record ancora in coda la versione letta non è quella
+    # che avrà dopo l'invio: si registra quando la coda l'ha inviata
+    versioni = st.session_state.setdefault(f"{chiave}_versioni", {})
+    if entry_id not in versioni:
+        versioni.clear()
+        in_coda = {op["entry_id"] for op in DiarioAlimentareDB.get_queue_status().get("data", [])}
+        if entry_id not in in_coda:
+            versioni[entry_id] = risultato["data"].get("updated_at")
+    # I valori mancanti (pd.NA) diventano None per i widget; formato esteso
+    # perché i valori tornano nel database così come sono mostrati
+    record = voci_a_dataframe([risultato["data"]], formato="esteso").iloc[0].astype(object)
+    return record.where(record.notna(), None)
 
 # Funzione per ottenere tutti i dati come DataFrame
 def ottieni_dati_come_df():
     try:
-        risultato = DiarioAlimentareDB.get_all_entries()
+        risultato = DiarioAlimentareDB.sync_entries()
         if risultato["success"] and risultato["data"]:
-            data = []
-            for record in risultato["data"]:
-                # Converti la data da stringa ISO a datetime se necessario
-                data_record = record['data']
-                if isinstance(data_record, str):
-                    data_record = datetime.fromisoformat(data_record.replace('Z', '+00:00'))
-                
-                data.append({
-                    'ID': record['id'],
-                    'Data': data_record,
-                    'Pasto': record.get('pasto', ''),
-                    'Alimento': record.get('alimento', ''),
-                    'Quantità': record.get('quantita', 0),
-                    'Unità di Misura': record.get('unita_misura', ''),
-                    'Carboidrati (g)': record.get('carboidrati', 0),
-                    'Glicemia Iniziale': record.get('glicemia_iniziale', 0),
-                    'Glicemia dopo 2h': record.get('glicemia_dop_2h', None),
-                    'Unità Insulina': record.get('unita_insulina', None),
-                    'Dosi Correttive': record.get('dosi_correttive', None),
-                    'Tempo Dose Correttiva (min)': record.get('tempo_dosi_correttive', None),
-                    'Note': record.get('note', '')
-                })
-                df = pd.DataFrame(data)
-                df["Data"]=pd.to_datetime(df["Data"]).dt.tz_localize(None)
-                df.sort_values(by="ID",inplace=True)
-            return df
+            # Riconverti solo se lo snapshot è cambiato dall'ultima esecuzione
+            # (le versioni sono per paziente, quindi si conserva anche di chi è)
+            versione, df = st.session_state.get("df_diario", (None, None))
+            attuale = (DiarioAlimentareDB.get_user(), risultato["version"])
+            if versione != attuale:
+                with metriche.misura("app.conversione") as misura:
+                    df = voci_a_dataframe(risultato["data"])
+                    misura["righe"] = len(df)
+                st.session_state["df_diario"] = (attuale, df)
+            return df.copy()
+        if not risultato["success"]:
+            st.error(f"Errore nel recuperare i dati: {risultato['error']}")
         return pd.DataFrame()
     except Exception as e:
         st.error(f"Errore nel recuperare i dati: {e}")
@@ -77,15 +364,34 @@ def ottieni_dati_come_df():
 if pagina == "📝 Aggiungi Record":
     st.header("Aggiungi Nuovo Record")
     
+    # Alimenti già registrati, per i suggerimenti e per precompilare quantità e carboidrati
+    risultato_catalogo = DiarioAlimentareDB.get_catalogo()
+    catalogo = risultato_catalogo["data"] if risultato_catalogo["success"] else None
+    
     col1, col2 = st.columns(2)
     
     with col1:
         data_input = st.date_input("Data", value=date.today())
         pasto = st.selectbox("Pasto", ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"])
-        alimento = st.text_input("Alimento")
-        quantita = st.number_input("Quantità", min_value=0, step=1)
-        unita_misura = st.selectbox("Unità di Misura", ["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"])
-        carboidrati = st.number_input("Carboidrati (g)", min_value=0.0, step=0.5)
+        alimento = st.text_input("Alimento", key="nuovo_alimento")
+        
+        suggerimenti = catalogo.suggerisci(alimento) if catalogo and alimento.strip() else []
+        if suggerimenti and [s["alimento"] for s in suggerimenti] != [alimento.strip()]:
+            st.selectbox("Suggerimenti dal diario", [None] + suggerimenti, key="nuovo_suggerimento",
+                         format_func=descrivi_suggerimento, on_change=applica_suggerimento)
+        
+        unita = UNITA_MISURA + [u for u in [st.session_state.get("nuova_unita")] if u and u not in UNITA_MISURA]
+        quantita = st.number_input("Quantità", min_value=0, step=1, key="nuova_quantita")
+        unita_misura = st.selectbox("Unità di Misura", unita, key="nuova_unita")
+        carboidrati = st.number_input("Carboidrati (g)", min_value=0.0, step=0.5, key="nuovi_carboidrati")
+        
+        noto = catalogo.trova(alimento) if catalogo and alimento.strip() else None
+        if noto and noto["carboidrati_per_unita"] is not None and noto["unita_misura"] == unita_misura:
+            base = 100 if unita_misura in ("g", "ml") else 1
+            st.caption(f"Dal diario: {noto['carboidrati_per_unita'] * base:.1f} g di carboidrati "
+                       f"per {base} {unita_misura} ({noto['voci']} voci)")
+            st.button("🧮 Calcola carboidrati", on_click=calcola_carboidrati,
+                      args=(noto["carboidrati_per_unita"],))
     
     with col2:
         glicemia_iniziale = st.number_input("Glicemia Iniziale (mg/dl)", min_value=0, step=1)
@@ -98,11 +404,17 @@ if pagina == "📝 Aggiungi Record":
     # Campo note a tutta larghezza
     note = st.text_area("Note personali", placeholder="Inserisci qui le tue note personali (es. come ti sei sentito, reazioni particolari, ecc.)", height=100)
     
+    # Chiave di idempotenza del record in compilazione: se il modulo viene
+    # inviato due volte (doppio clic, rete lenta) la voce viene creata una volta sola.
+    # Il record va nella coda locale e viene inviato in background, anche se la rete manca
+    if "chiave_nuovo_record" not in st.session_state:
+        st.session_state["chiave_nuovo_record"] = str(uuid.uuid4())
+    
     if st.button("Aggiungi Record", type="primary"):
         if alimento and quantita > 0:
             try:
                 data_datetime = datetime.combine(data_input, datetime.min.time())
-                risultato = DiarioAlimentareDB.create_entry(
+                risultato = DiarioAlimentareDB.queue_create_entry(
                     data=data_datetime,
                     pasto=pasto,
                     alimento=alimento,
@@ -114,11 +426,13 @@ if pagina == "📝 Aggiungi Record":
                     unita_insulina=unita_insulina if unita_insulina > 0 else None,
                     note=note if note.strip() else None,
                     dosi_correttive=dosi_correttive if dosi_correttive > 0 else None,
-                    tempo_dosi_correttive=tempo_dose_correttiva if tempo_dose_correttiva > 0 else None
+                    tempo_dosi_correttive=tempo_dose_correttiva if tempo_dose_correttiva > 0 else None,
+                    idempotency_key=st.session_state["chiave_nuovo_record"]
                 )
                 
                 if risultato["success"]:
-                    st.success("Record aggiunto con successo!")
+                    st.success("Record salvato: verrà inviato al database in background")
+                    del st.session_state["chiave_nuovo_record"]
                     st.rerun()
                 else:
                     st.error(f"Errore nell'aggiungere il record: {risultato['error']}")
@@ -131,36 +445,80 @@ if pagina == "📝 Aggiungi Record":
 elif pagina == "📊 Visualizza Dati":
     st.header("Visualizza Dati")
     
-    df = ottieni_dati_come_df()
+    # Filtri e ordinamento applicati dal database: si scarica solo la pagina visibile
+    with st.expander("🔎 Filtri e ordinamento", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            intervallo = st.date_input("Intervallo di date", value=(), key="filtro_date")
+        with col2:
+            filtro_pasto = st.selectbox("Pasto", ["Tutti"] + PASTI, key="filtro_pasto")
+        with col3:
+            filtro_alimento = st.text_input("Alimento contiene", key="filtro_alimento").strip()
+        col4, col5, col6 = st.columns(3)
+        campi_ordinabili = [campo for campo in COLONNE if campo != "note"]
+        with col4:
+            ordina_per = st.selectbox("Ordina per", campi_ordinabili, format_func=COLONNE.get, key="ordina_per")
+        with col5:
+            decrescente = st.toggle("Ordine decrescente", value=True, key="ordine_decrescente")
+        with col6:
+            righe_per_pagina = st.selectbox("Righe per pagina", [25, 50, 100, 250], index=1, key="righe_per_pagina")
     
-    if not df.empty:
-        # Mostra tabella
+    filtri = {
+        "start_date": datetime.combine(intervallo[0], datetime.min.time()) if len(intervallo) > 0 else None,
+        "end_date": datetime.combine(intervallo[-1], datetime.max.time()) if len(intervallo) > 0 else None,
+        "pasto": None if filtro_pasto == "Tutti" else filtro_pasto,
+        "alimento": filtro_alimento or None,
+    }
+    
+    # Cambiando filtri o ordinamento si torna alla prima pagina
+    firma = (tuple(filtri.values()), ordina_per, decrescente, righe_per_pagina)
+    if st.session_state.get("firma_tabella") != firma:
+        st.session_state["firma_tabella"] = firma
+        st.session_state["pagina_tabella"] = 1
+    
+    riepilogo = DiarioAlimentareDB.get_summary(**filtri)
+    totale = riepilogo["data"]["count"] if riepilogo["success"] else 0
+    pagine = max((totale + righe_per_pagina - 1) // righe_per_pagina, 1)
+    
+    if not riepilogo["success"]:
+        st.error(f"Errore nel recuperare i dati: {riepilogo['error']}")
+    elif totale > 0:
         st.subheader("Tabella Dati")
-        st.dataframe(df, use_container_width=True, hide_index=True)
-        
-        # Pulsante download Excel
-        excel_data = converti_in_excel(df)
-        st.download_button(
-            label="📥 Scarica come Excel",
-            data=excel_data,
-            file_name=f"diario_alimentare_{datetime.now().strftime('%Y%m%d')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        if st.session_state.get("pagina_tabella", 1) > pagine:
+            st.session_state["pagina_tabella"] = pagine
+        numero_pagina = st.number_input(f"Pagina (di {pagine})", min_value=1, max_value=pagine,
+                                        key="pagina_tabella")
+        risultato = DiarioAlimentareDB.get_entries_page(
+            page=numero_pagina, page_size=righe_per_pagina, sort_by=ordina_per, descending=decrescente, **filtri
         )
+        if risultato["success"]:
+            with metriche.misura("app.tabella") as misura:
+                tabella = voci_a_dataframe(risultato["data"], ordina=False, formato="esteso")
+                misura["righe"] = len(tabella)
+                st.dataframe(tabella, use_container_width=True, hide_index=True)
+            inizio = (numero_pagina - 1) * righe_per_pagina
+            st.caption(f"Record {inizio + 1}–{inizio + risultato['count']} di {risultato['total']}")
+        else:
+            st.error(f"Errore nel recuperare i dati: {risultato['error']}")
+        
+        # Esportazione di tutto il diario in Excel, CSV o Parquet
+        mostra_esportazione()
         
-        # Statistiche rapide
+        # Statistiche rapide, calcolate dal database sulle voci filtrate
         st.subheader("Statistiche Rapide")
+        dati = riepilogo["data"]
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Totale Record", len(df))
+            st.metric("Totale Record", dati["count"])
         with col2:
-            media_glicemia = df['Glicemia Iniziale'].mean()
-            st.metric("Media Glicemia Iniziale", f"{media_glicemia:.1f} mg/dl")
+            media_glicemia = dati["average_glucose"]
+            st.metric("Media Glicemia Iniziale", f"{media_glicemia:.1f} mg/dl" if media_glicemia is not None else "-")
         with col3:
-            carboidrati_totali = df['Carboidrati (g)'].sum()
-            st.metric("Carboidrati Totali", f"{carboidrati_totali:.1f} g")
+            st.metric("Carboidrati Totali", f"{dati['total_carbs']:.1f} g")
         with col4:
-            dosi_correttive_totali = df['Dosi Correttive'].fillna(0).sum()
-            st.metric("Dosi Correttive Totali", f"{dosi_correttive_totali:.1f} U")
+            st.metric("Dosi Correttive Totali", f"{dati['total_corrective_doses']:.1f} U")
+    elif any(filtri.values()):
+        st.info("Nessun record corrisponde ai filtri selezionati.")
     else:
         st.info("Nessun dato disponibile. Aggiungi alcuni record per iniziare!")
 
@@ -168,225 +526,343 @@ elif pagina == "📊 Visualizza Dati":
 elif pagina == "✏️ Modifica Record":
     st.header("Modifica Record")
     
-    df = ottieni_dati_come_df()
+    record = seleziona_record("Seleziona record da modificare:", "modifica")
     
-    if not df.empty:
-        # Selezione record da modificare
-        record_selezionato = st.selectbox(
-            "Seleziona record da modificare:",
-            options=df.index,
-            format_func=lambda x: f"ID {df.loc[x, 'ID']} - {df.loc[x, 'Data'].strftime('%d/%m/%Y')} - {df.loc[x, 'Alimento']}"
-        )
-        
-        if record_selezionato is not None:
-            record = df.loc[record_selezionato]
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                nuova_data = st.date_input("Data", value=record['Data'].date())
-                nuovo_pasto = st.selectbox("Pasto", ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"], 
-                                         index=["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"].index(record['Pasto']) if record['Pasto'] in ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"] else 0)
-                nuovo_alimento = st.text_input("Alimento", value=record['Alimento'])
-                nuova_quantita = st.number_input("Quantità", min_value=0, step=1, value=int(record['Quantità']))
-                nuova_unita = st.selectbox("Unità di Misura", ["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"],
-                                         index=["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"].index(record['Unità di Misura']) if record['Unità di Misura'] in ["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"] else 0)
-                nuovi_carboidrati = st.number_input("Carboidrati (g)", min_value=0.0, step=0.1, value=float(record['Carboidrati (g)']))
-            
-            with col2:
-                nuova_glicemia_iniziale = st.number_input("Glicemia Iniziale", min_value=0, step=1, value=int(record['Glicemia Iniziale']))
-                nuova_glicemia_2h = st.number_input("Glicemia dopo 2h", min_value=0, step=1, 
-                                                   value=int(record['Glicemia dopo 2h']) if pd.notna(record['Glicemia dopo 2h']) else 0)
-                nuova_insulina = st.number_input("Unità Insulina", min_value=0.0, step=0.1,
-                                                value=float(record['Unità Insulina']) if pd.notna(record['Unità Insulina']) else 0.0)
-                nuove_dosi_correttive = st.number_input("Dosi Correttive", min_value=0.0, step=0.1,
-                                                       value=float(record['Dosi Correttive']) if pd.notna(record['Dosi Correttive']) else 0.0)
-                nuovo_tempo_dose_correttiva = st.number_input("Tempo Dose Correttiva (minuti)", min_value=0, step=1, 
-                                                             value=int(record['Tempo Dose Correttiva (min)']) if pd.notna(record['Tempo Dose Correttiva (min)']) else 0, 
-                                                             help="Minuti trascorsi tra la dose principale e quella correttiva")
-            
-            # Campo note a tutta larghezza
-            nuove_note = st.text_area("Note personali", 
-                                     placeholder="Inserisci qui le tue note personali (es. come ti sei sentito, reazioni particolari, ecc.)", 
-                                     value=record['Note'] if pd.notna(record['Note']) else "", 
-                                     height=100)
-            
-            if st.button("Aggiorna Record", type="primary"):
-                try:
-                    nuova_data_datetime = datetime.combine(nuova_data, datetime.min.time())
-                    risultato = DiarioAlimentareDB.update_entry(
-                        record['ID'],
-                        data=nuova_data_datetime,
-                        pasto=nuovo_pasto,
-                        alimento=nuovo_alimento,
-                        quantita=nuova_quantita,
-                        unita_misura=nuova_unita,
-                        carboidrati=nuovi_carboidrati,
-                        glicemia_iniziale=nuova_glicemia_iniziale,
-                        glicemia_dop_2h=nuova_glicemia_2h if nuova_glicemia_2h > 0 else None,
-                        unita_insulina=nuova_insulina if nuova_insulina > 0 else None,
-                        note=nuove_note if nuove_note.strip() else None,
-                        dosi_correttive=nuove_dosi_correttive if nuove_dosi_correttive > 0 else None,
-                        tempo_dosi_correttive=nuovo_tempo_dose_correttiva if nuovo_tempo_dose_correttiva > 0 else None
-                    )
-                    
-                    if risultato["success"]:
-                        st.success("Record aggiornato con successo!")
-                        st.rerun()
-                    else:
-                        st.error(f"Errore nell'aggiornare il record: {risultato['error']}")
-                except Exception as e:
-                    st.error(f"Errore nell'aggiornare il record: {e}")
-    else:
-        st.info("Nessun record disponibile per la modifica.")
+    if record is not None:
+        col1, col2 = st.columns(2)
+
+        with col1:
+            nuova_data = st.date_input("Data", value=record['Data'].date())
+            nuovo_pasto = st.selectbox("Pasto", ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"], 
+                                     index=["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"].index(record['Pasto']) if record['Pasto'] in ["Colazione", "Spuntino Mattina", "Pranzo", "Merenda", "Cena", "Spuntino Sera"] else 0)
+            nuovo_alimento = st.text_input("Alimento", value=record['Alimento'] if pd.notna(record['Alimento']) else "")
+            nuova_quantita = st.number_input("Quantità", min_value=0, step=1, value=int(record['Quantità']) if pd.notna(record['Quantità']) else 0)
+            nuova_unita = st.selectbox("Unità di Misura", ["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"],
+                                     index=["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"].index(record['Unità di Misura']) if record['Unità di Misura'] in ["g", "ml", "porzione", "cucchiaio", "cucchiaino", "tazza"] else 0)
+            nuovi_carboidrati = st.number_input("Carboidrati (g)", min_value=0.0, step=0.1, value=float(record['Carboidrati (g)']) if pd.notna(record['Carboidrati (g)']) else 0.0)
+
+        with col2:
+            nuova_glicemia_iniziale = st.number_input("Glicemia Iniziale", min_value=0, step=1, value=int(record['Glicemia Iniziale']) if pd.notna(record['Glicemia Iniziale']) else 0)
+            nuova_glicemia_2h = st.number_input("Glicemia dopo 2h", min_value=0, step=1, 
+                                               value=int(record['Glicemia dopo 2h']) if pd.notna(record['Glicemia dopo 2h']) else 0)
+            nuova_insulina = st.number_input("Unità Insulina", min_value=0.0, step=0.1,
+                                            value=float(record['Unità Insulina']) if pd.notna(record['Unità Insulina']) else 0.0)
+            nuove_dosi_correttive = st.number_input("Dosi Correttive", min_value=0.0, step=0.1,
+                                                   value=float(record['Dosi Correttive']) if pd.notna(record['Dosi Correttive']) else 0.0)
+            nuovo_tempo_dose_correttiva = st.number_input("Tempo Dose Correttiva (minuti)", min_value=0, step=1, 
+                                                         value=int(record['Tempo Dose Correttiva (min)']) if pd.notna(record['Tempo Dose Correttiva (min)']) else 0, 
+                                                         help="Minuti trascorsi tra la dose principale e quella correttiva")
+
+        # Campo note a tutta larghezza
+        nuove_note = st.text_area("Note personali", 
+                                 placeholder="Inserisci qui le tue note personali (es. come ti sei sentito, reazioni particolari, ecc.)", 
+                                 value=record['Note'] if pd.notna(record['Note']) else "", 
+                                 height=100)
+
+        versioni = st.session_state["modifica_versioni"]
+        if record['ID'] not in versioni:
+            st.info("🕓 Una modifica precedente di questo record è ancora in coda: potrai modificarlo di nuovo dopo l'invio.")
+        if st.button("Aggiorna Record", type="primary", disabled=record['ID'] not in versioni):
+            try:
+                nuova_data_datetime = datetime.combine(nuova_data, datetime.min.time())
+                # La versione letta quando il record è stato scelto: se nel
+                # frattempo il record cambia altrove, la modifica va in conflitto
+                risultato = DiarioAlimentareDB.queue_update_entry(
+                    record['ID'],
+                    base_updated_at=versioni.get(record['ID']),
+                    data=nuova_data_datetime,
+                    pasto=nuovo_pasto,
+                    alimento=nuovo_alimento,
+                    quantita=nuova_quantita,
+                    unita_misura=nuova_unita,
+                    carboidrati=nuovi_carboidrati,
+                    glicemia_iniziale=nuova_glicemia_iniziale,
+                    glicemia_dop_2h=nuova_glicemia_2h if nuova_glicemia_2h > 0 else None,
+                    unita_insulina=nuova_insulina if nuova_insulina > 0 else None,
+                    note=nuove_note if nuove_note.strip() else None,
+                    dosi_correttive=nuove_dosi_correttive if nuove_dosi_correttive > 0 else None,
+                    tempo_dosi_correttive=nuovo_tempo_dose_correttiva if nuovo_tempo_dose_correttiva > 0 else None
+                )
+
+                if risultato["success"]:
+                    # La prossima modifica parte dalla versione salvata
+                    versioni.pop(record['ID'], None)
+                    st.success("Modifica salvata: verrà inviata al database in background")
+                    st.rerun()
+                else:
+                    st.error(f"Errore nell'aggiornare il record: {risultato['error']}")
+            except Exception as e:
+                st.error(f"Errore nell'aggiornare il record: {e}")
 
 # PAGINA: Elimina Record
 elif pagina == "🗑️ Elimina Record":
     st.header("Elimina Record")
     
-    df = ottieni_dati_come_df()
+    record = seleziona_record("Seleziona record da eliminare:", "elimina")
     
-    if not df.empty:
-        # Selezione record da eliminare
-        record_da_eliminare = st.selectbox(
-            "Seleziona record da eliminare:",
-            options=df.index,
-            format_func=lambda x: f"ID {df.loc[x, 'ID']} - {df.loc[x, 'Data'].strftime('%d/%m/%Y')} - {df.loc[x, 'Alimento']}"
-        )
-        
-        if record_da_eliminare is not None:
-            record = df.loc[record_da_eliminare]
-            
-            # Mostra dettagli del record
-            st.subheader("Dettagli del record da eliminare:")
-            col1, col2 = st.columns(2)
-            with col1:
-                st.write(f"**Data:** {record['Data'].strftime('%d/%m/%Y')}")
-                st.write(f"**Pasto:** {record['Pasto']}")
-                st.write(f"**Alimento:** {record['Alimento']}")
-                st.write(f"**Quantità:** {record['Quantità']} {record['Unità di Misura']}")
-            with col2:
-                st.write(f"**Carboidrati:** {record['Carboidrati (g)']} g")
-                st.write(f"**Glicemia Iniziale:** {record['Glicemia Iniziale']} mg/dl")
-                if pd.notna(record['Dosi Correttive']) and record['Dosi Correttive'] > 0:
-                    st.write(f"**Dosi Correttive:** {record['Dosi Correttive']} U")
-                if pd.notna(record['Tempo Dose Correttiva (min)']) and record['Tempo Dose Correttiva (min)'] > 0:
-                    st.write(f"**Tempo Dose Correttiva:** {record['Tempo Dose Correttiva (min)']} minuti")
-            
-            # Mostra le note se presenti
-            if pd.notna(record['Note']) and record['Note'].strip():
-                st.write("**Note:**")
-                st.info(record['Note'])
-            
-            st.warning("⚠️ Questa azione non può essere annullata!")
-            
-            if st.button("🗑️ Elimina Record", type="secondary"):
-                try:
-                    risultato = DiarioAlimentareDB.delete_entry(record['ID'])
-                    if risultato["success"]:
-                        st.success("Record eliminato con successo!")
-                        st.rerun()
-                    else:
-                        st.error(f"Errore nell'eliminare il record: {risultato['error']}")
-                except Exception as e:
-                    st.error(f"Errore nell'eliminare il record: {e}")
-    else:
-        st.info("Nessun record disponibile per l'eliminazione.")
+    if record is not None:
+        # Mostra dettagli del record
+        st.subheader("Dettagli del record da eliminare:")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write(f"**Data:** {record['Data'].strftime('%d/%m/%Y')}")
+            st.write(f"**Pasto:** {record['Pasto']}")
+            st.write(f"**Alimento:** {record['Alimento']}")
+            st.write(f"**Quantità:** {record['Quantità']} {record['Unità di Misura']}")
+        with col2:
+            st.write(f"**Carboidrati:** {record['Carboidrati (g)']} g")
+            st.write(f"**Glicemia Iniziale:** {record['Glicemia Iniziale']} mg/dl")
+            if pd.notna(record['Dosi Correttive']) and record['Dosi Correttive'] > 0:
+                st.write(f"**Dosi Correttive:** {record['Dosi Correttive']} U")
+            if pd.notna(record['Tempo Dose Correttiva (min)']) and record['Tempo Dose Correttiva (min)'] > 0:
+                st.write(f"**Tempo Dose Correttiva:** {record['Tempo Dose Correttiva (min)']} minuti")
+
+        # Mostra le note se presenti
+        if pd.notna(record['Note']) and record['Note'].strip():
+            st.write("**Note:**")
+            st.info(record['Note'])
+
+        st.warning("⚠️ Questa azione non può essere annullata!")
+
+        if st.button("🗑️ Elimina Record", type="secondary"):
+            try:
+                risultato = DiarioAlimentareDB.queue_delete_entry(record['ID'])
+                if risultato["success"]:
+                    st.success("Eliminazione salvata: verrà inviata al database in background")
+                    st.rerun()
+                else:
+                    st.error(f"Errore nell'eliminare il record: {risultato['error']}")
+            except Exception as e:
+                st.error(f"Errore nell'eliminare il record: {e}")
 
 # PAGINA: Analisi
 elif pagina == "📈 Analisi":
+    # plotly viene importato solo qui: le altre pagine non ne pagano il costo
+    import plotly.express as px
+
     st.header("Analisi dei Dati")
     
-    df = ottieni_dati_come_df()
+    # I grafici leggono gli aggregati per periodo e pasto, aggiornati a ogni
+    # modifica: il costo non cresce con il numero di voci del diario
+    versione_grafici = DiarioAlimentareDB.get_data_version()
+    risultato = DiarioAlimentareDB.get_rollup()
+    if not risultato["success"]:
+        st.error(f"Errore nel recuperare i dati: {risultato['error']}")
+        st.stop()
+    rollup = risultato["data"]
+    totali = rollup.totali()
+    totale = int(totali['Record'])
     
-    if not df.empty and len(df) > 1:
+    if totale > 1:
+        granularita = st.radio("Raggruppa per", ["giorno", "settimana", "mese"], horizontal=True,
+                               format_func=str.capitalize, key="analisi_granularita")
+        with metriche.misura("app.aggregati"):
+            andamento = rollup.serie(granularita)
+            per_pasto = rollup.per_pasto()
+        
+        # Intervallo delle serie nel tempo: le serie lunghe vengono ridotte a
+        # PUNTI_GRAFICO punti, quindi restringendolo si vedono più dettagli
+        intervallo = (andamento['Periodo'].min().date(), andamento['Periodo'].max().date())
+        if intervallo[0] < intervallo[1]:
+            intervallo = st.slider("Intervallo", min_value=intervallo[0], max_value=intervallo[1],
+                                   value=intervallo, format="DD/MM/YYYY")
+        inizio, fine = (pd.Timestamp(giorno) for giorno in intervallo)
+        
         # Grafici
         col1, col2 = st.columns(2)
         
         with col1:
-            # Grafico glicemia nel tempo
+            # Grafico glicemia nel tempo, con i soli punti che ne conservano la forma
             st.subheader("Andamento Glicemia")
-            fig_glicemia = px.line(df, x='Data', y='Glicemia Iniziale', 
-                                 title='Glicemia Iniziale nel Tempo',
-                                 markers=True)
-            if 'Glicemia dopo 2h' in df.columns and df['Glicemia dopo 2h'].notna().any():
-                fig_glicemia.add_scatter(x=df['Data'], y=df['Glicemia dopo 2h'], 
-                                       mode='lines+markers', name='Glicemia dopo 2h')
-            st.plotly_chart(fig_glicemia, use_container_width=True)
+            def crea_andamento():
+                serie = riduci(andamento, 'Periodo', ['Media Glicemia Iniziale', 'Media Glicemia dopo 2h'],
+                               inizio=inizio, fine=fine)
+                marcatori = len(serie) <= PUNTI_MARCATORI
+                grafico = px.line(serie, x='Periodo', y='Media Glicemia Iniziale',
+                                  title=f'Glicemia Iniziale Media per {granularita.capitalize()}',
+                                  markers=marcatori)
+                if serie['Media Glicemia dopo 2h'].notna().any():
+                    dopo_2h = serie.dropna(subset=['Media Glicemia dopo 2h'])
+                    grafico.add_scatter(x=dopo_2h['Periodo'], y=dopo_2h['Media Glicemia dopo 2h'],
+                                        mode='lines+markers' if marcatori else 'lines', name='Glicemia dopo 2h')
+                return grafico
+            fig_glicemia = figura(crea_andamento, chiave=("andamento", granularita, intervallo))
+            mostra_grafico(fig_glicemia)
         
         with col2:
             # Distribuzione per pasto
             st.subheader("Distribuzione per Pasto")
-            pasto_counts = df['Pasto'].value_counts()
-            fig_pasto = px.pie(values=pasto_counts.values, names=pasto_counts.index,
-                              title='Distribuzione Record per Pasto')
-            st.plotly_chart(fig_pasto, use_container_width=True)
+            fig_pasto = figura(px.pie, values=per_pasto['Record'].values, names=per_pasto.index,
+                              title='Distribuzione Record per Pasto', chiave=("pasti",))
+            mostra_grafico(fig_pasto)
         
         # Carboidrati per pasto
         st.subheader("Carboidrati per Pasto")
-        carboidrati_per_pasto = df.groupby('Pasto')['Carboidrati (g)'].mean().sort_values(ascending=False)
-        fig_carb = px.bar(x=carboidrati_per_pasto.index, y=carboidrati_per_pasto.values,
+        carboidrati_per_pasto = per_pasto['Media Carboidrati (g)'].dropna().sort_values(ascending=False)
+        fig_carb = figura(px.bar, x=carboidrati_per_pasto.index, y=carboidrati_per_pasto.values,
                          title='Media Carboidrati per Tipo di Pasto',
-                         labels={'x': 'Pasto', 'y': 'Carboidrati (g)'})
-        st.plotly_chart(fig_carb, use_container_width=True)
+                         labels={'x': 'Pasto', 'y': 'Carboidrati (g)'}, chiave=("carboidrati_pasto",))
+        mostra_grafico(fig_carb)
+        
+        # Barre sommate in intervalli più ampi quando i periodi sono troppi
+        def crea_carboidrati_periodo():
+            andamento_pasti = raggruppa(rollup.serie(granularita, per_pasto=True), 'Periodo',
+                                        ['Totale Carboidrati (g)'], inizio=inizio, fine=fine, gruppo='Pasto')
+            return px.bar(andamento_pasti, x='Periodo', y='Totale Carboidrati (g)', color='Pasto',
+                          title=f'Carboidrati Totali per {granularita.capitalize()}')
+        fig_carb_periodo = figura(crea_carboidrati_periodo, chiave=("carboidrati_periodo", granularita, intervallo))
+        mostra_grafico(fig_carb_periodo)
         
         # Tabella alimenti più frequenti
         st.subheader("Alimenti Più Frequenti")
-        alimenti_freq = df['Alimento'].value_counts().head(10)
+        alimenti_freq = rollup.alimenti_frequenti(10)
         col1, col2 = st.columns(2)
         with col1:
             st.dataframe(alimenti_freq.to_frame('Frequenza'))
         with col2:
-            fig_alimenti = px.bar(x=alimenti_freq.values, y=alimenti_freq.index,
-                                 orientation='h', title='Top 10 Alimenti')
-            st.plotly_chart(fig_alimenti, use_container_width=True)
+            fig_alimenti = figura(px.bar, x=alimenti_freq.values, y=alimenti_freq.index,
+                                 orientation='h', title='Top 10 Alimenti', chiave=("alimenti",))
+            mostra_grafico(fig_alimenti)
         
         # Correlazioni
-        if len(df) > 5:
-            st.subheader("Correlazioni")
-            numeric_cols = ['Quantità', 'Carboidrati (g)', 'Glicemia Iniziale', 'Glicemia dopo 2h', 'Unità Insulina', 'Dosi Correttive', 'Tempo Dose Correttiva (min)']
-            # Rimuovi colonne che non esistono o sono tutte NaN
-            existing_cols = [col for col in numeric_cols if col in df.columns and df[col].notna().any()]
-            if len(existing_cols) > 1:
-                corr_data = df[existing_cols].corr()
-                fig_corr = px.imshow(corr_data, text_auto=True, aspect="auto",
-                                   title='Matrice di Correlazione')
-                st.plotly_chart(fig_corr, use_container_width=True)
+        if totale > 5:
+            corr_data = rollup.correlazioni()
+            if len(corr_data) > 1:
+                st.subheader("Correlazioni")
+                fig_corr = figura(px.imshow, corr_data, text_auto=True, aspect="auto",
+                                   title='Matrice di Correlazione', chiave=("correlazioni",))
+                mostra_grafico(fig_corr)
         
         # Analisi Dosi Correttive
-        df_correttive = df[df['Dosi Correttive'].notna() & (df['Dosi Correttive'] > 0)]
-        if not df_correttive.empty:
+        correzioni = int(totali['Correzioni'])
+        if correzioni:
             st.subheader("Analisi Dosi Correttive")
             col1, col2 = st.columns(2)
             
             with col1:
                 # Distribuzione tempi dosi correttive
-                if df_correttive['Tempo Dose Correttiva (min)'].notna().any():
-                    fig_tempo = px.histogram(df_correttive, x='Tempo Dose Correttiva (min)', 
-                                           title='Distribuzione Tempi Dosi Correttive',
-                                           labels={'x': 'Minuti', 'y': 'Frequenza'})
-                    st.plotly_chart(fig_tempo, use_container_width=True)
+                tempi = rollup.tempi_correzione()
+                if not tempi.empty:
+                    fig_tempo = figura(px.bar, x=tempi.index, y=tempi.values,
+                                       title='Distribuzione Tempi Dosi Correttive',
+                                       labels={'x': 'Minuti', 'y': 'Frequenza'}, chiave=("tempi_correzione",))
+                    mostra_grafico(fig_tempo)
             
             with col2:
                 # Relazione tra dosi correttive e glicemia
-                fig_dosi_glicemia = px.scatter(df_correttive, x='Glicemia Iniziale', y='Dosi Correttive',
-                                             title='Relazione Glicemia - Dosi Correttive',
-                                             labels={'x': 'Glicemia Iniziale (mg/dl)', 'y': 'Dosi Correttive (U)'})
-                st.plotly_chart(fig_dosi_glicemia, use_container_width=True)
+                fasce = rollup.correzioni_per_glicemia()
+                if not fasce.empty:
+                    fig_dosi_glicemia = figura(px.bar, fasce, x=fasce.index, y='Media Dosi Correttive',
+                                               hover_data=['Correzioni'],
+                                               title='Relazione Glicemia - Dosi Correttive',
+                                               labels={'Glicemia Iniziale': 'Glicemia Iniziale (mg/dl)',
+                                                       'Media Dosi Correttive': 'Dosi Correttive (U)'},
+                                               chiave=("correzioni_glicemia",))
+                    mostra_grafico(fig_dosi_glicemia)
             
             # Statistiche dosi correttive
             st.write("**Statistiche Dosi Correttive:**")
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Media Dosi Correttive", f"{df_correttive['Dosi Correttive'].mean():.1f} U")
+                st.metric("Media Dosi Correttive", f"{totali['Media Dosi Correttive']:.1f} U")
             with col2:
-                tempo_medio = df_correttive['Tempo Dose Correttiva (min)'].mean()
+                tempo_medio = totali['Media Tempo Correzione (min)']
                 if pd.notna(tempo_medio):
                     st.metric("Tempo Medio Correzione", f"{tempo_medio:.0f} min")
                 else:
                     st.metric("Tempo Medio Correzione", "N/A")
             with col3:
-                st.metric("Frequenza Correzioni", f"{len(df_correttive)}/{len(df)} ({len(df_correttive)/len(df)*100:.1f}%)")
+                st.metric("Frequenza Correzioni", f"{correzioni}/{totale} ({correzioni/totale*100:.1f}%)")
+        
+        # Risposta glicemica ai pasti: calcolata sull'intero diario solo
+        # quando i dati cambiano, poi letta dalla memoria
+        risultato_risposta = DiarioAlimentareDB.get_glucose_response()
+        if risultato_risposta["success"]:
+            risposta = risultato_risposta["data"]
+            with metriche.misura("app.risposta_glicemica"):
+                variazioni = risposta.variazione_per_pasto()
+                rapporti = risposta.rapporti_per_pasto()
+                per_rapporto = risposta.variazione_per_rapporto()
+                efficacia = risposta.efficacia_correzioni()
+            
+            if not variazioni.empty:
+                st.subheader("Risposta Glicemica ai Pasti")
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    # Variazione tra glicemia iniziale e dopo 2h: mediana e quartili
+                    fig_variazione = figura(px.bar, variazioni, x=variazioni.index, y='Mediana Variazione',
+                                            error_y=variazioni['Terzo Quartile'] - variazioni['Mediana Variazione'],
+                                            error_y_minus=variazioni['Mediana Variazione'] - variazioni['Primo Quartile'],
+                                            hover_data=['Misurazioni', 'Media Variazione'],
+                                            title='Variazione Glicemia dopo 2h per Pasto',
+                                            labels={'Mediana Variazione': 'Variazione (mg/dl)'},
+                                            chiave=("variazione_pasto",))
+                    mostra_grafico(fig_variazione)
+                
+                with col2:
+                    fig_target = figura(px.bar, variazioni, x=variazioni.index, y='In Target dopo 2h (%)',
+                                        hover_data=['Misurazioni'],
+                                        title=f'Glicemia dopo 2h tra {TARGET[0]} e {TARGET[1]} mg/dl',
+                                        labels={'In Target dopo 2h (%)': 'In target (%)'}, chiave=("target",))
+                    mostra_grafico(fig_target)
+            
+            if not rapporti.empty:
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    # Rapporto carboidrati/insulina effettivamente usato
+                    fig_rapporti = figura(px.bar, rapporti, x=rapporti.index, y='Mediana Rapporto',
+                                          error_y=rapporti['Terzo Quartile'] - rapporti['Mediana Rapporto'],
+                                          error_y_minus=rapporti['Mediana Rapporto'] - rapporti['Primo Quartile'],
+                                          hover_data=['Voci', 'Media Variazione'],
+                                          title='Rapporto Carboidrati/Insulina per Pasto',
+                                          labels={'Mediana Rapporto': 'Carboidrati per unità (g/U)'},
+                                          chiave=("rapporti",))
+                    mostra_grafico(fig_rapporti)
+                
+                with col2:
+                    if not per_rapporto.empty:
+                        fig_per_rapporto = figura(px.line, per_rapporto, x=per_rapporto.index, y='Media Variazione',
+                                                  markers=True, hover_data=['Misurazioni', 'In Target dopo 2h (%)'],
+                                                  title='Variazione Glicemia per Rapporto Carboidrati/Insulina',
+                                                  labels={'Rapporto': 'Carboidrati per unità (g/U)',
+                                                          'Media Variazione': 'Variazione (mg/dl)'},
+                                                  chiave=("variazione_rapporto",))
+                        mostra_grafico(fig_per_rapporto)
+            
+            if not efficacia.empty:
+                # Efficacia delle correzioni secondo il tempo trascorso dal pasto
+                fig_efficacia = figura(px.bar, efficacia, x=efficacia.index, y='Variazione per Unità',
+                                       hover_data=['Correzioni', 'Media Dosi Correttive', 'In Target dopo 2h (%)'],
+                                       title='Efficacia Dosi Correttive per Tempo di Correzione',
+                                       labels={'Minuti': 'Tempo Dose Correttiva (min)',
+                                               'Variazione per Unità': 'Variazione per unità (mg/dl/U)'},
+                                       chiave=("efficacia",))
+                mostra_grafico(fig_efficacia)
+            
+            if not variazioni.empty or not rapporti.empty:
+                st.subheader("Tendenze per Pasto")
+                col1, col2 = st.columns(2)
+                with col1:
+                    misura_tendenza = st.selectbox("Misura", list(MISURE_TENDENZA), format_func=MISURE_TENDENZA.get,
+                                                   key="analisi_tendenza")
+                with col2:
+                    finestra = st.radio("Media mobile", [7, 30], format_func=lambda giorni: f"{giorni} giorni",
+                                        horizontal=True, key="analisi_finestra")
+                with metriche.misura("app.risposta_glicemica"):
+                    tendenze = risposta.tendenze(misura_tendenza)
+                if not tendenze.empty:
+                    colonna = f'Media {finestra} giorni'
+                    def crea_tendenze():
+                        return px.line(riduci(tendenze, 'Giorno', [colonna], inizio=inizio, fine=fine, gruppo='Pasto'),
+                                       x='Giorno', y=colonna, color='Pasto',
+                                       title=f'{MISURE_TENDENZA[misura_tendenza]}: media mobile a {finestra} giorni',
+                                       labels={colonna: MISURE_TENDENZA[misura_tendenza]})
+                    fig_tendenze = figura(crea_tendenze, chiave=("tendenze", misura_tendenza, finestra, intervallo))
+                    mostra_grafico(fig_tendenze)
+        else:
+            st.warning(f"Impossibile calcolare la risposta glicemica: {risultato_risposta['error']}")
         
         # Statistiche generali da Supabase
         st.subheader("Statistiche Generali")
@@ -401,13 +877,144 @@ elif pagina == "📈 Analisi":
                     st.metric("Media Carboidrati", f"{stats['average_carbs']:.1f} g")
                 with col3:
                     st.metric("Voci con Carboidrati", stats["entries_with_carbs"])
+                
+                if stats["per_pasto"]:
+                    per_pasto = pd.DataFrame.from_dict(stats["per_pasto"], orient="index")
+                    per_pasto = per_pasto.rename(columns={
+                        "count": "Record",
+                        "average_carbs": "Media Carboidrati (g)",
+                        "average_insulin": "Media Unità Insulina",
+                        "average_glucose": "Media Glicemia Iniziale",
+                        "average_glucose_2h": "Media Glicemia dopo 2h"
+                    })
+                    st.dataframe(per_pasto, use_container_width=True)
         except Exception as e:
             st.warning(f"Impossibile caricare le statistiche: {e}")
             
     else:
         st.info("Aggiungi più dati per visualizzare le analisi!")
 
+# PAGINA: Diagnostica (nascosta, vedi ?diagnostica)
+elif pagina == "🩺 Diagnostica":
+    st.header("Diagnostica")
+    
+    if not metriche.attive:
+        st.info("Le metriche sono disattivate (DIARIO_METRICHE=0).")
+    dati = metriche.dati(DiarioAlimentareDB.cache)
+    st.caption(f"Misure dal {datetime.fromtimestamp(dati['dal']).strftime('%d/%m/%Y %H:%M:%S')}, "
+               "per tutte le sessioni servite da questo processo")
+    
+    # Operazioni: db.* sono i metodi di DiarioAlimentareDB, backend.* le richieste
+    # al database, app.* le fasi di questo script
+    st.subheader("Operazioni")
+    if dati["operazioni"]:
+        operazioni = pd.DataFrame(dati["operazioni"]).drop(columns="bucket")
+        operazioni = operazioni.sort_values("totale_ms", ascending=False).rename(columns={
+            "operazione": "Operazione", "chiamate": "Chiamate", "errori": "Errori", "righe": "Righe",
+            "byte": "Byte", "totale_ms": "Totale (ms)", "media_ms": "Media (ms)", "p50_ms": "p50 (ms)",
+            "p95_ms": "p95 (ms)", "max_ms": "Max (ms)"
+        })
+        st.dataframe(operazioni, use_container_width=True, hide_index=True,
+                     column_config={c: st.column_config.NumberColumn(format="%.2f")
+                                    for c in operazioni.columns if c.endswith("(ms)")})
+        
+        scelta = st.selectbox("Distribuzione delle durate", operazioni["Operazione"], key="diagnostica_operazione")
+        bucket = next(v["bucket"] for v in dati["operazioni"] if v["operazione"] == scelta)
+        cumulati = list(bucket.values())
+        distribuzione = pd.DataFrame({
+            "Fino a (s)": list(bucket),
+            "Chiamate": [n - (cumulati[i - 1] if i else 0) for i, n in enumerate(cumulati)],
+        })
+        st.bar_chart(distribuzione, x="Fino a (s)", y="Chiamate")
+    else:
+        st.info("Nessuna operazione misurata.")
+    
+    # Timeout, tentativi e circuit breaker delle richieste al database
+    st.subheader("Connessione al database")
+    circuito = DiarioAlimentareDB.get_circuit_state()
+    eventi = {evento.split(".", 1)[1]: n for evento, n in dati["contatori"].items() if evento.startswith("resilienza.")}
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Circuito", circuito["stato"].capitalize(),
+                  help=f"Nuovo tentativo tra {circuito['riprova_tra_s']:.0f} s" if circuito["stato"] == "aperto" else None)
+    with col2:
+        st.metric("Tentativi ripetuti", eventi.get("ripetute", 0))
+    with col3:
+        st.metric("Timeout", eventi.get("timeout", 0))
+    with col4:
+        st.metric("Richieste rifiutate", eventi.get("rifiutate", 0),
+                  help="Chiamate respinte subito mentre il circuito era aperto")
+    
+    # Modifiche notificate dal database (altre sessioni e altri dispositivi)
+    st.subheader("Aggiornamenti in tempo reale")
+    tempo_reale = DiarioAlimentareDB.get_realtime_status()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Sottoscrizione", tempo_reale["stato"].capitalize())
+    with col2:
+        st.metric("Modifiche ricevute", tempo_reale["eventi"])
+    with col3:
+        st.metric("In attesa", tempo_reale["in_coda"])
+    with col4:
+        ultimo = tempo_reale["ultimo_evento"]
+        st.metric("Ultima modifica", f"{time.time() - ultimo:.0f} s fa" if ultimo else "-")
+    if tempo_reale["ultimo_errore"]:
+        st.caption(f"Ultimo errore: {tempo_reale['ultimo_errore']}")
+    
+    # Cache delle letture
+    st.subheader("Cache delle letture")
+    cache = dati["cache"]
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Successi", cache["hits"])
+    with col2:
+        st.metric("Mancati", cache["misses"])
+    with col3:
+        letture = cache["hits"] + cache["misses"]
+        st.metric("Percentuale successi", f"{cache['hits'] / letture * 100:.1f}%" if letture else "-")
+    with col4:
+        st.metric("Voci in cache", cache["voci"])
+    if cache["funzioni"]:
+        st.dataframe(pd.DataFrame.from_dict(cache["funzioni"], orient="index")
+                     .rename(columns={"hits": "Successi", "misses": "Mancati"}), use_container_width=True)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("📥 Scarica JSON", data=DiarioAlimentareDB.get_metrics("json").encode(),
+                           file_name="diario_metriche.json", mime="application/json")
+    with col2:
+        st.download_button("📥 Scarica Prometheus", data=DiarioAlimentareDB.get_metrics("prometheus").encode(),
+                           file_name="diario_metriche.prom", mime="text/plain")
+    with col3:
+        if st.button("♻️ Azzera misure"):
+            DiarioAlimentareDB.reset_metrics()
+            st.rerun()
+    
+    # Profilazione: ogni esecuzione dello script viene profilata finché è attiva,
+    # qui si vede il profilo dell'ultima esecuzione conclusa
+    st.subheader("Profilazione")
+    st.selectbox("Profila ogni esecuzione con", [None, *Profilo.MOTORI],
+                 index=[None, *Profilo.MOTORI].index(st.session_state.get("profilatore")),
+                 format_func=lambda motore: motore or "Nessuno", key="scelta_profilatore",
+                 on_change=lambda: st.session_state.update(profilatore=st.session_state["scelta_profilatore"]))
+    if "errore_profilo" in st.session_state:
+        st.warning(st.session_state.pop("errore_profilo"))
+    ultimo = st.session_state.get("ultimo_profilo")
+    if ultimo:
+        st.caption(f"Ultimo profilo ({ultimo['motore']}): {ultimo['pagina'] or '-'}, {ultimo['durata_ms']:.0f} ms")
+        st.code(ultimo["report"], language=None)
+        st.download_button("📥 Scarica profilo", data=ultimo["report"].encode(),
+                           file_name="diario_profilo.txt", mime="text/plain")
+
 # Footer
 st.markdown("---")
 st.markdown("💡 **Suggerimento:** Usa il menu laterale per navigare tra le diverse funzionalità dell'app!")
 st.markdown("🔗 **Database:** Connesso a Supabase per il salvataggio sicuro dei dati")
+
+# Versione dei dati appena mostrati, per il frammento aggiornamenti
+st.session_state["versione_mostrata"] = DiarioAlimentareDB.get_data_version() if pagina in PAGINE_DATI else None
+with st.sidebar:
+    aggiornamenti()
+
+metriche.registra(f"app.pagina.{pagina.split(' ', 1)[1]}", time.perf_counter() - inizio_esecuzione)
+chiudi_profilo()
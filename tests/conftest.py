@@ -0,0 +1,41 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+RADICE = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RADICE / "src"))
+sys.path.insert(0, str(RADICE / "benchmarks"))
+
+# Prima di importare database: niente file .env né coda su disco, invio
+# della coda solo su richiesta (flush_queue) e nessun thread in background
+os.environ["DIARIO_ENV_FILE"] = os.devnull
+os.environ["DIARIO_CODA_PATH"] = ":memory:"
+os.environ["DIARIO_CODA_INTERVALLO"] = "0"
+os.environ.pop("DIARIO_UTENTE", None)
+os.environ.pop("DIARIO_DATAFRAME", None)
+
+from database import diario_alimentare  # noqa: E402
+from database.backend_sqlite import SQLiteBackend  # noqa: E402
+from database.coda import CodaScritture  # noqa: E402
+from database.diario_alimentare import DiarioAlimentareDB  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_backend():
+    """SQLiteBackend in memoria, senza gli strati di DiarioAlimentareDB"""
+    backend = SQLiteBackend()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def db(sqlite_backend, monkeypatch):
+    """DiarioAlimentareDB su un SQLiteBackend in memoria, con cache, snapshot e coda vuoti"""
+    monkeypatch.setattr(diario_alimentare, "coda", CodaScritture(":memory:"))
+    DiarioAlimentareDB.use_backend(sqlite_backend)
+    DiarioAlimentareDB.set_user(None)
+    yield DiarioAlimentareDB
+    DiarioAlimentareDB.configure()
+    DiarioAlimentareDB.set_user(None)
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from database.aggregati import GRANULARITA, RollupDiario
+from generatore import genera_diario
+
+
+def _voce(id, data, pasto="Cena", carboidrati=40.0, **campi):
+    return {"id": id, "data": data, "pasto": pasto, "alimento": "Pasta", "carboidrati": carboidrati,
+            "unita_insulina": 4.0, "glicemia_iniziale": 110, "glicemia_dop_2h": 150, **campi}
+
+
+def test_il_giorno_e_quello_dell_ora_scritta():
+    rollup = RollupDiario()
+    # Le 00:30 dell'1 maggio a Roma sono ancora il 30 aprile in UTC
+    rollup.aggiorna(nuove=[_voce(1, "2024-05-01T00:30:00+02:00"), _voce(2, "2024-05-01T08:00:00Z", "Colazione")])
+
+    assert list(rollup.serie("giorno")["Periodo"]) == [pd.Timestamp("2024-05-01")]
+
+
+def test_aggiunte_e_rimozioni_come_un_ricalcolo():
+    voci = genera_diario(300)
+    rollup = RollupDiario()
+    rollup.aggiorna(nuove=voci[:200])
+    # Modifica di alcune voci (vecchia e nuova versione), poi eliminazioni e inserimenti
+    modificate = [{**voce, "pasto": "Cena", "carboidrati": 10.0} for voce in voci[:20]]
+    rollup.aggiorna(vecchie=voci[:20], nuove=modificate)
+    rollup.aggiorna(vecchie=voci[150:200])
+    rollup.aggiorna(nuove=voci[200:])
+
+    ricalcolato = RollupDiario()
+    ricalcolato.aggiorna(nuove=modificate + voci[20:150] + voci[200:])
+
+    for granularita in GRANULARITA:
+        pd.testing.assert_frame_equal(rollup.serie(granularita, per_pasto=True),
+                                      ricalcolato.serie(granularita, per_pasto=True))
+    pd.testing.assert_series_equal(rollup.totali(), ricalcolato.totali())
+    pd.testing.assert_frame_equal(rollup.per_pasto(), ricalcolato.per_pasto())
+    pd.testing.assert_series_equal(rollup.alimenti_frequenti(50), ricalcolato.alimenti_frequenti(50))
+    pd.testing.assert_series_equal(rollup.tempi_correzione(), ricalcolato.tempi_correzione())
+    pd.testing.assert_frame_equal(rollup.correzioni_per_glicemia(), ricalcolato.correzioni_per_glicemia())
+    pd.testing.assert_frame_equal(rollup.correlazioni(), ricalcolato.correlazioni())
+
+
+def test_eliminare_tutte_le_voci_svuota_gli_aggregati():
+    voci = genera_diario(50)
+    rollup = RollupDiario()
+    rollup.aggiorna(nuove=voci)
+    rollup.aggiorna(vecchie=voci)
+
+    assert rollup.serie("mese").empty
+    assert rollup.alimenti_frequenti().empty and rollup.tempi_correzione().empty
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+
+def test_un_blocco_rifiutato_viene_ripetuto_riga_per_riga(db, sqlite_backend, monkeypatch):
+    inserisci = sqlite_backend.insert
+    blocchi = []
+
+    def rifiuta_il_burro(righe):
+        blocchi.append(len(righe))
+        if any(riga["alimento"] == "Burro" for riga in righe):
+            raise ValueError("valore non valido")
+        return inserisci(righe)
+
+    monkeypatch.setattr(sqlite_backend, "insert", rifiuta_il_burro)
+    voci = [{"data": datetime(2024, 5, giorno, 12, 0), "alimento": alimento}
+            for giorno, alimento in enumerate(["Pane", "Burro", "Riso", "Pasta", "Mela"], start=1)]
+
+    esito = db.create_entries_bulk(voci, chunk_size=3)
+
+    # Il primo blocco fallisce e viene ripetuto una riga alla volta, il secondo passa intero
+    assert blocchi == [3, 1, 1, 1, 2]
+    assert esito["count"] == 4 and not esito["success"]
+    assert esito["errors"] == [{"index": 1, "error": "valore non valido"}]
+    assert [r["success"] for r in esito["results"]] == [True, False, True, True, True]
+    assert sorted(voce["alimento"] for voce in db.get_all_entries()["data"]) == ["Mela", "Pane", "Pasta", "Riso"]
+
+
+def test_aggiornamenti_ed_eliminazioni_a_blocchi(db):
+    ids = [voce["id"] for voce in db.create_entries_bulk(
+        [{"data": datetime(2024, 5, giorno, 12, 0), "alimento": "Pane"} for giorno in range(1, 6)]
+    )["data"]]
+
+    aggiornate = db.update_entries_bulk([{"id": ids[0], "alimento": "Riso"}, {"id": 999, "alimento": "Pasta"}],
+                                        chunk_size=2)
+    assert aggiornate["errors"] == [{"index": 1, "error": "Voce non trovata"}]
+    assert db.get_entry_by_id(ids[0])["data"]["alimento"] == "Riso"
+
+    assert db.delete_entries_bulk(ids[1:], chunk_size=2)["count"] == 4
+    assert [voce["id"] for voce in db.get_all_entries()["data"]] == [ids[0]]
+
+
+def test_una_data_non_valida_fallisce_solo_la_sua_voce(db):
+    voci = [{"data": datetime(2024, 5, 1, 12, 0), "alimento": "Pane"},
+            {"data": "ieri a pranzo", "alimento": "Riso"},
+            {"data": "2024-05-03T12:00:00", "alimento": "Pasta"}]
+
+    esito = db.create_entries_bulk(voci)
+
+    assert [errore["index"] for errore in esito["errors"]] == [1]
+    assert "ieri a pranzo" in esito["errors"][0]["error"]
+    assert [voce["alimento"] for voce in db.get_all_entries()["data"]] == ["Pasta", "Pane"]
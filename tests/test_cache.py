@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from database.cache import QueryCache
+from database.utenti import come_utente, utente_corrente
+
+
+def test_ogni_utente_ha_la_sua_partizione():
+    cache = QueryCache(partizione=utente_corrente)
+    with come_utente("paziente-a"):
+        cache.set("tutte", ["a"])
+    with come_utente("paziente-b"):
+        assert cache.get("tutte") == (False, None)
+        cache.set("tutte", ["b"])
+        cache.invalidate()
+        assert cache.get("tutte") == (False, None)
+    with come_utente("paziente-a"):
+        assert cache.get("tutte") == (True, ["a"])
+
+
+def test_le_scritture_invalidano_solo_la_cache_dell_utente(db):
+    cache = db.cache
+    for utente in ("paziente-a", "paziente-b"):
+        with db.as_user(utente):
+            db.create_entry(data=datetime(2024, 5, 1, 12, 0), alimento=f"Pane di {utente}")
+            db.get_all_entries()
+
+    with db.as_user("paziente-b"):
+        db.create_entry(data=datetime(2024, 5, 2, 12, 0), alimento="Riso")
+    with db.as_user("paziente-a"):
+        successi = cache.hits
+        assert [voce["alimento"] for voce in db.get_all_entries()["data"]] == ["Pane di paziente-a"]
+        assert cache.hits == successi + 1
+    with db.as_user("paziente-b"):
+        successi = cache.hits
+        assert len(db.get_all_entries()["data"]) == 2
+        assert cache.hits == successi
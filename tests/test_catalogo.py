@@ -0,0 +1,40 @@
+from database.catalogo import CatalogoAlimenti, TriePrefissi
+
+
+def _voce(alimento, quantita=80, carboidrati=56.0, unita_misura="g"):
+    return {"alimento": alimento, "quantita": quantita, "carboidrati": carboidrati, "unita_misura": unita_misura}
+
+
+def test_trie_trova_le_chiavi_per_prefisso_e_si_ripulisce():
+    trie = TriePrefissi()
+    trie.aggiungi("pasta", "pasta al pomodoro")
+    trie.aggiungi("pomodoro", "pasta al pomodoro")
+    trie.aggiungi("pane", "pane")
+
+    assert trie.cerca("pa") == {"pasta al pomodoro", "pane"}
+    assert trie.cerca("pom") == {"pasta al pomodoro"}
+    assert trie.cerca("") == set() and trie.cerca("riso") == set()
+
+    # Una chiave si toglie con tutte le sue parole, come fa il catalogo
+    for parola in ("pasta", "pomodoro"):
+        trie.rimuovi(parola, "pasta al pomodoro")
+    assert trie.cerca("pa") == {"pane"} and trie.cerca("pom") == set()
+    trie.rimuovi("pane", "pane")
+    # I nodi rimasti senza chiavi vengono eliminati
+    assert trie._radice == {}
+
+
+def test_suggerimenti_ordinati_e_aggiornati_con_le_voci():
+    catalogo = CatalogoAlimenti()
+    catalogo.aggiorna(nuove=[_voce("Pasta al pomodoro"), _voce("pasta al Pomodoro"), _voce("Pane", 50, 25.0),
+                             _voce("Pane", 100, 50.0), _voce("Pane", 50, 25.0), _voce("Patate")])
+
+    # Prima i nomi che iniziano con il testo, poi i più registrati
+    assert [s["alimento"] for s in catalogo.suggerisci("pa")] == ["Pane", "Pasta al pomodoro", "Patate"]
+    assert [s["alimento"] for s in catalogo.suggerisci("pa pom")] == ["Pasta al pomodoro"]
+    pane = catalogo.trova("PANE")
+    assert (pane["voci"], pane["quantita"], pane["carboidrati_per_unita"], pane["carboidrati"]) == (3, 50, 0.5, 25.0)
+
+    catalogo.aggiorna(vecchie=[_voce("Patate")])
+    assert catalogo.trova("patate") is None
+    assert [s["alimento"] for s in catalogo.suggerisci("pat")] == []
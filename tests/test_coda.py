@@ -0,0 +1,105 @@
+import logging
+import time
+from datetime import datetime
+
+from database.coda import AGGIORNA, CONFLITTO, CREA, ELIMINA, ERRORE, IN_ATTESA, CodaScritture, InvioCoda
+
+
+def _seq(operazioni):
+    return [operazione["seq"] for operazione in operazioni]
+
+
+def test_le_operazioni_partono_in_ordine_di_arrivo():
+    coda = CodaScritture(":memory:")
+    crea = coda.accoda(CREA, {"alimento": "Pane"}, chiave="k1", utente="a")
+    aggiorna = coda.accoda(AGGIORNA, {"alimento": "Pasta"}, entry_id=7, utente="a")
+    elimina = coda.accoda(ELIMINA, entry_id=8, utente="b")
+
+    assert _seq(coda.da_inviare(10)) == [crea["seq"], aggiorna["seq"], elimina["seq"]]
+    assert _seq(coda.da_inviare(2)) == [crea["seq"], aggiorna["seq"]]
+    assert _seq(coda.da_inviare(10, utente="b")) == [elimina["seq"]]
+    # Riaccodare la stessa chiave restituisce l'operazione già in coda
+    assert coda.accoda(CREA, {"alimento": "Pane"}, chiave="k1", utente="a")["seq"] == crea["seq"]
+
+
+def test_un_conflitto_blocca_solo_le_operazioni_successive_sulla_voce():
+    coda = CodaScritture(":memory:")
+    aggiorna = coda.accoda(AGGIORNA, {"alimento": "Pasta"}, entry_id=7, utente="a")
+    elimina = coda.accoda(ELIMINA, entry_id=7, utente="a")
+    altra = coda.accoda(ELIMINA, entry_id=8, utente="a")
+
+    coda.segna(aggiorna["seq"], CONFLITTO, "La voce è stata modificata da un altro dispositivo")
+
+    assert _seq(coda.da_inviare(10)) == [altra["seq"]]
+    assert coda.conteggi("a") == {IN_ATTESA: 2, CONFLITTO: 1, ERRORE: 0}
+    # Solo l'utente che l'ha accodata può ripeterla
+    assert not coda.riprova(aggiorna["seq"], utente="b")
+    assert coda.riprova(aggiorna["seq"], utente="a")
+    assert _seq(coda.da_inviare(10)) == [aggiorna["seq"], elimina["seq"], altra["seq"]]
+
+
+def test_una_creazione_rifiutata_blocca_le_modifiche_sulla_sua_chiave():
+    coda = CodaScritture(":memory:")
+    crea = coda.accoda(CREA, {"alimento": "Pane"}, chiave="k1", utente="a")
+    aggiorna = coda.accoda(AGGIORNA, {"alimento": "Pasta"}, chiave="k1", utente="a")
+    elimina = coda.accoda(ELIMINA, chiave="k1", utente="a")
+
+    coda.segna(crea["seq"], ERRORE, "valore non valido")
+
+    assert coda.da_inviare(10) == []
+    assert not coda.scarta(crea["seq"], utente="b")
+    assert coda.scarta(crea["seq"], utente="a")
+    assert _seq(coda.da_inviare(10)) == [aggiorna["seq"], elimina["seq"]]
+
+
+def test_modifica_in_conflitto_ripetuta_con_sovrascrittura(db):
+    voce = db.create_entry(data=datetime(2024, 5, 1, 12, 0), alimento="Pane")["data"]
+    db.queue_update_entry(voce["id"], base_updated_at="2000-01-01T00:00:00+00:00", alimento="Pasta")
+    db.queue_delete_entry(voce["id"])
+
+    esito = db.flush_queue()
+    assert (esito["sent"], esito["pending"]) == (0, 1)
+    stato = db.get_queue_status()
+    assert (stato["conflicts"], stato["pending"]) == (1, 1)
+
+    conflitto = next(op for op in stato["data"] if op["stato"] == CONFLITTO)
+    assert db.retry_queued(conflitto["seq"], overwrite=True)["success"]
+    esito = db.flush_queue()
+    assert (esito["sent"], esito["pending"]) == (2, 0)
+    assert not db.get_entry_by_id(voce["id"])["success"]
+
+
+def test_creazione_rifiutata_e_ripetuta(db, sqlite_backend, monkeypatch):
+    inserisci = sqlite_backend.insert
+
+    def rifiuta(righe):
+        raise ValueError("valore non valido")
+
+    monkeypatch.setattr(sqlite_backend, "insert", rifiuta)
+    db.queue_create_entry(datetime(2024, 5, 1, 12, 0), idempotency_key="k1", alimento="Pane")
+    db.queue_update_entry(idempotency_key="k1", alimento="Pasta")
+
+    esito = db.flush_queue()
+    assert (esito["sent"], esito["pending"]) == (0, 1)
+    assert db.get_queue_status()["errors"] == 1
+
+    monkeypatch.setattr(sqlite_backend, "insert", inserisci)
+    errore = next(op for op in db.get_queue_status()["data"] if op["stato"] == ERRORE)
+    db.retry_queued(errore["seq"])
+    assert db.flush_queue()["sent"] == 2
+    # Le operazioni inviate escono dalla coda: un nuovo invio non le ripete
+    assert db.flush_queue()["sent"] == 0
+    assert [voce["alimento"] for voce in db.get_all_entries()["data"]] == ["Pasta"]
+
+
+def test_invio_non_riuscito_registrato_nel_log(caplog):
+    # Senza operazioni in attesa il thread torna a dormire dopo il primo invio
+    invio = InvioCoda(lambda: {"success": False, "error": "rete assente", "pending": 0}, intervallo=60)
+    with caplog.at_level(logging.WARNING, logger="database.coda"):
+        invio.sveglia()
+        for _ in range(200):
+            if invio.ultimo_esito is not None:
+                break
+            time.sleep(0.01)
+    assert invio.ultimo_esito["error"] == "rete assente"
+    assert "rete assente" in caplog.text
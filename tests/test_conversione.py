@@ -0,0 +1,24 @@
+import pandas as pd
+
+from database.conversione import FORMATO_PREDEFINITO, TIPI, voci_a_dataframe
+
+
+def _date(*date):
+    return voci_a_dataframe([{"id": i, "data": data} for i, data in enumerate(date, start=1)])["Data"].tolist()
+
+
+def test_le_date_mantengono_l_ora_scritta():
+    assert _date("2024-05-01T12:00:00+02:00", "2024-05-01T13:30:00+02:00") == [
+        pd.Timestamp("2024-05-01 12:00"), pd.Timestamp("2024-05-01 13:30")]
+    assert _date("2024-05-01T12:00:00", "2024-05-01T13:00:00+00:00") == [
+        pd.Timestamp("2024-05-01 12:00"), pd.Timestamp("2024-05-01 13:00")]
+    # Fusi diversi tra le voci: ognuna con la sua ora, senza conversioni
+    assert _date("2024-05-01T12:00:00+02:00", "2024-05-01T12:00:00Z", "2024-05-01T12:00:00.5-0500") == [
+        pd.Timestamp("2024-05-01 12:00"), pd.Timestamp("2024-05-01 12:00"), pd.Timestamp("2024-05-01 12:00:00.5")]
+
+
+def test_il_formato_predefinito_e_esteso():
+    df = voci_a_dataframe([{"id": 1, "data": "2024-05-01T12:00:00", "pasto": "Pranzo", "carboidrati": 12.3}])
+    assert FORMATO_PREDEFINITO == "esteso"
+    assert {colonna: str(df[colonna].dtype) for colonna in TIPI} == TIPI
+    assert df["Carboidrati (g)"].iloc[0] == 12.3
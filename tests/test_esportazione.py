@@ -0,0 +1,29 @@
+import io
+
+import pytest
+
+from database import esportazione
+from database.conversione import FORMATI, voci_a_dataframe
+from generatore import genera_diario
+
+
+@pytest.mark.parametrize("formato", FORMATI)
+def test_excel_a_blocchi_con_valori_mancanti(formato, monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(esportazione, "BLOCCO_EXCEL", 2)
+    voci = genera_diario(5)
+    voci[1]["quantita"] = None
+    voci[2]["carboidrati"] = None
+    voci[3]["note"] = None
+    df = voci_a_dataframe(voci, formato=formato)
+
+    foglio = openpyxl.load_workbook(io.BytesIO(esportazione.esporta(df, "xlsx"))).active
+    righe = [[cella.value for cella in riga] for riga in foglio.iter_rows()]
+
+    assert righe[0] == list(df.columns)
+    assert [riga[0] for riga in righe[1:]] == [voce["id"] for voce in voci]
+    assert righe[2][df.columns.get_loc("Quantità")] is None
+    assert righe[3][df.columns.get_loc("Carboidrati (g)")] is None
+    assert righe[4][df.columns.get_loc("Note")] is None
+    # I float32 del formato compatto si esportano con il valore scritto nel diario
+    assert righe[1][df.columns.get_loc("Carboidrati (g)")] == voci[0]["carboidrati"]
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from database.grafici import lttb, minmax, riduci
+
+
+def _serie(n=5000):
+    generatore = np.random.default_rng(3)
+    x = np.arange(n, dtype=float)
+    y = np.sin(x / 200) * 50 + generatore.normal(0, 5, n)
+    # Picco isolato
+    y[n // 4] = 400.0
+    return x, y
+
+
+@pytest.mark.parametrize("scegli", [lttb, minmax])
+@pytest.mark.parametrize("punti", [4, 5, 101, 800])
+def test_al_piu_punti_indici_crescenti_con_gli_estremi(scegli, punti):
+    x, y = _serie()
+    scelti = scegli(x, y, punti)
+
+    assert len(scelti) <= punti
+    assert scelti[0] == 0 and scelti[-1] == len(x) - 1
+    assert (np.diff(scelti) > 0).all()
+    # Il picco isolato sopravvive alla riduzione
+    assert len(x) // 4 in scelti
+
+
+def test_lttb_tiene_esattamente_i_punti_richiesti():
+    x, y = _serie()
+    assert len(lttb(x, y, 800)) == 800
+
+
+def test_minmax_conserva_l_inviluppo():
+    x, y = _serie()
+    scelti = minmax(x, y, 100)
+    assert y[scelti].min() == y.min() and y[scelti].max() == y.max()
+
+
+@pytest.mark.parametrize("scegli", [lttb, minmax])
+def test_serie_corte_restano_intere(scegli):
+    x, y = _serie(10)
+    np.testing.assert_array_equal(scegli(x, y, 10), np.arange(10))
+    np.testing.assert_array_equal(scegli(x, y, 2), np.arange(10))
+
+
+@pytest.mark.parametrize("metodo", ["lttb", "minmax"])
+def test_riduci_per_gruppo_e_intervallo(metodo):
+    giorni = pd.date_range("2024-01-01", periods=3000, freq="h")
+    df = pd.DataFrame({"data": np.tile(giorni, 2), "pasto": np.repeat(["Pranzo", "Cena"], 3000),
+                       "glicemia": np.r_[_serie(3000)[1], _serie(3000)[1] + 20]})
+    df.loc[5, "glicemia"] = np.nan
+
+    ridotto = riduci(df, "data", ["glicemia"], punti=100, inizio=giorni[100], gruppo="pasto", metodo=metodo)
+
+    assert ridotto["data"].min() >= giorni[100]
+    assert ridotto["data"].is_monotonic_increasing
+    assert (ridotto.groupby("pasto").size() <= 100).all()
+    assert ridotto["glicemia"].notna().all()
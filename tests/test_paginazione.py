@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.backend_supabase import SupabaseBackend
+from fake_supabase import FakeSupabaseClient
+
+
+@pytest.fixture(params=["sqlite", "supabase"])
+def diario(request, db):
+    if request.param == "supabase":
+        db.use_backend(SupabaseBackend(FakeSupabaseClient()))
+    # Tre voci per istante: l'ordine tra loro lo decide solo l'id
+    inizio = datetime(2024, 5, 1, 12, 0)
+    voci = [{"data": inizio + timedelta(hours=i // 3), "alimento": f"Voce {i}"} for i in range(11)]
+    assert db.create_entries_bulk(voci)["success"]
+    return db
+
+
+def test_le_pagine_keyset_coprono_ogni_voce_una_volta(diario):
+    pagine = list(diario.iter_entry_pages(page_size=4))
+    voci = [voce for pagina in pagine for voce in pagina]
+
+    assert [len(pagina) for pagina in pagine] == [4, 4, 3]
+    chiavi = [(datetime.fromisoformat(voce["data"]), voce["id"]) for voce in voci]
+    assert chiavi == sorted(chiavi, reverse=True)
+    assert len({voce["id"] for voce in voci}) == 11
+
+
+def test_le_pagine_keyset_rispettano_l_intervallo(diario):
+    pagine = diario.iter_entry_pages(page_size=2, start_date=datetime(2024, 5, 1, 13, 0),
+                                     end_date=datetime(2024, 5, 1, 14, 0), columns="alimento")
+    voci = [voce for pagina in pagine for voce in pagina]
+    assert sorted(voce["alimento"] for voce in voci) == [f"Voce {i}" for i in range(3, 9)]
+    assert all(set(voce) == {"alimento", "data", "id"} for voce in voci)
@@ -0,0 +1,62 @@
+import uuid
+
+import pytest
+
+from database.backend import TABLE_NAME
+from database.backend_supabase import SupabaseBackend
+from database.resilienza import BackendResiliente
+from fake_supabase import FakeSupabaseClient, guasto_una_volta
+
+
+def _backend():
+    client = FakeSupabaseClient()
+    client.carica(TABLE_NAME, [])
+    return client, BackendResiliente(SupabaseBackend(client), timeout=0, attesa_base=0)
+
+
+def _righe(n, con_chiave=True):
+    return [{"data": "2024-05-01T12:00:00", "alimento": f"Voce {i}",
+             **({"chiave_idempotenza": str(uuid.uuid4())} if con_chiave else {})} for i in range(n)]
+
+
+def test_risposta_persa_riconciliata_senza_duplicati():
+    client, backend = _backend()
+    righe = _righe(3)
+    client.rete.append(guasto_una_volta("risposta", "insert", TimeoutError("timeout di lettura")))
+
+    scritte = backend.insert(righe)
+
+    assert [riga["chiave_idempotenza"] for riga in scritte] == [riga["chiave_idempotenza"] for riga in righe]
+    assert len(client.righe(TABLE_NAME)) == 3
+
+
+def test_chiavi_gia_scritte_restituiscono_le_righe_esistenti():
+    client, backend = _backend()
+    righe = _righe(4)
+    prime = backend.insert(righe[:2])
+
+    # Reinvio di tutto il blocco (ad esempio un modulo inviato due volte):
+    # si scrivono solo le righe mancanti, nell'ordine richiesto
+    scritte = backend.insert(righe)
+
+    assert [riga["id"] for riga in scritte[:2]] == [riga["id"] for riga in prime]
+    assert [riga["chiave_idempotenza"] for riga in scritte] == [riga["chiave_idempotenza"] for riga in righe]
+    assert len(client.righe(TABLE_NAME)) == 4
+
+
+def test_senza_chiave_un_esito_incerto_non_viene_ripetuto():
+    client, backend = _backend()
+    client.rete.append(guasto_una_volta("risposta", "insert", ConnectionResetError("connessione chiusa")))
+
+    with pytest.raises(ConnectionResetError):
+        backend.insert(_righe(1, con_chiave=False))
+    assert len(client.righe(TABLE_NAME)) == 1
+
+
+def test_richiesta_non_partita_ripetuta():
+    client, backend = _backend()
+    client.rete.append(guasto_una_volta("richiesta", "insert", ConnectionRefusedError("rifiutata")))
+
+    backend.insert(_righe(1, con_chiave=False))
+
+    assert len(client.righe(TABLE_NAME)) == 1
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from database.ricerca import SOGLIA_SIMILARITA, IndiceParole, conta_parole, parole, punteggio
+
+
+def test_ricerca_con_elenco_di_campi_e_limite(db):
+    for giorno, (alimento, note) in enumerate([("Pasta al sugo", None), ("Riso", "con pasta avanzata"),
+                                               ("Pasta fredda", None), ("Pane", None)], start=1):
+        db.create_entry(data=datetime(2024, 5, giorno, 12, 0), alimento=alimento, note=note)
+
+    risultato = db.search_entries("pasta", field=["alimento", "note"])
+    assert risultato["success"], risultato.get("error")
+    assert risultato["count"] == 3 and not risultato["truncated"]
+    # La stessa chiamata con una tupla usa la voce in cache
+    successi = db.cache.hits
+    assert db.search_entries("pasta", field=("alimento", "note"))["count"] == 3
+    assert db.cache.hits == successi + 1
+
+    limitata = db.search_entries("pasta", field=["alimento", "note"], limit=2)
+    assert (limitata["count"], limitata["limit"], limitata["truncated"]) == (2, 2, True)
+
+
+def test_punteggio_per_uguaglianza_prefisso_parte_e_refuso():
+    assert parole("Caffè  LATTE, 2 cucchiai") == ["caffe", "latte", "2", "cucchiai"]
+    assert punteggio("pasta", "pasta") == 1.0
+    assert punteggio("past", "pasta") == 0.9
+    assert punteggio("asta", "pasta") == 0.8
+    assert SOGLIA_SIMILARITA <= punteggio("pasat", "pasta") < 0.8
+    assert punteggio("pasta", "mela") < SOGLIA_SIMILARITA
+
+
+def test_candidati_ordinati_e_aggiornati_con_le_voci():
+    indice = IndiceParole()
+    righe = [{"alimento": "Pasta al sugo"}, {"alimento": "Pastasciutta"}, {"alimento": "Pasta fredda"},
+             {"alimento": "Mela", "note": "pasta frolla"}]
+    indice.aggiorna(conta_parole(righe))
+
+    assert [parola for parola, _ in indice.candidati("pasta", ["alimento"])] == ["pasta", "pastasciutta"]
+    assert [parola for parola, _ in indice.candidati("frola")] == ["frolla"]
+    assert indice.candidati("frola", ["alimento"]) == []
+
+    indice.aggiorna(conta_parole(righe[1:2], segno=-1))
+    assert [parola for parola, _ in indice.candidati("pasta", ["alimento"])] == ["pasta"]
+
+
+def test_risultati_ordinati_per_pertinenza(db):
+    for giorno, alimento in enumerate(["Pastasciutta", "Pasta al sugo", "Riso", "Pasta e fagioli"], start=1):
+        db.create_entry(data=datetime(2024, 5, giorno, 12, 0), alimento=alimento)
+
+    # Prima le corrispondenze esatte (dalla più recente), poi i prefissi
+    assert [voce["alimento"] for voce in db.search_entries("pasta")["data"]] == [
+        "Pasta e fagioli", "Pasta al sugo", "Pastasciutta"
+    ]
+    # Un refuso trova le parole abbastanza simili, non quelle molto più lunghe
+    assert [voce["alimento"] for voce in db.search_entries("pasat")["data"]] == ["Pasta e fagioli", "Pasta al sugo"]
+    # Con SQLite ogni parola del termine deve comparire, in qualsiasi ordine
+    assert [voce["alimento"] for voce in db.search_entries("fagioli pasta")["data"]] == ["Pasta e fagioli"]
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+from database.conversione import date_locali
+from database.risposta_glicemica import QUARTILI, RispostaGlicemica, _quantili
+from generatore import genera_diario
+
+
+def _voce(id, data, pasto="Cena", glicemia_iniziale=110, glicemia_dop_2h=150, **campi):
+    return {"id": id, "data": data, "pasto": pasto, "carboidrati": 40.0, "unita_insulina": 4.0,
+            "glicemia_iniziale": glicemia_iniziale, "glicemia_dop_2h": glicemia_dop_2h, **campi}
+
+
+def test_il_giorno_e_quello_dell_ora_scritta():
+    risposta = RispostaGlicemica()
+    # Le 00:30 dell'1 maggio a Roma sono ancora il 30 aprile in UTC
+    risposta.aggiorna(nuove=[_voce(1, "2024-05-01T00:30:00+02:00"), _voce(2, "2024-05-01T08:00:00Z")])
+
+    assert list(risposta.tendenze(finestre=(1,))["Giorno"]) == [pd.Timestamp("2024-05-01")]
+
+
+def test_quantili_per_gruppo_come_numpy():
+    generatore = np.random.default_rng(7)
+    valori = generatore.normal(100, 30, 500)
+    gruppi = generatore.integers(0, 5, 500)
+
+    # Il gruppo 5 è vuoto
+    risultato = _quantili(valori, gruppi, 6, QUARTILI)
+
+    for gruppo in range(5):
+        np.testing.assert_allclose(risultato[gruppo], np.quantile(valori[gruppi == gruppo], QUARTILI))
+    assert np.isnan(risultato[5]).all()
+
+
+def _voci_con_giorno():
+    voci = genera_diario(400)
+    df = pd.DataFrame(voci)
+    df["giorno"] = date_locali(df["data"]).dt.normalize()
+    df["variazione"] = (pd.to_numeric(df["glicemia_dop_2h"], errors="coerce")
+                        - pd.to_numeric(df["glicemia_iniziale"], errors="coerce"))
+    return voci, df.dropna(subset=["variazione"])
+
+
+def test_variazione_per_pasto_come_pandas():
+    voci, df = _voci_con_giorno()
+    risposta = RispostaGlicemica()
+    risposta.aggiorna(nuove=voci)
+
+    risultato = risposta.variazione_per_pasto()
+    gruppi = df.groupby("pasto")["variazione"]
+    np.testing.assert_array_equal(risultato["Misurazioni"], gruppi.size().loc[risultato.index])
+    np.testing.assert_allclose(risultato["Media Variazione"], gruppi.mean().loc[risultato.index])
+    np.testing.assert_allclose(risultato["Mediana Variazione"], gruppi.median().loc[risultato.index])
+    np.testing.assert_allclose(risultato["Terzo Quartile"], gruppi.quantile(0.75).loc[risultato.index])
+    np.testing.assert_allclose(risultato["Deviazione Standard"], gruppi.std().loc[risultato.index])
+
+
+def test_tendenze_come_finestre_di_calendario():
+    voci, df = _voci_con_giorno()
+    risposta = RispostaGlicemica()
+    risposta.aggiorna(nuove=voci)
+
+    tendenze = risposta.tendenze("variazione", finestre=(7,))
+    attese = []
+    for pasto, gruppo in df.groupby("pasto"):
+        giorni = pd.date_range(gruppo["giorno"].min(), gruppo["giorno"].max() + pd.Timedelta(days=6))
+        for giorno in giorni:
+            finestra = gruppo[(gruppo["giorno"] > giorno - pd.Timedelta(days=7)) & (gruppo["giorno"] <= giorno)]
+            if len(finestra):
+                attese.append((giorno, pasto, finestra["variazione"].mean()))
+    attese.sort(key=lambda t: t[:2])
+    # Le finestre oltre l'ultima voce del diario non compaiono
+    ultimo = df["giorno"].max()
+    attese = [t for t in attese if t[0] <= ultimo]
+
+    # Nello stesso giorno i pasti seguono l'ordine in cui sono comparsi nel diario
+    tendenze = tendenze.assign(Pasto=tendenze["Pasto"].astype(str)).sort_values(["Giorno", "Pasto"])
+    assert list(zip(tendenze["Giorno"], tendenze["Pasto"])) == [t[:2] for t in attese]
+    np.testing.assert_allclose(tendenze["Media 7 giorni"], [t[2] for t in attese])
+
+
+def test_le_voci_rimosse_escono_dalle_analisi():
+    voci = genera_diario(100)
+    risposta = RispostaGlicemica()
+    risposta.aggiorna(nuove=voci)
+    risposta.aggiorna(vecchie=voci[50:])
+
+    ricalcolata = RispostaGlicemica()
+    ricalcolata.aggiorna(nuove=voci[:50])
+    for nome, risultato in risposta.calcola().items():
+        pd.testing.assert_frame_equal(risultato, ricalcolata.calcola()[nome], obj=nome)
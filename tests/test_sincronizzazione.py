@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+from database.backend import TABLE_NAME
+from database.backend_supabase import SupabaseBackend
+from database.diario_alimentare import flusso, stati
+from fake_supabase import FakeSupabaseClient
+from generatore import genera_diario
+
+
+@pytest.fixture(autouse=True)
+def senza_tempo_reale(monkeypatch):
+    # Le novità si leggono dal server a ogni sincronizzazione
+    monkeypatch.setattr(flusso, "attivo", False)
+    flusso.ferma()
+
+
+def test_importazione_non_viene_riletta(db, sqlite_backend):
+    db.create_entries_bulk(genera_diario(300, con_id=False))
+    # Righe importate tempo fa, tutte con lo stesso updated_at (come dopo
+    # 001_updated_at.sql o una migrazione)
+    sqlite_backend.conn.execute(f'update "{TABLE_NAME}" set updated_at = ?', ("2024-01-01T00:00:00+00:00",))
+
+    assert db.sync_entries()["fetched"] == 300
+    assert db.sync_entries()["fetched"] == 0
+    assert db.sync_entries()["fetched"] == 0
+
+
+def test_sincronizzazione_legge_solo_le_novita(db):
+    db.create_entries_bulk(genera_diario(50, con_id=False))
+    assert db.sync_entries()["fetched"] == 50
+    stati.corrente().snapshot.margine = 0
+
+    assert db.sync_entries()["fetched"] == 0
+
+    entry_id = db.get_all_entries(limit=1)["data"][0]["id"]
+    db.get_backend().update({"note": "modificata"}, [("id", "eq", entry_id)])
+    risultato = db.sync_entries()
+    assert risultato["fetched"] == 1
+    assert next(v for v in risultato["data"] if v["id"] == entry_id)["note"] == "modificata"
+
+    nuova = genera_diario(1, seme=7, con_id=False)[0]
+    assert db.create_entry(**{**nuova, "data": datetime.fromisoformat(nuova["data"])})["success"]
+    assert db.sync_entries()["fetched"] == 1
+
+    # Eliminazione non notificata: rilevata dal conteggio, senza scaricare righe
+    db.get_backend().delete([("id", "eq", entry_id)])
+    risultato = db.sync_entries()
+    assert risultato["fetched"] == 0
+    assert risultato["count"] == 50
+    assert entry_id not in {voce["id"] for voce in risultato["data"]}
+
+
+def test_ora_del_server_da_supabase(db):
+    client = FakeSupabaseClient()
+    client.carica(TABLE_NAME, genera_diario(100))
+    db.use_backend(SupabaseBackend(client))
+
+    assert db.sync_entries()["fetched"] == 100
+    assert stati.corrente().snapshot.ora_sync is not None
+    assert db.sync_entries()["fetched"] == 0
+
+
+def test_senza_funzione_diario_ora_si_usa_l_ultima_modifica(db):
+    client = FakeSupabaseClient()
+    del client.funzioni["diario_ora"]
+    client.carica(TABLE_NAME, genera_diario(100))
+    db.use_backend(SupabaseBackend(client))
+
+    assert db.sync_entries()["fetched"] == 100
+    snapshot = stati.corrente().snapshot
+    assert snapshot.ora_sync is None
+    # Si rileggono solo le righe nel margine prima dell'ultima modifica
+    assert db.sync_entries()["fetched"] == 1
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from database.diario_alimentare import flusso, stati
+
+
+def _voce(alimento="Pane", **campi):
+    return {"data": datetime(2024, 5, 1, 12, 0), "pasto": "Pranzo", "alimento": alimento,
+            "quantita": 50, "unita_misura": "g", "carboidrati": 25.0, "glicemia_iniziale": 110, **campi}
+
+
+def test_copre_dopo_sincronizzazione_completa(db):
+    db.create_entry(**_voce())
+    assert db.sync_entries()["success"]
+    snapshot = stati.corrente().snapshot
+    assert flusso.copre(snapshot.inizio_sync)
+
+
+def test_copre_dopo_sincronizzazione_con_riconciliazione(db, sqlite_backend):
+    for alimento in ("Pane", "Pasta", "Mela"):
+        db.create_entry(**_voce(alimento))
+    db.sync_entries()
+    snapshot = stati.corrente().snapshot
+    # Modifiche non notificate (ad esempio da un altro processo): una voce
+    # eliminata e una con updated_at precedente al punto di ripresa, che la
+    # lettura delle novità non vede. Oltre l'intervallo di verifica si
+    # rilegge il server e i conteggi diversi fanno riconciliare gli id
+    sqlite_backend.conn.execute('delete from "DiarioAlimentare" where alimento = ?', ("Mela",))
+    sqlite_backend.conn.execute(
+        'insert into "DiarioAlimentare" (data, alimento, updated_at) values (?, ?, ?), (?, ?, ?)',
+        ("2024-05-01T12:00:00", "Riso", "2000-01-01T00:00:00+00:00",
+         "2024-05-01T12:00:00", "Latte", "2000-01-01T00:00:00+00:00"))
+    snapshot.inizio_sync -= flusso.verifica + 1
+    assert not flusso.copre(snapshot.inizio_sync)
+
+    risultato = db.sync_entries()
+
+    assert sorted(voce["alimento"] for voce in risultato["data"]) == ["Latte", "Pane", "Pasta", "Riso"]
+    assert flusso.copre(snapshot.inizio_sync)
+
+
+def test_modifica_notificata_aggiorna_lo_snapshot(db):
+    entry_id = db.create_entry(**_voce())["data"]["id"]
+    db.sync_entries()
+    versione = db.get_data_version()
+    # Scrittura di un'altra sessione sullo stesso backend, notificata dal flusso
+    db.get_backend().update({"note": "altra sessione"}, [("id", "eq", entry_id)])
+    flusso.attendi()
+    assert db.get_data_version() > versione
+    assert stati.corrente().snapshot.voci[entry_id]["note"] == "altra sessione"
@@ -0,0 +1,130 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from database.backend import TABLE_NAME
+from database.backend_supabase import SupabaseBackend
+from database.strumentazione import BackendMisurato, Metriche
+from database.utenti import BackendUtente, come_utente, con_accesso
+from fake_supabase import FakeAPIError, FakeSupabaseClient
+from generatore import genera_diario
+
+
+def _voce(alimento="Pane", **campi):
+    return {"data": datetime(2024, 5, 1, 12, 0), "pasto": "Pranzo", "alimento": alimento,
+            "quantita": 50, "unita_misura": "g", "carboidrati": 25.0, "glicemia_iniziale": 110, **campi}
+
+
+def test_un_utente_non_vede_ne_modifica_le_voci_di_un_altro(db):
+    with db.as_user("paziente-a"):
+        entry_id = db.create_entry(**_voce("Pane"))["data"]["id"]
+
+    with db.as_user("paziente-b"):
+        db.create_entry(**_voce("Riso"))
+        assert [voce["alimento"] for voce in db.get_all_entries()["data"]] == ["Riso"]
+        assert not db.get_entry_by_id(entry_id)["success"]
+        assert db.get_statistics()["data"]["total_entries"] == 1
+        assert db.search_entries("Pane")["data"] == []
+        db.update_entry(entry_id, alimento="Modificato")
+        db.delete_entry(entry_id)
+
+    with db.as_user("paziente-a"):
+        assert [voce["alimento"] for voce in db.get_all_entries()["data"]] == ["Pane"]
+
+
+def test_upsert_non_sovrascrive_le_voci_di_un_altro(sqlite_backend):
+    backend = BackendUtente(sqlite_backend)
+    with come_utente("paziente-a"):
+        entry_id = backend.insert([{"data": "2024-05-01T12:00:00", "alimento": "Pane"}])[0]["id"]
+
+    with come_utente("paziente-b"):
+        with pytest.raises(PermissionError):
+            backend.upsert([{"id": entry_id, "data": "2024-05-01T12:00:00", "alimento": "Riso"}])
+        with pytest.raises(PermissionError):
+            backend.insert([{"data": "2024-05-01T12:00:00", "alimento": "Riso", "user_id": "paziente-a"}])
+        with pytest.raises(PermissionError):
+            backend.update({"user_id": "paziente-c"}, [])
+
+    with come_utente("paziente-a"):
+        assert backend.select("alimento") == [{"alimento": "Pane"}]
+
+
+def test_le_funzioni_rpc_rifiutano_un_utente_nullo():
+    client = FakeSupabaseClient()
+    client.carica(TABLE_NAME, [{**voce, "user_id": "paziente-a"} for voce in genera_diario(20)])
+    backend = SupabaseBackend(client)
+
+    for chiamata in (backend.statistics, backend.summary, backend.checksum, lambda: backend.search("Pane")):
+        with pytest.raises(FakeAPIError):
+            chiamata()
+    with come_utente("paziente-a"):
+        assert BackendUtente(backend).statistics()["total_entries"] == 20
+    with come_utente("paziente-b"):
+        assert BackendUtente(backend).statistics()["total_entries"] == 0
+
+
+def _backend_con_sessione(client_sessione):
+    account = SimpleNamespace(id="account-a", app_metadata={"pazienti": ["paziente-b"]})
+    client_sessione.auth = SimpleNamespace(sign_in_with_password=lambda credenziali: SimpleNamespace(user=account),
+                                           sign_out=lambda: None)
+    return SupabaseBackend(FakeSupabaseClient(), nuovo_client=lambda: client_sessione)
+
+
+def test_le_richieste_usano_la_sessione_dell_accesso():
+    client_sessione = FakeSupabaseClient()
+    client_sessione.carica(TABLE_NAME, [{**voce, "user_id": "paziente-b"} for voce in genera_diario(5)])
+    backend = BackendUtente(_backend_con_sessione(client_sessione))
+
+    with con_accesso("sessione-1"):
+        assert backend.sign_in("a@example.com", "segreta") == ["account-a", "paziente-b"]
+        with come_utente("paziente-b"):
+            assert backend.count() == 5
+        # Un utente a cui la sessione non dà accesso usa il client della chiave, che non vede le voci
+        with come_utente("paziente-c"):
+            assert backend.count() == 0
+    # Un altro accesso (o un thread senza accesso) non usa la sessione, anche con lo stesso utente
+    for accesso in ("sessione-2", None):
+        with con_accesso(accesso), come_utente("paziente-b"):
+            assert backend.count() == 0
+
+    with con_accesso("sessione-1"):
+        backend.sign_out()
+        with come_utente("paziente-b"):
+            assert backend.count() == 0
+    # Il canale Realtime vedrebbe solo le voci del suo token
+    with pytest.raises(NotImplementedError):
+        backend.subscribe(lambda evento, riga: None)
+
+
+def test_la_coda_usa_l_accesso_che_ha_accodato(db, monkeypatch):
+    client_sessione = FakeSupabaseClient()
+    db.use_backend(_backend_con_sessione(client_sessione))
+    with con_accesso("sessione-1"):
+        assert db.sign_in("a@example.com", "segreta")["success"]
+        db.set_user("paziente-b")
+        db.queue_create_entry(datetime(2024, 5, 1, 12, 0), alimento="Pane")
+
+    # L'invio parte da un contesto senza accesso, come il thread in background
+    assert db.flush_queue()["sent"] == 1
+    assert [riga["alimento"] for riga in client_sessione._tabelle[TABLE_NAME]] == ["Pane"]
+
+
+def test_i_byte_delle_sessioni_sono_misurati():
+    hooks = {}
+
+    def client_con_hook(nome):
+        client = FakeSupabaseClient()
+        hooks[nome] = []
+        client.postgrest = SimpleNamespace(session=SimpleNamespace(event_hooks={"response": hooks[nome]}))
+        return client
+
+    supabase = _backend_con_sessione(client_con_hook("sessione"))
+    supabase.client = client_con_hook("chiave")
+    backend = BackendMisurato(BackendUtente(supabase), Metriche())
+
+    with con_accesso("sessione-1"):
+        backend.sign_in("a@example.com", "segreta")
+        with come_utente("paziente-b"):
+            backend.count()
+    assert len(hooks["chiave"]) == len(hooks["sessione"]) == 1